@@ -14,6 +14,10 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import queue
+import threading
+import time
+
 import numpy
 import vtk
 from ccpi.viewer import (ALT_KEY, CONTROL_KEY, CROSSHAIR_ACTOR, CURSOR_ACTOR, HELP_ACTOR, HISTOGRAM_ACTOR,
@@ -62,7 +66,7 @@ class CILInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         self._viewer.ren.SetActiveCamera(camera)
 
     def Render(self):
-        self._viewer.renWin.Render()
+        self._viewer.requestRender()
 
     def GetKeyCode(self):
         return self.GetInteractor().GetKeyCode()
@@ -455,6 +459,25 @@ class CILViewer(CILViewerBase):
         self.volume_render_initialised = False
         self.clipping_plane_initialised = False
 
+        # Level of detail: downsampled copies of the volume rendered whilst the camera moves
+        self._volumeLODEnabled = False
+        self._volumeLODFrameTime = 1. / 15
+        self._volumeLODMinimumSize = 64**3
+        self._volumeLODImages = []
+        self._volumeLODMappers = []
+        self._volumeLODRenderTimes = {}
+        self._volumeLODLevel = 0
+        self._volumeLODInteracting = False
+        self._volumeLODThread = None
+        self._volumeLODResults = queue.Queue()
+        self._volumeLODPollTimer = None
+        self._volumeRenderStartTime = None
+        self.style.AddObserver('StartInteractionEvent', self._onVolumeLODInteractionStart)
+        self.style.AddObserver('EndInteractionEvent', self._onVolumeLODInteractionEnd)
+        self.ren.AddObserver('StartEvent', self._onVolumeLODRenderStart)
+        self.ren.AddObserver('EndEvent', self._onVolumeLODRenderEnd)
+        self.iren.AddObserver('TimerEvent', self._onVolumeLODTimer)
+
     def createPolyDataActor(self, polydata):
         '''returns an actor for a given polydata'''
 
@@ -480,7 +503,7 @@ class CILViewer(CILViewerBase):
 
         self.actors[len(self.actors) + 1] = [actor, True]
         self.iren.Initialize()
-        self.renWin.Render()
+        self.requestRender()
 
     def displayPolyData(self, polydata):
         self.setPolyDataActor(self.createPolyDataActor(polydata))
@@ -494,7 +517,7 @@ class CILViewer(CILViewerBase):
 
             if delete:
                 self.actors = {}
-                self.renWin.Render()
+                self.requestRender()
 
         except KeyError as ke:
             print("Warning Actor not present")
@@ -519,6 +542,7 @@ class CILViewer(CILViewerBase):
 
     def setInput3DData(self, imageData):
         self.img3D = imageData
+        self._discardVolumeLODLevels()
 
         # Have to overwrite old volume and clipping planes if they
         # were previously created:
@@ -556,6 +580,11 @@ class CILViewer(CILViewerBase):
         # Save default camera settings for this image:
         self.saveDefaultCamera()
 
+        if self._volumeLODEnabled:
+            self.buildVolumeLODLevels()
+
+        self._observeProfiledObjects()
+
     def setInputData(self, imageData):
         '''alias of setInput3DData'''
         return self.setInput3DData(imageData)
@@ -613,7 +642,7 @@ class CILViewer(CILViewerBase):
         self.adjustCamera()
 
         self.iren.Initialize()
-        self.renWin.Render()
+        self.requestRender()
 
     def saveDefaultCamera(self):
         ''' Saves the default camera settings for a particular
@@ -653,6 +682,7 @@ class CILViewer(CILViewerBase):
         volume.SetMapper(self.volume_mapper)
         volume.SetProperty(volumeProperty)
         self.volume = volume
+        self._volumeLODLevel = 0
 
         # set defaults for opacity and colour mapping:
         color_percentiles = (5., 95.)
@@ -958,8 +988,7 @@ class CILViewer(CILViewerBase):
         generates array of color_num values between min and max values in 
         image or image gradient (depending on method).
         '''
-        ia = self.getImageHistogramStatistics(method)
-        x = numpy.linspace(ia.GetMinimum(), ia.GetMaximum(), num=color_num)
+        x = numpy.linspace(*self.getImageMapWholeRange(method), num=color_num)
         return x
 
     def installSliceActorPipeline(self):
@@ -995,28 +1024,30 @@ class CILViewer(CILViewerBase):
         self.ren.AddActor(self.imageSlice)
 
     def updatePipeline(self, resetcamera=False):
-        self.hideActor(self.sliceActorNo)
+        # updateVolumePipeline requests a render too, which is coalesced with this one:
+        with self.renderBatch(), self._profilePhase('updatePipeline'):
+            self.hideActor(self.sliceActorNo)
 
-        extent = [i for i in self.img3D.GetExtent()]
-        extent[self.sliceOrientation * 2] = self.getActiveSlice()
-        extent[self.sliceOrientation * 2 + 1] = self.getActiveSlice()
-        self.voi.SetVOI(extent[0], extent[1], extent[2], extent[3], extent[4], extent[5])
+            extent = [i for i in self.img3D.GetExtent()]
+            extent[self.sliceOrientation * 2] = self.getActiveSlice()
+            extent[self.sliceOrientation * 2 + 1] = self.getActiveSlice()
+            self.voi.SetVOI(extent[0], extent[1], extent[2], extent[3], extent[4], extent[5])
 
-        self.voi.Update()
-        self.ia.Update()
+            self.voi.Update()
+            self.ia.Update()
 
-        self.imageSliceMapper.SetOrientation(self.sliceOrientation)
-        self.imageSlice.Update()
+            self.imageSliceMapper.SetOrientation(self.sliceOrientation)
+            self.imageSlice.Update()
 
-        no = self.showActor(self.sliceActorNo, self.imageSlice)
-        self.sliceActorNo = no
+            no = self.showActor(self.sliceActorNo, self.imageSlice)
+            self.sliceActorNo = no
 
-        self.updateVolumePipeline()
-        self.updateSliceHistogram()
+            self.updateVolumePipeline()
+            self.updateSliceHistogram()
 
-        self.adjustCamera(resetcamera)
+            self.adjustCamera(resetcamera)
 
-        self.renWin.Render()
+            self.requestRender()
 
     def updateVolumePipeline(self):
         if self.volume_render_initialised and self.volume.GetVisibility():
@@ -1038,7 +1069,7 @@ class CILViewer(CILViewerBase):
                 self.volume_property.DisableGradientOpacityOn()
                 self.volume_property.SetScalarOpacity(opacity)
 
-            self.renWin.Render()
+            self.requestRender()
 
     def adjustCamera(self, resetcamera=False):
         self.ren.ResetCameraClippingRange()
@@ -1072,4 +1103,230 @@ class CILViewer(CILViewerBase):
             self.clipping_plane_initialised = False
 
             self.getRenderer().Render()
-            self.updatePipeline()
\ No newline at end of file
+            self.updatePipeline()
+
+    # LEVEL OF DETAIL: -----------------------------------------------------------
+
+    def setVolumeLODEnabled(self, value):
+        '''
+        Enables or disables level of detail volume rendering.
+
+        When enabled, the volume is downsampled once, in a background thread, to a series of
+        levels, each half the size of the previous one along each axis. Whilst the camera is
+        moving, the volume is rendered from the finest level which is expected to render within
+        the target frame time set by setVolumeLODFrameTime, and it is rendered at full resolution
+        again once the interaction stops.
+        '''
+        self._volumeLODEnabled = bool(value)
+        if self._volumeLODEnabled:
+            if not self._volumeLODImages:
+                self.buildVolumeLODLevels()
+        else:
+            self._showVolumeLODLevel(0)
+
+    def getVolumeLODEnabled(self):
+        return self._volumeLODEnabled
+
+    def setVolumeLODFrameTime(self, value):
+        '''
+        Parameters
+        ----------
+        value: float, default 1/15
+            target time in s to render each frame whilst the camera is moving
+        '''
+        if value <= 0:
+            raise ValueError('The frame time must be greater than 0. Got {}'.format(value))
+        self._volumeLODFrameTime = value
+
+    def getVolumeLODFrameTime(self):
+        return self._volumeLODFrameTime
+
+    def setVolumeLODMinimumSize(self, value):
+        '''
+        Parameters
+        ----------
+        value: int, default 64**3
+            minimum number of voxels of the coarsest level. Takes effect when the levels are next built.
+        '''
+        if value < 1:
+            raise ValueError('The minimum size must be at least 1. Got {}'.format(value))
+        self._volumeLODMinimumSize = int(value)
+
+    def getVolumeLODMinimumSize(self):
+        return self._volumeLODMinimumSize
+
+    def getVolumeLODLevels(self):
+        '''Returns the downsampled copies of the volume which have been built, from the finest to the coarsest.
+        Level n of the level of detail is the (n - 1)th of these, level 0 being the full resolution volume.'''
+        return list(self._volumeLODImages)
+
+    def getVolumeLODLevel(self):
+        '''Returns the level of detail the volume is rendered at, 0 being full resolution.'''
+        return self._volumeLODLevel
+
+    def getVolumeLODRenderTimes(self):
+        '''Returns the time in s of the last render at each level of detail, keyed by level.'''
+        return dict(self._volumeLODRenderTimes)
+
+    def buildVolumeLODLevels(self):
+        '''
+        Starts downsampling the volume in a background thread. Once done, the levels are
+        made available for rendering by applyVolumeLODLevels, which is called regularly by
+        a timer on the interactor.
+        '''
+        self._discardVolumeLODLevels()
+        if self.img3D is None:
+            return
+        self._volumeLODThread = threading.Thread(target=self._downsampleVolumeInThread,
+                                                 args=(self.img3D, self._volumeLODMinimumSize),
+                                                 daemon=True)
+        self._volumeLODThread.start()
+        if self._volumeLODPollTimer is None:
+            self._volumeLODPollTimer = self.iren.CreateRepeatingTimer(100)
+
+    def applyVolumeLODLevels(self, timeout=0):
+        '''
+        Creates a volume mapper for each of the levels downsampled in the background,
+        if they have been downsampled and are still of the current image.
+
+        Parameters
+        ----------
+        timeout: float, default 0
+            time in s to wait for the levels to be downsampled
+
+        Returns
+        -------
+        True if the levels can be rendered
+        '''
+        try:
+            image, levels = self._volumeLODResults.get(block=timeout > 0, timeout=timeout if timeout > 0 else None)
+        except queue.Empty:
+            return False
+        if isinstance(levels, Exception):
+            print("Unable to downsample the volume:", levels)
+            return False
+        if image is not self.img3D:
+            # the image has changed since the levels were requested
+            return False
+        mappers = []
+        for level in levels:
+            # mappers of the same type as the full resolution one:
+            mapper = self.volume_mapper.NewInstance()
+            mapper.SetBlendMode(self.volume_mapper.GetBlendMode())
+            mapper.SetInputData(level)
+            mappers.append(mapper)
+        self._volumeLODImages = levels
+        self._volumeLODMappers = mappers
+        return True
+
+    def _discardVolumeLODLevels(self):
+        '''renders the volume at full resolution and forgets the levels, e.g. when the image changes'''
+        self._showVolumeLODLevel(0)
+        self._volumeLODImages = []
+        self._volumeLODMappers = []
+        self._volumeLODRenderTimes = {}
+
+    def _downsampleVolumeInThread(self, image, minimum_size):
+        '''downsamples the image, and puts the levels in the queue of results to be
+        applied by applyVolumeLODLevels in the main thread.'''
+        try:
+            self._volumeLODResults.put((image, self._downsampleVolume(image, minimum_size)))
+        except Exception as e:
+            self._volumeLODResults.put((image, e))
+
+    @staticmethod
+    def _downsampleVolume(image, minimum_size):
+        '''returns a list of copies of the image, each downsampled by averaging blocks of 2 voxels along
+        each axis of the previous one, stopping before the number of voxels would drop below minimum_size'''
+        levels = []
+        current = image
+        while True:
+            dims = current.GetDimensions()
+            factors = [2 if dim > 1 else 1 for dim in dims]
+            if factors == [1, 1, 1] or numpy.prod([dim // f for dim, f in zip(dims, factors)]) < minimum_size:
+                return levels
+            shrink = vtk.vtkImageShrink3D()
+            shrink.SetInputData(current)
+            shrink.SetShrinkFactors(*factors)
+            shrink.AveragingOn()
+            shrink.Update()
+            level = vtk.vtkImageData()
+            level.ShallowCopy(shrink.GetOutput())
+            # place each voxel at the centre of the block it is the average of:
+            spacing = current.GetSpacing()
+            level.SetOrigin(*[o + (f - 1) * s / 2 for o, f, s in zip(level.GetOrigin(), factors, spacing)])
+            levels.append(level)
+            current = level
+
+    def _chooseVolumeLODLevel(self):
+        '''
+        Returns the finest level which is expected to render within the target frame time, or the coarsest
+        level if none are. The render time of the levels which haven't been rendered yet is estimated from the
+        level rendered most recently, in proportion to their number of voxels.
+        '''
+        num_levels = len(self._volumeLODMappers) + 1
+        times = self._volumeLODRenderTimes
+        if self._volumeLODLevel in times:
+            reference = self._volumeLODLevel
+        elif times:
+            reference = min(times)
+        else:
+            return num_levels - 1
+        voxels = [self.img3D.GetNumberOfPoints()] + [level.GetNumberOfPoints() for level in self._volumeLODImages]
+        for level in range(num_levels):
+            if level in times:
+                expected = times[level]
+            else:
+                expected = times[reference] * voxels[level] / voxels[reference]
+            if expected <= self._volumeLODFrameTime:
+                return level
+        return num_levels - 1
+
+    def _showVolumeLODLevel(self, level):
+        '''renders the volume from the mapper of the given level of detail, 0 being full resolution'''
+        if not self.volume_render_initialised:
+            self._volumeLODLevel = 0
+            return
+        mapper = self.volume_mapper if level == 0 else self._volumeLODMappers[level - 1]
+        if self.volume.GetMapper() is not mapper:
+            if level > 0:
+                # share the clipping planes of the full resolution mapper:
+                planes = self.volume_mapper.GetClippingPlanes()
+                if planes is None:
+                    mapper.RemoveAllClippingPlanes()
+                else:
+                    mapper.SetClippingPlanes(planes)
+            self.volume.SetMapper(mapper)
+        self._volumeLODLevel = level
+
+    def _onVolumeLODInteractionStart(self, style, event):
+        self._volumeLODInteracting = True
+        if self._volumeLODEnabled and self._volumeLODMappers:
+            self._showVolumeLODLevel(self._chooseVolumeLODLevel())
+
+    def _onVolumeLODInteractionEnd(self, style, event):
+        # the interactor style renders once this returns, at full resolution:
+        self._volumeLODInteracting = False
+        self._showVolumeLODLevel(0)
+
+    def _onVolumeLODRenderStart(self, renderer, event):
+        self._volumeRenderStartTime = time.perf_counter()
+
+    def _onVolumeLODRenderEnd(self, renderer, event):
+        if self._volumeRenderStartTime is None or not self.volume_render_initialised or \
+                not self.volume.GetVisibility():
+            return
+        self._volumeLODRenderTimes[self._volumeLODLevel] = time.perf_counter() - self._volumeRenderStartTime
+        self._volumeRenderStartTime = None
+        if self._volumeLODInteracting and self._volumeLODEnabled and self._volumeLODMappers:
+            # used from the next frame:
+            self._showVolumeLODLevel(self._chooseVolumeLODLevel())
+
+    def _onVolumeLODTimer(self, interactor, event):
+        if self.iren.GetTimerEventId() != self._volumeLODPollTimer:
+            return
+        self.applyVolumeLODLevels()
+        building = self._volumeLODThread is not None and self._volumeLODThread.is_alive()
+        if not building and self._volumeLODResults.empty():
+            self.iren.DestroyTimer(self._volumeLODPollTimer)
+            self._volumeLODPollTimer = None
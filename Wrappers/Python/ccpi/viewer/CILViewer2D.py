@@ -14,13 +14,19 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import queue
+import threading
+import time
+from collections import deque
+
 import numpy
 import vtk
+from vtk.util import numpy_support
 from ccpi.viewer import (ALT_KEY, CONTROL_KEY, SHIFT_KEY, CROSSHAIR_ACTOR, CURSOR_ACTOR, HELP_ACTOR, HISTOGRAM_ACTOR,
-                         LINEPLOT_ACTOR, OVERLAY_ACTOR, SLICE_ACTOR, WIPE_ACTOR, SLICE_ORIENTATION_XY,
-                         SLICE_ORIENTATION_XZ, SLICE_ORIENTATION_YZ)
-from ccpi.viewer.CILViewerBase import CILViewerBase
-from ccpi.viewer.utils import Converter
+                         LINEPLOT_ACTOR, OVERLAY_ACTOR, SEGMENT_PROFILE_ACTOR, SEGMENT_PROFILE_LINE_ACTOR, SLICE_ACTOR,
+                         WIPE_ACTOR, SLICE_ORIENTATION_XY, SLICE_ORIENTATION_XZ, SLICE_ORIENTATION_YZ)
+from ccpi.viewer.CILViewerBase import CILViewerBase, SliceIntegralStatistics
+from ccpi.viewer.utils import Converter, cilCachedExtractVOI
 
 from ccpi.viewer.widgets import cilviewerBoxWidget, SliceSliderRepresentation, SliderCallback
 
@@ -129,7 +135,7 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
         self._viewer.flipCameraPosition = flip
 
     def Render(self):
-        self._viewer.renWin.Render()
+        self._viewer.requestRender()
 
     def UpdateImageSlice(self):
         self._viewer.imageSlice.Update()
@@ -208,6 +214,9 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
     def UpdateLinePlot(self, imagecoordinate, display):
         self._viewer.updateLinePlot(imagecoordinate, display)
 
+    def UpdateSegmentProfilePlot(self, start, end, display):
+        self._viewer.updateSegmentProfilePlot(start, end, display)
+
     def GetCrosshairs(self):
         actor = self._viewer.crosshairsActor
         vert = self._viewer.vertLine
@@ -252,6 +261,8 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
             advance = 10
 
         if (self.GetActiveSlice() + advance <= maxSlice):
+            # the latency is recorded once the slice has been rendered:
+            self._viewer._startScrollLatency()
             self.SetActiveSlice(self.GetActiveSlice() + advance)
 
             self.UpdatePipeline()
@@ -260,6 +271,8 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
 
         if self.GetViewerEvent("SHOW_LINE_PROFILE_EVENT"):
             self.DisplayLineProfile(interactor, event, True)
+        if self._viewer.displaySegmentProfile:
+            self.UpdateSegmentProfilePlot(*self._viewer.segmentProfileEnds, True)
 
     def OnMouseWheelBackward(self, interactor, event):
         if self.GetInputData() is None:
@@ -270,12 +283,15 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
         if shift:
             advance = 10
         if (self.GetActiveSlice() - advance >= minSlice):
+            self._viewer._startScrollLatency()
             self.SetActiveSlice(self.GetActiveSlice() - advance)
             self.UpdatePipeline()
         else:
             self.log("minSlice %d request %d" % (minSlice, self.GetActiveSlice()))
         if self.GetViewerEvent("SHOW_LINE_PROFILE_EVENT"):
             self.DisplayLineProfile(interactor, event, True)
+        if self._viewer.displaySegmentProfile:
+            self.UpdateSegmentProfilePlot(*self._viewer.segmentProfileEnds, True)
 
     def AutoWindowLevelOnVolumeRange(self, update_slice=True):
         '''Auto-adjusts window-level for the slice, based on the 5 and 95th percentiles of the whole image volume.'''
@@ -325,6 +341,9 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
             camera.SetViewUp(0, 0, -1)
 
         self.SetActiveCamera(camera)
+        # the segment is drawn in the plane of the previous orientation:
+        if self._viewer.displaySegmentProfile:
+            self.UpdateSegmentProfilePlot(None, None, False)
         self.SetSliceOrientation(new_slice_orientation)
         self.UpdatePipeline(True)
 
@@ -361,9 +380,17 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
                 self.SetEventActive("SHOW_LINE_PROFILE_EVENT")
                 self.DisplayLineProfile(interactor, event, True)
 
+        elif interactor.GetKeyCode() == "p":
+            if self.GetViewerEvent("SEGMENT_PROFILE_EVENT"):
+                self.SetEventInactive("SEGMENT_PROFILE_EVENT")
+                self.UpdateSegmentProfilePlot(None, None, False)
+            else:
+                self.SetEventActive("SEGMENT_PROFILE_EVENT")
+
         elif interactor.GetKeyCode() == "h":
             self.DisplayHelp()
         elif interactor.GetKeyCode() == "w":
+            self._viewer.buildSliceIntegralStatistics()
             self.SetEventActive('UPDATE_WINDOW_LEVEL_UNDER_CURSOR')
         elif interactor.GetKeyCode() == "t":
             # tracing event is captured by widget
@@ -437,6 +464,11 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
             self.RemoveROIWidget()
             self.log("Event %s is DELETE_ROI_EVENT" % (event))
 
+        elif self.GetViewerEvent("SEGMENT_PROFILE_EVENT") and not (ctrl or alt or shift):
+            self.SetEventActive("DRAW_SEGMENT_PROFILE_EVENT")
+            self.DisplaySegmentProfile(interactor, event)
+            self.log("Event %s is DRAW_SEGMENT_PROFILE_EVENT" % (event))
+
         elif not (ctrl and alt and shift):
             self.SetEventActive("PICK_EVENT")
             self.HandlePickEvent(interactor, event)
@@ -465,10 +497,14 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
         elif self.GetViewerEvent("PICK_EVENT"):
             self.HandlePickEvent(interactor, event)
 
+        elif self.GetViewerEvent("DRAW_SEGMENT_PROFILE_EVENT"):
+            self.DisplaySegmentProfile(interactor, event)
+
         # Turn off CREATE_ROI and PICK_EVENT
         self.SetEventInactive("CREATE_ROI_EVENT")
         self.SetEventInactive("PICK_EVENT")
         self.SetEventInactive("DELETE_ROI_EVENT")
+        self.SetEventInactive("DRAW_SEGMENT_PROFILE_EVENT")
 
     def OnRightButtonPressEvent(self, interactor, event):
         if self.GetInputData() is None:
@@ -740,50 +776,15 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
             elif self.GetViewerEvent("PAN_EVENT"):
                 self.HandlePanEvent(interactor, event)
 
+            elif self.GetViewerEvent("DRAW_SEGMENT_PROFILE_EVENT"):
+                self.DisplaySegmentProfile(interactor, event)
+
             elif self.GetViewerEvent("SHOW_LINE_PROFILE_EVENT"):
                 self.DisplayLineProfile(interactor, event, True)
             elif self.GetViewerEvent('UPDATE_WINDOW_LEVEL_UNDER_CURSOR'):
-                x, y = interactor.GetEventPosition()
-                ic = self.display2imageCoordinate((x, y))
-                print(x, y, ic, "image coordinate")
-                whole_extent = self._viewer.img3D.GetExtent()
-                around = numpy.min(numpy.asarray([whole_extent[1], whole_extent[3], whole_extent[5]])) // 10
-                print(around, "around")
-                extent = [
-                    ic[0] - around, ic[0] + around, ic[1] - around, ic[1] + around, ic[2] - around, ic[2] + around
-                ]
-
-                orientation = self._viewer.sliceOrientation
-
-                extent[orientation * 2] = self.GetActiveSlice()
-                extent[orientation * 2 + 1] = self.GetActiveSlice()
-
-                if extent[0] < whole_extent[0]:
-                    extent[0] = whole_extent[0]
-                if extent[1] > whole_extent[1]:
-                    extent[1] = whole_extent[1]
-                if extent[2] < whole_extent[2]:
-                    extent[2] = whole_extent[2]
-                if extent[3] > whole_extent[3]:
-                    extent[3] = whole_extent[3]
-                if extent[4] < whole_extent[4]:
-                    extent[4] = whole_extent[4]
-                if extent[5] > whole_extent[5]:
-                    extent[5] = whole_extent[5]
-                # get mouse location
-
-                print(*extent, "w extent")
-                self._viewer.voicursor.SetInputData(self._viewer.img3D)
-                self._viewer.voicursor.SetVOI(*extent)
-
-                self._viewer.voicursor.Update()
-                # set window/level for current slices
-
-                self._viewer.iacursor.SetInputConnection(self._viewer.voicursor.GetOutputPort())
-                self._viewer.iacursor.SetAutoRangePercentiles(1.0, 99.)
-                self._viewer.iacursor.Update()
-                # reset color/window
-                cmin, cmax = self._viewer.iacursor.GetAutoRange()
+                ic = self.display2imageCoordinate(interactor.GetEventPosition())
+                # set window/level for the values around the cursor
+                cmin, cmax = self._viewer.getRangeAroundPosition(ic, (1., 99.))
 
                 window, level = self._viewer.getSliceWindowLevelFromRange(cmin, cmax)
 
@@ -859,6 +860,7 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
                              "  - a: Whole image Auto Window/Level\n"
                              "  - w: Region around cursor Auto Window/Level\n"
                              "  - l: Line Profile at cursor\n"
+                             "  - p: Line Profile along a segment: Left Click + Drag\n"
                              "  - s: Save Current Image\n"
                              "  - x: YZ Plane\n"
                              "  - y: XZ Plane\n"
@@ -892,6 +894,8 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
             # >1 zoom in, <1 zoom out
             camera.Zoom(1 + change / window_y_size)
             self.Render()
+            # a larger region of the slice may need reading at full resolution:
+            self._viewer.scheduleFullResolutionSlice()
 
         # Set the overall change value
         self.dy = dy
@@ -985,6 +989,12 @@ class CILInteractorStyle(vtk.vtkInteractorStyle):
         ic = self.display2imageCoordinate((x, y))
         self.UpdateLinePlot(ic, display)
 
+    def DisplaySegmentProfile(self, interactor, event):
+        '''Displays the profile along the segment from where the left button was pressed to the cursor'''
+        start = self.display2imageCoordinate(self.GetInitialEventPosition(), subvoxel=True)
+        end = self.display2imageCoordinate(interactor.GetEventPosition(), subvoxel=True)
+        self.UpdateSegmentProfilePlot(start, end, True)
+
 
 ###############################################################################
 
@@ -998,6 +1008,13 @@ class CILViewer2D(CILViewerBase):
     def __init__(self, dimx=600, dimy=600, ren=None, renWin=None, iren=None, debug=False, enableSliderWidget=True):
         CILViewerBase.__init__(self, dimx=dimx, dimy=dimy, ren=ren, renWin=renWin, iren=iren, debug=debug)
 
+        # caches the slices, and prefetches the next ones whilst scrolling:
+        self.voi = cilCachedExtractVOI()
+        # time taken to display a new slice when scrolling, in seconds:
+        self._scrollLatencies = deque(maxlen=100)
+        self._scrollStartTime = None
+        self.ren.AddObserver('EndEvent', self._onScrollRendered)
+
         self.setInteractorStyle(CILInteractorStyle(self))
 
         self.debug = debug
@@ -1011,8 +1028,6 @@ class CILViewer2D(CILViewerBase):
         self.axes_initialised = False
 
         #Actors
-        self.iacursor = vtk.vtkImageHistogramStatistics()
-        self.voicursor = vtk.vtkExtractVOI()
         #self.sliceActorNo = 0
 
         # input 2
@@ -1079,16 +1094,26 @@ class CILViewer2D(CILViewerBase):
         # XY Plot actor for histogram
         self.displayHistogram = False
         self.firstHistogram = 0
-        self.roiIA = vtk.vtkImageAccumulate()
-        self.roiVOI = vtk.vtkExtractVOI()
+        # histogram of the ROI, looked up in the integral statistics of the active slice:
+        self.roiHistogram = vtk.vtkTrivialProducer()
+        self._sliceIntegralStatistics = {}
+        self._sliceIntegralStatisticsImage = None
+        # the statistics can also be built in a background thread, see buildSliceIntegralStatistics:
+        self._sliceIntegralStatisticsLock = threading.Lock()
+        self._sliceIntegralStatisticsThread = None
+        # the (image, orientation, slice) the thread is building the statistics of:
+        self._sliceIntegralStatisticsBuilding = None
         self.histogramPlotActor.SetPosition2(0.6, 0.6)
         self.histogramPlotActor.SetPosition(0.4, 0.4)
 
         # XY Plot for X and Y slices
         self.displayLinePlot = False
         self.linePlot = 0
-        self.lineVOIX = vtk.vtkExtractVOI()
-        self.lineVOIY = vtk.vtkExtractVOI()
+        # the profiles are copied out of views of the image, see getLineProfiles:
+        self.lineProfileX = vtk.vtkTrivialProducer()
+        self.lineProfileY = vtk.vtkTrivialProducer()
+        self.lineProfileX.SetOutput(vtk.vtkImageData())
+        self.lineProfileY.SetOutput(vtk.vtkImageData())
         self.linePlotActor = vtk.vtkXYPlotActor()
         self.linePlotActor.ExchangeAxesOff()
         self.linePlotActor.SetXTitle("")
@@ -1112,6 +1137,30 @@ class CILViewer2D(CILViewerBase):
         self.linePlotActor.SetPlotLabel(1, 'vert')
         self.linePlotActor.LegendOn()
 
+        # XY Plot of the profile along a segment drawn on the slice
+        self.displaySegmentProfile = False
+        self.segmentProfileEnds = None
+        self.segmentProfile = vtk.vtkTrivialProducer()
+        self.segmentProfilePlotActor = vtk.vtkXYPlotActor()
+        self.segmentProfilePlotActor.ExchangeAxesOff()
+        self.segmentProfilePlotActor.SetXTitle("")
+        self.segmentProfilePlotActor.SetYTitle("")
+        self.segmentProfilePlotActor.SetXLabelFormat("%.1f")
+        self.segmentProfilePlotActor.SetYLabelFormat("%.1e")
+        self.segmentProfilePlotActor.SetXValuesToValue()
+        self.segmentProfilePlotActor.SetDataObjectXComponent(0, 0)
+        self.segmentProfilePlotActor.SetPlotColor(0, (0, 1, 1))
+        self.segmentProfilePlotActor.SetPosition(0, 0.1)
+        self.segmentProfilePlotActor.SetPosition2(1, 0.4)
+        self.segmentProfilePlotActor.SetAdjustXLabels(0)
+        self.segmentProfileLine = vtk.vtkLineSource()
+        segmentProfileLineMapper = vtk.vtkPolyDataMapper()
+        segmentProfileLineMapper.SetInputConnection(self.segmentProfileLine.GetOutputPort())
+        self.segmentProfileLineActor = vtk.vtkActor()
+        self.segmentProfileLineActor.SetMapper(segmentProfileLineMapper)
+        self.segmentProfileLineActor.GetProperty().SetColor(0, 1, 1)
+        self.segmentProfileLineActor.GetProperty().SetLineWidth(2)
+
         # crosshair lines for X Y slices
         self.horizLine = vtk.vtkLine()
         self.vertLine = vtk.vtkLine()
@@ -1148,6 +1197,19 @@ class CILViewer2D(CILViewerBase):
         self.sliderWidget = None
         self._sliderWidgetEnabled = enableSliderWidget
 
+        # Level of detail: full resolution slices read in the background
+        self._lodReader = None
+        self._lodEnabled = False
+        self._lodDelay = 300
+        self._lodDelayTimer = None
+        self._lodPollTimer = None
+        self._lodThread = None
+        self._lodResults = queue.Queue()
+        self._lodPendingRequest = None
+        self._lodDisplayedRequest = None
+        self._lodFullResolutionSlice = None
+        self.iren.AddObserver('TimerEvent', self._onLODTimer)
+
         self.__vis_mode = CILViewer2D.IMAGE_WITH_OVERLAY
         self.setVisualisationToImageWithOverlay()
 
@@ -1162,9 +1224,12 @@ class CILViewer2D(CILViewerBase):
     def setInputData(self, imageData):
         self.log("setInputData")
         self.reset()
+        self._lodDisplayedRequest = None
+        self._lodFullResolutionSlice = None
         self.img3D = imageData
         self.installPipeline()
         self.axes_initialised = True
+        self._observeProfiledObjects()
 
     def setInputData2(self, imageData):
         self.image2 = imageData
@@ -1210,19 +1275,310 @@ class CILViewer2D(CILViewerBase):
 
         self.installPipeline()
 
+    # LEVEL OF DETAIL: -----------------------------------------------------------
+
+    def setLODReader(self, reader):
+        '''
+        Sets the reader of the original, full resolution, image file which the
+        image displayed by the viewer was downsampled from.
+
+        When level of detail is enabled, once the user stops scrolling or zooming
+        the active slice (or the region of it in view) is read at full resolution
+        by this reader in a background thread, and replaces the downsampled slice.
+
+        Parameters
+        ----------
+        reader: cilBaseCroppedReader or None
+            A cropped reader of the original file, e.g. cilNumpyCroppedReader,
+            with the file name and dataset information set.
+            If the reader has a SetTargetExtent method, as the cropped readers do,
+            slices of every orientation are refined and only the region in view is read.
+            Otherwise only slices in the XY orientation are refined.
+        '''
+        self._lodReader = reader
+        self._lodDisplayedRequest = None
+        if reader is not None:
+            reader.ReadDataSetInfo()
+        elif self._lodEnabled:
+            self.setLODEnabled(False)
+
+    def getLODReader(self):
+        return self._lodReader
+
+    def setLODEnabled(self, value):
+        '''
+        Enables or disables reading the active slice at full resolution with the reader
+        set by setLODReader, once the user stops scrolling or zooming.
+        '''
+        if value and self._lodReader is None:
+            raise ValueError('A reader must be set with setLODReader before level of detail can be enabled.')
+        self._lodEnabled = value
+        if not value:
+            self._showDownsampledSlice()
+
+    def getLODEnabled(self):
+        return self._lodEnabled
+
+    def setLODDelay(self, value):
+        '''
+        Parameters
+        ----------
+        value: int, default 300
+            time in ms the user must stop scrolling or zooming for before
+            the full resolution slice is read
+        '''
+        self._lodDelay = value
+
+    def getLODDelay(self):
+        return self._lodDelay
+
+    def setSliceCacheMemoryBudget(self, value):
+        '''
+        Parameters
+        ----------
+        value: int, default 512 * 1024**2
+            maximum number of bytes of slices to cache for scrolling. 0 disables the cache.
+        '''
+        self.voi.SetMemoryBudget(value)
+
+    def getSliceCacheMemoryBudget(self):
+        return self.voi.GetMemoryBudget()
+
+    def setSlicePrefetchDepth(self, value):
+        '''
+        Parameters
+        ----------
+        value: int, default 4
+            number of slices to extract in the background, ahead of the direction of scrolling.
+            0 disables prefetching.
+        '''
+        self.voi.SetPrefetchDepth(value)
+
+    def getSlicePrefetchDepth(self):
+        return self.voi.GetPrefetchDepth()
+
+    def getScrollLatencyStats(self):
+        '''
+        Returns
+        -------
+        dict with the 'last', 'mean' and 'max' time in seconds taken to display a new
+        slice when scrolling with the mouse wheel, over the last 'count' scroll steps,
+        and the number of slice cache 'hits' and 'misses'. The times are None
+        before the first scroll.
+        '''
+        latencies = list(self._scrollLatencies)
+        stats = {'count': len(latencies), 'last': None, 'mean': None, 'max': None}
+        if latencies:
+            stats.update(last=latencies[-1], mean=sum(latencies) / len(latencies), max=max(latencies))
+        stats['hits'] = self.voi.GetCacheHits()
+        stats['misses'] = self.voi.GetCacheMisses()
+        return stats
+
+    def resetScrollLatencyStats(self):
+        self._scrollLatencies.clear()
+
+    def _recordScrollLatency(self, latency):
+        self._scrollLatencies.append(latency)
+        self.log("Scroll latency {0:.1f} ms".format(latency * 1000))
+
+    def _startScrollLatency(self):
+        if self._scrollStartTime is None:
+            self._scrollStartTime = time.perf_counter()
+
+    def _onScrollRendered(self, caller, event):
+        if self._scrollStartTime is not None:
+            self._recordScrollLatency(time.perf_counter() - self._scrollStartTime)
+            self._scrollStartTime = None
+
+    def getFullResolutionSlice(self):
+        '''Returns the full resolution slice which is displayed, or None if the
+        downsampled slice is displayed.'''
+        return self._lodFullResolutionSlice
+
+    def scheduleFullResolutionSlice(self):
+        '''
+        Called when the active slice or the view changes. Displays the downsampled slice
+        if the active slice has changed, and reads the full resolution slice after the
+        LOD delay, unless the slice or view changes again in the meantime.
+        '''
+        if not self._lodEnabled or self.img3D is None or self.vis_mode != CILViewer2D.IMAGE_WITH_OVERLAY:
+            return
+        request = self._getFullResolutionRequest()
+        if request is not None and request == self._lodDisplayedRequest:
+            return
+        if request is None or self._lodDisplayedRequest is None or request[:2] != self._lodDisplayedRequest[:2]:
+            self._showDownsampledSlice()
+        if self._lodDelayTimer is not None:
+            self.iren.DestroyTimer(self._lodDelayTimer)
+            self._lodDelayTimer = None
+        if request is not None:
+            self._lodDelayTimer = self.iren.CreateOneShotTimer(self._lodDelay)
+
+    def requestFullResolutionSlice(self):
+        '''
+        Starts reading the active slice at full resolution in a background thread.
+        Once it has been read it is displayed by applyFullResolutionSlice, which
+        is called regularly by a timer on the interactor.
+        '''
+        if not self._lodEnabled:
+            return
+        request = self._getFullResolutionRequest()
+        if request is None or request == self._lodDisplayedRequest:
+            return
+        if self._lodThread is not None and self._lodThread.is_alive():
+            # only one read at a time, this is started when the current one is done:
+            self._lodPendingRequest = request
+        else:
+            self._lodPendingRequest = None
+            self._lodThread = threading.Thread(target=self._readFullResolutionSliceInThread,
+                                               args=(request, ),
+                                               daemon=True)
+            self._lodThread.start()
+        if self._lodPollTimer is None:
+            self._lodPollTimer = self.iren.CreateRepeatingTimer(50)
+
+    def applyFullResolutionSlice(self, timeout=0):
+        '''
+        Displays the full resolution slice read in the background, if it has been read
+        and it is still for the active slice and view.
+
+        Parameters
+        ----------
+        timeout: float, default 0
+            time in s to wait for a slice to be read
+
+        Returns
+        -------
+        True if the full resolution slice has been displayed
+        '''
+        try:
+            request, image = self._lodResults.get(block=timeout > 0, timeout=timeout if timeout > 0 else None)
+        except queue.Empty:
+            return False
+        if self._lodPendingRequest is not None:
+            self.requestFullResolutionSlice()
+        if isinstance(image, Exception):
+            print("Unable to read full resolution slice:", image)
+            return False
+        if not self._lodEnabled or request != self._getFullResolutionRequest():
+            # the user has moved on
+            return False
+        self._lodDisplayedRequest = request
+        self._lodFullResolutionSlice = image
+        self.imageSliceMapper.SetInputData(image)
+        self.imageSlice.Update()
+        self.requestRender()
+        return True
+
+    def _showDownsampledSlice(self):
+        '''replaces the full resolution slice, if any, with the downsampled slice'''
+        if self._lodFullResolutionSlice is not None:
+            self.imageSliceMapper.SetInputConnection(self.voi.GetOutputPort())
+            self.imageSlice.Update()
+        self._lodDisplayedRequest = None
+        self._lodFullResolutionSlice = None
+
+    def _onLODTimer(self, interactor, event):
+        timer_id = self.iren.GetTimerEventId()
+        if timer_id == self._lodDelayTimer:
+            self._lodDelayTimer = None
+            self.requestFullResolutionSlice()
+        elif timer_id == self._lodPollTimer:
+            self.applyFullResolutionSlice()
+            reading = self._lodThread is not None and self._lodThread.is_alive()
+            if not reading and self._lodResults.empty() and self._lodPendingRequest is None:
+                self.iren.DestroyTimer(self._lodPollTimer)
+                self._lodPollTimer = None
+
+    def _getFullResolutionRequest(self):
+        '''
+        Returns what needs reading to show the active slice at full resolution:
+        (orientation, active slice, index of the slice in the full resolution image, extent of the
+        region in view or None for the whole slice), or None if the slice can't be read at full resolution.
+        '''
+        reader = self._lodReader
+        orientation = self.getSliceOrientation()
+        can_crop_region = hasattr(reader, 'SetTargetExtent')
+        if reader is None or (orientation != SLICE_ORIENTATION_XY and not can_crop_region):
+            return None
+
+        readshape = reader.GetStoredArrayShape()
+        full_dims = list(readshape) if reader.GetIsFortran() else list(readshape)[::-1]
+        full_spacing = reader.GetElementSpacing()
+        full_origin = reader.GetOrigin()
+
+        def world2fullIndex(world, axis):
+            return (world - full_origin[axis]) / full_spacing[axis]
+
+        # the slice in the full resolution image nearest to the active slice:
+        active_slice = self.getActiveSlice()
+        slice_world = self.img3D.GetOrigin()[orientation] + active_slice * self.img3D.GetSpacing()[orientation]
+        index = int(min(max(round(world2fullIndex(slice_world, orientation)), 0), full_dims[orientation] - 1))
+
+        region = None
+        if can_crop_region:
+            # only read the region of the slice which is in view:
+            size = self.renWin.GetSize()
+            corners = [self.style.display2world((0, 0)), self.style.display2world((size[0], size[1]))]
+            region = []
+            for axis in range(3):
+                if axis == orientation:
+                    region += [index, index]
+                else:
+                    lower = min(world2fullIndex(c[axis], axis) for c in corners)
+                    upper = max(world2fullIndex(c[axis], axis) for c in corners)
+                    lower = int(min(max(numpy.floor(lower), 0), full_dims[axis] - 1))
+                    upper = int(min(max(numpy.ceil(upper), lower), full_dims[axis] - 1))
+                    region += [lower, upper]
+            region = tuple(region)
+        return (orientation, active_slice, index, region)
+
+    def _readFullResolutionSliceInThread(self, request):
+        '''reads the full resolution slice for the request, and puts it in the queue of results
+        to be displayed by applyFullResolutionSlice in the main thread.'''
+        try:
+            self._lodResults.put((request, self._readFullResolutionSlice(request)))
+        except Exception as e:
+            self._lodResults.put((request, e))
+
+    def _readFullResolutionSlice(self, request):
+        '''reads the full resolution slice for the request, returns a vtkImageData
+        positioned in the plane of the active slice.'''
+        orientation, active_slice, index, region = request
+        reader = self._lodReader
+        if region is not None:
+            reader.SetTargetExtent(region)
+        else:
+            reader.SetTargetZExtent((index, index))
+        reader.Modified()
+        reader.Update()
+        image = vtk.vtkImageData()
+        image.DeepCopy(reader.GetOutput())
+
+        # place the slice in the world at the position of the downsampled slice,
+        # so it replaces it exactly:
+        spacing = reader.GetElementSpacing()
+        origin = list(reader.GetOrigin())
+        image.SetSpacing(spacing)
+        slice_world = self.img3D.GetOrigin()[orientation] + active_slice * self.img3D.GetSpacing()[orientation]
+        origin[orientation] = slice_world - image.GetExtent()[orientation * 2] * spacing[orientation]
+        image.SetOrigin(origin)
+        return image
+
     def displaySlice(self, sliceno=[0]):
         self.setActiveSlice(sliceno)
         self.updatePipeline()
-        self.renWin.Render()
 
     def updatePipeline(self, resetcamera=False):
-        if self.vis_mode == CILViewer2D.IMAGE_WITH_OVERLAY:
-            self.updateImageWithOverlayPipeline(resetcamera=resetcamera)
-        elif self.vis_mode == CILViewer2D.RECTILINEAR_WIPE:
-            self.updateRectilinearWipePipeline(resetcamera=resetcamera)
+        # the pipelines request renders too, which are coalesced into one:
+        with self.renderBatch(), self._profilePhase('updatePipeline'):
+            if self.vis_mode == CILViewer2D.IMAGE_WITH_OVERLAY:
+                self.updateImageWithOverlayPipeline(resetcamera=resetcamera)
+            elif self.vis_mode == CILViewer2D.RECTILINEAR_WIPE:
+                self.updateRectilinearWipePipeline(resetcamera=resetcamera)
 
-        self.AdjustCamera(resetcamera)
-        self.renWin.Render()
+            self.AdjustCamera(resetcamera)
+            self.requestRender()
 
     def updateRectilinearWipePipeline(self, resetcamera=False):
         extent = self.updateMainVOI()
@@ -1244,7 +1600,7 @@ class CILViewer2D(CILViewerBase):
 
     def updateImageWithOverlayPipeline(self, resetcamera=False):
         self.updateMainVOI()
-        self.ia.Update()
+        # the slice histogram, self.ia, is only updated when it is used
         self.imageSliceMapper.SetOrientation(self.sliceOrientation)
         self.imageSlice.Update()
 
@@ -1259,6 +1615,9 @@ class CILViewer2D(CILViewerBase):
 
         if self.displayHistogram:
             self.updateROIHistogram()
+
+        self.scheduleFullResolutionSlice()
+
         try:
             if not self.img3D is None:
                 # print ("self.img3D" , self.img3D)
@@ -1280,7 +1639,7 @@ class CILViewer2D(CILViewerBase):
         except Exception as ge:
             print(ge)
         self.AdjustCamera(resetcamera)
-        self.renWin.Render()
+        self.requestRender()
 
     @property
     def vis_mode(self):
@@ -1336,7 +1695,7 @@ class CILViewer2D(CILViewerBase):
         self.cursorActor.VisibilityOn()
 
         self.iren.Initialize()
-        self.renWin.Render()
+        self.requestRender()
 
     def installPipeline2(self):
         if self.image2 is not None:
@@ -1427,7 +1786,7 @@ class CILViewer2D(CILViewerBase):
             self.AdjustCamera()
 
             self.iren.Initialize()
-            self.renWin.Render()
+            self.requestRender()
         else:
             print("installPipeline2 no data")
 
@@ -1581,7 +1940,7 @@ class CILViewer2D(CILViewerBase):
             self.cornerAnnotation.VisibilityOff()
 
         self.cornerAnnotation.SetText(idx, text)
-        self.iren.Render()
+        self.requestRender()
 
     def createAnnotationText(self, display_type, data):
         ''' Returns string to be set as the corner annotation, giving
@@ -1635,9 +1994,8 @@ class CILViewer2D(CILViewerBase):
 
         return text
 
-    def updateROIHistogram(self):
-        self.log("Updating hist")
-
+    def getROISliceExtent(self):
+        '''Returns the extent of the ROI in the active slice, clamped to the image'''
         extent = [0 for i in range(6)]
         if self.getSliceOrientation() == SLICE_ORIENTATION_XY:
             self.log("slice orientation : XY")
@@ -1668,101 +2026,255 @@ class CILViewer2D(CILViewerBase):
             # y = abs(roi[1][2] - roi[0][2])
             extent[0] = self.getActiveSlice()
             extent[1] = self.getActiveSlice()
+        return extent
 
-        self.log("updateROIHistogram {0}".format(extent))
-        self.roiVOI.SetVOI(extent)
-        self.roiVOI.SetInputData(self.img3D)
-        self.roiVOI.Update()
-        irange = self.roiVOI.GetOutput().GetScalarRange()
+    def _getActiveSliceArray(self):
+        '''
+        Returns a view of the active slice in the scalars of img3D, indexed as (row, column),
+        where the columns are along the first axis in the plane of the slice and the rows
+        along the second. No data is copied, so the view is strided unless the slice is XY.
+        '''
+        orientation = self.getSliceOrientation()
+        # numpy indexes the image as z, y, x:
+        array = Converter.vtk2numpy(self.img3D)
+        index = self.getActiveSlice() - self.img3D.GetExtent()[orientation * 2]
+        if orientation == SLICE_ORIENTATION_XY:
+            return array[index, :, :]
+        elif orientation == SLICE_ORIENTATION_XZ:
+            return array[:, index, :]
+        else:
+            return array[:, :, index]
+
+    def _getCachedSliceIntegralStatistics(self):
+        '''Returns the SliceIntegralStatistics of the active slice if they have been built, otherwise None'''
+        image = (self.img3D, self.img3D.GetMTime())
+        with self._sliceIntegralStatisticsLock:
+            if self._sliceIntegralStatisticsImage is None or self._sliceIntegralStatisticsImage[0] is not image[0] \
+                    or self._sliceIntegralStatisticsImage[1] != image[1]:
+                # the image has changed, so the statistics of all the orientations are out of date:
+                self._sliceIntegralStatistics.clear()
+                self._sliceIntegralStatisticsImage = image
+            cached = self._sliceIntegralStatistics.get(self.getSliceOrientation())
+        if cached is not None and cached[0] == self.getActiveSlice():
+            return cached[1]
+        return None
+
+    def _cacheSliceIntegralStatistics(self, image, orientation, sliceno, statistics):
+        '''Keeps the statistics of a slice, unless the image has changed since they were built'''
+        with self._sliceIntegralStatisticsLock:
+            current = self._sliceIntegralStatisticsImage
+            if current is not None and current[0] is image[0] and current[1] == image[1]:
+                self._sliceIntegralStatistics[orientation] = (sliceno, statistics)
+
+    def getSliceIntegralStatistics(self):
+        '''
+        Returns the SliceIntegralStatistics of the active slice, which the ROI statistics
+        and histogram, and the window/level under the cursor, are looked up in. They are
+        built the first time they are needed for a slice, unless they are already being
+        built in the background, and the last ones built for each orientation are kept
+        until the image is modified or replaced. The background build is only waited for
+        if it is of the active slice.
+        '''
+        statistics = self._getCachedSliceIntegralStatistics()
+        if statistics is not None:
+            return statistics
+        if self._isBuildingActiveSliceIntegralStatistics() and self.waitForSliceIntegralStatistics():
+            statistics = self._getCachedSliceIntegralStatistics()
+            if statistics is not None:
+                return statistics
+        statistics = SliceIntegralStatistics(self._getActiveSliceArray())
+        self._cacheSliceIntegralStatistics(self._sliceIntegralStatisticsImage, self.getSliceOrientation(),
+                                           self.getActiveSlice(), statistics)
+        return statistics
+
+    def buildSliceIntegralStatistics(self):
+        '''
+        Starts building the SliceIntegralStatistics of the active slice in a background
+        thread, if they haven't been built yet. Only one slice is built at a time.
+        '''
+        if self._getCachedSliceIntegralStatistics() is not None:
+            return
+        if self._sliceIntegralStatisticsThread is not None and self._sliceIntegralStatisticsThread.is_alive():
+            return
+        args = (self._sliceIntegralStatisticsImage, self.getSliceOrientation(), self.getActiveSlice(),
+                self._getActiveSliceArray())
+        self._sliceIntegralStatisticsBuilding = args[0:3]
+        self._sliceIntegralStatisticsThread = threading.Thread(target=self._buildSliceIntegralStatisticsInThread,
+                                                               args=args,
+                                                               daemon=True)
+        self._sliceIntegralStatisticsThread.start()
+
+    def _isBuildingActiveSliceIntegralStatistics(self):
+        '''Returns True if the statistics of the active slice are being built in the background'''
+        thread = self._sliceIntegralStatisticsThread
+        if thread is None or not thread.is_alive():
+            return False
+        image, orientation, sliceno = self._sliceIntegralStatisticsBuilding
+        current = self._sliceIntegralStatisticsImage
+        return image[0] is current[0] and image[1] == current[1] and orientation == self.getSliceOrientation() \
+            and sliceno == self.getActiveSlice()
+
+    def _buildSliceIntegralStatisticsInThread(self, image, orientation, sliceno, array):
+        self._cacheSliceIntegralStatistics(image, orientation, sliceno, SliceIntegralStatistics(array))
+
+    def waitForSliceIntegralStatistics(self, timeout=None):
+        '''
+        Waits for the SliceIntegralStatistics being built in the background, if any.
+        Returns True if there were any and they have been built.
+        '''
+        thread = self._sliceIntegralStatisticsThread
+        if thread is None:
+            return False
+        thread.join(timeout)
+        return not thread.is_alive()
 
-        self.roiIA.SetInputData(self.roiVOI.GetOutput())
+    def getRangeAroundPosition(self, imagecoordinate, percentiles=(1., 99.)):
+        '''
+        Returns the values at the percentiles of the active slice in a square around
+        imagecoordinate, with sides a fifth of the smallest dimension of the image.
+
+        If the SliceIntegralStatistics of the slice have been built, the square is moved
+        to the nearest tile boundaries and the percentiles are looked up in their tile
+        histograms, which is quick enough to follow the cursor. Otherwise they are started
+        building in the background, and the percentiles are computed from the pixels.
+
+        Parameters
+        -----------
+        imagecoordinate: (x, y, z) image coordinates. The coordinate normal to the slice is ignored.
+        percentiles: (float, float), default (1., 99.)
+        '''
+        axes = [axis for axis in range(3) if axis != self.getSliceOrientation()]
+        whole_extent = self.img3D.GetExtent()
+        around = min(whole_extent[1], whole_extent[3], whole_extent[5]) // 10
+        array = self._getActiveSliceArray()
+        # the first and last column and row of the square, in the slice array:
+        bounds = []
+        for axis, length in zip(axes, array.shape[::-1]):
+            centre = int(imagecoordinate[axis]) - whole_extent[2 * axis]
+            bounds.append((max(centre - around, 0), min(centre + around, length - 1)))
+        columns, rows = bounds
+
+        statistics = self._getCachedSliceIntegralStatistics()
+        if statistics is None:
+            self.buildSliceIntegralStatistics()
+            region = array[rows[0]:rows[1] + 1, columns[0]:columns[1] + 1]
+            return tuple(numpy.percentile(region, percentiles))
+
+        tile_size = statistics.GetTileSize()
+        rectangle = []
+        for (first, last), length in zip((rows, columns), array.shape):
+            snapped = (int(round(first / tile_size)) * tile_size, int(round((last + 1) / tile_size)) * tile_size - 1)
+            if snapped[1] >= snapped[0]:
+                first, last = max(snapped[0], 0), min(snapped[1], length - 1)
+            rectangle.append((first, last))
+        return tuple(statistics.GetPercentiles(rectangle[0], rectangle[1], percentiles))
+
+    def getROIStatistics(self):
+        '''
+        Returns the statistics of the ROI in the active slice: a dict with the number
+        of pixels ('count'), the 'sum', 'mean' and standard deviation ('std') of their
+        values, and their 'histogram', with bins at 'bin_origin' + i * 'bin_spacing'.
+        Once the integral statistics of the slice are built, these take about the same
+        time to look up whatever the size of the ROI.
+        '''
+        extent = [int(i) for i in self.getROISliceExtent()]
+        orientation = self.getSliceOrientation()
+        # the rows and columns of the slice, in the order numpy indexes it:
+        axes = {SLICE_ORIENTATION_XY: (1, 0), SLICE_ORIENTATION_XZ: (2, 0), SLICE_ORIENTATION_YZ: (2, 1)}[orientation]
+        whole_extent = self.img3D.GetExtent()
+        rows, columns = [(extent[2 * axis] - whole_extent[2 * axis], extent[2 * axis + 1] - whole_extent[2 * axis])
+                         for axis in axes]
+
+        integral_statistics = self.getSliceIntegralStatistics()
+        statistics = integral_statistics.GetStatistics(rows, columns)
+        statistics['histogram'] = integral_statistics.GetHistogram(rows, columns)
+        statistics['bin_origin'] = integral_statistics.GetBinOrigin()
+        statistics['bin_spacing'] = integral_statistics.GetBinSpacing()
+        return statistics
+
+    def updateROIHistogram(self):
+        self.log("Updating hist")
+
+        statistics = self.getROIStatistics()
+        self.log("updateROIHistogram {0}".format(statistics))
+        histogram = statistics['histogram']
+        origin, spacing = statistics['bin_origin'], statistics['bin_spacing']
 
-        self.roiIA.IgnoreZeroOff()
-        self.roiIA.SetComponentOrigin(int(irange[0]), 0, 0)
-        self.roiIA.SetComponentSpacing(1, 0, 0)
-        self.roiIA.Update()
+        image = vtk.vtkImageData()
+        image.SetExtent(0, len(histogram) - 1, 0, 0, 0, 0)
+        image.SetOrigin(origin, 0, 0)
+        image.SetSpacing(spacing, 1, 1)
+        image.GetPointData().SetScalars(numpy_support.numpy_to_vtk(histogram.astype(numpy.int32), deep=1))
+        self.roiHistogram.SetOutput(image)
 
-        #use 255 bins
-        delta = self.roiIA.GetMax()[0] - self.roiIA.GetMin()[0]
-        nbins = 255
-        self.roiIA.SetComponentSpacing(delta / nbins, 0, 0)
-        self.roiIA.SetComponentExtent(0, nbins, 0, 0, 0, 0)
-        self.roiIA.Update()
+        # the range of the bins the ROI has values in:
+        filled_bins = numpy.flatnonzero(histogram)
+        irange = (origin + filled_bins[0] * spacing, origin + filled_bins[-1] * spacing)
 
-        self.histogramPlotActor.AddDataSetInputConnection(self.roiIA.GetOutputPort())
+        self.histogramPlotActor.AddDataSetInputConnection(self.roiHistogram.GetOutputPort())
         self.histogramPlotActor.SetXRange(irange[0], irange[1])
-        self.histogramPlotActor.SetYRange(self.roiIA.GetOutput().GetScalarRange())
+        self.histogramPlotActor.SetYRange(histogram.min(), histogram.max())
+
+    def getLineProfiles(self, imagecoordinate):
+        '''
+        Returns the profiles of the active slice through imagecoordinate, along the first and
+        second axes in the plane of the slice (e.g. along x and along y for an XY slice).
+        These are views of the scalars of img3D, so no data is copied or filtered.
+
+        Parameters
+        -----------
+        imagecoordinate: (x, y, z) image coordinates of a voxel. The coordinate normal
+            to the slice is ignored.
+        '''
+        axes = [axis for axis in range(3) if axis != self.getSliceOrientation()]
+        whole_extent = self.img3D.GetExtent()
+        column, row = [int(imagecoordinate[axis]) - whole_extent[2 * axis] for axis in axes]
+        array = self._getActiveSliceArray()
+        return array[row, :], array[:, column]
+
+    def _setLineProfileOutput(self, producer, values, axis, imagecoordinate):
+        '''
+        Sets the output of producer to the profile values, laid out along axis through
+        imagecoordinate in the active slice, in the same place as in img3D. The image is
+        reused whilst the profile has the same extent, so that moving the cursor along
+        the profile only copies the values into it.
+        '''
+        position = list(imagecoordinate[0:3])
+        position[self.getSliceOrientation()] = self.getActiveSlice()
+        extent = list(self.img3D.GetExtent())
+        for i in range(3):
+            if i != axis:
+                extent[2 * i] = extent[2 * i + 1] = int(position[i])
+
+        image = producer.GetOutputDataObject(0)
+        if list(image.GetExtent()) != extent or image.GetScalarType() != self.img3D.GetScalarType():
+            image = vtk.vtkImageData()
+            image.SetExtent(extent)
+            image.AllocateScalars(self.img3D.GetScalarType(), 1)
+            producer.SetOutput(image)
+        image.SetOrigin(self.img3D.GetOrigin())
+        image.SetSpacing(self.img3D.GetSpacing())
+        numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())[:] = values
+        image.Modified()
 
     def updateLinePlot(self, imagecoordinate, display):
 
         self.displayLinePlot = display
-        extent_x = list(self.img3D.GetExtent())
-        extent_y = list(self.img3D.GetExtent())
         self.log("imagecoordinate {0}".format(imagecoordinate))
 
         if display:
-            #extract profile along X
-            if self.getSliceOrientation() == SLICE_ORIENTATION_XY:
-                self.log("slice orientation : XY")
-                extent_y[0] = imagecoordinate[0]
-                extent_y[1] = imagecoordinate[0]
-
-                extent_x[2] = imagecoordinate[1]
-                extent_x[3] = imagecoordinate[1]
-
-                extent_y[4] = self.getActiveSlice()
-                extent_y[5] = self.getActiveSlice()
-                extent_x[4] = self.getActiveSlice()
-                extent_x[5] = self.getActiveSlice()
-
-                self.linePlotActor.SetDataObjectXComponent(0, 0)
-                self.linePlotActor.SetDataObjectXComponent(1, 1)
-
-                #y = abs(roi[1][1] - roi[0][1])
-            elif self.getSliceOrientation() == SLICE_ORIENTATION_XZ:
-                self.log("slice orientation : XZ")
-                extent_y[0] = imagecoordinate[0]
-                extent_y[1] = imagecoordinate[0]
-                #x = abs(roi[1][0] - roi[0][0])
-                extent_x[4] = imagecoordinate[2]
-                extent_x[5] = imagecoordinate[2]
-                #y = abs(roi[1][2] - roi[0][2])
-                extent_x[2] = self.getActiveSlice()
-                extent_x[3] = self.getActiveSlice()
-                extent_y[2] = self.getActiveSlice()
-                extent_y[3] = self.getActiveSlice()
-                self.linePlotActor.SetDataObjectXComponent(0, 0)
-                self.linePlotActor.SetDataObjectXComponent(1, 2)
-
-            elif self.getSliceOrientation() == SLICE_ORIENTATION_YZ:
-                self.log("slice orientation : YZ")
-                extent_y[2] = imagecoordinate[1]
-                extent_y[3] = imagecoordinate[1]
-                #x = abs(roi[1][1] - roi[0][1])
-                extent_x[4] = imagecoordinate[2]
-                extent_x[5] = imagecoordinate[2]
-                #y = abs(roi[1][2] - roi[0][2])
-                extent_x[0] = self.getActiveSlice()
-                extent_x[1] = self.getActiveSlice()
-                extent_y[0] = self.getActiveSlice()
-                extent_y[1] = self.getActiveSlice()
-
-                self.linePlotActor.SetDataObjectXComponent(0, 1)
-                self.linePlotActor.SetDataObjectXComponent(1, 2)
-
-            self.log("x {0} extent_x {1}".format(imagecoordinate[0], extent_x))
-            self.log("y {0} extent_y {1}".format(imagecoordinate[1], extent_y))
-            self.lineVOIX.SetVOI(extent_x)
-            self.lineVOIX.SetInputData(self.img3D)
-            self.lineVOIX.Update()
-            self.lineVOIY.SetVOI(extent_y)
-            self.lineVOIY.SetInputData(self.img3D)
-            self.lineVOIY.Update()
+            # the axes in the plane of the slice, which the profiles are along:
+            axis_x, axis_y = [axis for axis in range(3) if axis != self.getSliceOrientation()]
+            profile_x, profile_y = self.getLineProfiles(imagecoordinate)
+            self._setLineProfileOutput(self.lineProfileX, profile_x, axis_x, imagecoordinate)
+            self._setLineProfileOutput(self.lineProfileY, profile_y, axis_y, imagecoordinate)
+            self.linePlotActor.SetDataObjectXComponent(0, axis_x)
+            self.linePlotActor.SetDataObjectXComponent(1, axis_y)
 
             # fill
             if self.linePlot == 0:
-                self.linePlotActor.AddDataSetInputConnection(self.lineVOIX.GetOutputPort())
-                self.linePlotActor.AddDataSetInputConnection(self.lineVOIY.GetOutputPort())
+                self.linePlotActor.AddDataSetInputConnection(self.lineProfileX.GetOutputPort())
+                self.linePlotActor.AddDataSetInputConnection(self.lineProfileY.GetOutputPort())
                 # self.getRenderer().AddActor(self.linePlotActor)
                 self.AddActor(self.linePlotActor, LINEPLOT_ACTOR)
                 self.linePlot = 1
@@ -1778,8 +2290,7 @@ class CILViewer2D(CILViewerBase):
             origin_display = self.style.world2display((0, 0, 0))
 
             # Calculate the offset due to labels and borders on the graphs y-axis
-            max_y = max(int(self.lineVOIY.GetOutput().GetScalarRange()[1]),
-                        int(self.lineVOIX.GetOutput().GetScalarRange()[1]))
+            max_y = max(int(profile_x.max()), int(profile_y.max()))
             y_digits = len(str(max_y))
             x_min_offset = (width * y_digits) + border
             y_min_offset = height + border
@@ -1797,18 +2308,112 @@ class CILViewer2D(CILViewerBase):
             self.linePlotActor.SetPosition(origin_nview)
             self.linePlotActor.SetPosition2(top_right_nview[0] - origin_nview[0], 0.4)
 
-            self.log("data length x {0} y {1}".format(self.lineVOIX.GetOutput().GetDimensions(),
-                                                      self.lineVOIY.GetOutput().GetDimensions()))
+            self.log("data length x {0} y {1}".format(len(profile_x), len(profile_y)))
             self.linePlotActor.VisibilityOn()
             self.crosshairsActor.VisibilityOn()
 
-            self.renWin.Render()
+            self.requestRender()
 
         else:
             self.linePlotActor.VisibilityOff()
             self.crosshairsActor.VisibilityOff()
 
-            self.renWin.Render()
+            self.requestRender()
+
+    @staticmethod
+    def _sampleBilinear(array, rows, columns):
+        '''
+        Samples the 2D array at the fractional rows and columns, which are clamped to the
+        array, by bilinear interpolation. Only the pixels around the samples are read.
+        '''
+        rows = numpy.clip(rows, 0, array.shape[0] - 1)
+        columns = numpy.clip(columns, 0, array.shape[1] - 1)
+        row0 = numpy.minimum(numpy.floor(rows).astype(numpy.intp), max(array.shape[0] - 2, 0))
+        column0 = numpy.minimum(numpy.floor(columns).astype(numpy.intp), max(array.shape[1] - 2, 0))
+        row1 = numpy.minimum(row0 + 1, array.shape[0] - 1)
+        column1 = numpy.minimum(column0 + 1, array.shape[1] - 1)
+        fr = rows - row0
+        fc = columns - column0
+        top = (1 - fc) * array[row0, column0] + fc * array[row0, column1]
+        bottom = (1 - fc) * array[row1, column0] + fc * array[row1, column1]
+        return (1 - fr) * top + fr * bottom
+
+    def getSegmentProfile(self, start, end, num_samples=None):
+        '''
+        Returns the profile of the active slice along the segment from start to end,
+        sampled by bilinear interpolation: a tuple of the distances of the samples
+        from start, in world units, and their values.
+
+        Parameters
+        -----------
+        start, end: (x, y, z) image coordinates, which may be fractional. The coordinate
+            normal to the slice is ignored.
+        num_samples: int, optional
+            number of samples, evenly spaced from start to end. Defaults to one more than
+            the length of the segment in pixels.
+        '''
+        axes = [axis for axis in range(3) if axis != self.getSliceOrientation()]
+        whole_extent = self.img3D.GetExtent()
+        spacing = self.img3D.GetSpacing()
+        # the ends as (column, row) of the slice array:
+        start = numpy.array([start[axis] - whole_extent[2 * axis] for axis in axes], dtype=numpy.float64)
+        end = numpy.array([end[axis] - whole_extent[2 * axis] for axis in axes], dtype=numpy.float64)
+        if num_samples is None:
+            num_samples = int(numpy.ceil(numpy.hypot(*(end - start)))) + 1
+        if num_samples < 1:
+            raise ValueError('num_samples must be at least 1, got {}'.format(num_samples))
+
+        t = numpy.linspace(0, 1, num_samples)
+        columns = start[0] + t * (end[0] - start[0])
+        rows = start[1] + t * (end[1] - start[1])
+        values = self._sampleBilinear(self._getActiveSliceArray(), rows, columns)
+        length = numpy.hypot((end[0] - start[0]) * spacing[axes[0]], (end[1] - start[1]) * spacing[axes[1]])
+        return t * length, values
+
+    def updateSegmentProfilePlot(self, start, end, display):
+        '''
+        Plots the profile along the segment from start to end in the active slice, and
+        draws the segment on the slice. If display is False, hides both.
+
+        Parameters
+        -----------
+        start, end: (x, y, z) image coordinates, which may be fractional.
+        display: bool
+        '''
+        self.displaySegmentProfile = display
+
+        if display:
+            self.segmentProfileEnds = (start, end)
+            distances, values = self.getSegmentProfile(start, end)
+
+            image = vtk.vtkImageData()
+            image.SetExtent(0, len(values) - 1, 0, 0, 0, 0)
+            image.SetSpacing(distances[1] if len(distances) > 1 else 1, 1, 1)
+            image.GetPointData().SetScalars(numpy_support.numpy_to_vtk(values, deep=1))
+            self.segmentProfile.SetOutput(image)
+
+            if self.GetActor(SEGMENT_PROFILE_ACTOR) is None:
+                self.segmentProfilePlotActor.AddDataSetInputConnection(self.segmentProfile.GetOutputPort())
+                self.AddActor(self.segmentProfilePlotActor, SEGMENT_PROFILE_ACTOR)
+                self.AddActor(self.segmentProfileLineActor, SEGMENT_PROFILE_LINE_ACTOR)
+
+            # draw the segment in the plane of the active slice:
+            points = []
+            for point in (start, end):
+                point = list(point[0:3])
+                point[self.getSliceOrientation()] = self.getActiveSlice()
+                points.append(self.style.image2world(point))
+            self.segmentProfileLine.SetPoint1(points[0])
+            self.segmentProfileLine.SetPoint2(points[1])
+
+            self.segmentProfilePlotActor.SetXRange(0, max(distances[-1], 1e-6))
+            self.segmentProfilePlotActor.VisibilityOn()
+            self.segmentProfileLineActor.VisibilityOn()
+        else:
+            self.segmentProfilePlotActor.VisibilityOff()
+            self.segmentProfileLineActor.VisibilityOff()
+
+        self.requestRender()
 
     def AddActor(self, actor, name=None):
         '''print("ADDING ACTOR", name)
@@ -1,8 +1,15 @@
+import contextlib
+import math
+import time
+
+import numpy
 import vtk
+from vtk.util import numpy_support
 from ccpi.viewer import (ALT_KEY, CONTROL_KEY, CROSSHAIR_ACTOR, CURSOR_ACTOR, HELP_ACTOR, HISTOGRAM_ACTOR,
                          LINEPLOT_ACTOR, OVERLAY_ACTOR, SHIFT_KEY, SLICE_ACTOR, SLICE_ORIENTATION_XY,
                          SLICE_ORIENTATION_XZ, SLICE_ORIENTATION_YZ)
 from ccpi.viewer.utils.io import SaveRenderToPNG
+from ccpi.viewer.utils.visualisation_pipeline import cilGradientMagnitude
 
 
 class ViewerEventManager(object):
@@ -17,6 +24,8 @@ class ViewerEventManager(object):
             "CREATE_ROI_EVENT": False,  # ctrl + left mouse
             "DELETE_ROI_EVENT": False,  # alt + left mouse
             "SHOW_LINE_PROFILE_EVENT": False,  # l
+            "SEGMENT_PROFILE_EVENT": False,  # p
+            "DRAW_SEGMENT_PROFILE_EVENT": False,  # p + left mouse + move
             "UPDATE_WINDOW_LEVEL_UNDER_CURSOR": False,  # Mouse move + w
             "RECTILINEAR_WIPE": False  # activated by key 2, updates by mouse move
         }
@@ -41,6 +50,277 @@ class ViewerEventManager(object):
         return all(not x for x in self.events.values())
 
 
+class ImageStatistics(object):
+    '''
+    Histogram statistics of the values, or of the gradient magnitude, of an image.
+
+    The histogram and its cumulative distribution are computed once, so that
+    percentiles and the range of the values can be looked up without passing
+    over the image again. Use IsUpToDate to check whether the image has been
+    modified since.
+
+    Parameters
+    -----------
+    image: vtkImageData
+    method: string : ['scalar', 'gradient']
+        'scalar' - statistics of the values in the image
+        'gradient' - statistics of the values in the image's gradient magnitude
+    gradient_filter: cilGradientMagnitude, default None
+        filter which computes the gradient magnitude, for the 'gradient' method.
+        If None, one with the default settings is used. The gradient magnitude
+        is kept in the gradient attribute.
+    '''
+
+    def __init__(self, image, method='scalar', gradient_filter=None):
+        self._image = image
+        self._mtime = image.GetMTime()
+        self.gradient = None
+
+        ia = vtk.vtkImageHistogramStatistics()
+        if method == 'scalar':
+            ia.SetInputData(image)
+        else:
+            if gradient_filter is None:
+                gradient_filter = cilGradientMagnitude()
+            gradient_filter.SetInputData(image)
+            gradient_filter.Update()
+            self.gradient = vtk.vtkImageData()
+            self.gradient.ShallowCopy(gradient_filter.GetOutput())
+            ia.SetInputData(self.gradient)
+        ia.Update()
+        self.histogram_statistics = ia
+
+        histogram = numpy_support.vtk_to_numpy(ia.GetHistogram())
+        self.cdf = numpy.cumsum(histogram)
+        self.bin_values = ia.GetBinOrigin() + ia.GetBinSpacing() * numpy.arange(len(histogram))
+
+    def IsUpToDate(self, image):
+        return image is self._image and image.GetMTime() == self._mtime
+
+    def GetMinimum(self):
+        return self.histogram_statistics.GetMinimum()
+
+    def GetMaximum(self):
+        return self.histogram_statistics.GetMaximum()
+
+    def GetAutoRange(self, percentiles, expansion_factors=(0.1, 0.1)):
+        '''
+        Returns the values at the lower and upper percentiles, like
+        vtkImageHistogramStatistics.GetAutoRange, to the precision of the bins
+        of the histogram.
+
+        Parameters
+        -----------
+        percentiles: (float, float)
+            lower and upper percentiles, between 0 and 100
+        expansion_factors: (float, float), default (0.1, 0.1)
+            fractions of the range of the percentiles to expand it by at each end,
+            so that values just beyond the percentiles are included. The range
+            is never expanded beyond the minimum and maximum values.
+        '''
+        if self.cdf[-1] == 0:
+            return self.GetMinimum(), self.GetMaximum()
+        total = self.cdf[-1]
+        last_bin = len(self.cdf) - 1
+        # the first bins at which the cumulative distribution passes each percentile:
+        low = min(numpy.searchsorted(self.cdf, percentiles[0] * 0.01 * total, side='right'), last_bin)
+        high = min(numpy.searchsorted(self.cdf, percentiles[1] * 0.01 * total, side='left'), last_bin)
+        # with equal or close percentiles the low bin can pass the high one:
+        high = max(high, low)
+        low_value, high_value = self.bin_values[low], self.bin_values[high]
+
+        value_range = high_value - low_value
+        low_value -= expansion_factors[0] * value_range
+        high_value += expansion_factors[1] * value_range
+        return float(max(low_value, self.GetMinimum())), float(min(high_value, self.GetMaximum()))
+
+
+class SliceIntegralStatistics(object):
+    '''
+    Statistics and histograms of rectangular regions of a 2D slice, which take about
+    the same time to look up whatever the size of the region.
+
+    Summed-area tables of the values, and of their squares, give the sum, mean and
+    standard deviation of any rectangle with 4 look ups each. The histogram is binned
+    over the range of the values of the whole slice. An integral histogram of square
+    tiles of the slice gives the histogram of the tiles which a rectangle covers with
+    4 look ups per bin, so that only the pixels in the strips of partly covered tiles
+    along the edges of the rectangle are binned on each look up.
+
+    Parameters
+    -----------
+    array: numpy.ndarray
+        2D array of the slice, indexed (row, column)
+    num_bins: int, default 256
+        number of bins of the histogram. The first bin is at the minimum value
+        of the slice and the last one at its maximum.
+    tile_size: int, default 16
+        length in pixels of the side of the tiles of the integral histogram
+    '''
+
+    def __init__(self, array, num_bins=256, tile_size=16):
+        if numpy.ndim(array) != 2:
+            raise ValueError('Expected a 2D array. Got {} dimensions.'.format(numpy.ndim(array)))
+        if num_bins < 2 or tile_size < 1:
+            raise ValueError('Expected at least 2 bins and a tile size of at least 1. Got {} and {}'.format(
+                num_bins, tile_size))
+        values = numpy.asarray(array, dtype=numpy.float64)
+        self._shape = values.shape
+        self._minimum = float(values.min())
+        self._maximum = float(values.max())
+        self._num_bins = num_bins
+        self._tile_size = tile_size
+        self._bin_spacing = (self._maximum - self._minimum) / (num_bins - 1) if self._maximum > self._minimum else 1.
+        bins = numpy.floor((values - self._minimum) / self._bin_spacing)
+        self._bins = numpy.clip(bins, 0, num_bins - 1).astype(numpy.uint8 if num_bins <= 256 else numpy.uint32)
+
+        # the values are offset by their mean, so that the sums of squares keep their precision:
+        self._offset = float(values.mean())
+        values = values - self._offset
+        self._sums = self._SummedAreaTable(values)
+        values *= values
+        self._squared_sums = self._SummedAreaTable(values)
+
+        # histograms of the complete tiles, summed over the tiles above and to the left of each:
+        tile_rows, tile_columns = self._shape[0] // tile_size, self._shape[1] // tile_size
+        tiles = self._bins[:tile_rows * tile_size, :tile_columns * tile_size]
+        tiles = tiles.reshape(tile_rows, tile_size, tile_columns, tile_size).transpose(0, 2, 1, 3)
+        tiles = tiles.reshape(tile_rows * tile_columns, tile_size**2)
+        tile_offsets = numpy.arange(tile_rows * tile_columns, dtype=numpy.int64)[:, None] * num_bins
+        counts = numpy.bincount((tiles + tile_offsets).ravel(), minlength=tile_rows * tile_columns * num_bins)
+        self._tile_histograms = numpy.zeros((tile_rows + 1, tile_columns + 1, num_bins), dtype=numpy.int32)
+        self._tile_histograms[1:, 1:] = counts.reshape(tile_rows, tile_columns, num_bins).cumsum(0).cumsum(1)
+
+    @staticmethod
+    def _SummedAreaTable(values):
+        table = numpy.zeros((values.shape[0] + 1, values.shape[1] + 1))
+        numpy.cumsum(values, axis=0, out=table[1:, 1:])
+        numpy.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+        return table
+
+    @staticmethod
+    def _LookUp(table, rows, columns):
+        '''returns the sum over the rectangle of the integral table'''
+        r0, r1 = rows[0], rows[1] + 1
+        c0, c1 = columns[0], columns[1] + 1
+        return table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0]
+
+    def _ValidateRectangle(self, rows, columns):
+        rectangle = []
+        for (first, last), length in zip((rows, columns), self._shape):
+            first, last = int(min(first, last)), int(max(first, last))
+            if first < 0 or last >= length:
+                message = 'The rectangle {} is outside the slice of shape {}'
+                raise ValueError(message.format((rows, columns), self._shape))
+            rectangle.append((first, last))
+        return rectangle
+
+    def GetShape(self):
+        return self._shape
+
+    def GetNumberOfBins(self):
+        return self._num_bins
+
+    def GetTileSize(self):
+        return self._tile_size
+
+    def GetBinOrigin(self):
+        '''Returns the value of the first bin, the minimum value of the slice'''
+        return self._minimum
+
+    def GetBinSpacing(self):
+        return self._bin_spacing
+
+    def GetStatistics(self, rows, columns):
+        '''
+        Parameters
+        -----------
+        rows, columns: (int, int)
+            first and last row, and column, of the rectangle
+
+        Returns
+        -------
+        dict with the number of pixels ('count'), and the 'sum', 'mean' and (population)
+        standard deviation ('std') of their values
+        '''
+        rows, columns = self._ValidateRectangle(rows, columns)
+        count = (rows[1] - rows[0] + 1) * (columns[1] - columns[0] + 1)
+        offset_mean = self._LookUp(self._sums, rows, columns) / count
+        variance = self._LookUp(self._squared_sums, rows, columns) / count - offset_mean**2
+        # the rounding error of the 4 look ups in the table of squares, which is largest at its end:
+        if variance <= 4 * numpy.finfo(numpy.float64).eps * self._squared_sums[-1, -1] / count:
+            variance = 0.
+        mean = offset_mean + self._offset
+        return {'count': count, 'sum': mean * count, 'mean': mean, 'std': float(numpy.sqrt(max(variance, 0.)))}
+
+    def GetHistogram(self, rows, columns):
+        '''
+        Parameters
+        -----------
+        rows, columns: (int, int)
+            first and last row, and column, of the rectangle
+
+        Returns
+        -------
+        numpy.ndarray of the number of pixels of the rectangle in each bin. Bin i is at
+        GetBinOrigin() + i * GetBinSpacing(), and holds the values up to the next bin.
+        '''
+        rows, columns = self._ValidateRectangle(rows, columns)
+        tile_size = self._tile_size
+        # the complete tiles inside the rectangle:
+        tile_rows = (-(-rows[0] // tile_size), min((rows[1] + 1) // tile_size, self._tile_histograms.shape[0] - 1))
+        tile_columns = (-(-columns[0] // tile_size),
+                        min((columns[1] + 1) // tile_size, self._tile_histograms.shape[1] - 1))
+        if tile_rows[0] >= tile_rows[1] or tile_columns[0] >= tile_columns[1]:
+            region = self._bins[rows[0]:rows[1] + 1, columns[0]:columns[1] + 1]
+            return numpy.bincount(region.ravel(), minlength=self._num_bins)
+
+        histogram = self._LookUp(self._tile_histograms, (tile_rows[0], tile_rows[1] - 1),
+                                 (tile_columns[0], tile_columns[1] - 1)).astype(numpy.int64)
+        # the pixels in the strips around the complete tiles:
+        top, bottom = tile_rows[0] * tile_size, tile_rows[1] * tile_size
+        left, right = tile_columns[0] * tile_size, tile_columns[1] * tile_size
+        first_column, last_column = columns[0], columns[1] + 1
+        strips = [
+            self._bins[rows[0]:top, first_column:last_column],
+            self._bins[bottom:rows[1] + 1, first_column:last_column],
+            self._bins[top:bottom, first_column:left],
+            self._bins[top:bottom, right:last_column],
+        ]
+        for strip in strips:
+            if strip.size:
+                histogram += numpy.bincount(strip.ravel(), minlength=self._num_bins)
+        return histogram
+
+    def GetPercentiles(self, rows, columns, percentiles):
+        '''
+        Looks up the values at the percentiles of the rectangle in its histogram, so they
+        are accurate to a bin spacing. As in numpy.percentile, each is interpolated between
+        the pixels either side of it. If the rectangle is made of complete tiles, no pixels
+        are binned.
+
+        Parameters
+        -----------
+        rows, columns: (int, int)
+            first and last row, and column, of the rectangle
+        percentiles: list of float
+            percentiles, between 0 and 100
+
+        Returns
+        -------
+        numpy.ndarray of the values at the percentiles
+        '''
+        cumulative = numpy.cumsum(self.GetHistogram(rows, columns))
+        # the position of each percentile in the sorted pixels, counting from 0:
+        positions = numpy.asarray(percentiles, dtype=numpy.float64) / 100. * (cumulative[-1] - 1)
+        below = numpy.floor(positions)
+        # the bins of the pixels either side, whose ranks count from 1:
+        first_bins = numpy.searchsorted(cumulative, below + 1)
+        second_bins = numpy.searchsorted(cumulative, numpy.minimum(below + 2, cumulative[-1]))
+        bins = first_bins + (positions - below) * (second_bins - first_bins)
+        return self._minimum + bins * self._bin_spacing
+
+
 class CILViewerBase():
     '''
     Base Class for CILViewers.
@@ -90,6 +370,9 @@ class CILViewerBase():
         self.voi = vtk.vtkExtractVOI()
         self.ia = vtk.vtkImageHistogramStatistics()
         self.ia.SetAutoRangePercentiles(5.0, 95.)
+        # statistics of the whole image, keyed by method:
+        self._imageStatistics = {}
+        self._gradientMagnitudeFilter = cilGradientMagnitude()
 
         self.helpActor = vtk.vtkActor2D()
         self.helpActor.GetPositionCoordinate().SetCoordinateSystemToNormalizedDisplay()
@@ -130,10 +413,187 @@ class CILViewerBase():
         self.histogramPlotActor.SetXValuesToValue()
         self.histogramPlotActor.SetPlotColor(0, (0, 1, 1))
 
+        # render scheduler, see requestRender:
+        self._renderBatchDepth = 0
+        self._renderPending = False
+        self._renderTimer = None
+        self._lastRenderTime = -math.inf
+        self._maxFrameRate = None
+        self._renderStats = {'requested': 0, 'rendered': 0}
+        self.iren.AddObserver('TimerEvent', self._onRenderTimer)
+
+        # profiler which times the pipeline and renders, see setProfiler:
+        self._profiler = None
+        self._profiledObjects = []
+
     def setInteractorStyle(self, style):
         self.style = style
         self.iren.SetInteractorStyle(self.style)
         self.iren.Initialize()
+        # the renders requested whilst the style handles an event are coalesced. Only the
+        # events the style already observes are batched, as observing an event stops the
+        # style handling it by default:
+        for event in CILViewerBase.RENDER_BATCH_EVENTS:
+            if style.HasObserver(event):
+                style.AddObserver(event, self._beginRenderBatch, 1.e9)
+                style.AddObserver(event, self._endRenderBatch, -1.e9)
+
+    # RENDER SCHEDULER: ---------------------------------------------------------
+
+    RENDER_BATCH_EVENTS = [
+        'MouseWheelForwardEvent', 'MouseWheelBackwardEvent', 'KeyPressEvent', 'KeyReleaseEvent', 'CharEvent',
+        'LeftButtonPressEvent', 'LeftButtonReleaseEvent', 'RightButtonPressEvent', 'RightButtonReleaseEvent',
+        'MouseMoveEvent'
+    ]
+
+    def requestRender(self):
+        '''
+        Marks the viewer as needing a render. It is rendered straight away, unless:
+
+        - the request is made within a renderBatch, or whilst the interactor style
+          handles an event, in which case it is rendered once at the end of it
+        - a maximum frame rate is set and the last render was less than a frame
+          interval ago, in which case it is rendered by a timer on the interactor
+          when the interval is up, or by flushRender
+        '''
+        self._renderStats['requested'] += 1
+        self._renderPending = True
+        if self._renderBatchDepth == 0:
+            self._renderOrSchedule()
+
+    @contextlib.contextmanager
+    def renderBatch(self):
+        '''
+        Context manager which coalesces the renders requested within it into one,
+        at the end of the outermost batch.
+        '''
+        self._renderBatchDepth += 1
+        try:
+            yield
+        finally:
+            self._renderBatchDepth -= 1
+            if self._renderBatchDepth == 0 and self._renderPending:
+                self._renderOrSchedule()
+
+    def flushRender(self):
+        '''Renders straight away if a render has been requested and not done yet'''
+        if self._renderPending:
+            self._render()
+
+    def setMaxFrameRate(self, value):
+        '''
+        Caps the rate the viewer renders at, for instance for remote or headless sessions.
+        The renders which are deferred need a running interactor, or a call to flushRender.
+
+        Parameters
+        -----------
+        value: float or None
+            maximum number of renders per second, or None not to cap the frame rate
+        '''
+        if value is not None and value <= 0:
+            raise ValueError('The maximum frame rate must be positive or None, got {}'.format(value))
+        self._maxFrameRate = value
+
+    def getMaxFrameRate(self):
+        return self._maxFrameRate
+
+    def getRenderStats(self):
+        '''
+        Returns
+        -------
+        dict with the number of renders 'requested' with requestRender, the number
+        'rendered', and the number 'coalesced' into another render
+        '''
+        stats = dict(self._renderStats)
+        stats['coalesced'] = stats['requested'] - stats['rendered'] - int(self._renderPending)
+        return stats
+
+    def resetRenderStats(self):
+        self._renderStats = {'requested': 0, 'rendered': 0}
+
+    def _renderOrSchedule(self):
+        if self._maxFrameRate is not None:
+            wait = 1. / self._maxFrameRate - (time.perf_counter() - self._lastRenderTime)
+            if wait > 0:
+                if self._renderTimer is None:
+                    self._renderTimer = self.iren.CreateOneShotTimer(max(1, int(math.ceil(wait * 1000))))
+                return
+        self._render()
+
+    def _render(self):
+        if self._renderTimer is not None:
+            self.iren.DestroyTimer(self._renderTimer)
+            self._renderTimer = None
+        self._renderPending = False
+        self._lastRenderTime = time.perf_counter()
+        self._renderStats['rendered'] += 1
+        self.renWin.Render()
+
+    def _onRenderTimer(self, interactor, event):
+        if self._renderTimer is not None and interactor.GetTimerEventId() == self._renderTimer:
+            self._renderTimer = None
+            if self._renderPending:
+                self._render()
+
+    def _beginRenderBatch(self, caller, event):
+        self._renderBatchDepth += 1
+
+    def _endRenderBatch(self, caller, event):
+        self._renderBatchDepth = max(self._renderBatchDepth - 1, 0)
+        if self._renderBatchDepth == 0 and self._renderPending:
+            self._renderOrSchedule()
+
+    # PROFILING: ----------------------------------------------------------------
+
+    def setProfiler(self, profiler):
+        '''
+        Times the VTK algorithms of the viewer, its renders and the updates of its pipeline
+        with a PipelineProfiler. The readers which load the images are timed by the
+        profiler set with ccpi.viewer.utils.set_pipeline_profiler.
+
+        Parameters
+        -----------
+        profiler: PipelineProfiler or None
+            profiler to record the timings with, or None to stop timing the viewer
+        '''
+        if self._profiler is not None:
+            for obj in self._profiledObjects:
+                self._profiler.StopObserving(obj)
+        self._profiledObjects = []
+        self._profiler = profiler
+        self._observeProfiledObjects()
+
+    def getProfiler(self):
+        return self._profiler
+
+    def getProfileSummary(self):
+        '''
+        Returns
+        -------
+        the summary of the timings recorded by the profiler, see PipelineProfiler.GetSummary,
+        or an empty list if no profiler is set
+        '''
+        if self._profiler is None:
+            return []
+        return self._profiler.GetSummary()
+
+    def _observeProfiledObjects(self):
+        '''observes the render window and the VTK algorithms held by the viewer with the profiler.
+        This is called again when an image is set, as some algorithms are only created then.'''
+        if self._profiler is None:
+            return
+        objects = [('render', self.renWin)]
+        objects += [(name, value) for name, value in vars(self).items() if isinstance(value, vtk.vtkAlgorithm)]
+        for name, obj in objects:
+            if not self._profiler.IsObserving(obj):
+                self._profiler.Observe(obj, '{}.{}'.format(type(self).__name__, name))
+                self._profiledObjects.append(obj)
+
+    def _profilePhase(self, name):
+        '''returns a context manager which times the code run within it with the profiler, if one is set'''
+        if self._profiler is None:
+            return contextlib.nullcontext()
+        return self._profiler.Phase('{}.{}'.format(type(self).__name__, name), category='viewer')
 
     def getInteractor(self):
         return self.iren
@@ -181,19 +641,68 @@ class CILViewerBase():
     def setInput3DData(self, imageData):
         raise NotImplementedError("Implemented in the subclasses.")
 
+    def getImageStatistics(self, method):
+        '''
+        returns the ImageStatistics of either the image or gradient of
+        the image, depending on the method. These are computed once and
+        cached until the image is modified or replaced.
+        '''
+        statistics = self._imageStatistics.get(method)
+        if statistics is None or not statistics.IsUpToDate(self.img3D):
+            if statistics is not None:
+                # the image has changed, so all the statistics are out of date:
+                self._imageStatistics.clear()
+            statistics = ImageStatistics(self.img3D, method, self._gradientMagnitudeFilter)
+            self._imageStatistics[method] = statistics
+        return statistics
+
+    def getImageGradientMagnitude(self):
+        '''
+        returns the gradient magnitude of the image, as vtkImageData. It is computed
+        once, in z slabs by a pool of threads (see cilGradientMagnitude), and cached
+        with the gradient statistics until the image is modified or replaced.
+        '''
+        return self.getImageStatistics('gradient').gradient
+
+    def setGradientMagnitudeScalarType(self, scalar_type):
+        '''
+        Parameters
+        -----------
+        scalar_type: int or None, default None
+            VTK scalar type to store the gradient magnitude of the image as, e.g. vtk.VTK_FLOAT
+            or vtk.VTK_UNSIGNED_SHORT to save memory, or None for the scalar type of the image.
+        '''
+        self._gradientMagnitudeFilter.SetOutputScalarType(scalar_type)
+        self._imageStatistics.pop('gradient', None)
+
+    def getGradientMagnitudeScalarType(self):
+        return self._gradientMagnitudeFilter.GetOutputScalarType()
+
+    def setGradientMagnitudeNumberOfThreads(self, value):
+        '''
+        Parameters
+        -----------
+        value: int, default min(8, number of CPUs)
+            number of threads which compute the gradient magnitude of the image
+        '''
+        self._gradientMagnitudeFilter.SetNumberOfThreads(value)
+
+    def getGradientMagnitudeNumberOfThreads(self):
+        return self._gradientMagnitudeFilter.GetNumberOfThreads()
+
     def getImageHistogramStatistics(self, method, slice=False):
         '''
         returns histogram statistics for either the image
         or gradient of the image depending on the method
         if slice = True, calculates for the slice instead of
         the entire image volume.
+        The statistics of the entire image volume are cached, see getImageStatistics.
         '''
-        ia = vtk.vtkImageHistogramStatistics()
+        if not slice:
+            return self.getImageStatistics(method).histogram_statistics
 
-        if slice:
-            input_data = self.voi.GetOutput()
-        else:
-            input_data = self.img3D
+        ia = vtk.vtkImageHistogramStatistics()
+        input_data = self.voi.GetOutput()
 
         if method == 'scalar':
             ia.SetInputData(input_data)
@@ -212,11 +721,7 @@ class CILViewerBase():
         the image or image gradient (depending on method) for which
         the colormap or opacity are displayed.
         '''
-        ia = self.getImageHistogramStatistics(method)
-        ia.SetAutoRangePercentiles(*percentiles)
-        ia.Update()
-        min, max = ia.GetAutoRange()
-        return min, max
+        return self.getImageStatistics(method).GetAutoRange(percentiles)
 
     def getImageMapWholeRange(self, method):
         '''
@@ -227,9 +732,9 @@ class CILViewerBase():
             'gradient' - returns full range of values in 3D image's gradient
         '''
 
-        ia = self.getImageHistogramStatistics(method)
+        statistics = self.getImageStatistics(method)
 
-        return ia.GetMinimum(), ia.GetMaximum()
+        return statistics.GetMinimum(), statistics.GetMaximum()
 
     # METHODS ON THE SLICE: --------------------------------------------------------
 
@@ -245,13 +750,13 @@ class CILViewerBase():
     # Set interpolation on
     def setInterpolateOn(self):
         self.imageSlice.GetProperty().SetInterpolationTypeToLinear()
-        self.renWin.Render()
+        self.requestRender()
 
     # Set interpolation off
     def setInterpolateOff(self):
         self.imageSlice.GetProperty()\
             .SetInterpolationTypeToNearest()
-        self.renWin.Render()
+        self.requestRender()
 
     def setSliceColorWindowLevel(self, window, level):
         '''
@@ -261,8 +766,7 @@ class CILViewerBase():
         self.imageSlice.GetProperty().SetColorLevel(level)
         self.imageSlice.GetProperty().SetColorWindow(window)
         self.imageSlice.Update()
-        self.ren.Render()
-        self.renWin.Render()
+        self.requestRender()
 
     def setSliceColorPercentiles(self, min_percentage, max_percentage):
         min_val, max_val = self.getSliceMapRange((min_percentage, max_percentage), 'scalar')
@@ -281,8 +785,7 @@ class CILViewerBase():
         '''
         self.imageSlice.GetProperty().SetColorWindow(window)
         self.imageSlice.Update()
-        self.ren.Render()
-        self.renWin.Render()
+        self.requestRender()
 
     def setSliceColorLevel(self, level):
         '''
@@ -290,8 +793,7 @@ class CILViewerBase():
         '''
         self.imageSlice.GetProperty().SetColorLevel(level)
         self.imageSlice.Update()
-        self.ren.Render()
-        self.renWin.Render()
+        self.requestRender()
 
     def getSliceColorWindow(self):
         '''
@@ -355,6 +857,7 @@ class CILViewerBase():
     def autoWindowLevelOnSliceRange(self, update_slice=True):
         '''Auto-adjusts window-level for the slice, based on the 5 and 95th percentiles of the current slice.'''
         self.ia.SetAutoRangePercentiles(5.0, 95.)
+        self.ia.Update()
         cmin, cmax = self.ia.GetAutoRange()
         window, level = self.getSliceWindowLevelFromRange(cmin, cmax)
 
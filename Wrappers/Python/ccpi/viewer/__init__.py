@@ -13,6 +13,8 @@ HELP_ACTOR = 'help_actor'
 CURSOR_ACTOR = 'cursor_actor'
 CROSSHAIR_ACTOR = 'crosshair_actor'
 LINEPLOT_ACTOR = 'lineplot_actor'
+SEGMENT_PROFILE_ACTOR = 'segment_profile_actor'
+SEGMENT_PROFILE_LINE_ACTOR = 'segment_profile_line_actor'
 WIPE_ACTOR = 'wipe_actor'
 
 from .CILViewer import CILViewer as viewer3D
@@ -1,15 +1,27 @@
 from argparse import ArgumentParser
 
+import os
+
 import yaml
 import schema
 from schema import SchemaError, Schema, Optional
 
-from ccpi.viewer.utils.io import ImageReader, ImageWriter
+from ccpi.viewer.utils.conversion import DOWNSAMPLE_METHODS
+from ccpi.viewer.utils.io import ImageReader, ImageWriter, cilviewerHDF5StreamWriter
+from ccpi.viewer.utils.profiler import PipelineProfiler, profile_phase, set_pipeline_profiler
 '''
 This command line tool takes a dataset file and a yaml file as input.
 It resamples or crops the dataset as it reads it in, and then writes
 out the resulting dataset to a file.
 
+With stream set, each resampled slice is written to the HDF5 file as
+soon as it is produced, so the resampled dataset is never held in memory
+as a whole. Use this to resample datasets on machines with little memory.
+
+With --profile, the time taken by each step of reading, resampling and
+writing the dataset is printed as a table, and written to a Chrome trace
+file, which can be opened in chrome://tracing or https://ui.perfetto.dev
+
 Supported file types for reading:
 hdf5, nxs, mha, raw, numpy
 
@@ -29,9 +41,13 @@ input:
 resample:
     target_size: 1
     resample_z: True
+    downsample_method: 'mean' # reslice (default), mean, max, min, median
 output:
     file_name: 'this_fname.nxs'
     format: 'hdf5' # npy, METAImage, NIFTI (or Zarr to come)
+    stream: False # write each slice as it is resampled, only for hdf5
+    compression: 'gzip' # None (default), gzip or lzf, only for hdf5
+    compression_opts: 4 # gzip compression level
 '''
 '''
 
@@ -64,6 +80,8 @@ Entry 2 contains the resampled dataset and attributes
                                             - original_dataset: /entry1/tomo_entry/data/data
 '''
 
+HDF5_COMPRESSION_TYPES = (None, 'gzip', 'lzf')
+
 # This validates the input yaml file:
 schema = Schema({
     'input': {
@@ -76,11 +94,15 @@ schema = Schema({
     },  # only for hdf5 # need to set default
     'resample': {
         'target_size': float,
-        'resample_z': bool
+        'resample_z': bool,
+        Optional('downsample_method'): lambda m: m in DOWNSAMPLE_METHODS
     },
     'output': {
         'file_name': str,
-        'format': str
+        'format': str,
+        Optional('stream'): bool,
+        Optional('compression'): lambda c: c in HDF5_COMPRESSION_TYPES,
+        Optional('compression_opts'): int
     }
 })
 
@@ -118,6 +140,12 @@ def parse_arguments():
     parser.add_argument('--resample_z',
                         help='Whether to resample along the z axis of the dataset. Optional.',
                         default=True)
+    parser.add_argument('--downsample_method',
+                        help='How to downsample the dataset. reslice samples the dataset with vtkImageReslice, ' +
+                        'the others reduce each block of voxels to a single voxel. Optional.',
+                        choices=DOWNSAMPLE_METHODS,
+                        type=str,
+                        default='reslice')
 
     parser.add_argument('-o', help='Output filename. Required if -f is not set.')
     parser.add_argument('--out_format',
@@ -125,6 +153,20 @@ def parse_arguments():
                         choices=['hdf5', 'nxs', 'mha'],
                         type=str,
                         default='nxs')
+    parser.add_argument('--stream',
+                        help='Write each slice to the file as soon as it is resampled, ' +
+                        'instead of resampling the whole dataset in memory first. Only for hdf5/nxs.',
+                        action='store_true')
+    parser.add_argument('--compression',
+                        help='Compression filter for the hdf5/nxs output. Optional.',
+                        choices=HDF5_COMPRESSION_TYPES[1:],
+                        type=str)
+    parser.add_argument('--compression_opts', help='Compression level, for gzip compression.', type=int)
+
+    parser.add_argument('--profile',
+                        help='Times each step of reading, resampling and writing the dataset, prints a summary ' +
+                        'and writes the timings to this file as a Chrome trace. May be used with -f.',
+                        type=str)
 
     args = parser.parse_args()
 
@@ -142,6 +184,10 @@ def get_params_from_args(args):
                 # each of the values in data_raw is a dict
                 params[key] = {}
                 for sub_key, value in dict.items():
+                    if sub_key == 'downsample_method':
+                        # don't evaluate these, as 'max' and 'min' are python builtins:
+                        params[key][sub_key] = value
+                        continue
                     try:
                         params[key][sub_key] = eval(value)
                     except:
@@ -182,9 +228,18 @@ def get_params_from_args(args):
         if args.resample_z is not None:
             params['resample']['resample_z'] = eval(args.resample_z)
 
+        if args.downsample_method is not None:
+            params['resample']['downsample_method'] = args.downsample_method
+
         if args.out_format is not None:
             params['output']['format'] = args.out_format
 
+        params['output']['stream'] = args.stream
+
+        for a in ['compression', 'compression_opts']:
+            if eval(f"args.{a}") is not None:
+                params['output'][a] = eval(f"args.{a}")
+
     return params
 
 
@@ -196,6 +251,23 @@ def main():
         return
     params = get_params_from_args(args)
 
+    if args.profile is None:
+        resample_file(params)
+        return
+
+    profiler = PipelineProfiler()
+    set_pipeline_profiler(profiler)
+    try:
+        with profiler.Phase('resample file'):
+            resample_file(params)
+    finally:
+        set_pipeline_profiler(None)
+        profiler.WriteChromeTrace(args.profile)
+        print(profiler.FormatSummary())
+
+
+def resample_file(params):
+    '''reads and resamples the dataset, and writes it out, as set in the parameters'''
     raw_attrs = None
     dataset_name = None
     if 'input' in params.keys():
@@ -217,7 +289,13 @@ def main():
                          target_size=target_size,
                          resample_z=params['resample']['resample_z'],
                          raw_image_attrs=raw_attrs,
-                         hdf5_dataset_name=dataset_name)
+                         hdf5_dataset_name=dataset_name,
+                         downsample_method=params['resample'].get('downsample_method', 'reslice'))
+
+    if params['output'].get('stream', False):
+        write_resampled_slices(reader, params['output'])
+        return
+
     downsampled_image = reader.Read()
     original_image_attrs = reader.GetOriginalImageAttrs()
     loaded_image_attrs = reader.GetLoadedImageAttrs()
@@ -225,9 +303,42 @@ def main():
     writer = ImageWriter()
     writer.SetFileName(params['output']['file_name'])
     writer.SetFileFormat(params['output']['format'])
+    writer.SetHDF5Compression(get_hdf5_compression(params['output']))
     writer.SetOriginalDataset(None, original_image_attrs)
     writer.AddChildDataset(downsampled_image, loaded_image_attrs)
-    writer.Write()
+    with profile_phase('write'):
+        writer.Write()
+
+
+def get_hdf5_compression(output_params):
+    '''returns the compression settings for the HDF5 writers from the output parameters'''
+    compression = output_params.get('compression')
+    if compression is None:
+        return None
+    return [compression, output_params.get('compression_opts'), True]
+
+
+def write_resampled_slices(reader, output_params):
+    '''Resamples the dataset with the ImageReader one chunk at a time, and
+    writes each resampled slice to the HDF5 output file as soon as it is produced.'''
+    file_format = output_params['format']
+    if file_format not in ['hdf5', 'nxs', 'h5']:
+        raise Exception("Streaming is only supported when writing to hdf5/nexus. Got format: {}".format(file_format))
+    file_name = os.path.splitext(output_params['file_name'])[0] + '.' + file_format
+
+    shape, slices = reader.ReadSlices()
+
+    writer = cilviewerHDF5StreamWriter()
+    writer.SetFileName(file_name)
+    writer.SetHDF5Compression(get_hdf5_compression(output_params))
+    writer.SetOriginalDataset(None, reader.GetOriginalImageAttrs())
+    writer.Open(shape, reader.GetLoadedImageAttrs())
+    try:
+        for index, array in slices:
+            with profile_phase('write slice', index=index):
+                writer.WriteSlice(index, array)
+    finally:
+        writer.Close()
 
 
 if __name__ == '__main__':
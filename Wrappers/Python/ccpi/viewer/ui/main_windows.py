@@ -12,12 +12,12 @@ from ccpi.viewer.QCILViewerWidget import QCILDockableWidget
 from ccpi.viewer.ui.dialogs import HDF5InputDialog, RawInputDialog, ViewerSettingsDialog
 from ccpi.viewer.ui.qt_widgets import ViewerCoordsDockWidget
 from ccpi.viewer.utils import cilPlaneClipper
-from ccpi.viewer.utils.io import ImageReader
+from ccpi.viewer.utils.io import ImageReadCancelledError, ImageReader, format_read_progress
 from eqt.threading import Worker
 from eqt.ui.SessionDialogs import ErrorDialog
 from eqt.ui.MainWindowWithSessionManagement import MainWindowWithProgressDialogs, MainWindowWithSessionManagement
 from PySide2.QtCore import Qt
-from PySide2.QtWidgets import QApplication, QFileDialog, QMainWindow, QSizePolicy
+from PySide2.QtWidgets import QApplication, QFileDialog, QMainWindow, QProgressDialog, QSizePolicy
 
 
 class ViewerMainWindow(MainWindowWithProgressDialogs):
@@ -68,6 +68,7 @@ class ViewerMainWindow(MainWindowWithProgressDialogs):
         self._viewer_docks = []
         self._frames = []
         self._vs_dialog = None
+        self.read_progress_window = None
 
         self.createViewerCoordsDockWidget()
 
@@ -291,19 +292,75 @@ class ViewerMainWindow(MainWindowWithProgressDialogs):
         image_reader.SetHDF5DatasetName(dataset_name)
         image_reader.SetResampleZ(resample_z)
         image_reader_worker = Worker(image_reader.Read)
-        self.createUnknownProgressWindow("Reading Image")
+        self.createReadProgressWindow(image_reader)
         if image_name is None and isinstance(image, str):
             image_name = image
         image_reader_worker.signals.result.connect(
             partial(self.displayImage, viewers, input_num, image_reader, image_name))
-        image_reader_worker.signals.finished.connect(lambda: self.finishProcess("Reading Image"))
+        image_reader_worker.signals.progress.connect(partial(self.updateReadProgressWindow, image_reader))
+        image_reader_worker.signals.finished.connect(self.closeReadProgressWindow)
         image_reader_worker.signals.error.connect(self.processErrorDialog)
         self.threadpool.start(image_reader_worker)
 
+    def createReadProgressWindow(self, image_reader, title="Reading Image"):
+        '''
+        Creates a progress window for reading an image, which shows the progress,
+        speed and estimated time left of the read, and can cancel it.
+
+        Parameters
+        ----------
+        image_reader: ImageReader
+            The reader reading the image.
+        title: str
+            The title of the window.
+        '''
+        self.closeReadProgressWindow()
+        dialog = QProgressDialog(title, "Cancel", 0, 100, self)
+        dialog.setWindowTitle(title)
+        dialog.setWindowModality(Qt.ApplicationModal)
+        dialog.setMinimumDuration(0)
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        dialog.canceled.connect(image_reader.Cancel)
+        dialog.setValue(0)
+        dialog.show()
+        self.read_progress_window = dialog
+
+    def updateReadProgressWindow(self, image_reader, value):
+        '''
+        Updates the progress window for reading an image with the progress of the read.
+
+        Parameters
+        ----------
+        image_reader: ImageReader
+            The reader reading the image.
+        value: int
+            The progress of the read, as a percentage.
+        '''
+        dialog = self.read_progress_window
+        if dialog is None or dialog.wasCanceled():
+            return
+        dialog.setValue(value)
+        dialog.setLabelText(format_read_progress(image_reader.GetReadProgress()))
+
+    def closeReadProgressWindow(self):
+        '''
+        Closes the progress window for reading an image, if it is open.
+        '''
+        dialog = self.read_progress_window
+        if dialog is not None:
+            # closing the dialog emits canceled, which mustn't cancel the next read:
+            dialog.canceled.disconnect()
+            dialog.close()
+            self.read_progress_window = None
+
     def processErrorDialog(self, error, **kwargs):
         '''
         Creates an error dialog to display the error.
+        No dialog is shown if reading an image was cancelled by the user.
         '''
+        if error[0] is ImageReadCancelledError:
+            return
         dialog = ErrorDialog(self, "Error", str(error[1]), str(error[2]))
         dialog.open()
 
@@ -1,6 +1,9 @@
 from .conversion import *
 from .colormaps import *
 
-from .visualisation_pipeline import cilClipPolyDataBetweenPlanes, cilPlaneClipper, cilMaskPolyData
+from .visualisation_pipeline import (cilClipPolyDataBetweenPlanes, cilPlaneClipper, cilMaskPolyData,
+                                     cilCachedExtractVOI, cilGradientMagnitude)
 
 from .CameraData import CameraData
+
+from .profiler import PipelineProfiler, get_pipeline_profiler, set_pipeline_profiler
@@ -27,6 +27,8 @@
 # You should have received a copy of the CC0 legalcode along with this
 # work.  If not, see <http://creativecommons.org/publicdomain/zero/1.0/>.
 
+from collections import OrderedDict
+
 import vtk
 import numpy
 
@@ -419,56 +421,131 @@ def relu(x, xmin, xmax, scaling=1):
     :param scaling: (optional) max value, defaults to 1
 
     '''
-    out = []
-    dx = xmax - xmin
-    for i, val in enumerate(x):
-        if val < xmin or val > xmax:
-            out.append(0)
-        else:
-            out.append(scaling * ((val - xmin) / dx))
-    return numpy.asarray(out)
+    x = numpy.asarray(x, dtype=numpy.float64)
+    out = ramp(x, xmin, xmax, scaling)
+    out[x > xmax] = 0
+    return out
+
+
+def ramp(x, xmin, xmax, scaling=1):
+    r'''Linear ramp between two values
+
+    returns values as
+    1. x< xmin : f(x) = 0
+    2. xmin <= x <= xmax : f(x) =  (x - xmin) / (xmax - xmin)
+    3. x > xmax: f(x) = 1
+
+    :param x: ndarray to evaluate the function at
+    :param xmin: value at which the function start increasing
+    :param xmax: value at which the function stops increasing
+    :param scaling: (optional) max value, defaults to 1
+
+    '''
+    x = numpy.asarray(x, dtype=numpy.float64)
+    if xmax == xmin:
+        return step(x, xmin, scaling)
+    return scaling * numpy.clip((x - xmin) / (xmax - xmin), 0, 1)
+
+
+def step(x, x0, scaling=1):
+    r'''Step function
+
+    returns values as
+    1. x< x0 : f(x) = 0
+    2. x >= x0: f(x) = 1
+
+    :param x: ndarray to evaluate the function at
+    :param x0: value at which the function steps up
+    :param scaling: (optional) max value, defaults to 1
+
+    '''
+    x = numpy.asarray(x, dtype=numpy.float64)
+    return numpy.where(x < x0, 0., float(scaling))
 
 
 class CILColorMaps(object):
+    '''Creates the color and opacity transfer functions for the volume render.
 
-    @staticmethod
-    def get_color_map(cmap):
+    The transfer functions are memoised: the same arguments return a deep copy
+    of the same VTK object, so that it isn't rebuilt, and the copy may be modified.
+    The most recently used MAX_CACHED_FUNCTIONS of each kind are kept.'''
+
+    MAX_CACHED_FUNCTIONS = 32
+    _color_maps = {}
+    _color_transfer_functions = OrderedDict()
+    _opacity_transfer_functions = OrderedDict()
+
+    @classmethod
+    def get_color_map(cls, cmap):
+        if cmap in cls._color_maps:
+            return cls._color_maps[cmap]
         if not cmap in _color_map_dict.keys():
 
             try:
                 from matplotlib import cm
 
-                colors = []
-                for x in range(0, 255):
-                    color = cm.get_cmap(cmap)(x)
-                    colors.append([color[0], color[1], color[2]])
+                colors = cm.get_cmap(cmap)(numpy.arange(0, 255))[:, :3].tolist()
             except ImportError:
                 print("To use colormaps other than: ",
                       "{}, please install matplotlib.".format(str(list(_color_map_dict.keys()))))
+                return None
 
         else:
             colors = _color_map_dict[cmap]
+        cls._color_maps[cmap] = colors
         return colors
 
+    @classmethod
+    def _get_cached_function(cls, cache, key):
+        '''returns a copy of the cached function, or None if it isn't cached'''
+        tf = cache.get(key)
+        if tf is None:
+            return None
+        cache.move_to_end(key)
+        return cls._copy_function(tf)
+
+    @classmethod
+    def _cache_function(cls, cache, key, tf):
+        '''caches the function, and returns a copy of it'''
+        cache[key] = tf
+        while len(cache) > cls.MAX_CACHED_FUNCTIONS:
+            cache.popitem(last=False)
+        return cls._copy_function(tf)
+
+    @staticmethod
+    def _copy_function(tf):
+        copy = tf.NewInstance()
+        copy.DeepCopy(tf)
+        return copy
+
     @classmethod
     def get_color_transfer_function(cls, cmap, color_range):
+        key = (cmap, float(color_range[0]), float(color_range[1]))
+        tf = cls._get_cached_function(cls._color_transfer_functions, key)
+        if tf is not None:
+            return tf
 
         tf = vtk.vtkColorTransferFunction()
 
-        colors = cls.get_color_map(cmap)
+        colors = numpy.ascontiguousarray(cls.get_color_map(cmap), dtype=numpy.float64)
 
-        N = len(colors)
-        for i, color in enumerate(colors):
-            level = color_range[0] + \
-                (color_range[1] - color_range[0]) * i / (N-1)
-            tf.AddRGBPoint(level, color[0], color[1], color[2])
+        # N colors evenly spaced over the color range:
+        tf.BuildFunctionFromTable(key[1], key[2], len(colors), colors.ravel())
 
-        return tf
+        return cls._cache_function(cls._color_transfer_functions, key, tf)
+
+    @classmethod
+    def get_opacity_transfer_function(cls, x, function, *params):
+        x = numpy.asarray(x, dtype=numpy.float64)
+        key = (function, params, x.tobytes())
+        opacity = cls._get_cached_function(cls._opacity_transfer_functions, key)
+        if opacity is not None:
+            return opacity
 
-    @staticmethod
-    def get_opacity_transfer_function(x, function, *params):
         opacity = vtk.vtkPiecewiseFunction()
         vals = function(x, *params)
-        for _x, _y in zip(x, vals):
-            opacity.AddPoint(_x, _y)
-        return opacity
+        # pairs of x, opacity:
+        points = numpy.ascontiguousarray(numpy.column_stack((x, vals)), dtype=numpy.float64)
+        opacity.FillFromDataPointer(len(x), points.ravel())
+
+        return cls._cache_function(cls._opacity_transfer_functions, key, opacity)
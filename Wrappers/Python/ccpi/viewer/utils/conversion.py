@@ -28,9 +28,16 @@ from vtk.util import numpy_support
 
 import tempfile
 import numpy as np
-from ccpi.viewer.utils.hdf5_io import HDF5Reader, HDF5SubsetReader
+from ccpi.viewer.utils.hdf5_io import HDF5ChunkAlignedReader, HDF5Reader, HDF5SubsetReader, get_hdf5_file_pool
+from ccpi.viewer.utils.profiler import profile_algorithm, profile_phase
 
 import shutil
+import sys
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from multiprocessing import shared_memory
 
 
 # Converter class
@@ -367,6 +374,10 @@ class cilReaderInterface(VTKPythonAlgorithmBase):
         ''' get the file name or path from which the image data is read '''
         return self._FileName
 
+    def _GetDataFileName(self):
+        ''' Returns the name of the file containing the image data.'''
+        return self.GetFileName()
+
     def FillInputPortInformation(self, port, info):
         '''This is a reader so no input'''
         return 1
@@ -668,16 +679,19 @@ class cilHDF5ReaderInterface(cilReaderInterface):
         from the HDF5 file, and save as attributes of the class'''
         reader = HDF5Reader()
         reader.SetFileName(self.GetFileName())
-        if self.GetDatasetName() is not None:
-            reader.SetDatasetName(self.GetDatasetName())
-        else:
-            raise Exception("DataSetName must be set.")
-        shape = reader.GetDimensions()
+        # the file is opened once for all of the info:
+        with get_hdf5_file_pool().Open(self.GetFileName()):
+            if self.GetDatasetName() is not None:
+                reader.SetDatasetName(self.GetDatasetName())
+            else:
+                raise Exception("DataSetName must be set.")
+            shape = reader.GetDimensions()
+            data_type = reader.GetDataType()
         # This is because the HDF5Reader already swaps the order:
         self.SetIsFortran(True)
         self.SetStoredArrayShape(shape)
         # get the datatype:
-        typecode = str(np.dtype(reader.GetDataType()))
+        typecode = str(np.dtype(data_type))
         self.SetOutputVTKType(Converter.dtype_name_to_vtkType[typecode])
 
 
@@ -689,13 +703,25 @@ class cilMetaImageReaderInterface(cilReaderInterface):
         VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1)
         super(cilMetaImageReaderInterface, self).__init__()
         self._CompressedData = False
+        self._CompressedDataSize = None
         self._ElementFile = None
 
+    def _GetDataFileName(self):
+        ''' Returns the name of the file containing the image data.
+        This is the metaimage file itself if the data is stored locally (.mha),
+        otherwise it is the ElementDataFile given in the header (.mhd).'''
+        data_fname = self.GetElementFile()
+        if data_fname == 'LOCAL':
+            data_fname = self.GetFileName()
+        return data_fname
+
     def ReadMetaImageHeader(self):
         ''' Read info from the metaimage file's header, 
         including endianness, origin, spacing, shape and typecode,
         and save as attributes of the class'''
         header_length = 0
+        self.SetIsCompressedData(False)
+        self.SetCompressedDataSize(None)
         with open(self.GetFileName(), 'rb') as f:
             for line in f:
                 header_length += len(line)
@@ -731,12 +757,11 @@ class cilMetaImageReaderInterface(cilReaderInterface):
                     if typecode not in Converter.MetaImageType_to_vtkType.keys():
                         raise ValueError("Unexpected Type:  {}".format(typecode))
                     self.SetOutputVTKType(Converter.MetaImageType_to_vtkType[typecode])
+                elif 'CompressedDataSize' in line:
+                    self.SetCompressedDataSize(int(line.split('= ')[-1]))
                 elif 'CompressedData' in line:
                     compressed = line.split('= ')[-1]
-                    self.SetIsCompressedData(eval(compressed))
-                    if self.GetIsCompressedData():
-                        print("Cannot resample compressed image")
-                        raise Exception("Cannot resample compressed image")
+                    self.SetIsCompressedData(compressed == 'True')
                 elif 'HeaderSize' in line:
                     header_size = line.split('= ')[-1]
                     self.SetFileHeaderLength(int(header_size))
@@ -756,13 +781,13 @@ class cilMetaImageReaderInterface(cilReaderInterface):
         self.Modified()
 
     def GetIsCompressedData(self):
-        ''' Gets whether the image file is compressed.
-        If True then we can't resample it.'''
+        ''' Gets whether the element data of the image file is zlib compressed.
+        If True, the data is inflated slab by slab with a cilZlibSlabDecoder.'''
         return self._CompressedData
 
     def SetIsCompressedData(self, value):
-        ''' Sets whether the image file is compressed.
-        If True then we can't resample it.
+        ''' Sets whether the element data of the image file is zlib compressed.
+        If True, the data is inflated slab by slab with a cilZlibSlabDecoder.
 
         Parameters
         -----------
@@ -770,6 +795,36 @@ class cilMetaImageReaderInterface(cilReaderInterface):
             whether the file is compressed'''
         self._CompressedData = value
 
+    def GetCompressedDataSize(self):
+        ''' Gets the length in bytes of the compressed element data, or None if it is not known.'''
+        return self._CompressedDataSize
+
+    def SetCompressedDataSize(self, value):
+        ''' Sets the length in bytes of the compressed element data.
+
+        Parameters
+        -----------
+        value: int or None
+            length of the compressed data, or None if the data runs to the end of the zlib stream'''
+        self._CompressedDataSize = value
+
+    def _GetCompressedDataDecoder(self):
+        ''' Returns a cilZlibSlabDecoder of the compressed element data of the file,
+        whose header must have been read with ReadDataSetInfo'''
+        shape = self.GetStoredArrayShape()
+        slice_length = shape[0] * shape[1] * self.GetBytesPerElement()
+        return cilZlibSlabDecoder(self._GetDataFileName(),
+                                  self.GetFileHeaderLength(),
+                                  slice_length,
+                                  compressed_size=self.GetCompressedDataSize())
+
+    def _DecodeCompressedSlices(self, decoder, start_slice, out):
+        ''' Inflates the slices from start_slice into out, a numpy array (z, y, x) with the
+        whole x and y extent of the image, in the native byte order.'''
+        decoder.ReadInto(start_slice, out)
+        if self.GetBigEndian() != (sys.byteorder == 'big'):
+            out.byteswap(inplace=True)
+
     def SetElementFile(self, value):
         self._ElementFile = value
         self.Modified()
@@ -793,6 +848,33 @@ class cilTIFFImageReaderInterface(cilReaderInterface):
         # https://github.com/vais-ral/CILViewer/issues/296
         # https://gitlab.kitware.com/vtk/vtk/-/merge_requests/6155
         self._OrientationType = 1
+        self._NumberOfDecodingThreads = min(8, os.cpu_count() or 1)
+
+    def SetNumberOfDecodingThreads(self, value):
+        '''
+        Parameters
+        -----------
+        value (int), default=min(8, number of CPUs):
+            Number of threads which decode the TIFF files concurrently, see cilTIFFStackDecoder.'''
+        if not isinstance(value, int):
+            raise ValueError('Expected an integer. Got {}'.format(type(value)))
+        if value < 1:
+            raise ValueError('Number of decoding threads must be at least 1. Got {}'.format(value))
+        if value != self._NumberOfDecodingThreads:
+            self._NumberOfDecodingThreads = value
+            self.Modified()
+
+    def GetNumberOfDecodingThreads(self):
+        ''' Get the number of threads which decode the TIFF files concurrently.'''
+        return self._NumberOfDecodingThreads
+
+    def _GetStackDecoder(self):
+        '''returns a cilTIFFStackDecoder of the files, which must have been read with ReadDataSetInfo'''
+        shape = self.GetStoredArrayShape()
+        return cilTIFFStackDecoder(self.GetFileName(), (shape[1], shape[0]),
+                                   self.GetTypeCodeName(),
+                                   orientation_type=self.GetOrientationType(),
+                                   num_threads=self.GetNumberOfDecodingThreads())
 
     def SetFileName(self, value):
         ''' Set the file name or path from which to read the image data
@@ -897,7 +979,478 @@ class cilTIFFImageReaderInterface(cilReaderInterface):
         self.Modified()
 
 
+class cilTIFFStackDecoder(object):
+    '''Decodes slabs of consecutive files of a TIFF stack into a numpy array of
+    shape (z, y, x), with a pool of threads which each decode files with their own
+    vtkTIFFReader. vtkAlgorithm.Update releases the GIL in VTK builds with
+    VTK_PYTHON_FULL_THREADSAFE, so that the files are decoded concurrently.
+
+    The slabs are decoded into 2 buffers which are allocated once and reused.
+    While one slab is being used, the next can be decoded into the other buffer
+    in the background with Prefetch. So the slab returned by Decode is only valid
+    until the next call to Decode.
+
+    Parameters
+    -----------
+    file_names: list of str
+        the files of the stack, one z slice per file
+    slice_shape: tuple
+        shape (y, x) of each slice
+    dtype: numpy.dtype or str
+        data type of the slices
+    orientation_type: int, default 1
+        orientation type of the vtkTIFFReader, see cilTIFFImageReaderInterface.SetOrientationType
+    num_threads: int, default 1
+        number of threads which decode the files
+
+    Example
+    -------
+    decoder = cilTIFFStackDecoder(file_names, (512, 512), 'uint16', num_threads=4)
+    slab = decoder.Decode(0, 9)
+    decoder.Prefetch(10, 19)
+    ...
+    slab = decoder.Decode(10, 19)
+    decoder.Close()
+    '''
+
+    def __init__(self, file_names, slice_shape, dtype, orientation_type=1, num_threads=1):
+        self._FileNames = list(file_names)
+        self._SliceShape = tuple(slice_shape)
+        self._DType = np.dtype(dtype)
+        self._OrientationType = orientation_type
+        self._Executor = ThreadPoolExecutor(max_workers=num_threads)
+        self._ThreadLocal = threading.local()
+        self._Buffers = [None, None]
+        self._Current = 0
+        self._Prefetched = None
+
+    def _GetBuffer(self, index, num_slices):
+        '''returns a view of num_slices slices of buffer index, growing it if it is too small'''
+        buffer = self._Buffers[index]
+        if buffer is None or buffer.shape[0] < num_slices:
+            buffer = np.empty((num_slices, ) + self._SliceShape, dtype=self._DType)
+            self._Buffers[index] = buffer
+        return buffer[:num_slices]
+
+    def _DecodeFile(self, file_name, out):
+        '''decodes a single file into out, with the vtkTIFFReader of this thread'''
+        reader = getattr(self._ThreadLocal, 'reader', None)
+        if reader is None:
+            reader = vtk.vtkTIFFReader()
+            # Set orientation type due to issue:
+            # https://github.com/vais-ral/CILViewer/issues/296
+            reader.SetOrientationType(self._OrientationType)
+            self._ThreadLocal.reader = reader
+        reader.SetFileName(file_name)
+        reader.Update()
+        out[:] = numpy_support.vtk_to_numpy(reader.GetOutput().GetPointData().GetScalars()).reshape(out.shape)
+
+    def _Submit(self, start_slice, end_slice, out):
+        '''submits decoding files start_slice to end_slice into out, and returns the futures'''
+        if start_slice < 0 or end_slice >= len(self._FileNames) or end_slice < start_slice:
+            raise ValueError('{} ERROR: Z extent {} is not valid for {} slices.'.format(
+                self.__class__.__name__, (start_slice, end_slice), len(self._FileNames)))
+        return [
+            self._Executor.submit(self._DecodeFile, self._FileNames[i], out[i - start_slice])
+            for i in range(start_slice, end_slice + 1)
+        ]
+
+    def _WaitForPrefetch(self):
+        '''waits for the slab being prefetched, if any, and returns its extent'''
+        if self._Prefetched is None:
+            return None
+        z_extent, futures = self._Prefetched
+        self._Prefetched = None
+        for future in futures:
+            future.result()
+        return z_extent
+
+    def Decode(self, start_slice, end_slice):
+        '''Returns the slices start_slice to end_slice (inclusive) as an array of shape (z, y, x).
+        If this slab was prefetched, this waits for it to be decoded.'''
+        num_slices = end_slice - start_slice + 1
+        try:
+            prefetched = self._WaitForPrefetch()
+        except Exception:
+            prefetched = None
+        self._Current = 1 - self._Current
+        slab = self._GetBuffer(self._Current, num_slices)
+        if prefetched != (start_slice, end_slice):
+            for future in self._Submit(start_slice, end_slice, slab):
+                future.result()
+        return slab
+
+    def Prefetch(self, start_slice, end_slice):
+        '''Starts decoding the slices start_slice to end_slice (inclusive) in the background,
+        so that the next call to Decode for this slab returns without waiting for all of it.'''
+        self._WaitForPrefetch()
+        slab = self._GetBuffer(1 - self._Current, end_slice - start_slice + 1)
+        self._Prefetched = ((start_slice, end_slice), self._Submit(start_slice, end_slice, slab))
+
+    def Close(self):
+        '''Cancels any prefetch and shuts down the threads'''
+        if self._Prefetched is not None:
+            for future in self._Prefetched[1]:
+                future.cancel()
+            self._Prefetched = None
+        self._Executor.shutdown(wait=True)
+
+
+class cilZlibSlabDecoder(object):
+    '''Inflates slabs of consecutive z slices of zlib compressed image data, such as the
+    element data of a metaimage file with CompressedData = True, so that the file can be
+    read chunk by chunk without decompressing all of it in memory.
+
+    The data is inflated as a stream, so reading the slabs in increasing z order only
+    inflates each byte once. To also allow seeking back, the state of the decompressor is
+    saved at a slice boundary every checkpoint_interval bytes of uncompressed data. A slab
+    before the current position is read by restarting from the nearest checkpoint before it,
+    rather than from the start of the data. Each checkpoint holds a copy of the zlib window
+    (32KB) and of the compressed bytes still to be inflated, so the memory used is bounded by
+    the size of the slabs read, plus roughly read_size for each checkpoint.
+
+    Parameters
+    -----------
+    file_name: str
+        the file containing the compressed data
+    offset: int
+        position in the file of the first byte of the compressed data
+    slice_length: int
+        length in bytes of each uncompressed slice
+    compressed_size: int, default None
+        length in bytes of the compressed data. If None, the data runs to the end of the
+        zlib stream.
+    checkpoint_interval: int, default 64MB
+        number of bytes of uncompressed data between checkpoints
+    read_size: int, default 1MB
+        number of bytes of compressed data read from the file at a time
+
+    Example
+    -------
+    decoder = cilZlibSlabDecoder('data.mha', header_length, 512 * 512 * 2)
+    slab = numpy.empty((10, 512, 512), dtype='uint16')
+    decoder.ReadInto(20, slab)
+    decoder.Close()
+    '''
+
+    def __init__(self,
+                 file_name,
+                 offset,
+                 slice_length,
+                 compressed_size=None,
+                 checkpoint_interval=64 * 1024**2,
+                 read_size=1024**2):
+        self._FileName = file_name
+        self._Offset = offset
+        self._SliceLength = slice_length
+        self._CompressedSize = compressed_size
+        self._CheckpointInterval = checkpoint_interval
+        self._ReadSize = read_size
+        self._File = None
+        # (slice, position in the file, decompressor, unconsumed compressed bytes), in increasing z order:
+        self._Checkpoints = []
+        self._BytesRead = 0
+        self._Restart(None)
+
+    def _Restart(self, checkpoint):
+        '''restarts inflating from the checkpoint, or from the start of the data if None'''
+        if checkpoint is None:
+            self._Slice, self._Position, self._Tail = 0, self._Offset, b''
+            self._Decompressor = zlib.decompressobj()
+        else:
+            self._Slice, self._Position, decompressor, self._Tail = checkpoint
+            # copy, so that the checkpoint can be restarted from again:
+            self._Decompressor = decompressor.copy()
+
+    def _SaveCheckpoint(self):
+        '''saves the state of the decompressor at the current slice, if the last checkpoint
+        is at least checkpoint_interval bytes of uncompressed data before it'''
+        last_slice = self._Checkpoints[-1][0] if self._Checkpoints else 0
+        if (self._Slice - last_slice) * self._SliceLength < self._CheckpointInterval:
+            return
+        self._Checkpoints.append((self._Slice, self._Position, self._Decompressor.copy(), self._Tail))
+
+    def _ReadCompressed(self):
+        '''returns the next bytes of compressed data from the file, or b'' at the end of the data'''
+        size = self._ReadSize
+        if self._CompressedSize is not None:
+            size = min(size, self._Offset + self._CompressedSize - self._Position)
+            if size <= 0:
+                return b''
+        if self._File is None:
+            self._File = open(self._FileName, 'rb')
+        self._File.seek(self._Position)
+        data = self._File.read(size)
+        self._Position += len(data)
+        self._BytesRead += len(data)
+        return data
+
+    def _InflateSlice(self, out):
+        '''inflates the next slice into the writable buffer out, of length slice_length'''
+        filled = 0
+        while filled < len(out):
+            if not self._Tail:
+                self._Tail = self._ReadCompressed()
+                if not self._Tail:
+                    raise ValueError('{} ERROR: The compressed data in {} ended before slice {}.'.format(
+                        self.__class__.__name__, self._FileName, self._Slice))
+            data = self._Decompressor.decompress(self._Tail, len(out) - filled)
+            self._Tail = self._Decompressor.unconsumed_tail
+            out[filled:filled + len(data)] = data
+            filled += len(data)
+            if self._Decompressor.eof and filled < len(out):
+                raise ValueError('{} ERROR: The compressed data in {} ended before slice {}.'.format(
+                    self.__class__.__name__, self._FileName, self._Slice))
+        self._Slice += 1
+        self._SaveCheckpoint()
+
+    def _SeekToSlice(self, slice_index):
+        '''moves the decompressor to the start of slice slice_index, restarting from the
+        nearest checkpoint before it if it is behind the current position, or if the
+        checkpoint is closer'''
+        checkpoint = None
+        for saved in self._Checkpoints:
+            if saved[0] > slice_index:
+                break
+            checkpoint = saved
+        if slice_index < self._Slice or (checkpoint is not None and checkpoint[0] > self._Slice):
+            self._Restart(checkpoint)
+        if self._Slice < slice_index:
+            skipped = bytearray(self._SliceLength)
+            while self._Slice < slice_index:
+                self._InflateSlice(skipped)
+
+    def ReadInto(self, start_slice, out):
+        '''Inflates the slices from start_slice into out, a writable buffer (such as a
+        C contiguous numpy array) whose length in bytes is a whole number of slices.'''
+        if start_slice < 0:
+            raise ValueError('{} ERROR: Start slice cannot be negative.'.format(self.__class__.__name__))
+        view = memoryview(out).cast('B')
+        if len(view) % self._SliceLength != 0:
+            raise ValueError('{} ERROR: Expected a whole number of slices of {} bytes. Got {} bytes.'.format(
+                self.__class__.__name__, self._SliceLength, len(view)))
+        self._SeekToSlice(start_slice)
+        for start in range(0, len(view), self._SliceLength):
+            self._InflateSlice(view[start:start + self._SliceLength])
+
+    def GetNumberOfCheckpoints(self):
+        ''' Returns the number of points in the data which can be restarted from, besides its start'''
+        return len(self._Checkpoints)
+
+    def GetBytesRead(self):
+        ''' Returns the total number of bytes of compressed data read from the file'''
+        return self._BytesRead
+
+    def Close(self):
+        '''Closes the file'''
+        if self._File is not None:
+            self._File.close()
+            self._File = None
+
+
+class cilArrayChunkReader(VTKPythonAlgorithmBase):
+    '''vtkAlgorithm which outputs a slab of z slices of a 3D NumPy array
+    (for instance a numpy.memmap of an image file) as vtkImageData,
+    without copying the data if possible.
+
+    The array must be stored in VTK order, i.e. x fastest. This is the case for
+    a C-contiguous array with shape (z, y, x) or a Fortran-contiguous array
+    with shape (x, y, z). Data which is not in the native byte order of the
+    machine is byte-swapped, which requires a copy of the slab.
+
+    Example
+    -------
+    This example outputs slices 2 to 5 of a raw file with shape (z, y, x):
+
+    array = numpy.memmap('data.raw', dtype='uint16', mode='c', shape=(10, 20, 30))
+    reader = cilArrayChunkReader()
+    reader.SetArray(array, is_fortran=False)
+    reader.SetZExtent((2, 5))
+    reader.Update()
+    image = reader.GetOutput()
+    '''
+
+    def __init__(self):
+        VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1, outputType='vtkImageData')
+        self._Array = None
+        self._IsFortran = False
+        self._ZExtent = None
+        self._ElementSpacing = (1., 1., 1.)
+        self._Origin = (0., 0., 0.)
+        self._BytesRead = 0
+
+    def SetArray(self, array, is_fortran=False):
+        '''
+        Parameters
+        -----------
+        array: numpy.ndarray
+            3D array to read the slabs from
+        is_fortran: bool, default: False
+            whether the array is indexed as (x, y, z), in fortran order.
+            Otherwise it is indexed as (z, y, x), in C order.
+        '''
+        self._Array = array
+        self._IsFortran = is_fortran
+        self.Modified()
+
+    def GetArray(self):
+        return self._Array
+
+    def SetZExtent(self, value):
+        '''
+        Parameters
+        -----------
+        value: tuple of length 2
+            first and last (inclusive) z slice of the slab to output.
+            If None, the whole array is output.
+        '''
+        if value != self._ZExtent:
+            self._ZExtent = value
+            self.Modified()
+
+    def GetZExtent(self):
+        return self._ZExtent
+
+    def SetElementSpacing(self, value):
+        self._ElementSpacing = tuple(value)
+        self.Modified()
+
+    def SetOrigin(self, value):
+        self._Origin = tuple(value)
+        self.Modified()
+
+    def GetBytesRead(self):
+        ''' returns the number of bytes of the array in the last output slab'''
+        return self._BytesRead
+
+    def GetOutput(self):
+        return self.GetOutputDataObject(0)
+
+    def _GetSlab(self):
+        if self._Array is None:
+            raise Exception("Array must be set.")
+        zdim = self._Array.shape[2] if self._IsFortran else self._Array.shape[0]
+        if self._ZExtent is None:
+            start_slice, end_slice = 0, zdim - 1
+        else:
+            start_slice, end_slice = self._ZExtent
+        if start_slice < 0 or end_slice >= zdim or end_slice < start_slice:
+            raise ValueError('{} ERROR: Z extent {} is not valid for {} slices.'.format(
+                self.__class__.__name__, self._ZExtent, zdim))
+        if self._IsFortran:
+            return self._Array[:, :, start_slice:end_slice + 1]
+        return self._Array[start_slice:end_slice + 1]
+
+    def RequestInformation(self, request, inInfo, outInfo):
+        slab = self._GetSlab()
+        shape = slab.shape if self._IsFortran else slab.shape[::-1]
+        info = outInfo.GetInformationObject(0)
+        info.Set(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT(),
+                 (0, shape[0] - 1, 0, shape[1] - 1, 0, shape[2] - 1), 6)
+        info.Set(vtk.vtkDataObject.SPACING(), self._ElementSpacing, 3)
+        info.Set(vtk.vtkDataObject.ORIGIN(), self._Origin, 3)
+        return 1
+
+    def RequestData(self, request, inInfo, outInfo):
+        outData = vtk.vtkImageData.GetData(outInfo)
+        slab = self._GetSlab()
+        if not slab.dtype.isnative:
+            # VTK can only wrap data in the native byte order:
+            slab = slab.astype(slab.dtype.newbyteorder('='))
+        self._BytesRead = slab.nbytes
+        image = Converter.numpy2vtkImage(slab, spacing=self._ElementSpacing, origin=self._Origin)
+        outData.ShallowCopy(image)
+        return 1
+
+
 # ---------------------- RESAMPLE READERS -------------------------------------------------------------
+# methods available to downsample an image when resampling it.
+# 'reslice' uses vtkImageReslice, the others reduce each block of voxels
+# which is downsampled to a single voxel with the named numpy operation.
+DOWNSAMPLE_METHODS = ('reslice', 'mean', 'max', 'min', 'median')
+
+
+def calculate_block_edges(length, num_blocks):
+    '''calculate the edges of num_blocks blocks of (nearly) equal size, which cover an axis of given length
+
+    Parameters
+    ----------
+    length: int
+        length of the axis
+    num_blocks: int
+        number of blocks to split the axis into, must be between 1 and length
+
+    Returns
+    -------
+    edges: numpy.ndarray
+        num_blocks + 1 increasing indices, starting at 0 and ending at length
+    '''
+    if num_blocks < 1 or num_blocks > length:
+        raise ValueError('Number of blocks must be between 1 and {}. Got {}'.format(length, num_blocks))
+    return np.linspace(0, length, num_blocks + 1).astype(int)
+
+
+def block_reduce(array, block_edges, method='mean'):
+    '''downsample a 3D array by reducing each block of voxels to a single value
+
+    Parameters
+    ----------
+    array: numpy.ndarray
+        3D array to downsample
+    block_edges: list of 3 sequences of int
+        the edges of the blocks along each axis of the array, each starting
+        at 0 and ending at the length of the axis, see calculate_block_edges
+    method: str, default 'mean'
+        how to reduce each block: 'mean', 'max', 'min' or 'median'
+
+    Returns
+    -------
+    numpy.ndarray with len(block_edges[i]) - 1 elements along axis i.
+    The dtype is float64 for 'mean' and 'median', and the dtype of the array otherwise.
+    '''
+    if array.ndim != 3 or len(block_edges) != 3:
+        raise ValueError('Expected a 3D array and the block edges of 3 axes.')
+    block_edges = [np.asarray(edges, dtype=int) for edges in block_edges]
+    block_sizes = [np.diff(edges) for edges in block_edges]
+
+    if method in ('mean', 'max', 'min'):
+        # these are separable, so we can reduce one axis at a time:
+        ufunc = {'mean': np.add, 'max': np.maximum, 'min': np.minimum}[method]
+        kwargs = {'dtype': np.float64} if method == 'mean' else {}
+        reduced = array
+        for axis, edges in enumerate(block_edges):
+            reduced = ufunc.reduceat(reduced, edges[:-1], axis=axis, **kwargs)
+        if method == 'mean':
+            reduced /= np.multiply.outer(np.multiply.outer(block_sizes[0], block_sizes[1]), block_sizes[2])
+        return reduced
+
+    elif method == 'median':
+        # gather the blocks into an array of shape (num_blocks_0, max_block_size_0, num_blocks_1, ...)
+        # padding the smaller blocks with nan, which nanmedian ignores:
+        indices = []
+        valid = []
+        for edges, sizes in zip(block_edges, block_sizes):
+            offsets = np.arange(sizes.max())
+            valid.append(offsets[np.newaxis, :] < sizes[:, np.newaxis])
+            indices.append(np.minimum(edges[:-1, np.newaxis] + offsets[np.newaxis, :], edges[-1] - 1))
+        blocks = array[np.ix_(*[index.ravel() for index in indices])].astype(np.float64)
+        blocks = blocks.reshape([n for index in indices for n in index.shape])
+        mask = valid[0][:, :, None, None, None, None] & valid[1][None, None, :, :, None, None] \
+            & valid[2][None, None, None, None, :, :]
+        blocks[~mask] = np.nan
+        return np.nanmedian(blocks, axis=(1, 3, 5))
+
+    raise ValueError('Unknown block reduction method {}. Expected one of: mean, max, min, median'.format(method))
+
+
+def _cast_reduced_array(array, dtype):
+    '''casts the result of block_reduce to dtype, rounding to the nearest integer for integer types'''
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer) and not np.issubdtype(array.dtype, np.integer):
+        array = np.rint(array)
+    return array.astype(dtype)
+
+
 def calculate_target_downsample_magnification(max_size, total_size, acq=False):
     '''calculate the magnification of each axis and the number of slices per chunk
     
@@ -971,6 +1524,127 @@ class cilBaseResampleReader(cilReaderInterface):
         self._SlicePerChunk = None
         self._TempDir = None
         self._ChunkReader = None
+        self._NumberOfWorkers = 1
+        self._DownsampleMethod = 'reslice'
+        self._TargetZExtent = None
+        self._AbortRead = False
+        self._ReadAborted = False
+        self._ChunksDone = 0
+        self._NumberOfChunks = 0
+        self._BytesDone = 0
+
+    def SetTargetZExtent(self, value):
+        '''
+        Parameters
+        -----------
+        value (tuple of length 2 or None), default=None:
+            first and last (inclusive) z slice of the file to read. Only the slabs
+            in this extent are read and resampled to the target size. The origin
+            of the output is moved to the first slice read.
+            If None, the whole file is read.'''
+        if value is not None:
+            if not isinstance(value, (list, tuple)) or len(value) != 2:
+                raise ValueError('Expected a list or tuple of length 2. Got {}'.format(value))
+            value = (int(value[0]), int(value[1]))
+        if value != self._TargetZExtent:
+            self._TargetZExtent = value
+            self.Modified()
+
+    def GetTargetZExtent(self):
+        ''' Get the first and last z slice of the file to read, or None if the whole file is read.'''
+        return self._TargetZExtent
+
+    def _GetZExtentToRead(self):
+        '''returns the first and last z slice of the file to read: the target z extent clipped
+        to the file, or the whole file. The dataset info must have been read.'''
+        num_slices = self._GetNumberOfSlicesInFile()
+        if self.GetTargetZExtent() is None:
+            return 0, num_slices - 1
+        first, last = max(self.GetTargetZExtent()[0], 0), min(self.GetTargetZExtent()[1], num_slices - 1)
+        if last < first:
+            raise ValueError('{} ERROR: Target z extent {} does not overlap the {} slices of the file.'.format(
+                self.__class__.__name__, self.GetTargetZExtent(), num_slices))
+        return first, last
+
+    def _GetLastSliceToRead(self):
+        '''returns the last z slice of the file which is read'''
+        return self._GetZExtentToRead()[1]
+
+    def SetAbortRead(self, value):
+        '''
+        Parameters
+        -----------
+        value (bool):
+            whether to stop reading. This is checked between chunks, so it can be set from
+            another thread whilst the reader is updating. If the read is stopped, the output
+            is left empty and GetReadAborted returns True. The reader reads again once this
+            is set back to False.'''
+        self._AbortRead = bool(value)
+
+    def GetAbortRead(self):
+        ''' Get whether the reader has been asked to stop reading.'''
+        return self._AbortRead
+
+    def GetReadAborted(self):
+        ''' Returns whether the last update, or stream of slices, was stopped by SetAbortRead(True)
+        before all the chunks were read.'''
+        return self._ReadAborted
+
+    def GetReadProgress(self):
+        ''' Returns the progress of the current, or last, update or stream of slices of the reader.
+        This may be called from another thread whilst the reader is updating.
+
+        Returns
+        -------
+        dict with the number of 'chunks_done' and the total 'num_chunks' to read,
+        and the uncompressed 'bytes_read' of the image in the chunks done
+        '''
+        return {'chunks_done': self._ChunksDone, 'num_chunks': self._NumberOfChunks, 'bytes_read': self._BytesDone}
+
+    def _StartReadProgress(self, num_chunks):
+        '''resets the progress reported by GetReadProgress, before reading num_chunks chunks'''
+        self._ReadAborted = False
+        self._ChunksDone = 0
+        self._NumberOfChunks = num_chunks
+        self._BytesDone = 0
+
+    def _ReportChunksDone(self, num_chunks, num_slices):
+        '''records that num_chunks more chunks, covering num_slices slices of the file, have been read'''
+        shape = self._GetShapeInFile()
+        self._ChunksDone += num_chunks
+        self._BytesDone += num_slices * shape[0] * shape[1] * self.GetBytesPerElement()
+        self.UpdateProgress(self._ChunksDone / max(1, self._NumberOfChunks))
+
+    def _CheckAbortRead(self):
+        '''returns whether reading has been asked to stop, and records that it was stopped'''
+        if self._AbortRead:
+            self._ReadAborted = True
+        return self._ReadAborted
+
+    def _GetNumberOfSlicesInChunk(self, start_sliceno):
+        '''returns the number of slices of the file read in the chunk starting at start_sliceno'''
+        return min(self._GetNumSlicesPerChunk(), self._GetLastSliceToRead() + 1 - start_sliceno)
+
+    def SetNumberOfWorkers(self, value):
+        '''
+        Parameters
+        -----------
+        value (int), default=1:
+            Number of worker processes to resample the chunks with.
+            If greater than 1, the chunks are read and resampled in a process
+            pool, and each worker writes its resampled slices into a shared
+            memory buffer which is then copied to the output.'''
+        if not isinstance(value, int):
+            raise ValueError('Expected an integer. Got {}', type(value))
+        if value < 1:
+            raise ValueError('Number of workers must be at least 1. Got {}'.format(value))
+        if value != self._NumberOfWorkers:
+            self._NumberOfWorkers = value
+            self.Modified()
+
+    def GetNumberOfWorkers(self):
+        ''' Get the number of worker processes the chunks are resampled with.'''
+        return self._NumberOfWorkers
 
     def SetTargetSize(self, value):
         ''''
@@ -989,6 +1663,25 @@ class cilBaseResampleReader(cilReaderInterface):
         ''' Get the total target size to downsample image to, in bytes.'''
         return self._TargetSize
 
+    def SetDownsampleMethod(self, value):
+        '''
+        Parameters
+        -----------
+        value (str), default='reslice':
+            How each chunk is downsampled to a single slice.
+            'reslice' samples the chunk with vtkImageReslice.
+            'mean', 'max', 'min' or 'median' reduce each block of voxels which
+            is downsampled to a single voxel with that operation, see block_reduce.'''
+        if value not in DOWNSAMPLE_METHODS:
+            raise ValueError('Expected one of {}. Got {}'.format(DOWNSAMPLE_METHODS, value))
+        if value != self._DownsampleMethod:
+            self._DownsampleMethod = value
+            self.Modified()
+
+    def GetDownsampleMethod(self):
+        ''' Get how each chunk is downsampled to a single slice.'''
+        return self._DownsampleMethod
+
     def _GetInternalChunkReader(self):
         ''' Returns a reader which can be used to read each chunk.
         The reader is always going to read the header file: header.mhd, and
@@ -1033,139 +1726,425 @@ class cilBaseResampleReader(cilReaderInterface):
         '''set the temporary directory where we save the chunks as they are being read'''
         self._TempDir = folder
 
-    def RequestData(self, request, inInfo, outInfo):
-        try:
-            outData = vtk.vtkImageData.GetData(outInfo)
+    def _RemoveTempDir(self):
+        '''removes the temporary directory where we save the chunks, if it exists'''
+        tmpdir = self._GetTempDir()
+        if tmpdir is not None:
+            if os.path.exists(tmpdir):
+                shutil.rmtree(tmpdir)
 
-            if self.GetFileName() is None:
-                raise Exception("FileName must be set.")
+    def _GetChunkResampler(self, output_spacing):
+        '''returns the vtkImageReslice used to resample each chunk to a single slice'''
+        resampler = vtk.vtkImageReslice()
+        resampler.SetOutputSpacing(*output_spacing)
+        return profile_algorithm(resampler)
 
-            self.ReadDataSetInfo()
+    def _ResampleChunk(self, resampler, chunk_index, start_sliceno, target_image_shape):
+        '''reads the chunk starting at slice start_sliceno and resamples it to
+        slice chunk_index of the target image.
+
+        Returns
+        -------
+        the resampled slice (vtkImageData) and its extent in the target image'''
+        with profile_phase('chunk read', chunk=chunk_index, start_slice=start_sliceno):
+            self.UpdateChunkToRead(start_sliceno)
+            self._ChunkReader.Modified()
+            self._ChunkReader.Update()
 
-            # get basic info
-            readshape = self.GetStoredArrayShape()
-            is_fortran = self.GetIsFortran()
+        # change the extent of the resampled image
+        extent = (0, target_image_shape[0] - 1, 0, target_image_shape[1] - 1, chunk_index, chunk_index)
 
-            if is_fortran:
-                shape = list(readshape)
-            else:
-                shape = list(readshape)[::-1]
+        with profile_phase('resample', chunk=chunk_index, method=self.GetDownsampleMethod()):
+            if self.GetDownsampleMethod() != 'reslice':
+                return self._BlockReduceChunk(start_sliceno, target_image_shape, extent), extent
+
+            resampler.SetOutputExtent(extent)
+            resampler.Update()
+            return resampler.GetOutput(), extent
 
-            total_size = shape[0] * shape[1] * shape[2] * self.GetBytesPerElement()
+    def _GetNumberOfSlicesInFile(self):
+        '''returns the number of slices along the z axis of the image in the file'''
+        readshape = self.GetStoredArrayShape()
+        return readshape[2] if self.GetIsFortran() else readshape[0]
 
-            max_size = self.GetTargetSize()
+    def _BlockReduceChunk(self, start_sliceno, target_image_shape, extent):
+        '''reduces the chunk which has been read by self._ChunkReader to a single slice,
+        with the method set by SetDownsampleMethod.
 
-            if total_size < max_size:  # in this case we don't need to resample
-                # set the chunk size to equal the total extent of the dataset:
-                self._SetNumSlicesPerChunk(shape[2])
-                reader = self._GetInternalChunkReader()
-                self.UpdateChunkToRead(0)
-                reader.Modified()
-                reader.Update()
-                # print(reader.GetOutput().GetScalarComponentAsDouble(0, 0, 0, 0))
-                outData.ShallowCopy(reader.GetOutput())
+        Returns
+        -------
+        the reduced slice (vtkImageData) with the given extent'''
+        chunk = Converter.vtk2numpy(self._ChunkReader.GetOutput())
+        # the last chunk may contain fewer slices than the others:
+        num_slices = self._GetNumberOfSlicesInChunk(start_sliceno)
+        chunk = chunk[:num_slices]
+        block_edges = [[0, num_slices],
+                       calculate_block_edges(chunk.shape[1], target_image_shape[1]),
+                       calculate_block_edges(chunk.shape[2], target_image_shape[0])]
+        reduced = block_reduce(chunk, block_edges, self.GetDownsampleMethod())
+        data = Converter.numpy2vtkImage(_cast_reduced_array(reduced, chunk.dtype), deep=1)
+        data.SetExtent(extent)
+        return data
+
+    def _GetShapeInFile(self):
+        '''returns the shape of the image in the file, in VTK order (x, y, z)'''
+        readshape = self.GetStoredArrayShape()
+        if self.GetIsFortran():
+            return list(readshape)
+        return list(readshape)[::-1]
+
+    def _GetShapeToRead(self):
+        '''returns the shape of the part of the image which is read, in VTK order (x, y, z)'''
+        shape = self._GetShapeInFile()
+        first, last = self._GetZExtentToRead()
+        shape[2] = last - first + 1
+        return shape
+
+    def _NeedsResampling(self, shape):
+        '''whether the image of the given shape (x, y, z) is larger than the target size'''
+        total_size = shape[0] * shape[1] * shape[2] * self.GetBytesPerElement()
+        return total_size >= self.GetTargetSize()
+
+    def _GetResampledImageGeometry(self, shape):
+        '''calculates how the image of the given shape (x, y, z) is resampled to the
+        target size, and sets the number of slices per chunk accordingly.
+
+        Returns
+        -------
+        the first slice of each chunk, and the shape (x, y, z), spacing and origin
+        of the resampled image'''
+        total_size = shape[0] * shape[1] * shape[2] * self.GetBytesPerElement()
+        num_slices_per_chunk, xy_axes_magnification = \
+            calculate_target_downsample_magnification(self.GetTargetSize(),
+                                                      total_size,
+                                                      self.GetIsAcquisitionData())
+        # Each chunk will be the z slices that we will resample together to form one new slice.
+        # Each chunk will contain num_slices_per_chunk number of slices.
+        self._SetNumSlicesPerChunk(num_slices_per_chunk)
+
+        # indices of the first slice per chunk, in the file
+        # we will read in num_slices_per_chunk slices at a time
+        first_slice = self._GetZExtentToRead()[0]
+        start_sliceno_in_chunks = [first_slice + i for i in range(0, shape[2], num_slices_per_chunk)]
+
+        num_chunks = len(start_sliceno_in_chunks)  # the number of chunks we will read in total
+
+        # in the case of acquisition data this will be 1 as num_chunks=shape[2]:
+        z_axis_magnification = num_chunks / (shape[2])
+
+        target_image_shape = (int(xy_axes_magnification * shape[0]), int(xy_axes_magnification * shape[1]), num_chunks)
+
+        element_spacing = self.GetElementSpacing()
+
+        new_spacing = [
+            element_spacing[0] / xy_axes_magnification, element_spacing[1] / xy_axes_magnification,
+            element_spacing[2] / z_axis_magnification
+        ]
+
+        original_origin = self._GetOriginOfSlicesRead()
+        '''The new origin is based on where we need to position each slice in the world
+        If we have an image which is downsampled by 5 times, 
+        slices 0-4 are downsampled to a single slice and the image spacing is 5.
+        Slice 0 in image coordinates corresponds to slices 0-4 in the actual image.
+        The clipping planes will need to include points ranging from -0.5 to 4.49.
+        Therefore the slice needs to be centred half way through this range: at 2.
+        Because world coordinates = image coords * spacing + origin,
+        we need the origin to be 2 for this image.
+
+        In general, the origin must be at (image_spacing-1)/2 plus the original
+        position of the image's origin:'''
+        new_origin = tuple([(s - 1) / 2 + original_origin[i] for i, s in enumerate(new_spacing)])
+
+        return start_sliceno_in_chunks, target_image_shape, new_spacing, new_origin
+
+    def _GetOriginOfSlicesRead(self):
+        '''returns the origin of the image formed by the slices which are read'''
+        origin = list(self.GetOrigin())
+        origin[2] += self._GetZExtentToRead()[0] * self.GetElementSpacing()[2]
+        return tuple(origin)
+
+    def GetResampledImageInfo(self):
+        '''Reads the dataset info and returns the geometry of the image which Update or
+        StreamResampledSlices will produce.
 
+        Returns
+        -------
+        dict with the 'shape' (x, y, z), 'spacing' and 'origin' of the output image,
+        and whether it is 'resampled'
+        '''
+        if self.GetFileName() is None:
+            raise Exception("FileName must be set.")
+        self.ReadDataSetInfo()
+        shape = self._GetShapeToRead()
+        if not self._NeedsResampling(shape):
+            return {
+                'shape': tuple(shape),
+                'spacing': self.GetElementSpacing(),
+                'origin': self._GetOriginOfSlicesRead(),
+                'resampled': False
+            }
+        _, target_image_shape, new_spacing, new_origin = self._GetResampledImageGeometry(shape)
+        return {'shape': target_image_shape, 'spacing': tuple(new_spacing), 'origin': new_origin, 'resampled': True}
+
+    def StreamResampledSlices(self):
+        '''Reads and resamples the image like Update, but yields each z slice of the
+        resampled image as soon as it is produced, instead of building the whole image
+        in memory. Only one chunk of the file is held in memory at a time. If the
+        image doesn't need resampling, it is read one slice at a time.
+        The chunks are always resampled in this process, see SetNumberOfWorkers.
+        If SetAbortRead(True) is called, the stream stops before the next chunk.
+
+        Yields
+        ------
+        the index of the slice in the resampled image, and the slice as a 2D numpy array (y, x)'''
+        info = self.GetResampledImageInfo()
+        shape = self._GetShapeToRead()
+        slice_shape = info['shape'][1::-1]
+        try:
+            if not info['resampled']:
+                self._SetNumSlicesPerChunk(1)
+                self._StartReadProgress(shape[2])
+                reader = profile_algorithm(self._GetInternalChunkReader())
+                first_slice = self._GetZExtentToRead()[0]
+                for sliceno in range(shape[2]):
+                    if self._CheckAbortRead():
+                        return
+                    with profile_phase('chunk read', chunk=sliceno, start_slice=first_slice + sliceno):
+                        self.UpdateChunkToRead(first_slice + sliceno)
+                        reader.Modified()
+                        reader.Update()
+                    with profile_phase('copy', chunk=sliceno):
+                        array = numpy_support.vtk_to_numpy(reader.GetOutput().GetPointData().GetScalars())
+                        array = array[:slice_shape[0] * slice_shape[1]].reshape(slice_shape).copy()
+                    self._ReportChunksDone(1, 1)
+                    yield sliceno, array
             else:
-                num_slices_per_chunk, xy_axes_magnification = \
-                    calculate_target_downsample_magnification(max_size,
-                                                              total_size,
-                                                              self.GetIsAcquisitionData())
-                # Each chunk will be the z slices that we will resample together to form one new slice.
-                # Each chunk will contain num_slices_per_chunk number of slices.
-                self._SetNumSlicesPerChunk(num_slices_per_chunk)
+                start_sliceno_in_chunks, target_image_shape, new_spacing, _ = self._GetResampledImageGeometry(shape)
+                self._StartReadProgress(len(start_sliceno_in_chunks))
+                reader = profile_algorithm(self._GetInternalChunkReader())
+                resampler = self._GetChunkResampler(new_spacing)
+                resampler.SetInputData(reader.GetOutput())
+                for i, start_sliceno in enumerate(start_sliceno_in_chunks):
+                    if self._CheckAbortRead():
+                        return
+                    data, _ = self._ResampleChunk(resampler, i, start_sliceno, target_image_shape)
+                    with profile_phase('copy', chunk=i):
+                        array = numpy_support.vtk_to_numpy(data.GetPointData().GetScalars())
+                        array = array.reshape(slice_shape).copy()
+                    self._ReportChunksDone(1, self._GetNumberOfSlicesInChunk(start_sliceno))
+                    yield i, array
+        finally:
+            self._RemoveTempDir()
+
+    def _GetWorkerParameters(self):
+        '''returns the parameters which _SetWorkerParameters needs to recreate this reader in a
+        worker process: the file name, the dataset info, which must have been read, and how the
+        chunks are read. They are plain python values, so that they can be pickled.'''
+        return {
+            'file_name': self.GetFileName(),
+            'stored_array_shape': tuple(self.GetStoredArrayShape()),
+            'output_vtk_type': self.GetOutputVTKType(),
+            'is_fortran': bool(self.GetIsFortran()),
+            'big_endian': bool(self.GetBigEndian()),
+            'file_header_length': int(self.GetFileHeaderLength()),
+            'element_spacing': tuple(self.GetElementSpacing()),
+            'origin': tuple(self.GetOrigin()),
+            'target_z_extent': self.GetTargetZExtent(),
+            'downsample_method': self.GetDownsampleMethod(),
+            'num_slices_per_chunk': self._GetNumSlicesPerChunk()
+        }
+
+    def _SetWorkerParameters(self, file_name, stored_array_shape, output_vtk_type, is_fortran, big_endian,
+                             file_header_length, element_spacing, origin, target_z_extent, downsample_method,
+                             num_slices_per_chunk):
+        '''sets up this reader, in a worker process, to read the same chunks as the reader
+        whose _GetWorkerParameters are given. The dataset info is set rather than read again.'''
+        self.SetFileName(file_name)
+        self.SetStoredArrayShape(stored_array_shape)
+        self.SetOutputVTKType(output_vtk_type)
+        self.SetIsFortran(is_fortran)
+        self.SetBigEndian(big_endian)
+        self.SetFileHeaderLength(file_header_length)
+        self.SetElementSpacing(element_spacing)
+        self.SetOrigin(origin)
+        self.SetTargetZExtent(target_z_extent)
+        self.SetDownsampleMethod(downsample_method)
+        self._SetNumSlicesPerChunk(num_slices_per_chunk)
+
+    def _ResampleChunksInParallel(self, start_sliceno_in_chunks, output_spacing, target_image_shape, resampled_image):
+        '''reads and resamples the chunks in a pool of self.GetNumberOfWorkers() processes.
+        Each worker writes the slices it resamples to a shared memory buffer,
+        which is copied to resampled_image once all chunks are done.
+        If SetAbortRead(True) is called, the batches which haven't started are cancelled
+        and resampled_image is not filled.'''
+        if self._CheckAbortRead():
+            return
+        num_chunks = len(start_sliceno_in_chunks)
+        num_workers = min(self.GetNumberOfWorkers(), num_chunks)
+        dtype = np.dtype(self.GetTypeCodeName())
+        output_shape = tuple(target_image_shape[::-1])
+        shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(output_shape)) * dtype.itemsize))
+        try:
+            # each worker reads contiguous chunks, and we split into more batches
+            # than workers so that progress is reported regularly:
+            num_batches = min(num_chunks, 4 * num_workers)
+            batches = [[(int(i), start_sliceno_in_chunks[i]) for i in batch]
+                       for batch in np.array_split(np.arange(num_chunks), num_batches)]
+            parameters = self._GetWorkerParameters()
+            with profile_phase('resample in workers', num_workers=num_workers, num_chunks=num_chunks), \
+                    ProcessPoolExecutor(max_workers=num_workers) as executor:
+                futures = [
+                    executor.submit(_resample_chunks_in_worker, self.__class__, parameters, batch, output_spacing,
+                                    target_image_shape, shm.name, dtype.str) for batch in batches
+                ]
+                batch_of_future = dict(zip(futures, batches))
+                for future in as_completed(futures):
+                    num_chunks_resampled, _ = future.result()
+                    num_slices = sum(self._GetNumberOfSlicesInChunk(start) for _, start in batch_of_future[future])
+                    self._ReportChunksDone(num_chunks_resampled, num_slices)
+                    if self._CheckAbortRead():
+                        for pending in futures:
+                            pending.cancel()
+                        break
+
+            if self.GetReadAborted():
+                return
+
+            if hasattr(self, '_ChunkBytesRead'):
+                self._ChunkBytesRead = [b for future in futures for b in future.result()[1]]
+
+            with profile_phase('copy'):
+                output = np.ndarray(output_shape, dtype=dtype, buffer=shm.buf)
+                numpy_support.vtk_to_numpy(resampled_image.GetPointData().GetScalars())[:] = output.ravel()
+                del output
+        finally:
+            shm.close()
+            shm.unlink()
 
-                # print("Slice per chunk: ", num_slices_per_chunk)
+    def RequestData(self, request, inInfo, outInfo):
+        try:
+            outData = vtk.vtkImageData.GetData(outInfo)
 
-                # indices of the first slice per chunk
-                # we will read in num_slices_per_chunk slices at a time
-                start_sliceno_in_chunks = [i for i in range(0, shape[2], num_slices_per_chunk)]
+            if self.GetFileName() is None:
+                raise Exception("FileName must be set.")
 
-                num_chunks = len(start_sliceno_in_chunks)  # the number of chunks we will read in total
+            self.ReadDataSetInfo()
 
-                # in the case of acquisition data this will be 1 as num_chunks=shape[2]:
-                z_axis_magnification = num_chunks / (shape[2])
+            shape = self._GetShapeToRead()
 
-                target_image_shape = (int(xy_axes_magnification * shape[0]), int(xy_axes_magnification * shape[1]),
-                                      num_chunks)
+            if not self._NeedsResampling(shape):
+                # set the chunk size to equal the extent of the dataset which is read:
+                self._SetNumSlicesPerChunk(shape[2])
+                self._StartReadProgress(1)
+                if self._CheckAbortRead():
+                    return 1
+                reader = profile_algorithm(self._GetInternalChunkReader())
+                with profile_phase('chunk read', chunk=0, start_slice=self._GetZExtentToRead()[0]):
+                    self.UpdateChunkToRead(self._GetZExtentToRead()[0])
+                    reader.Modified()
+                    reader.Update()
+                outData.ShallowCopy(reader.GetOutput())
+                # the output starts at the first slice read, like the resampled images:
+                outData.SetExtent(0, shape[0] - 1, 0, shape[1] - 1, 0, shape[2] - 1)
+                outData.SetOrigin(self._GetOriginOfSlicesRead())
+                self._ReportChunksDone(1, shape[2])
 
-                resampler = vtk.vtkImageReslice()
+            else:
+                start_sliceno_in_chunks, target_image_shape, new_spacing, new_origin = \
+                    self._GetResampledImageGeometry(shape)
 
-                element_spacing = self.GetElementSpacing()
+                num_chunks = len(start_sliceno_in_chunks)  # the number of chunks we will read in total
+                self._StartReadProgress(num_chunks)
 
-                resampler.SetOutputSpacing(element_spacing[0] / xy_axes_magnification,
-                                           element_spacing[1] / xy_axes_magnification,
-                                           element_spacing[2] / z_axis_magnification)
                 # resampled data
                 resampled_image = vtk.vtkImageData()
 
                 resampled_image.SetExtent(0, target_image_shape[0] - 1, 0, target_image_shape[1] - 1, 0,
                                           target_image_shape[2] - 1)
 
-                resampled_image.SetSpacing(element_spacing[0] / xy_axes_magnification,
-                                           element_spacing[1] / xy_axes_magnification,
-                                           element_spacing[2] / z_axis_magnification)
-
-                new_spacing = [
-                    element_spacing[0] / xy_axes_magnification, element_spacing[1] / xy_axes_magnification,
-                    element_spacing[2] / z_axis_magnification
-                ]
-
-                original_origin = self.GetOrigin()
-                '''The new origin is based on where we need to position each slice in the world
-                If we have an image which is downsampled by 5 times, 
-                slices 0-4 are downsampled to a single slice and the image spacing is 5.
-                Slice 0 in image coordinates corresponds to slices 0-4 in the actual image.
-                The clipping planes will need to include points ranging from -0.5 to 4.49.
-                Therefore the slice needs to be centred half way through this range: at 2.
-                Because world coordinates = image coords * spacing + origin,
-                we need the origin to be 2 for this image.
-
-                In general, the origin must be at (image_spacing-1)/2 plus the original
-                position of the image's origin:'''
-                new_origin = tuple([(s - 1) / 2 + original_origin[i] for i, s in enumerate(new_spacing)])
+                resampled_image.SetSpacing(*new_spacing)
 
                 resampled_image.SetOrigin(new_origin)
 
                 resampled_image.AllocateScalars(self.GetOutputVTKType(), 1)
 
-                reader = self._GetInternalChunkReader()
-
-                resampler.SetInputData(reader.GetOutput())
-
-                # process each chunk:
-                for i, start_sliceno in enumerate(start_sliceno_in_chunks):
-                    self.UpdateChunkToRead(start_sliceno)
-                    reader.Modified()
-                    reader.Update()
-                    # print(i, reader.GetOutput().GetScalarComponentAsDouble(0,0,0,0))
+                if self.GetNumberOfWorkers() > 1 and num_chunks > 1:
+                    self._ResampleChunksInParallel(start_sliceno_in_chunks, new_spacing, target_image_shape,
+                                                   resampled_image)
+                else:
+                    reader = profile_algorithm(self._GetInternalChunkReader())
 
-                    # change the extent of the resampled image
-                    extent = (0, target_image_shape[0] - 1, 0, target_image_shape[1] - 1, i, i)
+                    resampler = self._GetChunkResampler(new_spacing)
+                    resampler.SetInputData(reader.GetOutput())
 
-                    resampler.SetOutputExtent(extent)
-                    resampler.Update()
-                    # print(i, resampler.GetOutput().GetScalarComponentAsDouble(0,0,i,0))
+                    # process each chunk, unless we are asked to stop:
+                    for i, start_sliceno in enumerate(start_sliceno_in_chunks):
+                        if self._CheckAbortRead():
+                            break
+                        data, extent = self._ResampleChunk(resampler, i, start_sliceno, target_image_shape)
 
-                    ################# vtk way ####################
+                        ################# vtk way ####################
+                        with profile_phase('copy', chunk=i):
+                            resampled_image.CopyAndCastFrom(data, extent)
+                        self._ReportChunksDone(1, self._GetNumberOfSlicesInChunk(start_sliceno))
 
-                    data = resampler.GetOutput()
-                    resampled_image.CopyAndCastFrom(data, extent)
-                    self.UpdateProgress(i / num_chunks)
-
-                outData.ShallowCopy(resampled_image)
+                if not self.GetReadAborted():
+                    outData.ShallowCopy(resampled_image)
 
         except Exception as e:
             raise Exception(e)
 
         finally:
-            tmpdir = self._GetTempDir()
-            if tmpdir is not None:
-                if os.path.exists(tmpdir):
-                    shutil.rmtree(self._GetTempDir())
+            self._RemoveTempDir()
 
         return 1
 
 
+def _resample_chunks_in_worker(reader_class, parameters, chunks, output_spacing, target_image_shape, shm_name, dtype):
+    '''Reads and resamples chunks of an image in a worker process of
+    cilBaseResampleReader.SetNumberOfWorkers.
+
+    Parameters
+    ----------
+    reader_class: type
+        the class of the resample reader
+    parameters: dict
+        the parameters of the resample reader, from _GetWorkerParameters
+    chunks: list of tuples
+        (index in the resampled image, first slice in the image file) of each chunk to resample
+    output_spacing: list
+        spacing of the resampled image
+    target_image_shape: tuple
+        shape of the resampled image, in VTK order (x, y, z)
+    shm_name: str
+        name of the shared memory buffer holding the resampled image
+    dtype: str
+        numpy dtype of the resampled image
+
+    Returns
+    -------
+    the number of chunks resampled, and the bytes read for each of them if
+    the reader reports this, otherwise an empty list
+    '''
+    reader = reader_class()
+    reader._SetWorkerParameters(**parameters)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        output = np.ndarray(tuple(target_image_shape[::-1]), dtype=np.dtype(dtype), buffer=shm.buf)
+        chunk_reader = reader._GetInternalChunkReader()
+        resampler = reader._GetChunkResampler(output_spacing)
+        resampler.SetInputData(chunk_reader.GetOutput())
+        for chunk_index, start_sliceno in chunks:
+            data, extent = reader._ResampleChunk(resampler, chunk_index, start_sliceno, target_image_shape)
+            output[chunk_index] = numpy_support.vtk_to_numpy(data.GetPointData().GetScalars()).reshape(output.shape[1:])
+        del output
+    finally:
+        shm.close()
+        reader._RemoveTempDir()
+    bytes_read = reader.GetChunkBytesRead() if hasattr(reader, 'GetChunkBytesRead') else []
+    return len(chunks), bytes_read
+
+
 class cilBaseBinaryBlobResampleReader(cilBaseResampleReader):
     '''vtkAlgorithm to load and resample a file to an approximate memory footprint.
     This BaseClass provides the methods needed to resample a file, if the filename
@@ -1180,6 +2159,69 @@ class cilBaseBinaryBlobResampleReader(cilBaseResampleReader):
         self._SlicePerChunk = None
         self._TempDir = None
         self._ChunkReader = None
+        self._UseMemoryMap = False
+        self._ChunkBytesRead = []
+        self._ChunkHeaderNumSlices = None
+
+    def SetUseMemoryMap(self, value):
+        ''' Sets whether to memory map the image file to read each chunk.
+
+        If True, each chunk is passed to the resampler as a view of a numpy.memmap
+        of the file, so no temporary files are written. Otherwise each chunk is
+        copied to a temporary file which is then read by a vtkMetaImageReader.
+
+        Parameters
+        -----------
+        value: bool, default: False
+            whether to memory map the image file
+        '''
+        if not isinstance(value, bool):
+            raise ValueError('Expected bool, got {}'.format(type(value)))
+        if value != self._UseMemoryMap:
+            self._UseMemoryMap = value
+            self.Modified()
+
+    def GetUseMemoryMap(self):
+        ''' Returns whether the image file is memory mapped to read each chunk.'''
+        return self._UseMemoryMap
+
+    def GetChunkBytesRead(self):
+        ''' Returns a list of the number of bytes read from the image file
+        for each chunk, in the last update of the reader.'''
+        return self._ChunkBytesRead
+
+    def _GetWorkerParameters(self):
+        '''returns the parameters to recreate this reader in a worker process, see
+        cilBaseResampleReader._GetWorkerParameters, and whether to memory map the file'''
+        parameters = super(cilBaseBinaryBlobResampleReader, self)._GetWorkerParameters()
+        parameters['use_memory_map'] = self.GetUseMemoryMap()
+        return parameters
+
+    def _SetWorkerParameters(self, use_memory_map=False, **parameters):
+        '''sets up this reader in a worker process, see cilBaseResampleReader._SetWorkerParameters'''
+        super(cilBaseBinaryBlobResampleReader, self)._SetWorkerParameters(**parameters)
+        self.SetUseMemoryMap(use_memory_map)
+
+    def _GetMemoryMappedChunkReader(self):
+        ''' Returns a cilArrayChunkReader which reads each chunk from a numpy.memmap
+        of the image file. The memmap is opened copy-on-write, so that the file is
+        never modified, even if the output of the reader is.'''
+        self._SetTempDir(None)
+        byte_order = '>' if self.GetBigEndian() else '<'
+        dtype = np.dtype(self.GetTypeCodeName()).newbyteorder(byte_order)
+        order = 'F' if self.GetIsFortran() else 'C'
+        array = np.memmap(self._GetDataFileName(),
+                          dtype=dtype,
+                          mode='c',
+                          offset=self.GetFileHeaderLength(),
+                          shape=tuple(self.GetStoredArrayShape()),
+                          order=order)
+        reader = cilArrayChunkReader()
+        reader.SetArray(array, is_fortran=self.GetIsFortran())
+        reader.SetElementSpacing(self.GetElementSpacing())
+        reader.SetOrigin(self.GetOrigin())
+        self._ChunkReader = reader
+        return reader
 
     def _GetInternalChunkReader(self):
         ''' Returns a reader which can be used to read each chunk.
@@ -1191,9 +2233,13 @@ class cilBaseBinaryBlobResampleReader(cilBaseResampleReader):
         We have to make a new metaimage header so that the vtk.vtkMetaImageReader
         knows the extent it needs to read when we read a chunk.
         
-        TODO: In future we need to use the vtk.vtkImageReader2 to replace this
-        and remove the need for re-writing out chunks.
+        If SetUseMemoryMap(True) has been called, no files are written and
+        a reader of a memory map of the image file is returned instead.
         '''
+        self._ChunkBytesRead = []
+        if self.GetUseMemoryMap():
+            return self._GetMemoryMappedChunkReader()
+
         tmpdir = tempfile.mkdtemp()
         self._SetTempDir(tmpdir)
         header_filename = os.path.join(tmpdir, "header.mhd")
@@ -1203,31 +2249,27 @@ class cilBaseBinaryBlobResampleReader(cilBaseResampleReader):
         chunk_file_name = os.path.join(tmpdir, "chunk.raw")
         self._ChunkFileName = chunk_file_name
 
-        readshape = self.GetStoredArrayShape()
-        is_fortran = self.GetIsFortran()
-
-        if is_fortran:
-            shape = list(readshape)
-        else:
-            shape = list(readshape)[::-1]
-
-        chunk_shape = shape.copy()
         if self._GetNumSlicesPerChunk() is not None:
             num_slices_per_chunk = self._GetNumSlicesPerChunk()
         else:
-            num_slices_per_chunk = shape[2]
-        chunk_shape[2] = num_slices_per_chunk
+            num_slices_per_chunk = self._GetShapeInFile()[2]
+        self._WriteChunkHeader(num_slices_per_chunk)
+        self._ChunkReader = reader
+        return reader
 
-        cilNumpyMETAImageWriter.WriteMETAImageHeader(chunk_file_name,
-                                                     header_filename,
+    def _WriteChunkHeader(self, num_slices):
+        '''writes the metaimage header of self._ChunkFileName, for a chunk of num_slices slices'''
+        chunk_shape = self._GetShapeInFile()
+        chunk_shape[2] = num_slices
+        cilNumpyMETAImageWriter.WriteMETAImageHeader(self._ChunkFileName,
+                                                     os.path.join(self._GetTempDir(), "header.mhd"),
                                                      self.GetMetaImageTypeCode(),
                                                      self.GetBigEndian(),
                                                      0,
                                                      tuple(chunk_shape),
                                                      spacing=tuple(self.GetElementSpacing()),
                                                      origin=self.GetOrigin())
-        self._ChunkReader = reader
-        return reader
+        self._ChunkHeaderNumSlices = num_slices
 
     def UpdateChunkToRead(self, start_slice):
         '''Read the next chunk from the image file,
@@ -1235,19 +2277,34 @@ class cilBaseBinaryBlobResampleReader(cilBaseResampleReader):
         It is self._ChunkFileName that is being read by the resampler
         so essentially this method is updating which chunk of data the 
         resampler will receive.
+        If the file is memory mapped, this instead updates the slab of
+        the memory map which is output by the chunk reader.
         '''
+        if start_slice < 0:
+            raise ValueError('{} ERROR: Start slice cannot be negative.'.format(self.__class__.__name__))
 
-        # This is the length of the chunk we will read from the file in bytes:
-        chunk_length = self._GetSliceLengthInFile() * self._GetNumSlicesPerChunk()
-
-        with open(self.GetFileName(), "rb") as image_file_object:
-            if start_slice < 0:
-                raise ValueError('{} ERROR: Start slice cannot be negative.'.format(self.__class__.__name__))
+        if self.GetUseMemoryMap():
+            end_slice = min(start_slice + self._GetNumSlicesPerChunk() - 1, self._GetLastSliceToRead())
+            self._ChunkReader.SetZExtent((start_slice, end_slice))
+            self._ChunkBytesRead.append((end_slice - start_slice + 1) * self._GetSliceLengthInFile())
+            return
+
+        # This is the length of the chunk we will read from the file in bytes,
+        # which stops at the last slice to read:
+        num_slices = min(self._GetNumSlicesPerChunk(), self._GetLastSliceToRead() + 1 - start_slice)
+        chunk_length = self._GetSliceLengthInFile() * num_slices
+        # the last chunk may contain fewer slices than the others, and the header
+        # must match, otherwise the chunk reader doesn't read it:
+        if num_slices != self._ChunkHeaderNumSlices:
+            self._WriteChunkHeader(num_slices)
+
+        with open(self._GetDataFileName(), "rb") as image_file_object:
             chunk_location = self.GetFileHeaderLength() + start_slice * self._GetSliceLengthInFile()
             with open(self._ChunkFileName, "wb") as chunk_file_object:
                 image_file_object.seek(chunk_location)
                 chunk = image_file_object.read(chunk_length)
                 chunk_file_object.write(chunk)
+        self._ChunkBytesRead.append(len(chunk))
 
 
 class cilRawResampleReader(cilBaseBinaryBlobResampleReader, cilRawReaderInterface):
@@ -1316,11 +2373,57 @@ class cilHDF5ResampleReader(cilBaseResampleReader, cilHDF5ReaderInterface):
     def __init__(self):
         VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1)
         super(cilHDF5ResampleReader, self).__init__()
+        self._UseChunkAlignedReads = True
+        self._FileReader = None
+        self._OpenFiles = ExitStack()
+
+    def SetUseChunkAlignedReads(self, value):
+        '''
+        Parameters
+        -----------
+        value (bool), default=True:
+            Whether to read whole rows of the HDF5 chunks of the dataset along z,
+            with HDF5ChunkAlignedReader, so that each HDF5 chunk is read and
+            decompressed only once, even if the chunks we resample together
+            don't line up with the HDF5 chunks. Otherwise each chunk is read
+            from the file on its own with HDF5Reader.'''
+        if value != self._UseChunkAlignedReads:
+            self._UseChunkAlignedReads = value
+            self.Modified()
+
+    def GetUseChunkAlignedReads(self):
+        '''Get whether whole rows of the HDF5 chunks of the dataset are read along z'''
+        return self._UseChunkAlignedReads
+
+    def _GetWorkerParameters(self):
+        '''returns the parameters to recreate this reader in a worker process, see
+        cilBaseResampleReader._GetWorkerParameters, and the dataset and how it is read'''
+        parameters = super(cilHDF5ResampleReader, self)._GetWorkerParameters()
+        parameters['dataset_name'] = self.GetDatasetName()
+        parameters['use_chunk_aligned_reads'] = self.GetUseChunkAlignedReads()
+        return parameters
+
+    def _SetWorkerParameters(self, dataset_name, use_chunk_aligned_reads=True, **parameters):
+        '''sets up this reader in a worker process, see cilBaseResampleReader._SetWorkerParameters'''
+        # the dataset name is set first, so that setting the file name doesn't read the dataset info again:
+        self._DatasetName = dataset_name
+        super(cilHDF5ResampleReader, self)._SetWorkerParameters(**parameters)
+        self.SetUseChunkAlignedReads(use_chunk_aligned_reads)
+
+    def GetNumberOfSlicesRead(self):
+        '''Returns the number of z slices read from the file in this process by the last update'''
+        if self._FileReader is None:
+            return 0
+        return self._FileReader.GetNumberOfSlicesRead()
 
     def _GetInternalChunkReader(self):
         '''returns a reader which will only read a specific chunk of the data.
         This is a chunk which will get resampled into a single slice.'''
-        reader = HDF5Reader()
+        # the file is kept open in the pool until the read is done, see _RemoveTempDir,
+        # so that all the chunks are read with the same handle and chunk cache:
+        self._OpenFiles.enter_context(get_hdf5_file_pool().Open(self.GetFileName()))
+        reader = HDF5ChunkAlignedReader() if self.GetUseChunkAlignedReads() else HDF5Reader()
+        self._FileReader = reader
         reader.SetFileName(self.GetFileName())
         if self.GetDatasetName() is not None:
             reader.SetDatasetName(self.GetDatasetName())
@@ -1340,7 +2443,7 @@ class cilHDF5ResampleReader(cilBaseResampleReader, cilHDF5ReaderInterface):
         start_slice in the z direction'''
         num_slices_per_chunk = self._GetNumSlicesPerChunk()
         end_slice = start_slice + num_slices_per_chunk - 1
-        end_z_value = self.GetStoredArrayShape()[2] - 1
+        end_z_value = self._GetLastSliceToRead()
         if end_slice > end_z_value:
             end_slice = end_z_value
         if start_slice < 0:
@@ -1348,6 +2451,12 @@ class cilHDF5ResampleReader(cilBaseResampleReader, cilHDF5ReaderInterface):
         dims = self.GetStoredArrayShape()
         self._ChunkReader.SetUpdateExtent((0, dims[0] - 1, 0, dims[1] - 1, start_slice, end_slice))
 
+    def _RemoveTempDir(self):
+        '''releases the file, which is kept open in the pool whilst the chunks are read.
+        No temporary directory is used to read HDF5 files.'''
+        self._OpenFiles.close()
+        super(cilHDF5ResampleReader, self)._RemoveTempDir()
+
 
 class cilMetaImageResampleReader(cilBaseBinaryBlobResampleReader, cilMetaImageReaderInterface):
     '''vtkAlgorithm to load and resample a metaimage file to an approximate memory footprint
@@ -1362,36 +2471,79 @@ class cilMetaImageResampleReader(cilBaseBinaryBlobResampleReader, cilMetaImageRe
     reader.SetTargetSize(1024*1024*1024)
     reader.Update()
     image = reader.GetOutput()
-    
+
+    If the element data is compressed, each chunk is inflated from the file
+    with a cilZlibSlabDecoder, so only one chunk is decompressed in memory at
+    a time. SetUseMemoryMap has no effect on compressed files.
     '''
 
     def __init__(self):
         VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1)
         super(cilMetaImageResampleReader, self).__init__()
+        self._Decoder = None
+        self._InflatedChunk = None
+
+    def _GetWorkerParameters(self):
+        '''returns the parameters to recreate this reader in a worker process, see
+        cilBaseResampleReader._GetWorkerParameters, and where and how the element data is stored'''
+        parameters = super(cilMetaImageResampleReader, self)._GetWorkerParameters()
+        parameters['element_file'] = self.GetElementFile()
+        parameters['is_compressed_data'] = self.GetIsCompressedData()
+        parameters['compressed_data_size'] = self.GetCompressedDataSize()
+        return parameters
+
+    def _SetWorkerParameters(self, element_file, is_compressed_data=False, compressed_data_size=None, **parameters):
+        '''sets up this reader in a worker process, see cilBaseResampleReader._SetWorkerParameters'''
+        super(cilMetaImageResampleReader, self)._SetWorkerParameters(**parameters)
+        self.SetElementFile(element_file)
+        self.SetIsCompressedData(is_compressed_data)
+        self.SetCompressedDataSize(compressed_data_size)
 
-    def UpdateChunkToRead(self, start_slice):
-        '''Read the next chunk from the image file,
-        and write out to self._ChunkFileName
-        It is self._ChunkFileName that is being read by the resampler
-        so essentially this method is updating which chunk of data the 
-        resampler will receive.
-        '''
-
-        # This is the length of the chunk we will read from the file in bytes:
-        chunk_length = self._GetSliceLengthInFile() * self._GetNumSlicesPerChunk()
-
-        data_fname = self.GetElementFile()
-        if data_fname == 'LOCAL':
-            data_fname = self.GetFileName()
+    def _GetInternalChunkReader(self):
+        ''' Returns a reader which can be used to read each chunk.
+        If the element data is compressed, this is a cilArrayChunkReader of the slabs
+        inflated by a cilZlibSlabDecoder, otherwise see
+        cilBaseBinaryBlobResampleReader._GetInternalChunkReader.'''
+        if not self.GetIsCompressedData():
+            return super(cilMetaImageResampleReader, self)._GetInternalChunkReader()
+        self._ChunkBytesRead = []
+        self._SetTempDir(None)
+        self._Decoder = self._GetCompressedDataDecoder()
+        self._InflatedChunk = None
+        reader = cilArrayChunkReader()
+        reader.SetElementSpacing(self.GetElementSpacing())
+        reader.SetOrigin(self.GetOrigin())
+        self._ChunkReader = reader
+        return reader
 
-        with open(data_fname, "rb") as image_file_object:
-            if start_slice < 0:
-                raise ValueError('{} ERROR: Start slice cannot be negative.'.format(self.__class__.__name__))
-            chunk_location = self.GetFileHeaderLength() + start_slice * self._GetSliceLengthInFile()
-            with open(self._ChunkFileName, "wb") as chunk_file_object:
-                image_file_object.seek(chunk_location)
-                chunk = image_file_object.read(chunk_length)
-                chunk_file_object.write(chunk)
+    def UpdateChunkToRead(self, start_slice):
+        ''' Inflates the next chunk of compressed element data, starting at start_slice,
+        into the chunk reader. If the element data is not compressed, see
+        cilBaseBinaryBlobResampleReader.UpdateChunkToRead.'''
+        if not self.GetIsCompressedData():
+            return super(cilMetaImageResampleReader, self).UpdateChunkToRead(start_slice)
+        if start_slice < 0:
+            raise ValueError('{} ERROR: Start slice cannot be negative.'.format(self.__class__.__name__))
+        end_slice = min(start_slice + self._GetNumSlicesPerChunk() - 1, self._GetLastSliceToRead())
+        shape = self.GetStoredArrayShape()
+        # the chunk is allocated once, and only the last chunk may be smaller:
+        if self._InflatedChunk is None or self._InflatedChunk.shape[0] < end_slice - start_slice + 1:
+            self._InflatedChunk = np.empty((self._GetNumSlicesPerChunk(), shape[1], shape[0]),
+                                           dtype=self.GetTypeCodeName())
+        chunk = self._InflatedChunk[:end_slice - start_slice + 1]
+        bytes_read = self._Decoder.GetBytesRead()
+        self._DecodeCompressedSlices(self._Decoder, start_slice, chunk)
+        self._ChunkReader.SetArray(chunk, is_fortran=False)
+        self._ChunkBytesRead.append(self._Decoder.GetBytesRead() - bytes_read)
+
+    def _RemoveTempDir(self):
+        '''closes the file of compressed data, if it is open, and removes the
+        temporary directory where we save the chunks, if it exists'''
+        if self._Decoder is not None:
+            self._Decoder.Close()
+            self._Decoder = None
+        self._InflatedChunk = None
+        super(cilMetaImageResampleReader, self)._RemoveTempDir()
 
 
 class cilTIFFResampleReader(cilBaseResampleReader, cilTIFFImageReaderInterface):
@@ -1410,11 +2562,29 @@ class cilTIFFResampleReader(cilBaseResampleReader, cilTIFFImageReaderInterface):
     
     '''
 
+    def _GetWorkerParameters(self):
+        '''returns the parameters to recreate this reader in a worker process, see
+        cilBaseResampleReader._GetWorkerParameters, and how the files are decoded'''
+        parameters = super(cilTIFFResampleReader, self)._GetWorkerParameters()
+        parameters['orientation_type'] = self.GetOrientationType()
+        parameters['number_of_decoding_threads'] = self.GetNumberOfDecodingThreads()
+        return parameters
+
+    def _SetWorkerParameters(self, orientation_type=1, number_of_decoding_threads=1, **parameters):
+        '''sets up this reader in a worker process, see cilBaseResampleReader._SetWorkerParameters'''
+        super(cilTIFFResampleReader, self)._SetWorkerParameters(**parameters)
+        self.SetOrientationType(orientation_type)
+        self.SetNumberOfDecodingThreads(number_of_decoding_threads)
+
     def _GetInternalChunkReader(self):
         '''returns a reader which will only read a specific chunk of the data.
-        This is a chunk which will get resampled into a single slice.'''
-        reader = vtk.vtkTIFFReader()
-        reader.SetOrientationType(self.GetOrientationType())
+        This is a chunk which will get resampled into a single slice.
+        The files of each chunk are decoded concurrently by a cilTIFFStackDecoder,
+        which decodes the next chunk in the background while this one is resampled.'''
+        self._Decoder = self._GetStackDecoder()
+        reader = cilArrayChunkReader()
+        reader.SetElementSpacing(self.GetElementSpacing())
+        reader.SetOrigin(self.GetOrigin())
         self._ChunkReader = reader
         return reader
 
@@ -1423,35 +2593,48 @@ class cilTIFFResampleReader(cilBaseResampleReader, cilTIFFImageReaderInterface):
         start_slice in the z direction'''
         num_slices_per_chunk = self._GetNumSlicesPerChunk()
         end_slice = start_slice + num_slices_per_chunk - 1
-        end_z_value = self.GetStoredArrayShape()[2] - 1
+        end_z_value = self._GetLastSliceToRead()
         if end_slice > end_z_value:
             end_slice = end_z_value
         if start_slice < 0:
             raise ValueError('{} ERROR: Start slice cannot be negative.'.format(self.__class__.__name__))
-        dims = self.GetStoredArrayShape()
 
-        fnames = self.GetFileName()
-        chunk = vtk.vtkStringArray()
-        for i in range(start_slice, end_slice + 1):
-            chunk.InsertNextValue(fnames[i])
-        self._ChunkReader.SetFileNames(chunk)
+        self._ChunkReader.SetArray(self._Decoder.Decode(start_slice, end_slice), is_fortran=False)
+        # decode the following chunk whilst this one is resampled:
+        if end_slice < end_z_value:
+            self._Decoder.Prefetch(end_slice + 1, min(end_slice + num_slices_per_chunk, end_z_value))
+
+    def _RemoveTempDir(self):
+        '''shuts down the threads decoding the files. No temporary directory is used
+        to read TIFF files.'''
+        decoder = getattr(self, '_Decoder', None)
+        if decoder is not None:
+            decoder.Close()
+            self._Decoder = None
+        super(cilTIFFResampleReader, self)._RemoveTempDir()
 
 
 # CROPPED READERS -----------------------------------------------------------------------------------
 
 
 class cilBaseCroppedReader(cilReaderInterface):
-    '''vtkAlgorithm to crop in the z direction
+    '''vtkAlgorithm to crop an image file to an extent, on read.
+
+    The extent is read straight from the file into the array of the output:
+    one read per contiguous run of bytes if whole rows are read, otherwise a copy
+    from a memory map of the file. So only the bytes in the extent are read.
     '''
 
     def __init__(self):
         VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1)
         super(cilBaseCroppedReader, self).__init__()
         self._TargetZExtent = (0, 0)
+        self._TargetExtent = None
 
     def SetTargetZExtent(self, value):
         ''' 
         Set the target extent to crop to on the z axis.
+        This replaces any target extent set with SetTargetExtent.
         
         Parameters
         -----------
@@ -1461,8 +2644,9 @@ class cilBaseCroppedReader(cilReaderInterface):
         if not isinstance(value, tuple):
             raise ValueError('Expected a tuple. Got {}', type(value))
 
-        if not value == self.GetTargetZExtent():
+        if not value == self.GetTargetZExtent() or self._TargetExtent is not None:
             self._TargetZExtent = value
+            self._TargetExtent = None
             self.Modified()
 
     def GetTargetZExtent(self):
@@ -1471,15 +2655,94 @@ class cilBaseCroppedReader(cilReaderInterface):
         '''
         return self._TargetZExtent
 
+    def SetTargetExtent(self, value):
+        '''
+        Set the target extent to crop to, on all axes.
+        This takes priority over the target z extent.
+
+        Parameters
+        -----------
+        value: list of len 6, or None
+            the extent (x_min, x_max, y_min, y_max, z_min, z_max) to crop the dataset to.
+            A value of -1 stands for the whole extent on that axis.
+            If None, the dataset is cropped to the target z extent.
+        '''
+        if value is not None:
+            if not isinstance(value, (list, tuple)) or len(value) != 6:
+                raise ValueError('Expected a list or tuple of length 6. Got {}'.format(value))
+            value = tuple(int(v) for v in value)
+        if value != self._TargetExtent:
+            self._TargetExtent = value
+            self.Modified()
+
+    def GetTargetExtent(self):
+        ''' Returns the target extent to crop to on all axes, or None
+        if the dataset is cropped to the target z extent.'''
+        return self._TargetExtent
+
+    def _GetExtentToRead(self, shape):
+        '''returns the extent to read from an image of the given shape (x, y, z):
+        the target extent, or else the target z extent, clipped to the image.'''
+        if self.GetTargetExtent() is not None:
+            extent = list(self.GetTargetExtent())
+        else:
+            extent = [0, -1, 0, -1, self.GetTargetZExtent()[0], self.GetTargetZExtent()[1]]
+        for axis in range(3):
+            lower, upper = extent[2 * axis:2 * axis + 2]
+            lower = 0 if lower == -1 else max(lower, 0)
+            upper = shape[axis] - 1 if upper == -1 else min(upper, shape[axis] - 1)
+            if upper < lower:
+                raise ValueError('{} ERROR: Extent {} does not overlap the image of shape {}.'.format(
+                    self.__class__.__name__, extent, tuple(shape)))
+            extent[2 * axis:2 * axis + 2] = [lower, upper]
+        return tuple(extent)
+
+    def _ReadExtent(self, extent, shape):
+        '''reads the extent of the image of the given shape (x, y, z) from the file.
+
+        Returns
+        -------
+        numpy array (z, y, x) in the native byte order'''
+        dtype = np.dtype(self.GetTypeCodeName()).newbyteorder('>' if self.GetBigEndian() else '<')
+        x_min, x_max, y_min, y_max, z_min, z_max = extent
+        array = np.empty((z_max - z_min + 1, y_max - y_min + 1, x_max - x_min + 1), dtype=dtype.newbyteorder('='))
+        # whatever the order of the array, x varies fastest in the file:
+        row_length = shape[0] * dtype.itemsize
+        slice_length = row_length * shape[1]
+        header_length = self.GetFileHeaderLength()
+
+        if array.shape[2] == shape[0]:
+            # whole rows, so each slice, or the whole extent, is contiguous in the file:
+            if array.shape[1] == shape[1]:
+                runs = [(header_length + z_min * slice_length, array)]
+            else:
+                runs = [(header_length + z * slice_length + y_min * row_length, array[z - z_min])
+                        for z in range(z_min, z_max + 1)]
+            with open(self._GetDataFileName(), 'rb') as image_file_object:
+                for location, out in runs:
+                    image_file_object.seek(location)
+                    if image_file_object.readinto(out) != out.nbytes:
+                        raise ValueError('{} ERROR: {} is smaller than expected.'.format(
+                            self.__class__.__name__, self._GetDataFileName()))
+            if not dtype.isnative:
+                array.byteswap(inplace=True)
+        else:
+            memory_map = np.memmap(self._GetDataFileName(),
+                                   dtype=dtype,
+                                   mode='r',
+                                   offset=header_length,
+                                   shape=(shape[2], shape[1], shape[0]))
+            array[:] = memory_map[z_min:z_max + 1, y_min:y_max + 1, x_min:x_max + 1]
+            del memory_map
+        return array
+
     def RequestData(self, request, inInfo, outInfo):
         outData = vtk.vtkImageData.GetData(outInfo)
 
         self.ReadDataSetInfo()
 
         # get basic info
-        big_endian = self.GetBigEndian()
         readshape = self.GetStoredArrayShape()
-        file_header_length = self.GetFileHeaderLength()
         is_fortran = self.GetIsFortran()
 
         if is_fortran:
@@ -1487,103 +2750,14 @@ class cilBaseCroppedReader(cilReaderInterface):
         else:
             shape = list(readshape)[::-1]
 
-        tmpdir = tempfile.mkdtemp()
-        header_filename = os.path.join(tmpdir, "header.mhd")
-        reader = vtk.vtkMetaImageReader()
-        reader.SetFileName(header_filename)
-
-        slice_length = self._GetSliceLengthInFile()
-
-        try:
-            if self.GetTargetZExtent()[1] >= shape[2] and self.GetTargetZExtent()[0] <= 0:
-                # in this case we don't need to crop, so we read the whole dataset
-                # print("Don't crop")
-
-                chunk_file_name = os.path.join(tmpdir, "chunk.raw")
-
-                # Creates a metaimageheader which will be used to read a file containing the
-                # data - chunk_file_name which we will fill below.
-
-                cilNumpyMETAImageWriter.WriteMETAImageHeader(chunk_file_name,
-                                                             header_filename,
-                                                             self.GetMetaImageTypeCode(),
-                                                             big_endian,
-                                                             0,
-                                                             tuple(shape),
-                                                             spacing=tuple(self.GetElementSpacing()),
-                                                             origin=self.GetOrigin())
-
-                image_file = self.GetFileName()
-                # Writes the entire dataset to chunk_file_name
-                with open(image_file, "rb") as image_file_object:
-                    end_slice = shape[2]
-                    chunk_location = file_header_length
-                    with open(chunk_file_name, "wb") as chunk_file_object:
-                        image_file_object.seek(chunk_location)
-                        chunk_length = slice_length * end_slice
-                        chunk = image_file_object.read(chunk_length)
-                        chunk_file_object.write(chunk)
-
-                reader.Modified()
-                reader.Update()
-                # print(reader.GetOutput().GetScalarComponentAsDouble(0, 0, 0, 0))
-                outData.ShallowCopy(reader.GetOutput())
-
-                return 1
-
-            # In the case we do need to crop: ---------------------------------------------
-
-            shape[2] = self.GetTargetZExtent()[1] - self.GetTargetZExtent()[0] + 1
-
-            chunk_file_name = os.path.join(tmpdir, "chunk.raw")
-
-            # Creates a metaimageheader which will be used to read a file just containing the cropped
-            # data - chunk_file_name which we will fill below.
-            cilNumpyMETAImageWriter.WriteMETAImageHeader(chunk_file_name,
-                                                         header_filename,
-                                                         self.GetMetaImageTypeCode(),
-                                                         big_endian,
-                                                         0,
-                                                         tuple(shape),
-                                                         spacing=tuple(self.GetElementSpacing()),
-                                                         origin=self.GetOrigin())
-            image_file = self.GetFileName()
-            chunk_location = file_header_length + \
-                (self.GetTargetZExtent()[0]) * slice_length
-
-            # Reads the data as a single chunk.
-            # Copies the chunk from the original file to chunk_file_name:
-            with open(chunk_file_name, "wb") as chunk_file_object:
-                with open(image_file, "rb") as image_file_object:
-                    image_file_object.seek(chunk_location)
-                    chunk_length = (self.GetTargetZExtent()[1] - self.GetTargetZExtent()[0] + 1) * slice_length
-                    chunk = image_file_object.read(chunk_length)
-                    chunk_file_object.write(chunk)
-
-            reader.Modified()
-            reader.Update()
-
-            # Once we have read the data, update the extent to reflect where
-            # we have cut the cropped dataset out of the original image
-            Data = vtk.vtkImageData()
-            extent = (0, shape[0] - 1, 0, shape[1] - 1, self.GetTargetZExtent()[0], self.GetTargetZExtent()[1])
-            Data.SetExtent(extent)
-            Data.SetSpacing(self.GetElementSpacing())
-            Data.SetOrigin(self.GetOrigin())
-            Data.AllocateScalars(self.GetOutputVTKType(), 1)
-
-            read_data = reader.GetOutput()
-            read_data.SetExtent(extent)
-
-            Data.CopyAndCastFrom(read_data, extent)
-            outData.ShallowCopy(Data)
+        extent = self._GetExtentToRead(shape)
+        array = self._ReadExtent(extent, shape)
 
-        except Exception as e:
-            print("Exception", e)
-            raise Exception(e)
-        finally:
-            if os.path.exists(tmpdir):
-                shutil.rmtree(tmpdir)
+        # the output wraps the array which was read, and its extent
+        # reflects where it was cut out of the original image:
+        data = Converter.numpy2vtkImage(array, spacing=self.GetElementSpacing(), origin=self.GetOrigin())
+        data.SetExtent(extent)
+        outData.ShallowCopy(data)
         return 1
 
 
@@ -1645,12 +2819,41 @@ class cilMetaImageCroppedReader(cilBaseCroppedReader, cilMetaImageReaderInterfac
     reader.SetTargetZExtent((1, 3))
     reader.Update()
     image = reader.GetOutput()
+
+    If the element data is compressed, only the slices up to the end of the
+    extent are inflated, one at a time unless whole slices are read.
     '''
 
     def __init__(self):
         VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1)
         super(cilMetaImageCroppedReader, self).__init__()
 
+    def _ReadExtent(self, extent, shape):
+        '''reads the extent of the image of the given shape (x, y, z) from the file,
+        inflating it with a cilZlibSlabDecoder if the element data is compressed.
+
+        Returns
+        -------
+        numpy array (z, y, x) in the native byte order'''
+        if not self.GetIsCompressedData():
+            return super(cilMetaImageCroppedReader, self)._ReadExtent(extent, shape)
+        x_min, x_max, y_min, y_max, z_min, z_max = extent
+        decoder = self._GetCompressedDataDecoder()
+        try:
+            if x_max - x_min + 1 == shape[0] and y_max - y_min + 1 == shape[1]:
+                array = np.empty((z_max - z_min + 1, shape[1], shape[0]), dtype=self.GetTypeCodeName())
+                self._DecodeCompressedSlices(decoder, z_min, array)
+            else:
+                array = np.empty((z_max - z_min + 1, y_max - y_min + 1, x_max - x_min + 1),
+                                 dtype=self.GetTypeCodeName())
+                whole_slice = np.empty((1, shape[1], shape[0]), dtype=self.GetTypeCodeName())
+                for z in range(z_min, z_max + 1):
+                    self._DecodeCompressedSlices(decoder, z, whole_slice)
+                    array[z - z_min] = whole_slice[0, y_min:y_max + 1, x_min:x_max + 1]
+        finally:
+            decoder.Close()
+        return array
+
 
 class cilHDF5CroppedReader(cilBaseCroppedReader, cilHDF5ReaderInterface):
     '''vtkAlgorithm to load and crop a hdf5 file
@@ -1673,24 +2876,6 @@ class cilHDF5CroppedReader(cilBaseCroppedReader, cilHDF5ReaderInterface):
     def __init__(self):
         VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1)
         super(cilHDF5CroppedReader, self).__init__()
-        self._TargetExtent = None
-
-    def SetTargetExtent(self, value):
-        ''' 
-        Set the target extent to crop to. Unlike other cropped readers,
-        the HDF5CroppedReader can crop in all dimensions
-
-        Parameters
-        -----------
-        value: list of len 5
-            the extent to crop the dataset to
-        '''
-        self._TargetExtent = value
-
-    def GetTargetExtent(self):
-        ''' Returns the target extent to crop to. Unlike other cropped readers,
-        the HDF5CroppedReader can crop in all dimensions'''
-        return self._TargetExtent
 
     def RequestData(self, request, inInfo, outInfo):
         outData = vtk.vtkImageData.GetData(outInfo)
@@ -1703,7 +2888,7 @@ class cilHDF5CroppedReader(cilBaseCroppedReader, cilHDF5ReaderInterface):
         # Either the TargetExtent or TargetZExtent should have been set.
         # We prioritise the TargetExtent
         if self.GetTargetExtent() is None:
-            extent = [0, -1, 0, -1, self.GetTargetZExtent[0], self.GetTargetZExtent[1]]
+            extent = [0, -1, 0, -1, self.GetTargetZExtent()[0], self.GetTargetZExtent()[1]]
         else:
             extent = self.GetTargetExtent()
         reader.SetUpdateExtent(extent)
@@ -1734,7 +2919,6 @@ class cilTIFFCroppedReader(cilBaseCroppedReader, cilTIFFImageReaderInterface):
     def __init__(self):
         VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1)
         super(cilTIFFCroppedReader, self).__init__()
-        self._TargetExtent = None
 
     def RequestData(self, request, inInfo, outInfo):
         outData = vtk.vtkImageData.GetData(outInfo)
@@ -1750,51 +2934,20 @@ class cilTIFFCroppedReader(cilBaseCroppedReader, cilTIFFImageReaderInterface):
         else:
             shape = list(readshape)[::-1]
 
-        reader = vtk.vtkTIFFReader()
-        # Set orientation type due to issue:
-        # https://github.com/vais-ral/CILViewer/issues/296
-        # https://gitlab.kitware.com/vtk/vtk/-/merge_requests/6155
-        reader.SetOrientationType(self.GetOrientationType())
-        sa = vtk.vtkStringArray()
-
-        extent = [0, -1, 0, -1, self.GetTargetZExtent()[0], self.GetTargetZExtent()[1]]
-
-        # crop on Z
-        if extent[5] >= shape[2] and extent[4] <= 0:
-            # in this case we don't need to crop, so we read the whole dataset
-            # print("Don't crop")
-            for el in self.GetFileName():
-                sa.InsertNextValue(el)
-            reader.SetFileNames(sa)
-            reader.Update()
-            outData.ShallowCopy(reader.GetOutput())
-
-            return 1
-
-        # In the case we do need to crop: ---------------------------------------------
-
-        shape[2] = self.GetTargetZExtent()[1] - self.GetTargetZExtent()[0] + 1
-
-        image_file = self.GetFileName()[extent[4]:extent[5] + 1]
-        for el in image_file:
-            sa.InsertNextValue(el)
-        reader.SetFileNames(sa)
-        reader.Update()
+        extent = self._GetExtentToRead(shape)
 
-        # Once we have read the data, update the extent to reflect where
-        # we have cut the cropped dataset out of the original image
+        # the files are decoded concurrently straight into the array of the output:
+        decoder = self._GetStackDecoder()
+        try:
+            array = decoder.Decode(extent[4], extent[5])
+        finally:
+            decoder.Close()
+        if extent[:4] != (0, shape[0] - 1, 0, shape[1] - 1):
+            array = np.ascontiguousarray(array[:, extent[2]:extent[3] + 1, extent[0]:extent[1] + 1])
 
-        Data = vtk.vtkImageData()
-        extent = (0, shape[0] - 1, 0, shape[1] - 1, self.GetTargetZExtent()[0], self.GetTargetZExtent()[1])
+        # the extent reflects where the data was cut out of the original image:
+        Data = Converter.numpy2vtkImage(array, spacing=self.GetElementSpacing(), origin=self.GetOrigin())
         Data.SetExtent(extent)
-        Data.SetSpacing(self.GetElementSpacing())
-        Data.SetOrigin(self.GetOrigin())
-        Data.AllocateScalars(self.GetOutputVTKType(), 1)
-
-        read_data = reader.GetOutput()
-        read_data.SetExtent(extent)
-
-        Data.CopyAndCastFrom(read_data, extent)
         outData.ShallowCopy(Data)
 
         return 1
@@ -1816,6 +2969,7 @@ class vtkImageResampler(VTKPythonAlgorithmBase):
 
         self._TargetSize = 256**3
         self._IsAcquisitionData = False
+        self._DownsampleMethod = 'reslice'
 
     def SetIsAcquisitionData(self, value):
         '''
@@ -1850,6 +3004,25 @@ class vtkImageResampler(VTKPythonAlgorithmBase):
         ''' Get the total target size to downsample image to, in bytes.'''
         return self._TargetSize
 
+    def SetDownsampleMethod(self, value):
+        '''
+        Parameters
+        -----------
+        value (str), default='reslice':
+            How the image is downsampled.
+            'reslice' samples the image with vtkImageReslice.
+            'mean', 'max', 'min' or 'median' reduce each block of voxels which
+            is downsampled to a single voxel with that operation, see block_reduce.'''
+        if value not in DOWNSAMPLE_METHODS:
+            raise ValueError('Expected one of {}. Got {}'.format(DOWNSAMPLE_METHODS, value))
+        if value != self._DownsampleMethod:
+            self._DownsampleMethod = value
+            self.Modified()
+
+    def GetDownsampleMethod(self):
+        ''' Get how the image is downsampled.'''
+        return self._DownsampleMethod
+
     def GetBytesPerElement(self):
         ''' Get number of bytes per element'''
         if hasattr(self, '_BytesPerElement'):
@@ -1918,24 +3091,34 @@ class vtkImageResampler(VTKPythonAlgorithmBase):
             target_image_shape = (int(xy_axes_magnification * shape[0]), int(xy_axes_magnification * shape[1]),
                                   num_chunks)
 
-            resampler = vtk.vtkImageReslice()
-
             element_spacing = self.GetElementSpacing()
 
-            resampler.SetOutputSpacing(element_spacing[0] / xy_axes_magnification,
-                                       element_spacing[1] / xy_axes_magnification,
-                                       element_spacing[2] / z_axis_magnification)
+            if self.GetDownsampleMethod() == 'reslice':
+                resampler = vtk.vtkImageReslice()
+
+                resampler.SetOutputSpacing(element_spacing[0] / xy_axes_magnification,
+                                           element_spacing[1] / xy_axes_magnification,
+                                           element_spacing[2] / z_axis_magnification)
 
-            resampler.SetInputData(inData)
+                resampler.SetInputData(inData)
 
-            # change the extent of the resampled image
-            extent = (0, target_image_shape[0] - 1, 0, target_image_shape[1] - 1, 0, target_image_shape[2] - 1)
+                # change the extent of the resampled image
+                extent = (0, target_image_shape[0] - 1, 0, target_image_shape[1] - 1, 0, target_image_shape[2] - 1)
 
-            resampler.SetOutputExtent(extent)
-            resampler.Update()
+                resampler.SetOutputExtent(extent)
+                resampler.Update()
 
-            # resampled data:
-            resampled_image = resampler.GetOutput()
+                # resampled data:
+                resampled_image = resampler.GetOutput()
+            else:
+                array = Converter.vtk2numpy(inData)
+                block_edges = [
+                    start_sliceno_in_chunks + [shape[2]],
+                    calculate_block_edges(shape[1], target_image_shape[1]),
+                    calculate_block_edges(shape[0], target_image_shape[0])
+                ]
+                reduced = block_reduce(array, block_edges, self.GetDownsampleMethod())
+                resampled_image = Converter.numpy2vtkImage(_cast_reduced_array(reduced, array.dtype), deep=1)
             new_spacing = [
                 element_spacing[0] / xy_axes_magnification, element_spacing[1] / xy_axes_magnification,
                 element_spacing[2] / z_axis_magnification
@@ -1,3 +1,8 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import vtk
 from vtk.util.vtkAlgorithm import VTKPythonAlgorithmBase
 import h5py
@@ -5,6 +10,248 @@ import numpy as np
 from vtk.numpy_interface import dataset_adapter as dsa
 from vtk.util import numpy_support
 
+# Pool of open HDF5 files:
+
+
+class _PooledFile(object):
+    '''An open h5py.File in the HDF5FilePool, with the signature of the file on disk
+    when it was opened and the number of users currently reading it.'''
+
+    def __init__(self, file, signature):
+        self.file = file
+        self.signature = signature
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.retired = False
+
+
+def _file_signature(path):
+    '''Returns the modification time, size and inode of the file, which change if the file is rewritten'''
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class HDF5FilePool(object):
+    '''
+    Pool of open, read-only h5py.File objects, keyed by the path of the file.
+
+    Opening a HDF5 file can take tens of milliseconds on a parallel filesystem,
+    and closing it throws away the chunk cache of its datasets. The pool keeps files
+    open between reads, so that repeated reads of a file reuse the same handle and
+    chunk cache.
+
+    A file is closed once it has not been used for idle_timeout seconds, or when
+    it changes on disk (its modification time, size or inode differ from when it
+    was opened). A file must be released from the pool with Invalidate before
+    writing to it. An open file holds a lock on it, which stops other processes
+    writing to it, so by default files are closed as soon as they are no longer
+    being read, and a reader keeps the file open only for as long as it reads it
+    (see cilHDF5ResampleReader). Keeping files open between reads is opt in,
+    with a positive idle_timeout.
+
+    Parameters
+    -----------
+    rdcc_nbytes: int, default 64MB
+        size in bytes of the raw data chunk cache of each file.
+    rdcc_nslots: int, default 10007
+        number of slots in the hash table of the chunk cache of each file. This should
+        be a prime number, around 100 times the number of chunks which fit in the cache.
+    idle_timeout: float or None, default 0
+        time in seconds after which an unused file is closed. If 0, files are closed
+        as soon as they are no longer being read. If None, files are kept open until
+        they change or are invalidated.
+
+    Example
+    -------
+    pool = get_hdf5_file_pool()
+    with pool.Open('data.nxs') as f:
+        shape = f['entry1/tomo_entry/data/data'].shape
+    '''
+
+    def __init__(self, rdcc_nbytes=64 * 1024 * 1024, rdcc_nslots=10007, idle_timeout=0):
+        self._lock = threading.RLock()
+        self._files = {}
+        self._timer = None
+        self._pid = os.getpid()
+        self._rdcc_nbytes = rdcc_nbytes
+        self._rdcc_nslots = rdcc_nslots
+        self._idle_timeout = idle_timeout
+        self.ResetMetrics()
+
+    @contextmanager
+    def Open(self, filename):
+        '''Context manager which yields an open, read-only h5py.File of filename.
+        The file is opened if it is not already open in the pool.'''
+        entry = self._Acquire(filename)
+        try:
+            yield entry.file
+        finally:
+            self._Release(entry)
+
+    def Invalidate(self, filename):
+        '''Closes filename if it is open in the pool. If it is being read,
+        it is closed once the reads have finished.'''
+        path = os.path.realpath(filename)
+        with self._lock:
+            self._CheckProcess()
+            if path in self._files:
+                self._Discard(path)
+
+    def CloseAll(self):
+        '''Closes all of the files in the pool'''
+        with self._lock:
+            self._CheckProcess()
+            for path in list(self._files):
+                self._Discard(path)
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def EvictIdle(self):
+        '''Closes the files which have not been used for longer than the idle timeout'''
+        with self._lock:
+            self._CheckProcess()
+            self._EvictIdle()
+
+    def SetChunkCache(self, rdcc_nbytes, rdcc_nslots=None):
+        '''Sets the size in bytes, and optionally the number of hash table slots,
+        of the chunk cache of each file. Files which are already open are reopened
+        with the new settings the next time they are read.'''
+        if rdcc_nslots is None:
+            rdcc_nslots = self._rdcc_nslots
+        if rdcc_nbytes < 0 or rdcc_nslots < 1:
+            raise ValueError('Expected a non-negative chunk cache size and a positive number of slots, '
+                             'got {} and {}'.format(rdcc_nbytes, rdcc_nslots))
+        with self._lock:
+            if (rdcc_nbytes, rdcc_nslots) != (self._rdcc_nbytes, self._rdcc_nslots):
+                self._rdcc_nbytes = rdcc_nbytes
+                self._rdcc_nslots = rdcc_nslots
+                self.CloseAll()
+
+    def GetChunkCache(self):
+        '''Returns the size in bytes and the number of hash table slots of the chunk cache of each file'''
+        return self._rdcc_nbytes, self._rdcc_nslots
+
+    def SetIdleTimeout(self, seconds):
+        '''Sets the time in seconds after which an unused file is closed. If 0, files are closed
+        as soon as they are no longer being read. If None, files are kept open until they
+        change or are invalidated.'''
+        if seconds is not None and seconds < 0:
+            raise ValueError('Expected a non-negative idle timeout, got {}'.format(seconds))
+        with self._lock:
+            self._idle_timeout = seconds
+            self._EvictIdle()
+            self._ScheduleEviction()
+
+    def GetIdleTimeout(self):
+        '''Returns the time in seconds after which an unused file is closed'''
+        return self._idle_timeout
+
+    def GetNumberOfOpenFiles(self):
+        '''Returns the number of files open in the pool'''
+        with self._lock:
+            self._CheckProcess()
+            return len(self._files)
+
+    def GetMetrics(self):
+        '''
+        Returns a dictionary of counts since the metrics were last reset:
+
+        opens: number of times a file was opened
+        hits: number of reads which reused a file which was already open
+        invalidations: number of files closed because they changed on disk
+        evictions: number of files closed because they were idle
+        open_files: number of files which are currently open
+        '''
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['open_files'] = self.GetNumberOfOpenFiles()
+            return metrics
+
+    def ResetMetrics(self):
+        '''Sets the counts returned by GetMetrics to 0'''
+        self._metrics = {'opens': 0, 'hits': 0, 'invalidations': 0, 'evictions': 0}
+
+    def _Acquire(self, filename):
+        path = os.path.realpath(filename)
+        signature = _file_signature(path)
+        with self._lock:
+            self._CheckProcess()
+            self._EvictIdle()
+            entry = self._files.get(path)
+            if entry is not None and entry.signature != signature:
+                self._Discard(path)
+                self._metrics['invalidations'] += 1
+                entry = None
+            if entry is None:
+                entry = _PooledFile(h5py.File(path, 'r', rdcc_nbytes=self._rdcc_nbytes, rdcc_nslots=self._rdcc_nslots),
+                                    signature)
+                self._files[path] = entry
+                self._metrics['opens'] += 1
+            else:
+                self._metrics['hits'] += 1
+            entry.users += 1
+            return entry
+
+    def _Release(self, entry):
+        with self._lock:
+            entry.users -= 1
+            entry.last_used = time.monotonic()
+            if entry.retired and entry.users == 0:
+                entry.file.close()
+            if self._idle_timeout == 0:
+                self._EvictIdle()
+            else:
+                self._ScheduleEviction()
+
+    def _Discard(self, path):
+        '''Removes the file from the pool, and closes it unless it is being read'''
+        entry = self._files.pop(path)
+        entry.retired = True
+        if entry.users == 0:
+            entry.file.close()
+
+    def _EvictIdle(self):
+        if self._idle_timeout is None:
+            return
+        now = time.monotonic()
+        for path, entry in list(self._files.items()):
+            if entry.users == 0 and now - entry.last_used >= self._idle_timeout:
+                self._Discard(path)
+                self._metrics['evictions'] += 1
+
+    def _ScheduleEviction(self):
+        '''Starts a timer to close the idle files, if one is not already running'''
+        if not self._idle_timeout or self._timer is not None or not self._files:
+            return
+        self._timer = threading.Timer(self._idle_timeout, self._OnTimer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _OnTimer(self):
+        with self._lock:
+            self._timer = None
+            self._CheckProcess()
+            self._EvictIdle()
+            self._ScheduleEviction()
+
+    def _CheckProcess(self):
+        '''Forgets the files which were opened before this process was forked,
+        without closing them, as their handles belong to the parent process.'''
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._files = {}
+            self._timer = None
+
+
+_file_pool = HDF5FilePool()
+
+
+def get_hdf5_file_pool():
+    '''Returns the HDF5FilePool shared by the HDF5 readers of this process'''
+    return _file_pool
+
+
 # Methods for reading and writing HDF5 files:
 
 
@@ -19,6 +266,7 @@ def write_image_data_to_hdf5(filename, data, dataset_name, attributes={}):
         attributes: dict - attributes to assign to HDF5 dataset.
     '''
 
+    get_hdf5_file_pool().Invalidate(filename)
     with h5py.File(filename, "a") as f:
         # The function imgdata.GetPointData().GetScalars() returns a pointer to a
         # vtk<TYPE>Array where the data is stored as X-Y-Z.
@@ -56,6 +304,7 @@ class HDF5Reader(VTKPythonAlgorithmBase):
         self._DatasetName = None
         self._4DSliceIndex = 0
         self._4DIndex = 0
+        self._NumberOfSlicesRead = 0
 
     def RequestData(self, request, inInfo, outInfo):
         self._update_output_data(outInfo)
@@ -66,40 +315,47 @@ class HDF5Reader(VTKPythonAlgorithmBase):
             raise Exception("DataSetName must be set.")
         if self._FileName is None:
             raise Exception("FileName must be set.")
-        with h5py.File(self._FileName, 'r') as f:
+        with get_hdf5_file_pool().Open(self._FileName) as f:
             info = outInfo.GetInformationObject(0)
-            shape = np.shape(f[self._DatasetName])
-            # print("keys:", list(f.keys()))
-            # print(shape)
+            dset = f[self._DatasetName]
             ue = info.Get(vtk.vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT())
-            # Note that we flip the update extents because VTK is Fortran order
-            # whereas h5py reads in C order. When writing we pretend that the
-            # data was C order so we have to flip the extents/dimensions.
-            if len(shape) == 3:
-                data = f[self._DatasetName][ue[4]:ue[5] + 1, ue[2]:ue[3] + 1, ue[0]:ue[1] + 1]
-            elif len(shape) == 4:
-                if self._4DIndex == 0:
-                    data = f[self._DatasetName][self._4DSliceIndex, ue[4]:ue[5] + 1, ue[2]:ue[3] + 1, ue[0]:ue[1] + 1]
-                elif self._4DIndex == 1:
-                    data = f[self._DatasetName][ue[4]:ue[5] + 1, self._4DSliceIndex, ue[2]:ue[3] + 1, ue[0]:ue[1] + 1]
-                elif self._4DIndex == 2:
-                    data = f[self._DatasetName][ue[4]:ue[5] + 1, ue[2]:ue[3] + 1, self._4DSliceIndex, ue[0]:ue[1] + 1]
-                elif self._4DIndex == 3:
-                    data = f[self._DatasetName][ue[4]:ue[5] + 1, ue[2]:ue[3] + 1, ue[0]:ue[1] + 1, self._4DSliceIndex]
-            else:
-                raise Exception("Currently only 3D and 4D datasets are supported.")
-            # print("attributes: ", f.attrs.items())
-            output = dsa.WrapDataObject(vtk.vtkImageData.GetData(outInfo))
-            output.SetExtent(ue)
-            output.PointData.append(data.ravel(), self._DatasetName)
-            output.PointData.SetActiveScalars(self._DatasetName)
-            return output
+            selection = self._GetSelection(dset.shape, ue)
+            # read straight into a new array, which VTK wraps without copying:
+            data = np.empty((ue[5] - ue[4] + 1, ue[3] - ue[2] + 1, ue[1] - ue[0] + 1), dtype=dset.dtype)
+            dset.read_direct(data, source_sel=selection)
+            self._NumberOfSlicesRead += data.shape[0]
+        return self._SetOutputData(outInfo, ue, data)
+
+    def _GetSelection(self, shape, ue):
+        '''returns the selection of the dataset of the given shape which holds the update extent ue'''
+        # Note that we flip the update extents because VTK is Fortran order
+        # whereas h5py reads in C order. When writing we pretend that the
+        # data was C order so we have to flip the extents/dimensions.
+        selection = [slice(ue[4], ue[5] + 1), slice(ue[2], ue[3] + 1), slice(ue[0], ue[1] + 1)]
+        if len(shape) == 4:
+            selection.insert(self._4DIndex, self._4DSliceIndex)
+        elif len(shape) != 3:
+            raise Exception("Currently only 3D and 4D datasets are supported.")
+        return tuple(selection)
+
+    def _SetOutputData(self, outInfo, ue, data):
+        '''sets the C-contiguous array data, with the shape of the update extent ue in numpy
+        order, as the scalars of the output. The output shares its memory with data.'''
+        output = dsa.WrapDataObject(vtk.vtkImageData.GetData(outInfo))
+        output.SetExtent(ue)
+        output.PointData.append(data.reshape(-1), self._DatasetName)
+        output.PointData.SetActiveScalars(self._DatasetName)
+        return output
+
+    def GetNumberOfSlicesRead(self):
+        '''Returns the number of z slices this reader has read from the file'''
+        return self._NumberOfSlicesRead
 
     def SetFileName(self, fname):
         if fname != self._FileName:
             self.Modified()
             if self._DatasetName is not None:
-                with h5py.File(fname, 'r') as f:
+                with get_hdf5_file_pool().Open(fname) as f:
                     if not (self._DatasetName in f):
                         raise Exception("No dataset named {} exists in {}.".format(self._DatasetName, fname))
             self._FileName = fname
@@ -111,7 +367,7 @@ class HDF5Reader(VTKPythonAlgorithmBase):
         if lname != self._DatasetName:
             self.Modified()
             if self._FileName is not None:
-                with h5py.File(self._FileName, 'r') as f:
+                with get_hdf5_file_pool().Open(self._FileName) as f:
                     if not (lname in f):
                         raise Exception("No dataset named {} exists in {}.".format(lname, self._FileName))
             self._DatasetName = lname
@@ -136,7 +392,7 @@ class HDF5Reader(VTKPythonAlgorithmBase):
     def GetDimensions(self):
         if self._FileName is None:
             raise Exception("FileName must be set.")
-        with h5py.File(self._FileName, 'r') as f:
+        with get_hdf5_file_pool().Open(self._FileName) as f:
             # Note that we flip the shape because VTK is Fortran order
             # whereas h5py reads in C order. When writing we pretend that the
             # data was C order so we have to flip the extents/dimensions.
@@ -147,7 +403,7 @@ class HDF5Reader(VTKPythonAlgorithmBase):
     def GetDataSetAttributes(self):
         if self._FileName is None:
             raise Exception("FileName must be set.")
-        with h5py.File(self._FileName, 'r') as f:
+        with get_hdf5_file_pool().Open(self._FileName) as f:
             if self._DatasetName is None:
                 raise Exception("DataSetName must be set.")
             return dict(f[self._DatasetName].attrs)
@@ -161,7 +417,7 @@ class HDF5Reader(VTKPythonAlgorithmBase):
     def GetDataType(self):
         if self._FileName is None:
             raise Exception("FileName must be set.")
-        with h5py.File(self._FileName, 'r') as f:
+        with get_hdf5_file_pool().Open(self._FileName) as f:
             data_type = f.get(self._DatasetName).dtype
             return data_type
 
@@ -173,6 +429,102 @@ class HDF5Reader(VTKPythonAlgorithmBase):
         return 1
 
 
+class HDF5ChunkAlignedReader(HDF5Reader):
+    '''
+    HDF5Reader for reading a 3D dataset in consecutive slabs along z, as the
+    resample readers do.
+
+    Instead of reading just the update extent, it reads whole rows of the HDF5
+    chunks of the dataset along z, into a buffer which is allocated once and
+    reused. Following update extents which lie in the rows already read are
+    served from the buffer. So each chunk is read, and decompressed, only once
+    even when the slabs don't line up with the chunk grid. Contiguous datasets,
+    4D datasets and rows larger than the max buffer size are read like HDF5Reader.
+
+    The output shares its memory with the buffer, so it is only valid until
+    the next update.
+    '''
+
+    def __init__(self):
+        super(HDF5ChunkAlignedReader, self).__init__()
+        self._MaxBufferSize = 1024**3
+        self._Buffer = None
+        self._Slab = None
+        self._SlabKey = None
+        self._SlabZExtent = None
+
+    def SetMaxBufferSize(self, value):
+        '''
+        Parameters
+        -----------
+        value (int), default=1024**3:
+            Maximum size of the buffer, in bytes. If the rows of chunks holding
+            an update extent are larger than this, only the update extent is read.'''
+        if not isinstance(value, int):
+            raise ValueError('Expected an integer. Got {}'.format(type(value)))
+        if value != self._MaxBufferSize:
+            self._MaxBufferSize = value
+            self.Modified()
+
+    def GetMaxBufferSize(self):
+        '''Get the maximum size of the buffer, in bytes'''
+        return self._MaxBufferSize
+
+    def _update_output_data(self, outInfo):
+        if self._DatasetName is None:
+            raise Exception("DataSetName must be set.")
+        if self._FileName is None:
+            raise Exception("FileName must be set.")
+        info = outInfo.GetInformationObject(0)
+        ue = info.Get(vtk.vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT())
+        with get_hdf5_file_pool().Open(self._FileName) as f:
+            dset = f[self._DatasetName]
+            if len(dset.shape) != 3:
+                return super(HDF5ChunkAlignedReader, self)._update_output_data(outInfo)
+            # the slab is only reused for the same x and y extent of the same file:
+            key = (os.path.realpath(self._FileName), self._DatasetName, tuple(ue[:4]), _file_signature(self._FileName))
+            if key != self._SlabKey or not self._SlabZExtent[0] <= ue[4] <= ue[5] <= self._SlabZExtent[1]:
+                self._ReadSlab(dset, ue, key)
+        start = ue[4] - self._SlabZExtent[0]
+        return self._SetOutputData(outInfo, ue, self._Slab[start:start + ue[5] - ue[4] + 1])
+
+    def _GetSlabZExtent(self, dset, ue):
+        '''returns the z extent of the rows of chunks of dset which hold the update extent ue'''
+        if dset.chunks is None:
+            return ue[4], ue[5]
+        chunk_depth = dset.chunks[0]
+        start = ue[4] // chunk_depth * chunk_depth
+        end = min((ue[5] // chunk_depth + 1) * chunk_depth, dset.shape[0]) - 1
+        slab_size = (end - start + 1) * (ue[3] - ue[2] + 1) * (ue[1] - ue[0] + 1) * dset.dtype.itemsize
+        if slab_size > self._MaxBufferSize:
+            return ue[4], ue[5]
+        return start, end
+
+    def _ReadSlab(self, dset, ue, key):
+        '''reads the rows of chunks of dset which hold the update extent ue into the buffer.
+        Rows at the end of the previous slab which are also in this one are moved
+        to the start of the buffer rather than read again.'''
+        start, end = self._GetSlabZExtent(dset, ue)
+        slab_shape = (end - start + 1, ue[3] - ue[2] + 1, ue[1] - ue[0] + 1)
+        size = slab_shape[0] * slab_shape[1] * slab_shape[2]
+        buffer = self._Buffer
+        if buffer is None or buffer.dtype != dset.dtype or buffer.size < size:
+            buffer = np.empty(size, dtype=dset.dtype)
+        slab = buffer[:size].reshape(slab_shape)
+        read_start = start
+        if key == self._SlabKey and self._SlabZExtent[0] <= start <= self._SlabZExtent[1]:
+            read_start = self._SlabZExtent[1] + 1
+            slab[:read_start - start] = self._Slab[start - self._SlabZExtent[0]:]
+        dset.read_direct(slab,
+                         source_sel=np.s_[read_start:end + 1, ue[2]:ue[3] + 1, ue[0]:ue[1] + 1],
+                         dest_sel=np.s_[read_start - start:])
+        self._NumberOfSlicesRead += end + 1 - read_start
+        self._Buffer = buffer
+        self._Slab = slab
+        self._SlabKey = key
+        self._SlabZExtent = (start, end)
+
+
 class HDF5SubsetReader(VTKPythonAlgorithmBase):
     '''Modifies a HDF5Reader to return a different extent from an HDF5 file
     
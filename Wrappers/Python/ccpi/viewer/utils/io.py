@@ -1,20 +1,25 @@
 import datetime
 import glob
+import hashlib
 import logging
 import os
 import re
+import threading
+import time
+from concurrent.futures import Future
 from functools import partial
 
 import h5py
 import numpy as np
 import vtk
 from ccpi.viewer.utils import Converter
-from ccpi.viewer.utils.conversion import (cilHDF5CroppedReader, cilHDF5ResampleReader, cilMetaImageCroppedReader,
-                                          cilMetaImageResampleReader, cilNumpyCroppedReader, cilNumpyResampleReader,
-                                          cilRawCroppedReader, cilRawResampleReader, cilTIFFCroppedReader,
-                                          cilTIFFResampleReader, vtkImageResampler)
+from ccpi.viewer.utils.conversion import (DOWNSAMPLE_METHODS, cilHDF5CroppedReader, cilHDF5ResampleReader,
+                                          cilMetaImageCroppedReader, cilMetaImageResampleReader, cilNumpyCroppedReader,
+                                          cilNumpyResampleReader, cilRawCroppedReader, cilRawResampleReader,
+                                          cilTIFFCroppedReader, cilTIFFResampleReader, vtkImageResampler)
 from ccpi.viewer.utils.error_handling import EndObserver, ErrorObserver
-from ccpi.viewer.utils.hdf5_io import HDF5Reader
+from ccpi.viewer.utils.hdf5_io import HDF5Reader, get_hdf5_file_pool
+from ccpi.viewer.utils.profiler import profile_algorithm, profile_phase
 #from ccpi.viewer.version import version
 from schema import Optional, Or, Schema, SchemaError
 from vtk.util import numpy_support
@@ -60,15 +65,98 @@ def SaveRenderToPNG(render_window, filename):
     writer.Write()
 
 
+def format_read_progress(progress):
+    '''
+    Formats the progress of a read, from ImageReader.GetReadProgress, as text to show the user,
+    e.g. '45% - 3 of 7 chunks - 210.5 MB/s - about 12 s left'
+    '''
+    text = ['{:.0f}%'.format(100 * progress['fraction'])]
+    if progress.get('num_chunks'):
+        text.append('{} of {} chunks'.format(progress['chunks_done'], progress['num_chunks']))
+    if progress.get('bytes_per_second') is not None:
+        text.append('{:.1f} MB/s'.format(progress['bytes_per_second'] / 1e6))
+    if progress.get('eta') is not None:
+        text.append('about {:.0f} s left'.format(progress['eta']))
+    return ' - '.join(text)
+
+
+class ImageReadCancelledError(Exception):
+    '''Raised when a read of an ImageReader is stopped with ImageReader.Cancel'''
+
+
+class ImageReadHandle(object):
+    '''
+    Future-like handle to an image being read in a background thread,
+    returned by ImageReader.ReadAsync.
+
+    Example
+    -------
+    handle = ImageReader(file_name='data.mha').ReadAsync()
+    while not handle.Done():
+        progress = handle.GetProgress()
+        print(progress['fraction'], progress['bytes_per_second'], progress['eta'])
+        time.sleep(1)
+    image = handle.Result()
+    '''
+
+    def __init__(self, image_reader, future):
+        self._ImageReader = image_reader
+        self._Future = future
+
+    def Cancel(self):
+        '''Asks the read to stop. The resample readers stop before reading the next
+        chunk, after which Result raises ImageReadCancelledError.
+
+        Returns
+        -------
+        False if the read had already finished, True otherwise'''
+        if self._Future.done():
+            return False
+        self._ImageReader.Cancel()
+        return True
+
+    def Cancelled(self):
+        '''Returns whether the read finished by being cancelled'''
+        return self._Future.done() and isinstance(self._Future.exception(), ImageReadCancelledError)
+
+    def Done(self):
+        '''Returns whether the read has finished, successfully or not'''
+        return self._Future.done()
+
+    def Result(self, timeout=None):
+        '''Waits up to timeout seconds (forever if None) for the read to finish, and returns the
+        vtkImageData read. Raises ImageReadCancelledError if the read was cancelled, the error
+        raised by the read if it failed, or concurrent.futures.TimeoutError on timeout.'''
+        return self._Future.result(timeout)
+
+    def Exception(self, timeout=None):
+        '''Waits up to timeout seconds for the read to finish, and returns the error
+        raised by the read, or None if it succeeded.'''
+        return self._Future.exception(timeout)
+
+    def AddDoneCallback(self, fn):
+        '''Calls fn(handle) once the read has finished, in the thread which read the
+        image, or straight away if it has already finished.'''
+        self._Future.add_done_callback(lambda _: fn(self))
+
+    def GetProgress(self):
+        '''Returns the progress of the read, see ImageReader.GetReadProgress'''
+        return self._ImageReader.GetReadProgress()
+
+    def GetImageReader(self):
+        '''Returns the ImageReader, which has the loaded and original image attributes once the read is done'''
+        return self._ImageReader
+
+
 class ImageReader(object):
     '''
     Generic reader for reading to vtkImageData
     Currently reads: HDF5, MetaImage, Numpy, Raw, TIFF stacks
     or vtk image data in memory.
-    Supports resampling OR cropping the dataset whilst
-    reading.
-    Currently doesn't support both cropping and resampling
-    If set both to true then it resamples and doesn't crop
+    Supports resampling and/or cropping the dataset on the z axis
+    whilst reading.
+    If set both to true then only the slices in the target z extent
+    are read, and these are resampled to the target size.
     '''
 
     def __init__(self,
@@ -81,7 +169,9 @@ class ImageReader(object):
                  resample_z=False,
                  raw_image_attrs=None,
                  hdf5_dataset_name="entry1/tomo_entry/data/data",
-                 log_file=None):
+                 log_file=None,
+                 downsample_method='reslice',
+                 pyramid_cache=None):
         '''
         Constructor
 
@@ -100,7 +190,8 @@ class ImageReader(object):
         target_size: int, default 512**3
             target size after downsampling
         target_z_extent: list [,], default None
-            desired extent after cropping on z axis
+            desired extent after cropping on z axis. If resample is also
+            True, this extent is resampled to the target size.
         resample_z: bool, default True
             whether to resample on the z axis. E.g. in the case we have
             acquisition data, the projections would be on the z axis, so
@@ -113,11 +204,20 @@ class ImageReader(object):
             Name of the hdf5 dataset to be read, if file format is hdf5
         log_file: str, optional, default None
             log verbose output to file of this name            
+        downsample_method: str, default 'reslice'
+            how to downsample when resampling: 'reslice' uses vtkImageReslice,
+            'mean', 'max', 'min' or 'median' reduce each block of voxels to a single voxel
+        pyramid_cache: ImagePyramidCache, default None
+            if set, resampled images are read from a multi-resolution pyramid of the file
+            in this cache, which is built the first time the file is read
         '''
         if file_name is None and vtk_image is None:
             raise Exception('Path to file (file_name) or vtk image (vtk_image) is required.')
 
         self._OriginalImageAttrs = {}
+        self._CurrentReader = None
+        self._CancelRequested = False
+        self._ReadStartTime = None
 
         self.SetFileName(file_name)
         self.SetVTKImage(vtk_image)
@@ -129,6 +229,8 @@ class ImageReader(object):
         self.SetHDF5DatasetName(hdf5_dataset_name)
         self.SetRawImageAttributes(raw_image_attrs)
         self.SetLogFileName(log_file)
+        self.SetDownsampleMethod(downsample_method)
+        self.SetPyramidCache(pyramid_cache)
 
     def SetFileName(self, file_name):
         '''
@@ -189,7 +291,8 @@ class ImageReader(object):
         Parameters
         ----------
         target_z_extent: list [,], default None
-            desired extent after cropping on z axis
+            desired extent after cropping on z axis. If resample is also
+            True, this extent is resampled to the target size.
             '''
         self._TargetZExtent = target_z_extent
 
@@ -204,6 +307,29 @@ class ImageReader(object):
         '''
         self._ResampleZ = resample_z
 
+    def SetDownsampleMethod(self, downsample_method):
+        '''
+        Parameters
+        ----------
+        downsample_method: str, default 'reslice'
+            how to downsample when resampling: 'reslice' uses vtkImageReslice,
+            'mean', 'max', 'min' or 'median' reduce each block of voxels to a single voxel
+        '''
+        if downsample_method not in DOWNSAMPLE_METHODS:
+            raise ValueError('downsample_method must be one of {}. Got {}'.format(DOWNSAMPLE_METHODS,
+                                                                                  downsample_method))
+        self._DownsampleMethod = downsample_method
+
+    def SetPyramidCache(self, pyramid_cache):
+        '''
+        Parameters
+        ----------
+        pyramid_cache: ImagePyramidCache, default None
+            if set, resampled images are read from a multi-resolution pyramid of the file
+            in this cache, which is built the first time the file is read
+        '''
+        self._PyramidCache = pyramid_cache
+
     def SetHDF5DatasetName(self, hdf5_dataset_name):
         '''
         Parameters
@@ -232,18 +358,15 @@ class ImageReader(object):
 
     def Read(self, *args, **kwargs):
         ''' reads self._FileName
-            returns vtkImageData'''
+            returns vtkImageData
+
+            Raises ImageReadCancelledError if Cancel is called whilst reading.'''
         # identifies file type
         # uses appropriate reader based on file type and cropping or resampling
 
         if self._Crop:
             if self._TargetZExtent is None:
                 raise TypeError("If crop is set to True, target_z_extent must be set.")
-            if self._Resample:
-                self.logger.warning(
-                    "Both cropping and resampling is not yet implemented. Image will just be cropped and not resampled."
-                )
-                self._Resample = False
 
         self._LoadedImageAttrs = {'resampled': self._Resample, 'cropped': self._Crop}
 
@@ -251,9 +374,25 @@ class ImageReader(object):
 
         progress_callback = kwargs.get('progress_callback')
 
-        reader = self._GetReader(progress_callback)
-        reader.Update()
-        data = reader.GetOutput()
+        self._ReadStartTime = time.perf_counter()
+        self._CurrentReader = None
+        try:
+            self._RaiseIfCancelled()
+            if self._PyramidCache is not None and self._Resample and not self._Crop:
+                data = self._ReadFromPyramidCache(progress_callback)
+                if data is not None:
+                    return data
+
+            reader = self._GetReader(progress_callback)
+            self._SetCurrentReader(reader)
+            with profile_phase('ImageReader.Read', file_name=str(self._FileName)):
+                reader.Update()
+            # readers which can't be stopped part way through are cancelled once they finish:
+            if not hasattr(reader, 'GetReadAborted') or reader.GetReadAborted():
+                self._RaiseIfCancelled()
+            data = reader.GetOutput()
+        finally:
+            self._CancelRequested = False
 
         self._UpdateLoadedImageAttrs(reader, data)
 
@@ -261,9 +400,227 @@ class ImageReader(object):
 
         return data
 
+    def ReadAsync(self, progress_callback=None):
+        '''
+        Starts reading self._FileName in a background thread, like Read.
+
+        Parameters
+        ----------
+        progress_callback: object with an emit method, default None
+            called with the progress of the read, as a percentage, see Read
+
+        Returns
+        -------
+        an ImageReadHandle, which returns the vtkImageData once the read is done,
+        and can cancel the read and report its progress
+        '''
+        self._CurrentReader = None
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def read():
+            try:
+                future.set_result(self.Read(progress_callback=progress_callback))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=read, daemon=True).start()
+        return ImageReadHandle(self, future)
+
+    def Cancel(self):
+        '''
+        Asks the current, or next, read to stop. The resample readers check this between
+        chunks, so that a read can be stopped part way through. Read then raises
+        ImageReadCancelledError and ReadSlices stops yielding slices.
+        This may be called from another thread than the one reading.
+        '''
+        self._CancelRequested = True
+        reader = self._CurrentReader
+        if reader is not None and hasattr(reader, 'SetAbortRead'):
+            reader.SetAbortRead(True)
+
+    def GetReadProgress(self):
+        '''
+        Returns the progress of the current, or last, read. This may be called
+        from another thread than the one reading.
+
+        Returns
+        -------
+        dict with:
+            'fraction': fraction of the read done, between 0 and 1
+            'chunks_done' and 'num_chunks': number of chunks of the file read, and to read in total.
+                These are None if the reader doesn't read the file in chunks.
+            'bytes_read': number of bytes of the (uncompressed) image read, or None if not known
+            'bytes_per_second': rate the image has been read at, or None if not known
+            'elapsed': seconds since the read started
+            'eta': estimated seconds until the read is done, or None if not known
+        '''
+        progress = {
+            'fraction': 0.,
+            'chunks_done': None,
+            'num_chunks': None,
+            'bytes_read': None,
+            'bytes_per_second': None,
+            'elapsed': 0.,
+            'eta': None
+        }
+        if self._ReadStartTime is None:
+            return progress
+        elapsed = time.perf_counter() - self._ReadStartTime
+        progress['elapsed'] = elapsed
+        reader = self._CurrentReader
+        if reader is None:
+            return progress
+        progress['fraction'] = reader.GetProgress()
+        if hasattr(reader, 'GetReadProgress'):
+            progress.update(reader.GetReadProgress())
+            if progress['num_chunks']:
+                progress['fraction'] = progress['chunks_done'] / progress['num_chunks']
+            if elapsed > 0:
+                progress['bytes_per_second'] = progress['bytes_read'] / elapsed
+        if progress['fraction'] > 0:
+            progress['eta'] = elapsed * (1 - progress['fraction']) / progress['fraction']
+        return progress
+
+    def _SetCurrentReader(self, reader):
+        '''sets the reader whose progress is reported, stopping it straight away if
+        Cancel has already been called'''
+        self._CurrentReader = reader
+        if self._CancelRequested and hasattr(reader, 'SetAbortRead'):
+            reader.SetAbortRead(True)
+
+    def _RaiseIfCancelled(self):
+        '''raises ImageReadCancelledError if Cancel has been called during this read'''
+        if self._CancelRequested:
+            self.logger.info("reading was cancelled: {}".format(self._FileName))
+            raise ImageReadCancelledError('Reading {} was cancelled.'.format(self._FileName))
+
+    def ReadSlices(self, progress_callback=None):
+        '''
+        Reads self._FileName resampled to the target size, one z slice at a time,
+        so that only one chunk of the file is in memory at once.
+        If crop is set, only the target z extent is read. Reading from memory
+        and the pyramid cache are not supported. If Cancel is called, no more
+        slices are yielded and the iterator raises ImageReadCancelledError.
+
+        Returns
+        -------
+        the shape (z, y, x) of the resampled image, and an iterator of the index and
+        2D numpy array (y, x) of each of its z slices. The original and loaded image
+        attributes are set before this returns.
+        '''
+        if self._Crop and self._TargetZExtent is None:
+            raise TypeError("If crop is set to True, target_z_extent must be set.")
+        if self._FileName is None:
+            raise NotImplementedError("Reading slices is not implemented for reading VTK images from memory.")
+
+        self._LoadedImageAttrs = {'resampled': self._Resample, 'cropped': self._Crop}
+        self.logger.info("reading slices of: {}".format(self._FileName))
+
+        self._ReadStartTime = time.perf_counter()
+        self._CurrentReader = None
+        reader = self._GetReader(progress_callback, use_cropped_reader=False)
+        self._SetCurrentReader(reader)
+        info = reader.GetResampledImageInfo()
+        self._LoadedImageAttrs['resampled'] = info['resampled']
+        self._LoadedImageAttrs['spacing'] = info['spacing']
+        self._LoadedImageAttrs['origin'] = info['origin']
+        if self._Resample:
+            self._LoadedImageAttrs['resample_z'] = self._ResampleZ
+            self._LoadedImageAttrs['downsample_method'] = self._DownsampleMethod
+        self._UpdateOriginalImageAttrs(reader)
+
+        return tuple(info['shape'][::-1]), self._StreamSlices(reader)
+
+    def _StreamSlices(self, reader):
+        '''yields the slices streamed by the resample reader, raising ImageReadCancelledError
+        if the stream was stopped by Cancel'''
+        try:
+            yield from reader.StreamResampledSlices()
+            if reader.GetReadAborted():
+                self._RaiseIfCancelled()
+        finally:
+            self._CancelRequested = False
+
     def GetOriginalImageAttrs(self):
         return self._OriginalImageAttrs
 
+    def _GetPyramidCacheKey(self):
+        '''returns the settings, other than the file name, which change how the file is read,
+        including the downsample method, which the levels of the pyramid are built with'''
+        key = {'resample_z': self._ResampleZ, 'downsample_method': self._DownsampleMethod}
+        file_extension = os.path.splitext(self._FileName)[1]
+        if file_extension in ['.nxs', '.h5', '.hdf5']:
+            key['dataset_name'] = self._HDF5DatasetName
+        elif file_extension in ['.raw']:
+            # the attrs are normalised, as e.g. the shape is set as a tuple, but
+            # is updated to an array once the image has been read:
+            attrs = self._OriginalImageAttrs
+            if attrs.get('shape') is not None:
+                key['shape'] = tuple(int(s) for s in attrs['shape'])
+            for attr in ['is_fortran', 'is_big_endian']:
+                if attrs.get(attr) is not None:
+                    key[attr] = bool(attrs[attr])
+            if attrs.get('typecode') is not None:
+                key['typecode'] = str(np.dtype(attrs['typecode']))
+        return repr(sorted((k, str(v)) for k, v in key.items()))
+
+    def _ReadFromPyramidCache(self, progress_callback=None):
+        '''
+        Reads the image resampled to the target size from its pyramid in self._PyramidCache,
+        building the pyramid first if it isn't in the cache or it is out of date. The pyramid
+        is built with the downsample method of this reader, and its build can be cancelled
+        and reports its progress like any other read.
+        Returns None if the image can't be read from the pyramid, in which case it should be read
+        from the file, e.g. when it doesn't need to be resampled.
+        '''
+        if not isinstance(self._FileName, str):
+            self.logger.info("Pyramid cache is not used for lists of files.")
+            return None
+
+        cache = self._PyramidCache
+        key = self._GetPyramidCacheKey()
+
+        if not cache.IsUpToDate(self._FileName, key):
+            reader = self._GetReader(progress_callback)
+            reader.ReadDataSetInfo()
+            shape = reader.GetStoredArrayShape()
+            total_size = shape[0] * shape[1] * shape[2] * reader.GetBytesPerElement()
+            if total_size <= self._TargetSize:
+                return None
+            self.logger.info("building pyramid of: {}".format(self._FileName))
+            first_level, target_size = cache.GetFirstLevel(total_size, self._ResampleZ)
+            reader.SetTargetSize(target_size)
+            self._SetCurrentReader(reader)
+            reader.Update()
+            if reader.GetReadAborted():
+                self._RaiseIfCancelled()
+            self._UpdateOriginalImageAttrs(reader)
+            cache.Build(self._FileName, reader.GetOutput(), first_level, self._OriginalImageAttrs, key, self._ResampleZ,
+                        self._DownsampleMethod)
+
+        result = cache.Read(self._FileName, self._TargetSize, key, self._ResampleZ, self._DownsampleMethod)
+        if result is None:
+            return None
+        self.logger.info("read from pyramid cache: {}".format(cache.GetCacheFileName(self._FileName, key)))
+        data, original_image_attrs, level_attrs = result
+
+        # the attributes are read back from HDF5 as numpy values, which the readers' setters don't accept:
+        self._OriginalImageAttrs.update({
+            key: value.item() if isinstance(value, np.generic) else value
+            for key, value in original_image_attrs.items()
+        })
+        self._LoadedImageAttrs = {
+            'resampled': True,
+            'cropped': False,
+            'spacing': data.GetSpacing(),
+            'origin': data.GetOrigin(),
+            'resample_z': self._ResampleZ,
+            'downsample_method': self._DownsampleMethod,
+            'pyramid_level': int(level_attrs['pyramid_level'])
+        }
+        return data
+
     def GetLoadedImageAttrs(self):
         return self._LoadedImageAttrs
 
@@ -283,7 +640,7 @@ class ImageReader(object):
         raw_attrs_schema.validate(raw_attrs)
         return raw_attrs
 
-    def _GetReader(self, progress_callback=None):
+    def _GetReader(self, progress_callback=None, use_cropped_reader=None):
         '''
         Returns an appropriate reader for the image file provided.
         If a filename is given, the appropriate reader is decided by
@@ -296,34 +653,40 @@ class ImageReader(object):
         No actual check of the file format is performed.
 
         If a vtk image is given, the reader is a vtkImageResampler
+
+        A cropped reader is used if crop is set and resample is not, unless
+        use_cropped_reader is given. Otherwise a resample reader is used, which
+        only reads the target z extent if crop is set.
         '''
+        if use_cropped_reader is None:
+            use_cropped_reader = self._Crop and not self._Resample
         if self._FileName is None:
             reader = self._GetVTKImageResampler()
         else:
             if isinstance(self._FileName, list):
                 # When self._FileName is set as a list, we already have checked that
                 # the files are all tiffs.
-                reader = self._GetTiffImageReader()
+                reader = self._GetTiffImageReader(use_cropped_reader)
                 reader.SetFileName(self._FileName)
                 file_extension = '.tiff'
             elif os.path.isfile(self._FileName):
                 file_extension = os.path.splitext(self._FileName)[1]
 
                 if file_extension in ['.mha', '.mhd']:
-                    reader = self._GetMetaImageReader()
+                    reader = self._GetMetaImageReader(use_cropped_reader)
 
                 elif file_extension in ['.npy']:
-                    reader = self._GetNumpyImageReader()
+                    reader = self._GetNumpyImageReader(use_cropped_reader)
 
                 elif file_extension in ['.raw']:
-                    reader = self._GetRawImageReader()
+                    reader = self._GetRawImageReader(use_cropped_reader)
 
                 elif file_extension in ['.nxs', '.h5', '.hdf5']:
-                    reader = self._GetHDF5ImageReader()
+                    reader = self._GetHDF5ImageReader(use_cropped_reader)
                     self._OriginalImageAttrs['dataset_name'] = self._HDF5DatasetName
 
                 elif file_extension in ['.tif', '.tiff']:
-                    reader = self._GetTiffImageReader()
+                    reader = self._GetTiffImageReader(use_cropped_reader)
                     reader.SetFileName(self._FileName)
 
                 else:
@@ -339,7 +702,7 @@ class ImageReader(object):
                 if len(image_files) == 0:
                     raise Exception('No tiff files were found in: {}'.format(self._FileName))
                 image_files.sort(key=self.__natural_keys)
-                reader = self._GetTiffImageReader()
+                reader = self._GetTiffImageReader(use_cropped_reader)
                 reader.SetFileName(image_files)
                 file_extension = '.tiff'
 
@@ -350,15 +713,16 @@ class ImageReader(object):
         # setting SetIsAcquisitionData determines whether to crop on Z:
         reader.SetIsAcquisitionData(not self._ResampleZ)
 
-        if not self._Crop:
+        if not use_cropped_reader:
             if self._Resample:
                 target_size = self._TargetSize
             else:
                 # forced use of resample reader in the case that we
-                # don't want to crop or resample,
+                # don't want to resample,
                 # but the large target size means we don't resample
                 target_size = 1e12
             reader.SetTargetSize(int(target_size))
+            reader.SetDownsampleMethod(self._DownsampleMethod)
 
         # Add observers:
         reader.AddObserver(vtk.vtkCommand.ProgressEvent,
@@ -371,6 +735,9 @@ class ImageReader(object):
         # Could add end observer so that we don't continue to do anything
         # else if an error does occur in reader?
 
+        # times the reader, if a profiler is set with set_pipeline_profiler:
+        profile_algorithm(reader)
+
         return reader
 
     def __natural_keys(self, text):
@@ -387,32 +754,36 @@ class ImageReader(object):
         '''Used in the sorting of tiff files retrieved with glob'''
         return int(text) if text.isdigit() else text
 
-    def _GetMetaImageReader(self, progress_callback=None):
-        if self._Crop:
+    def _GetMetaImageReader(self, use_cropped_reader):
+        if use_cropped_reader:
             reader = cilMetaImageCroppedReader()
-            reader.SetTargetZExtent(tuple(self._TargetZExtent))
         else:
             reader = cilMetaImageResampleReader()
+        self._SetReaderTargetZExtent(reader)
         return reader
 
-    def _GetNumpyImageReader(self, progress_callback=None):
-        if self._Crop:
+    def _GetNumpyImageReader(self, use_cropped_reader):
+        if use_cropped_reader:
             reader = cilNumpyCroppedReader()
-            reader.SetTargetZExtent(tuple(self._TargetZExtent))
         else:
             reader = cilNumpyResampleReader()
-
+        self._SetReaderTargetZExtent(reader)
         return reader
 
-    def _GetTiffImageReader(self, progress_callback=None):
-        if self._Crop:
+    def _GetTiffImageReader(self, use_cropped_reader):
+        if use_cropped_reader:
             reader = cilTIFFCroppedReader()
-            reader.SetTargetZExtent(tuple(self._TargetZExtent))
         else:
             reader = cilTIFFResampleReader()
+        self._SetReaderTargetZExtent(reader)
         return reader
 
-    def _GetRawImageReader(self):
+    def _SetReaderTargetZExtent(self, reader):
+        '''sets the target z extent on the cropped or resample reader, if crop is set'''
+        if self._Crop:
+            reader.SetTargetZExtent(tuple(self._TargetZExtent))
+
+    def _GetRawImageReader(self, use_cropped_reader):
         if self._OriginalImageAttrs is None or 'shape' not in self._OriginalImageAttrs.keys():
             raise Exception("To read a raw image, raw_image_attrs must be set.")
 
@@ -421,11 +792,11 @@ class ImageReader(object):
         typecode = self._OriginalImageAttrs['typecode']
         shape = tuple(self._OriginalImageAttrs['shape'])
 
-        if self._Crop:
+        if use_cropped_reader:
             reader = cilRawCroppedReader()
-            reader.SetTargetZExtent(tuple(self._TargetZExtent))
         else:
             reader = cilRawResampleReader()
+        self._SetReaderTargetZExtent(reader)
 
         reader.SetBigEndian(isBigEndian)
         reader.SetIsFortran(isFortran)
@@ -434,13 +805,13 @@ class ImageReader(object):
 
         return reader
 
-    def _GetHDF5ImageReader(self):
-        if self._Crop:
+    def _GetHDF5ImageReader(self, use_cropped_reader):
+        if use_cropped_reader:
             reader = cilHDF5CroppedReader()
             reader.SetTargetExtent([0, -1, 0, -1, self._TargetZExtent[0], self._TargetZExtent[1]])
-
         else:
             reader = cilHDF5ResampleReader()
+            self._SetReaderTargetZExtent(reader)
 
         reader.SetDatasetName(self._HDF5DatasetName)
 
@@ -477,7 +848,10 @@ class ImageReader(object):
 
     def _UpdateLoadedImageAttrs(self, reader, data):
         # Make sure whether we did resample or not:
-        if self._Resample:
+        if self._Resample and self._Crop:
+            # only the target z extent was resampled:
+            self._LoadedImageAttrs['resampled'] = reader.GetResampledImageInfo()['resampled']
+        elif self._Resample:
             original_image_size = reader.GetStoredArrayShape()[0] * reader.GetStoredArrayShape(
             )[1] * reader.GetStoredArrayShape()[2]
             resampled_image_size = reader.GetTargetSize()
@@ -490,6 +864,7 @@ class ImageReader(object):
         self._LoadedImageAttrs['origin'] = data.GetOrigin()
         if self._Resample:
             self._LoadedImageAttrs['resample_z'] = self._ResampleZ
+            self._LoadedImageAttrs['downsample_method'] = self._DownsampleMethod
 
     def _UpdateOriginalImageAttrs(self, reader):
         self._OriginalImageAttrs['shape'] = reader.GetStoredArrayShape()
@@ -760,19 +1135,10 @@ class cilviewerHDF5Writer(ImageWriterInterface):
             if var is []:
                 raise Exception("child dataset(/s) and attribute(/s), are required.")
 
+        get_hdf5_file_pool().Invalidate(self._FileName)
         with h5py.File(self._FileName, 'w') as f:
 
-            # give the file some important attributes
-            f.attrs['file_name'] = self._FileName
-            #f.attrs['viewer_version'] = version
-            f.attrs['file_time'] = str(datetime.datetime.utcnow())
-            f.attrs['creator'] = np.bytes_('io.py')
-            f.attrs['HDF5_Version'] = h5py.version.hdf5_version
-            f.attrs['h5py_version'] = h5py.version.version
-
-            # create the NXentry group
-            nxentry = f.create_group('entry1/tomo_entry')
-            nxentry.attrs['NX_class'] = 'NXentry'
+            self._WriteFileAttributes(f)
 
             datasets = [self._OriginalDataset]
             datasets += self._ChildDatasets
@@ -803,30 +1169,7 @@ class cilviewerHDF5Writer(ImageWriterInterface):
                     if array is None:
                         dset = f.create_dataset(dataset_name, dataset_info['shape'])
                     else:
-                        if self._Chunking:
-                            if self._ChunkShape is None:
-                                # If Chunking has been selected but a shape has not,
-                                # by default use a slice as the chunk
-                                slice_shape = list(array.shape)
-                                slice_shape[0] = 1
-                                self._ChunkShape = tuple(slice_shape)
-                            if self._HDF5Compression is None or self._HDF5Compression[0] is None:
-                                dset = f.create_dataset(dataset_name, data=array, chunks=self._ChunkShape)
-                            elif self._HDF5Compression[0] == 'gzip':
-                                dset = f.create_dataset(dataset_name,
-                                                        data=array,
-                                                        chunks=self._ChunkShape,
-                                                        compression=self._HDF5Compression[0],
-                                                        compression_opts=self._HDF5Compression[1],
-                                                        shuffle=self._HDF5Compression[2])
-                            elif self._HDF5Compression[0] == 'lzf':
-                                dset = f.create_dataset(dataset_name,
-                                                        data=array,
-                                                        chunks=self._ChunkShape,
-                                                        compression=self._HDF5Compression[0],
-                                                        shuffle=self._HDF5Compression[2])
-                        else:
-                            dset = f.create_dataset(dataset_name, data=array)
+                        dset = f.create_dataset(dataset_name, data=array, **self._GetStorageOptions(array.shape))
 
                 except RuntimeError:
                     print("Unable to save image data to {0}."
@@ -838,6 +1181,123 @@ class cilviewerHDF5Writer(ImageWriterInterface):
                 for key, value in dataset_info.items():
                     dset.attrs[key] = value
 
+    def _WriteFileAttributes(self, f):
+        '''gives the file some important attributes, and creates the NXentry group'''
+        f.attrs['file_name'] = self._FileName
+        #f.attrs['viewer_version'] = version
+        f.attrs['file_time'] = str(datetime.datetime.utcnow())
+        f.attrs['creator'] = np.bytes_('io.py')
+        f.attrs['HDF5_Version'] = h5py.version.hdf5_version
+        f.attrs['h5py_version'] = h5py.version.version
+
+        # create the NXentry group
+        nxentry = f.create_group('entry1/tomo_entry')
+        nxentry.attrs['NX_class'] = 'NXentry'
+
+    def _GetStorageOptions(self, shape):
+        '''returns the chunking and compression keyword arguments of h5py create_dataset
+        for a dataset of the given shape (z, y, x)'''
+        if not self._Chunking:
+            return {}
+        chunk_shape = self._ChunkShape
+        if chunk_shape is None:
+            # If Chunking has been selected but a shape has not,
+            # by default use a slice of this dataset as the chunk
+            slice_shape = list(shape)
+            slice_shape[0] = 1
+            chunk_shape = tuple(slice_shape)
+        options = {'chunks': chunk_shape}
+        if self._HDF5Compression is None or self._HDF5Compression[0] is None:
+            return options
+        options['compression'] = self._HDF5Compression[0]
+        if self._HDF5Compression[0] == 'gzip':
+            options['compression_opts'] = self._HDF5Compression[1]
+        options['shuffle'] = self._HDF5Compression[2]
+        return options
+
+
+class cilviewerHDF5StreamWriter(cilviewerHDF5Writer):
+    '''
+    Writes the attributes of an original dataset, plus one resampled or cropped
+    'child' dataset, to HDF5 in the same layout as cilviewerHDF5Writer, but writes
+    the child dataset one z slice at a time, so that it never has to be in memory.
+    The child dataset is pre-created with the chunking and compression settings
+    when its first slice is written, as its type is that of the slices.
+
+    Example:
+    shape, slices = image_reader.ReadSlices()
+    writer = cilviewerHDF5StreamWriter()
+    writer.SetFileName('resampled_image.hdf5')
+    writer.SetOriginalDataset(None, image_reader.GetOriginalImageAttrs())
+    writer.SetHDF5Compression(['gzip', 4, True])
+    writer.Open(shape, image_reader.GetLoadedImageAttrs())
+    for index, array in slices:
+        writer.WriteSlice(index, array)
+    writer.Close()
+    '''
+
+    def __init__(self):
+        super(cilviewerHDF5StreamWriter, self).__init__()
+        self._File = None
+        self._Dataset = None
+        self._Shape = None
+        self._Attributes = None
+
+    def Open(self, shape, attributes):
+        '''
+        Creates the file and writes the attributes of the original dataset.
+
+        Parameters
+        ----------
+        shape: tuple
+            shape (z, y, x) of the child dataset
+        attributes: dict
+            attributes of the child dataset, see cilviewerHDF5Writer
+        '''
+        for var in [self._FileName, self._OriginalDatasetAttributes]:
+            if var is None:
+                raise Exception("file_name and the attributes of the original dataset are required.")
+        self._ValidateChildDatasetAttributes(None, attributes)
+
+        self._Shape = tuple(shape)
+        self._Attributes = attributes
+        get_hdf5_file_pool().Invalidate(self._FileName)
+        self._File = h5py.File(self._FileName, 'w')
+        self._WriteFileAttributes(self._File)
+        dset = self._File.create_dataset('entry1/tomo_entry/data/data', self._OriginalDatasetAttributes['shape'])
+        for key, value in self._OriginalDatasetAttributes.items():
+            dset.attrs[key] = value
+
+    def WriteSlice(self, index, array):
+        '''
+        Writes a z slice of the child dataset.
+
+        Parameters
+        ----------
+        index: int
+            index of the slice on the z axis
+        array: numpy.ndarray
+            2D array (y, x) of the slice
+        '''
+        if self._File is None:
+            raise Exception("Open must be called before writing slices.")
+        if self._Dataset is None:
+            self._Dataset = self._File.create_dataset('entry2/tomo_entry/data/data',
+                                                      shape=self._Shape,
+                                                      dtype=array.dtype,
+                                                      **self._GetStorageOptions(self._Shape))
+            self._Dataset.attrs['original_dataset'] = 'entry1/tomo_entry/data/data'
+            for key, value in self._Attributes.items():
+                self._Dataset.attrs[key] = value
+        self._Dataset[index] = array
+
+    def Close(self):
+        '''Closes the file, once all the slices have been written'''
+        if self._File is not None:
+            self._File.close()
+        self._File = None
+        self._Dataset = None
+
 
 class cilviewerHDF5Reader(HDF5Reader):
     '''
@@ -868,7 +1328,7 @@ class cilviewerHDF5Reader(HDF5Reader):
         '''
         dataset_name = 'entry{}/tomo_entry/data/data'.format(num)
         if self._FileName is not None:
-            with h5py.File(self._FileName, 'r') as f:
+            with get_hdf5_file_pool().Open(self._FileName) as f:
                 if not (dataset_name in f):
                     raise Exception("No dataset named {} exists in {}.".format(dataset_name, self._FileName))
         self._DatasetEntryNumber = num
@@ -903,7 +1363,7 @@ class cilviewerHDF5Reader(HDF5Reader):
 
     def RequestData(self, request, inInfo, outInfo):
         output = super(cilviewerHDF5Reader, self)._update_output_data(outInfo)
-        with h5py.File(self._FileName, 'r') as f:
+        with get_hdf5_file_pool().Open(self._FileName) as f:
             attrs = f[self._DatasetName].attrs
             # TODO check on the errors if these attributes haven't been found:
             output.SetOrigin(attrs['origin'])
@@ -930,3 +1390,342 @@ class cilviewerHDF5Reader(HDF5Reader):
         Returns a dictionary of the attributes of the dataset that is currently loaded.
         '''
         return self.GetDataSetAttributes()
+
+
+class ImagePyramidCache(object):
+    '''
+    Persistent cache of multi-resolution pyramids of image files, so that a large
+    dataset can be re-opened by ImageReader without streaming and resampling the whole file.
+
+    The pyramid of a file is stored in a sidecar HDF5 file in the cache directory,
+    with the layout written by cilviewerHDF5Writer:
+    entry1 contains the attributes of the original dataset, and
+    entry2, entry3, ... contain the levels of the pyramid, each downsampled
+    2 times more than the previous one on the x and y axes, and on the z axis
+    if resample_z is set. By default the levels are downsampled by block averaging.
+    The first level is the first one which is smaller than the max level size,
+    and levels are added until they are smaller than the min level size.
+
+    A request for a target size is served from the smallest level which is larger
+    than the target size, which is then resampled in memory to the target size.
+    If the target size is larger than the first level, the cache can't serve it.
+
+    A pyramid is rebuilt when the modification time or size of the file it was built
+    from changes. When the total size of the pyramids in the cache directory exceeds
+    the max cache size, the least recently used pyramids are deleted.
+
+    Example:
+    cache = ImagePyramidCache(cache_dir='pyramids', max_cache_size=10 * 1024**3)
+    reader = ImageReader(file_name='image.nxs', target_size=256**3, pyramid_cache=cache)
+    image = reader.Read()
+    '''
+
+    FILE_SUFFIX = '.pyramid.hdf5'
+
+    def __init__(self, cache_dir=None, max_cache_size=None, max_level_size=1024**3, min_level_size=1024**2):
+        '''
+        Constructor
+
+        Parameters
+        ----------
+        cache_dir: str, default None
+            directory to store the pyramids in. If None, ~/.cache/ccpi_viewer/pyramids is used.
+        max_cache_size: int, default None
+            maximum total size of the pyramids in the cache directory, in bytes.
+            If None, the size of the cache is not limited.
+        max_level_size: int, default 1024**3
+            maximum size of the first level of a pyramid, in bytes
+        min_level_size: int, default 1024**2
+            levels are added to a pyramid until they are smaller than this, in bytes
+        '''
+        self.SetCacheDirectory(cache_dir)
+        self.SetMaxCacheSize(max_cache_size)
+        self.SetMaxLevelSize(max_level_size)
+        self.SetMinLevelSize(min_level_size)
+
+    def SetCacheDirectory(self, cache_dir):
+        '''
+        Parameters
+        ----------
+        cache_dir: str, default None
+            directory to store the pyramids in. If None, ~/.cache/ccpi_viewer/pyramids is used.
+        '''
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'ccpi_viewer', 'pyramids')
+        self._CacheDirectory = cache_dir
+
+    def GetCacheDirectory(self):
+        return self._CacheDirectory
+
+    def SetMaxCacheSize(self, max_cache_size):
+        '''
+        Parameters
+        ----------
+        max_cache_size: int, default None
+            maximum total size of the pyramids in the cache directory, in bytes.
+            If None, the size of the cache is not limited.
+        '''
+        self._MaxCacheSize = max_cache_size
+
+    def GetMaxCacheSize(self):
+        return self._MaxCacheSize
+
+    def SetMaxLevelSize(self, max_level_size):
+        '''
+        Parameters
+        ----------
+        max_level_size: int, default 1024**3
+            maximum size of the first level of a pyramid, in bytes
+        '''
+        self._MaxLevelSize = max_level_size
+
+    def GetMaxLevelSize(self):
+        return self._MaxLevelSize
+
+    def SetMinLevelSize(self, min_level_size):
+        '''
+        Parameters
+        ----------
+        min_level_size: int, default 1024**2
+            levels are added to a pyramid until they are smaller than this, in bytes
+        '''
+        self._MinLevelSize = min_level_size
+
+    def GetMinLevelSize(self):
+        return self._MinLevelSize
+
+    def GetCacheFileName(self, file_name, key=''):
+        '''
+        Returns the name of the file the pyramid of file_name is stored in.
+
+        Parameters
+        ----------
+        file_name: str
+            name of the image file, or directory of TIFF files
+        key: str, default ''
+            anything else which changes how the file is read, e.g. the HDF5 dataset name
+        '''
+        digest = hashlib.sha1('{}|{}'.format(os.path.abspath(file_name), key).encode()).hexdigest()[:16]
+        basename = os.path.basename(os.path.normpath(file_name))
+        return os.path.join(self._CacheDirectory, '{}_{}{}'.format(basename, digest, self.FILE_SUFFIX))
+
+    @staticmethod
+    def _GetSourceStats(file_name):
+        '''returns the modification time, in ns, and size of a file,
+        or the latest modification time and total size of the files in a directory'''
+        if os.path.isdir(file_name):
+            stats = [os.stat(entry.path) for entry in os.scandir(file_name) if entry.is_file()]
+            return max([s.st_mtime_ns for s in stats], default=0), sum(s.st_size for s in stats)
+        stat = os.stat(file_name)
+        return stat.st_mtime_ns, stat.st_size
+
+    def IsUpToDate(self, file_name, key=''):
+        '''
+        Returns whether there is a pyramid of file_name in the cache, which
+        was built from a file with the current modification time and size.
+        '''
+        cache_file = self.GetCacheFileName(file_name, key)
+        if not os.path.isfile(cache_file):
+            return False
+        mtime, size = self._GetSourceStats(file_name)
+        try:
+            with get_hdf5_file_pool().Open(cache_file) as f:
+                return (f.attrs.get('source_mtime_ns') == mtime and f.attrs.get('source_size') == size
+                        and f.attrs.get('cache_key') == key)
+        except OSError:
+            # e.g. a file which was not fully written
+            return False
+
+    def GetFirstLevel(self, total_size, resample_z=True):
+        '''
+        Returns the number of the first level of a pyramid of an image of total_size bytes,
+        and the target size to resample the image to, to build this level.
+
+        Level n is downsampled 2**n times on the x and y axes,
+        and on the z axis if resample_z is set.
+        '''
+        factor = 8 if resample_z else 4
+        level = 1
+        while total_size / factor**level > self._MaxLevelSize:
+            level += 1
+        # the resample readers downsample each axis by (target_size / total_size)**(1/3)
+        # (or **(1/2) if not resampling z), rounding the shape down, so we add one to
+        # make sure the shape isn't reduced by more than 2**level:
+        return level, int(total_size // factor**level) + 1
+
+    def Build(self,
+              file_name,
+              first_level_image,
+              first_level,
+              original_image_attrs,
+              key='',
+              resample_z=True,
+              downsample_method='mean'):
+        '''
+        Builds the pyramid of file_name from its first level, and writes it to the cache.
+
+        Parameters
+        ----------
+        file_name: str
+            name of the image file, or directory of TIFF files
+        first_level_image: vtkImageData
+            the image downsampled to the first level, see GetFirstLevel
+        first_level: int
+            the number of the first level
+        original_image_attrs: dict
+            attributes of the original image, as returned by ImageReader.GetOriginalImageAttrs
+        key: str, default ''
+            anything else which changes how the file is read, e.g. the HDF5 dataset name
+        resample_z: bool, default True
+            whether the levels are downsampled on the z axis
+        downsample_method: str, default 'mean'
+            how the levels are downsampled, see vtkImageResampler.SetDownsampleMethod.
+            This should be the method the first level was downsampled with.
+        '''
+        if not os.path.isdir(self._CacheDirectory):
+            os.makedirs(self._CacheDirectory)
+        cache_file = self.GetCacheFileName(file_name, key)
+        mtime, size = self._GetSourceStats(file_name)
+
+        original_image_attrs = {k: v for k, v in original_image_attrs.items() if v is not None}
+        original_image_attrs['file_name'] = str(file_name)
+        original_image_attrs['shape'] = list(original_image_attrs['shape'])
+
+        writer = cilviewerHDF5Writer()
+        # write to a temporary file, so that a pyramid is never read before it has been fully written:
+        writer.SetFileName(cache_file + '.tmp')
+        writer.SetOriginalDataset(None, original_image_attrs)
+
+        image = first_level_image
+        level = first_level
+        factor = 8 if resample_z else 4
+        while True:
+            writer.AddChildDataset(
+                image, {
+                    'resampled': True,
+                    'cropped': False,
+                    'spacing': list(image.GetSpacing()),
+                    'origin': list(image.GetOrigin()),
+                    'resample_z': resample_z,
+                    'downsample_method': downsample_method,
+                    'pyramid_level': level
+                })
+            dims = image.GetDimensions()
+            level_size = image.GetPointData().GetScalars().GetDataTypeSize() * dims[0] * dims[1] * dims[2]
+            if level_size <= self._MinLevelSize or dims[0] < 2 or dims[1] < 2:
+                break
+            image = self._Resample(image, level_size // factor + 1, resample_z, downsample_method)
+            level += 1
+
+        writer.Write()
+        with h5py.File(cache_file + '.tmp', 'a') as f:
+            f.attrs['source_file_name'] = str(file_name)
+            f.attrs['source_mtime_ns'] = mtime
+            f.attrs['source_size'] = size
+            f.attrs['cache_key'] = key
+        os.replace(cache_file + '.tmp', cache_file)
+
+        self.Evict(keep=[cache_file])
+
+    def GetLevels(self, file_name, key=''):
+        '''
+        Returns the entry number in the pyramid file, pyramid level and size in bytes
+        of each level of the pyramid of file_name, from the largest to the smallest.
+        '''
+        levels = []
+        with get_hdf5_file_pool().Open(self.GetCacheFileName(file_name, key)) as f:
+            entry_number = 2
+            while 'entry{}/tomo_entry/data/data'.format(entry_number) in f:
+                dset = f['entry{}/tomo_entry/data/data'.format(entry_number)]
+                levels.append((entry_number, int(dset.attrs['pyramid_level']), dset.size * dset.dtype.itemsize))
+                entry_number += 1
+        return levels
+
+    def Read(self, file_name, target_size, key='', resample_z=True, downsample_method='reslice'):
+        '''
+        Reads file_name resampled to target_size from its pyramid in the cache.
+
+        Parameters
+        ----------
+        file_name: str
+            name of the image file, or directory of TIFF files
+        target_size: int
+            target size to resample the image to, in bytes
+        key: str, default ''
+            anything else which changes how the file is read, e.g. the HDF5 dataset name
+        resample_z: bool, default True
+            whether to resample on the z axis, when resampling the level to the target size
+        downsample_method: str, default 'reslice'
+            how to downsample the level to the target size, see vtkImageResampler.SetDownsampleMethod
+
+        Returns
+        -------
+        None if the pyramid can't serve the target size, otherwise:
+        the resampled image (vtkImageData), the attributes of the original image,
+        and the attributes of the level it was read from
+        '''
+        levels = self.GetLevels(file_name, key)
+        if len(levels) == 0 or target_size > levels[0][2]:
+            return None
+        # the smallest level which is at least as large as the target size:
+        entry_number, level, level_size = [lvl for lvl in levels if lvl[2] >= target_size][-1]
+
+        cache_file = self.GetCacheFileName(file_name, key)
+        reader = cilviewerHDF5Reader()
+        reader.SetFileName(cache_file)
+        reader.SetDatasetEntryNumber(entry_number)
+        reader.Update()
+        image = reader.GetOutputDataObject(0)
+        original_image_attrs = reader.GetOriginalImageAttrs()
+        level_attrs = reader.GetLoadedImageAttrs()
+
+        if level_size > target_size:
+            image = self._Resample(image, int(target_size), resample_z, downsample_method)
+
+        # mark the pyramid as recently used:
+        os.utime(cache_file)
+        return image, original_image_attrs, level_attrs
+
+    @staticmethod
+    def _Resample(image, target_size, resample_z, downsample_method):
+        '''resamples image in memory to target_size bytes with vtkImageResampler'''
+        resampler = vtkImageResampler()
+        resampler.SetInputDataObject(image)
+        resampler.SetTargetSize(int(target_size))
+        resampler.SetIsAcquisitionData(not resample_z)
+        resampler.SetDownsampleMethod(downsample_method)
+        resampler.Update()
+        resampled_image = vtk.vtkImageData()
+        resampled_image.DeepCopy(resampler.GetOutput())
+        # vtkImageResampler places the origin for an input with unit spacing.
+        # Each voxel is centred on the block of input voxels it was downsampled from:
+        resampled_image.SetOrigin([
+            o + (new_s - s) / 2
+            for o, s, new_s in zip(image.GetOrigin(), image.GetSpacing(), resampled_image.GetSpacing())
+        ])
+        return resampled_image
+
+    def Evict(self, keep=()):
+        '''
+        Deletes the least recently used pyramids in the cache directory, until their
+        total size is at most the max cache size.
+
+        Parameters
+        ----------
+        keep: list of str
+            names of pyramid files which must not be deleted
+        '''
+        if self._MaxCacheSize is None or not os.path.isdir(self._CacheDirectory):
+            return
+        cache_files = sorted(glob.glob(os.path.join(self._CacheDirectory, '*' + self.FILE_SUFFIX)),
+                             key=os.path.getmtime)
+        total_size = sum(os.path.getsize(f) for f in cache_files)
+        keep = [os.path.abspath(f) for f in keep]
+        for cache_file in cache_files:
+            if total_size <= self._MaxCacheSize:
+                break
+            if os.path.abspath(cache_file) in keep:
+                continue
+            total_size -= os.path.getsize(cache_file)
+            get_hdf5_file_pool().Invalidate(cache_file)
+            os.remove(cache_file)
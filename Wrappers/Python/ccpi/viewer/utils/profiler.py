@@ -0,0 +1,346 @@
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+import weakref
+
+
+class PipelineProfiler(object):
+    '''
+    Records how long the VTK algorithms of a pipeline, and phases of the python code
+    which drives them, take to execute.
+
+    The algorithms are timed by observing their StartEvent and EndEvent, see Observe,
+    and their progress is recorded from their ProgressEvent. Python code is timed
+    with the Phase context manager. The timings may be exported as a Chrome trace,
+    which can be opened in chrome://tracing or https://ui.perfetto.dev, or summed
+    up per algorithm and phase with GetSummary and FormatSummary.
+
+    Example:
+
+    profiler = PipelineProfiler()
+    profiler.Observe(reader)
+    with profiler.Phase('read'):
+        reader.Update()
+    print(profiler.FormatSummary())
+    profiler.WriteChromeTrace('trace.json')
+
+    The timings may be recorded from several threads. Code run in other
+    processes, e.g. by the workers of the resample readers, is not timed.
+    '''
+
+    def __init__(self, max_events=100000):
+        '''
+        Parameters
+        -----------
+        max_events: int, default 100000
+            maximum number of timings, and of progress updates, to keep. Once reached,
+            the oldest ones are dropped.
+        '''
+        self._Lock = threading.Lock()
+        self._Origin = time.perf_counter()
+        self._Events = collections.deque(maxlen=max_events)
+        self._ProgressEvents = collections.deque(maxlen=max_events)
+        self._ThreadNames = {}
+        # the start times of the algorithms which are executing, keyed by algorithm and thread:
+        self._Started = {}
+        # the observer tags of the objects which are observed:
+        self._Observed = weakref.WeakKeyDictionary()
+        self._Enabled = True
+
+    def SetEnabled(self, value):
+        '''Sets whether timings are recorded. The observers are kept whilst disabled.'''
+        self._Enabled = bool(value)
+
+    def GetEnabled(self):
+        return self._Enabled
+
+    def Observe(self, algorithm, name=None, category='vtk'):
+        '''
+        Times each execution of a vtkAlgorithm, or of any other vtkObject which
+        invokes a StartEvent and an EndEvent, such as a vtkRenderWindow.
+        Observing an object which is already observed does nothing.
+
+        Parameters
+        -----------
+        algorithm: vtkObject
+            the object to observe
+        name: str, default None
+            name to record the timings under, by default the name of the class of the object
+        category: str, default 'vtk'
+            category to record the timings under
+        '''
+        if algorithm in self._Observed:
+            return
+        if name is None:
+            name = type(algorithm).__name__
+        tags = [
+            algorithm.AddObserver('StartEvent', self._OnStart),
+            algorithm.AddObserver('EndEvent', lambda caller, event: self._OnEnd(caller, name, category)),
+            algorithm.AddObserver('ProgressEvent', lambda caller, event: self._OnProgress(caller, name, category))
+        ]
+        self._Observed[algorithm] = tags
+
+    def ObservePipeline(self, algorithm, category='vtk'):
+        '''
+        Observes the vtkAlgorithm and all the algorithms upstream of it, see Observe.
+        The vtkTrivialProducers which VTK adds for inputs set with SetInputData are skipped.
+        '''
+        to_visit = [algorithm]
+        while to_visit:
+            current = to_visit.pop()
+            if current is None or current in self._Observed or current.IsA('vtkTrivialProducer'):
+                continue
+            self.Observe(current, category=category)
+            for port in range(current.GetNumberOfInputPorts()):
+                for connection in range(current.GetNumberOfInputConnections(port)):
+                    to_visit.append(current.GetInputAlgorithm(port, connection))
+
+    def IsObserving(self, algorithm):
+        return algorithm in self._Observed
+
+    def StopObserving(self, algorithm):
+        '''Removes the observers added to the object by Observe'''
+        tags = self._Observed.pop(algorithm, None)
+        if tags is not None:
+            for tag in tags:
+                algorithm.RemoveObserver(tag)
+
+    def StopObservingAll(self):
+        for algorithm in list(self._Observed.keys()):
+            self.StopObserving(algorithm)
+
+    @contextlib.contextmanager
+    def Phase(self, name, category='python', **args):
+        '''
+        Context manager which times the code run within it.
+
+        Parameters
+        -----------
+        name: str
+            name to record the timing under
+        category: str, default 'python'
+            category to record the timing under
+        args:
+            values to store with the timing, which are shown in the Chrome trace
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.AddTiming(name, start, time.perf_counter() - start, category, args)
+
+    def AddTiming(self, name, start, duration, category='python', args=None):
+        '''
+        Records a timing measured elsewhere.
+
+        Parameters
+        -----------
+        name: str
+            name to record the timing under
+        start: float
+            time it started at, from time.perf_counter
+        duration: float
+            time it took, in seconds
+        category: str, default 'python'
+            category to record the timing under
+        args: dict, default None
+            values to store with the timing
+        '''
+        if not self._Enabled:
+            return
+        with self._Lock:
+            self._Events.append({
+                'name': name,
+                'category': category,
+                'start': start - self._Origin,
+                'duration': duration,
+                'thread': self._GetThread(),
+                'args': dict(args or {})
+            })
+
+    def _GetThread(self):
+        '''returns the id of the current thread, remembering its name. Must hold the lock.'''
+        thread = threading.get_ident()
+        if thread not in self._ThreadNames:
+            self._ThreadNames[thread] = threading.current_thread().name
+        return thread
+
+    def _OnStart(self, caller, event):
+        if self._Enabled:
+            self._Started[(id(caller), threading.get_ident())] = time.perf_counter()
+
+    def _OnEnd(self, caller, name, category):
+        start = self._Started.pop((id(caller), threading.get_ident()), None)
+        if start is not None:
+            self.AddTiming(name, start, time.perf_counter() - start, category)
+
+    def _OnProgress(self, caller, name, category):
+        if not self._Enabled:
+            return
+        with self._Lock:
+            self._ProgressEvents.append({
+                'name': name,
+                'category': category,
+                'time': time.perf_counter() - self._Origin,
+                'thread': self._GetThread(),
+                'progress': caller.GetProgress()
+            })
+
+    def Clear(self):
+        '''Forgets the timings recorded so far, but keeps observing the same objects'''
+        with self._Lock:
+            self._Events.clear()
+            self._ProgressEvents.clear()
+
+    def GetTimings(self):
+        '''
+        Returns
+        -------
+        list of dicts with the 'name', 'category', 'start' (in seconds since the profiler
+        was created), 'duration' (in seconds), 'thread' and 'args' of each timing, in the
+        order they finished
+        '''
+        with self._Lock:
+            return [dict(event) for event in self._Events]
+
+    def GetProgressUpdates(self):
+        '''
+        Returns
+        -------
+        list of dicts with the 'name', 'category', 'time' (in seconds since the profiler
+        was created), 'thread' and 'progress' of each progress update of the observed algorithms
+        '''
+        with self._Lock:
+            return [dict(event) for event in self._ProgressEvents]
+
+    def GetSummary(self):
+        '''
+        Returns
+        -------
+        list of dicts with the 'name', 'category', 'count', and the 'total', 'mean' and
+        'max' duration in seconds, of each algorithm and phase, sorted by total duration
+        '''
+        totals = collections.OrderedDict()
+        for event in self.GetTimings():
+            key = (event['name'], event['category'])
+            if key not in totals:
+                totals[key] = {'name': key[0], 'category': key[1], 'count': 0, 'total': 0., 'max': 0.}
+            summary = totals[key]
+            summary['count'] += 1
+            summary['total'] += event['duration']
+            summary['max'] = max(summary['max'], event['duration'])
+        for summary in totals.values():
+            summary['mean'] = summary['total'] / summary['count']
+        return sorted(totals.values(), key=lambda s: s['total'], reverse=True)
+
+    def FormatSummary(self):
+        '''Returns the summary of the timings, see GetSummary, as a table of text'''
+        summary = self.GetSummary()
+        width = max([len(s['name']) for s in summary] + [len('name')])
+        row = '{:<' + str(width) + '} {:>8} {:>8} {:>12} {:>12} {:>12}'
+        lines = [row.format('name', 'category', 'count', 'total (ms)', 'mean (ms)', 'max (ms)')]
+        for s in summary:
+            lines.append(
+                row.format(s['name'], s['category'], s['count'], '{:.3f}'.format(1e3 * s['total']),
+                           '{:.3f}'.format(1e3 * s['mean']), '{:.3f}'.format(1e3 * s['max'])))
+        return '\n'.join(lines)
+
+    def GetChromeTrace(self):
+        '''
+        Returns
+        -------
+        dict in the Chrome trace event format, with a complete event for each timing,
+        and a counter event for each progress update
+        '''
+        pid = os.getpid()
+        trace_events = []
+        for event in self.GetTimings():
+            args = {key: _to_json(value) for key, value in event['args'].items()}
+            trace_events.append({
+                'name': event['name'],
+                'cat': event['category'],
+                'ph': 'X',
+                'ts': 1e6 * event['start'],
+                'dur': 1e6 * event['duration'],
+                'pid': pid,
+                'tid': event['thread'],
+                'args': args
+            })
+        for event in self.GetProgressUpdates():
+            trace_events.append({
+                'name': '{} progress'.format(event['name']),
+                'cat': event['category'],
+                'ph': 'C',
+                'ts': 1e6 * event['time'],
+                'pid': pid,
+                'tid': event['thread'],
+                'args': {
+                    'progress': event['progress']
+                }
+            })
+        with self._Lock:
+            thread_names = dict(self._ThreadNames)
+        for thread, thread_name in thread_names.items():
+            trace_events.append({
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': pid,
+                'tid': thread,
+                'args': {
+                    'name': thread_name
+                }
+            })
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def WriteChromeTrace(self, file_name):
+        '''Writes the timings to a JSON file in the Chrome trace event format, see GetChromeTrace'''
+        with open(file_name, 'w') as f:
+            json.dump(self.GetChromeTrace(), f)
+
+
+def _to_json(value):
+    '''returns the value if it can be written to JSON, otherwise its string representation'''
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    return str(value)
+
+
+_pipeline_profiler = None
+
+
+def set_pipeline_profiler(profiler):
+    '''
+    Sets the PipelineProfiler which times the readers and their python code in this
+    process, or None not to time them.
+    '''
+    global _pipeline_profiler
+    _pipeline_profiler = profiler
+
+
+def get_pipeline_profiler():
+    '''Returns the PipelineProfiler set with set_pipeline_profiler, or None'''
+    return _pipeline_profiler
+
+
+def profile_phase(name, category='python', **args):
+    '''Returns a context manager which times the code run within it with the profiler
+    set with set_pipeline_profiler, see PipelineProfiler.Phase. It does nothing if
+    no profiler is set.'''
+    profiler = _pipeline_profiler
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.Phase(name, category, **args)
+
+
+def profile_algorithm(algorithm, name=None):
+    '''Times the algorithm with the profiler set with set_pipeline_profiler, if one is set,
+    see PipelineProfiler.Observe. Returns the algorithm.'''
+    profiler = _pipeline_profiler
+    if profiler is not None:
+        profiler.Observe(algorithm, name)
+    return algorithm
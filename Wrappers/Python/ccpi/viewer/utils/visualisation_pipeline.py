@@ -1,4 +1,12 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
 import vtk
+from vtk.util import numpy_support
 from vtk.util.vtkAlgorithm import VTKPythonAlgorithmBase
 from vtk import vtkPolyData, vtkAlgorithmOutput, vtkImageData
 
@@ -254,44 +262,47 @@ class cilMaskPolyData(VTKPythonAlgorithmBase):
         return 1
 
     def RequestData(self, request, inInfo, outInfo):
-        self.point_in_mask = 0
         in_points = vtk.vtkDataSet.GetData(inInfo[0])
         mask = vtk.vtkDataSet.GetData(inInfo[1])
         out_points = vtk.vtkPoints()
 
-        # this implementation is slightly more efficient
-        spac = mask.GetSpacing()
-        orig = mask.GetOrigin()
-        for i in range(in_points.GetNumberOfPoints()):
-            pp = in_points.GetPoint(i)
-
-            # get the point in image coordinate
-
-            # ic = self.world2imageCoordinate(pp, mask)
-            ic = [round((pp[i] + orig[i]) / spac[i]) for i in range(3)]
-            i = 0
-            outside = False
-            while i < len(ic):
-                outside = ic[i] < 0 or ic[i] >= mask.GetDimensions()[i]
-                if outside:
-                    break
-                i += 1
-
-            if not outside:
-                mm = mask.GetScalarComponentAsDouble(int(ic[0]), int(ic[1]), int(ic[2]), 0)
-
-                if int(mm) == int(self.GetMaskValue()):
-                    # print ("value of point {} {}".format(mm, ic))
-                    out_points.InsertNextPoint(*pp)
-                    self.point_in_mask += 1
+        if in_points.GetNumberOfPoints() > 0:
+            points = numpy_support.vtk_to_numpy(in_points.GetPoints().GetData())
+            in_mask = self.getPointsInMask(points, mask)
+            out_points.SetData(numpy_support.numpy_to_vtk(points[in_mask], deep=1))
+        self.point_in_mask = out_points.GetNumberOfPoints()
 
         vertices = self.points2vertices(out_points)
         pointPolyData = vtk.vtkPolyData.GetData(outInfo)
         pointPolyData.SetPoints(out_points)
         pointPolyData.SetVerts(vertices)
-        print("points in mask", self.point_in_mask)
         return 1
 
+    def GetOutput(self):
+        return self.GetOutputDataObject(0)
+
+    def getPointsInMask(self, points, mask):
+        '''returns a boolean array which is True for the points where the mask has the mask value
+
+        :param points: (N, 3) ndarray of the points in world coordinates
+        :param mask: vtkImageData of the mask
+        '''
+        spac = numpy.asarray(mask.GetSpacing())
+        orig = numpy.asarray(mask.GetOrigin())
+        dims = numpy.asarray(mask.GetDimensions())
+
+        # get the points in image coordinates, see world2imageCoordinate
+        ic = numpy.rint((points + orig) / spac).astype(numpy.int64)
+        inside = numpy.all((ic >= 0) & (ic < dims), axis=1)
+
+        in_mask = numpy.zeros(len(points), dtype=bool)
+        scalars = mask.GetPointData().GetScalars()
+        mask_values = numpy_support.vtk_to_numpy(scalars).reshape(-1, scalars.GetNumberOfComponents())[:, 0]
+        ic = ic[inside]
+        mm = mask_values[ic[:, 0] + dims[0] * (ic[:, 1] + dims[1] * ic[:, 2])]
+        in_mask[inside] = mm.astype(numpy.int64) == int(self.GetMaskValue())
+        return in_mask
+
     def world2imageCoordinate(self, world_coordinates, imagedata):
         """
         Convert from the world or global coordinates to image coordinates
@@ -307,9 +318,417 @@ class cilMaskPolyData(VTKPythonAlgorithmBase):
     def points2vertices(self, points):
         '''returns a vtkCellArray from a vtkPoints'''
 
+        # one vertex cell per point:
+        ids = numpy.arange(points.GetNumberOfPoints() + 1, dtype=numpy.int64)
+        offsets = numpy_support.numpy_to_vtkIdTypeArray(ids, deep=1)
+        connectivity = numpy_support.numpy_to_vtkIdTypeArray(ids[:-1], deep=1)
         vertices = vtk.vtkCellArray()
-        for i in range(points.GetNumberOfPoints()):
-            vertices.InsertNextCell(1)
-            vertices.InsertCellPoint(i)
-            # print (points.GetPoint(i))
+        vertices.SetData(offsets, connectivity)
         return vertices
+
+
+class cilCachedExtractVOI(VTKPythonAlgorithmBase):
+    '''A replacement for vtkExtractVOI which caches the slices it extracts
+
+    It is meant to be used by the CILViewer2D, which extracts a single slice
+    of its input every time the user scrolls. Slices which span the whole
+    input in the other 2 directions are kept in a least recently used cache,
+    keyed by (orientation, slice index), up to a memory budget in bytes.
+    Whilst the user scrolls, a background thread extracts the next slices in
+    the direction of scrolling, so that they are already in the cache when
+    they are requested.
+
+    Any other VOI is extracted without caching. The cache is cleared when the
+    input, or its modified time, changes.
+
+    Input: vtkImageData
+    Output: vtkImageData of the VOI, with the extent of the VOI
+    '''
+
+    def __init__(self):
+        VTKPythonAlgorithmBase.__init__(self,
+                                        nInputPorts=1,
+                                        inputType='vtkImageData',
+                                        nOutputPorts=1,
+                                        outputType='vtkImageData')
+        self.__VOI = (0, -1, 0, -1, 0, -1)
+        self.__MemoryBudget = 512 * 1024**2
+        self.__PrefetchDepth = 4
+        self.__Cache = OrderedDict()
+        self.__CacheSize = 0
+        self.__CacheLock = threading.Lock()
+        self.__CacheHits = 0
+        self.__CacheMisses = 0
+        # the input the cache refers to, and its modified time:
+        self.__CachedInput = None
+        self.__CachedInputMTime = None
+        self.__Generation = 0
+        self.__LastKey = None
+        self.__PrefetchQueue = queue.Queue()
+        self.__PrefetchThread = None
+
+    def SetInputData(self, data):
+        self.SetInputDataObject(0, data)
+
+    def SetVOI(self, *voi):
+        '''Sets the extent to extract, either as 6 ints or a sequence of 6 ints'''
+        if len(voi) == 1:
+            voi = voi[0]
+        voi = tuple(int(i) for i in voi)
+        if len(voi) != 6:
+            raise ValueError('Expected 6 values for the VOI. Got', voi)
+        if voi != self.__VOI:
+            self.__VOI = voi
+            self.Modified()
+
+    def GetVOI(self):
+        return self.__VOI
+
+    def GetOutput(self):
+        return self.GetOutputDataObject(0)
+
+    def SetMemoryBudget(self, value):
+        '''Sets the maximum number of bytes of slices to keep in the cache. 0 disables the cache.'''
+        if not isinstance(value, Integral) or value < 0:
+            raise ValueError('Expected a non-negative integer number of bytes. Got', value)
+        if value != self.__MemoryBudget:
+            self.__MemoryBudget = value
+            with self.__CacheLock:
+                self._EvictSlices()
+            self.Modified()
+
+    def GetMemoryBudget(self):
+        return self.__MemoryBudget
+
+    def SetPrefetchDepth(self, value):
+        '''Sets the number of slices to extract ahead of the direction of scrolling. 0 disables prefetching.'''
+        if not isinstance(value, Integral) or value < 0:
+            raise ValueError('Expected a non-negative integer number of slices. Got', value)
+        if value != self.__PrefetchDepth:
+            self.__PrefetchDepth = value
+            self.Modified()
+
+    def GetPrefetchDepth(self):
+        return self.__PrefetchDepth
+
+    def GetCacheSize(self):
+        '''Returns the number of bytes of slices in the cache'''
+        return self.__CacheSize
+
+    def GetNumberOfCachedSlices(self):
+        return len(self.__Cache)
+
+    def IsSliceCached(self, orientation, index):
+        with self.__CacheLock:
+            return (orientation, index) in self.__Cache
+
+    def GetCacheHits(self):
+        return self.__CacheHits
+
+    def GetCacheMisses(self):
+        return self.__CacheMisses
+
+    def ClearCache(self):
+        with self.__CacheLock:
+            self.__Cache.clear()
+            self.__CacheSize = 0
+            self.__Generation += 1
+        self._ClearPrefetchQueue()
+
+    def WaitForPrefetch(self):
+        '''Blocks until the slices which have been queued for prefetching are in the cache'''
+        self.__PrefetchQueue.join()
+
+    def RequestUpdateExtent(self, request, inInfo, outInfo):
+        # the slices are extracted from the whole input:
+        info = inInfo[0].GetInformationObject(0)
+        info.Set(vtk.vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT(),
+                 info.Get(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT()), 6)
+        return 1
+
+    def RequestInformation(self, request, inInfo, outInfo):
+        in_info = inInfo[0].GetInformationObject(0)
+        whole_extent = in_info.Get(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT())
+        info = outInfo.GetInformationObject(0)
+        info.Set(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT(), self._ClampVOI(whole_extent), 6)
+        return 1
+
+    def RequestData(self, request, inInfo, outInfo):
+        input_image = vtk.vtkImageData.GetData(inInfo[0])
+        output_image = vtk.vtkImageData.GetData(outInfo)
+        if input_image is not self.__CachedInput or input_image.GetMTime() != self.__CachedInputMTime:
+            self.ClearCache()
+            self.__CachedInput = input_image
+            self.__CachedInputMTime = input_image.GetMTime()
+            self.__LastKey = None
+
+        extent = input_image.GetExtent()
+        voi = self._ClampVOI(extent)
+        key = self._GetSliceKey(extent, voi)
+        if key is None:
+            output_image.ShallowCopy(self._ExtractVOI(input_image, voi))
+            return 1
+
+        with self.__CacheLock:
+            image = self.__Cache.get(key)
+            if image is not None:
+                self.__Cache.move_to_end(key)
+        if image is None:
+            self.__CacheMisses += 1
+            image = self._ExtractVOI(input_image, voi)
+            with self.__CacheLock:
+                self._CacheSlice(key, image)
+        else:
+            self.__CacheHits += 1
+        output_image.ShallowCopy(image)
+
+        self._PrefetchSlices(input_image, key)
+        self.__LastKey = key
+        return 1
+
+    def _ClampVOI(self, extent):
+        voi = list(self.__VOI)
+        for i in range(3):
+            voi[2 * i] = max(voi[2 * i], extent[2 * i])
+            voi[2 * i + 1] = min(voi[2 * i + 1], extent[2 * i + 1])
+        return tuple(voi)
+
+    def _GetSliceKey(self, extent, voi):
+        '''returns (orientation, slice index) if the VOI is a whole slice of the extent, otherwise None'''
+        single = [i for i in range(3) if voi[2 * i] == voi[2 * i + 1]]
+        for orientation in single:
+            others = [i for i in range(3) if i != orientation]
+            if all(voi[2 * i] == extent[2 * i] and voi[2 * i + 1] == extent[2 * i + 1] for i in others):
+                return (orientation, voi[2 * orientation])
+        return None
+
+    @staticmethod
+    def _ExtractVOI(input_image, voi):
+        '''copies the VOI of the input into a new vtkImageData'''
+        extent = input_image.GetExtent()
+        dims = input_image.GetDimensions()
+        scalars = input_image.GetPointData().GetScalars()
+        num_components = scalars.GetNumberOfComponents()
+        array = numpy_support.vtk_to_numpy(scalars).reshape(dims[2], dims[1], dims[0], num_components)
+        # numpy indexes the array as z, y, x:
+        index = tuple(slice(voi[2 * i] - extent[2 * i], voi[2 * i + 1] - extent[2 * i] + 1) for i in (2, 1, 0))
+        sub_array = numpy.ascontiguousarray(array[index]).reshape(-1, num_components)
+        if num_components == 1:
+            sub_array = sub_array.ravel()
+        vtk_array = numpy_support.numpy_to_vtk(sub_array, deep=1, array_type=scalars.GetDataType())
+        vtk_array.SetName(scalars.GetName())
+
+        image = vtk.vtkImageData()
+        image.SetExtent(voi)
+        image.SetSpacing(input_image.GetSpacing())
+        image.SetOrigin(input_image.GetOrigin())
+        image.GetPointData().SetScalars(vtk_array)
+        return image
+
+    @staticmethod
+    def _GetImageSize(image):
+        scalars = image.GetPointData().GetScalars()
+        return scalars.GetNumberOfValues() * scalars.GetDataTypeSize()
+
+    def _CacheSlice(self, key, image):
+        '''adds a slice to the cache and evicts the least recently used slices. Call holding the cache lock.'''
+        size = self._GetImageSize(image)
+        if size > self.__MemoryBudget:
+            return
+        if key in self.__Cache:
+            self.__CacheSize -= self._GetImageSize(self.__Cache.pop(key))
+        self.__Cache[key] = image
+        self.__CacheSize += size
+        self._EvictSlices()
+
+    def _EvictSlices(self):
+        '''removes the least recently used slices until the cache fits the budget. Call holding the cache lock.'''
+        while self.__Cache and self.__CacheSize > self.__MemoryBudget:
+            _, image = self.__Cache.popitem(last=False)
+            self.__CacheSize -= self._GetImageSize(image)
+
+    def _ClearPrefetchQueue(self):
+        while True:
+            try:
+                self.__PrefetchQueue.get_nowait()
+            except queue.Empty:
+                break
+            self.__PrefetchQueue.task_done()
+
+    def _PrefetchSlices(self, input_image, key):
+        '''queues the slices ahead of the direction of scrolling for extraction in the background'''
+        if self.__LastKey is None or self.__LastKey[0] != key[0] or self.__LastKey[1] == key[1]:
+            return
+        orientation, index = key
+        step = index - self.__LastKey[1]
+        extent = input_image.GetExtent()
+        slice_size = max(1, self._GetImageSize(input_image) // input_image.GetDimensions()[orientation])
+        # leave room in the cache for the slices already displayed:
+        depth = min(self.__PrefetchDepth, self.__MemoryBudget // (2 * slice_size))
+        indices = [index + step * i for i in range(1, depth + 1)]
+        indices = [i for i in indices if extent[2 * orientation] <= i <= extent[2 * orientation + 1]]
+        if not indices:
+            return
+
+        # a new direction of scrolling supersedes the slices queued previously:
+        self._ClearPrefetchQueue()
+        for i in indices:
+            self.__PrefetchQueue.put((self.__Generation, input_image, (orientation, i)))
+        if self.__PrefetchThread is None:
+            self.__PrefetchThread = threading.Thread(target=self._PrefetchInThread, daemon=True)
+            self.__PrefetchThread.start()
+
+    def _PrefetchInThread(self):
+        while True:
+            generation, input_image, key = self.__PrefetchQueue.get()
+            try:
+                if generation == self.__Generation and not self.IsSliceCached(*key):
+                    orientation, index = key
+                    voi = list(input_image.GetExtent())
+                    voi[2 * orientation] = voi[2 * orientation + 1] = index
+                    image = self._ExtractVOI(input_image, voi)
+                    with self.__CacheLock:
+                        # discard it if the input changed whilst extracting:
+                        if generation == self.__Generation:
+                            self._CacheSlice(key, image)
+            finally:
+                self.__PrefetchQueue.task_done()
+
+
+class cilGradientMagnitude(VTKPythonAlgorithmBase):
+    '''Computes the magnitude of the gradient of a 3D image, like vtkImageGradientMagnitude
+    with dimensionality 3 and HandleBoundaries on, in slabs along z which are computed
+    concurrently by a pool of threads.
+
+    The gradient is computed with central differences, clamping at the edges of the image,
+    in double precision, one slab at a time, so that the only full size array is the output.
+    By default the output has the scalar type of the input, as vtkImageGradientMagnitude does,
+    but a smaller type can be set with SetOutputScalarType to save memory.
+
+    Input: vtkImageData with 1 component
+    Output: vtkImageData of the gradient magnitude, with the geometry of the input
+    '''
+
+    def __init__(self):
+        VTKPythonAlgorithmBase.__init__(self,
+                                        nInputPorts=1,
+                                        inputType='vtkImageData',
+                                        nOutputPorts=1,
+                                        outputType='vtkImageData')
+        self.__NumberOfThreads = min(8, os.cpu_count() or 1)
+        self.__SlabDepth = 16
+        self.__OutputScalarType = None
+
+    def SetInputData(self, data):
+        self.SetInputDataObject(0, data)
+
+    def SetNumberOfThreads(self, value):
+        '''Sets the number of threads which compute slabs of the output concurrently, default min(8, number of CPUs)'''
+        if not isinstance(value, Integral) or value < 1:
+            raise ValueError('Expected an integer number of threads of at least 1. Got', value)
+        if value != self.__NumberOfThreads:
+            self.__NumberOfThreads = value
+            self.Modified()
+
+    def GetNumberOfThreads(self):
+        return self.__NumberOfThreads
+
+    def SetSlabDepth(self, value):
+        '''Sets the number of z slices computed in each slab, default 16'''
+        if not isinstance(value, Integral) or value < 1:
+            raise ValueError('Expected an integer number of slices of at least 1. Got', value)
+        if value != self.__SlabDepth:
+            self.__SlabDepth = value
+            self.Modified()
+
+    def GetSlabDepth(self):
+        return self.__SlabDepth
+
+    def SetOutputScalarType(self, value):
+        '''Sets the VTK scalar type of the output, e.g. vtk.VTK_FLOAT or vtk.VTK_UNSIGNED_SHORT,
+        or None for the scalar type of the input. Values out of the range of an integer type are clipped.'''
+        if value is not None:
+            try:
+                numpy_support.get_numpy_array_type(value)
+            except KeyError:
+                raise ValueError('Expected a VTK scalar type. Got', value)
+        if value != self.__OutputScalarType:
+            self.__OutputScalarType = value
+            self.Modified()
+
+    def GetOutputScalarType(self):
+        return self.__OutputScalarType
+
+    def GetOutput(self):
+        return self.GetOutputDataObject(0)
+
+    def RequestInformation(self, request, inInfo, outInfo):
+        if self.__OutputScalarType is not None:
+            vtk.vtkDataObject.SetPointDataActiveScalarInfo(outInfo.GetInformationObject(0), self.__OutputScalarType, 1)
+        return 1
+
+    def RequestUpdateExtent(self, request, inInfo, outInfo):
+        # each voxel depends on its neighbours, so the whole input is needed:
+        info = inInfo[0].GetInformationObject(0)
+        info.Set(vtk.vtkStreamingDemandDrivenPipeline.UPDATE_EXTENT(),
+                 info.Get(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT()), 6)
+        return 1
+
+    def RequestData(self, request, inInfo, outInfo):
+        input_image = vtk.vtkImageData.GetData(inInfo[0])
+        output_image = vtk.vtkImageData.GetData(outInfo)
+        scalars = input_image.GetPointData().GetScalars()
+        if scalars.GetNumberOfComponents() != 1:
+            raise ValueError('Expected an image with 1 component. Got', scalars.GetNumberOfComponents())
+        dims = input_image.GetDimensions()
+        # numpy indexes the array as z, y, x:
+        array = numpy_support.vtk_to_numpy(scalars).reshape(dims[::-1])
+        scalar_type = self.__OutputScalarType if self.__OutputScalarType is not None else scalars.GetDataType()
+        # the slabs are written straight into the memory of the output array:
+        vtk_array = vtk.vtkDataArray.CreateDataArray(scalar_type)
+        vtk_array.SetNumberOfComponents(1)
+        vtk_array.SetNumberOfTuples(array.size)
+        vtk_array.SetName('GradientMagnitude')
+        gradient = numpy_support.vtk_to_numpy(vtk_array).reshape(array.shape)
+
+        starts = range(0, dims[2], self.__SlabDepth)
+        with ThreadPoolExecutor(max_workers=min(self.__NumberOfThreads, len(starts))) as executor:
+            # list raises any error from the threads:
+            list(
+                executor.map(
+                    lambda start: self._ComputeSlab(array, start, self.__SlabDepth, input_image.GetSpacing(), gradient),
+                    starts))
+
+        output_image.SetExtent(input_image.GetExtent())
+        output_image.SetSpacing(input_image.GetSpacing())
+        output_image.SetOrigin(input_image.GetOrigin())
+        output_image.GetPointData().SetScalars(vtk_array)
+        return 1
+
+    @staticmethod
+    def _ComputeSlab(array, start, depth, spacing, gradient):
+        '''computes the gradient magnitude of the slices start to start + depth of the array (z, y, x) into gradient'''
+        stop = min(start + depth, array.shape[0])
+        total = None
+        # sum the squares of the differences in the same order as vtkImageGradientMagnitude (x, y, z):
+        for axis, numpy_axis in enumerate((2, 1, 0)):
+            length = array.shape[numpy_axis]
+            indices = numpy.arange(start, stop) if numpy_axis == 0 else numpy.arange(length)
+            # neighbouring voxels, clamped at the edges of the image:
+            previous = numpy.clip(indices - 1, 0, length - 1)
+            following = numpy.clip(indices + 1, 0, length - 1)
+            slab = array if numpy_axis == 0 else array[start:stop]
+            difference = numpy.take(slab, following, axis=numpy_axis).astype(numpy.float64)
+            difference -= numpy.take(slab, previous, axis=numpy_axis)
+            difference *= 0.5 / spacing[axis]
+            difference *= difference
+            if total is None:
+                total = difference
+            else:
+                total += difference
+        numpy.sqrt(total, out=total)
+        dtype = gradient.dtype
+        if numpy.issubdtype(dtype, numpy.integer):
+            info = numpy.iinfo(dtype)
+            numpy.clip(total, info.min, info.max, out=total)
+        gradient[start:stop] = total
@@ -1,5 +1,8 @@
 # code largely copied from https://sourceforge.net/p/pyve/code/ci/master/tree/PyVE/components/viewer.py
 # MIT licensed
+import math
+import time
+
 from ccpi.viewer.CILViewer import CILInteractorStyle as CIL3DInteractorStyle
 from ccpi.viewer.CILViewer2D import CILInteractorStyle as CIL2DInteractorStyle
 
@@ -165,6 +168,348 @@ class ViewerLinker():
         self._from.linkInterpolation = linkInterpolation
 
 
+#################################
+# ViewerLinkHub
+#################################
+class ViewerLinkHub():
+    """
+    This class links any number of viewers. It offers the same methods
+    as the ViewerLinker for enabling and disabling the links, and setting
+    up what is linked, but rather than replaying the interactor events of
+    one viewer in the others, it reads the state of a viewer (slice,
+    orientation, window/level, interpolation, zoom, pan and pick) each time
+    it renders, and applies the changes in state to the other viewers.
+
+    Changes which happen within a frame interval of the last update are
+    coalesced into one update, applied when the interval is up, so that a
+    burst of mouse moves renders each of the other viewers once per frame.
+    Zoom is applied as a ratio of the parallel scale and pan as a shift of
+    the camera, so that the viewers keep their own cameras.
+
+    The viewers don't need the Linked interactor styles.
+    """
+
+    def __init__(self, *viewers, frameInterval=1. / 30):
+        self._viewers = []
+        self._observers = {}
+        self._states = {}
+        self._pending = {}
+        self._stats = {}
+        self._enabled = False
+        self._applying = False
+        self._flushTimer = None
+        self._lastFlush = -math.inf
+        self.frameInterval = frameInterval
+        self.linkZoom = True
+        self.linkPan = True
+        self.linkPick = True
+        self.linkWindowLevel = True
+        self.linkSlice = True
+        self.linkOrientation = True
+        self.linkInterpolation = True
+        for viewer in viewers:
+            self.addViewer(viewer)
+
+    def __del__(self):
+        self.disable()
+
+    def addViewer(self, viewer):
+        """
+        Link a viewer to the others
+        :param viewer: (CILViewer or CILViewer2D)
+        """
+        if viewer in self._viewers:
+            return
+        self._viewers.append(viewer)
+        if self._enabled:
+            self._addObservers(viewer)
+
+    def removeViewer(self, viewer):
+        """
+        Unlink a viewer from the others
+        :param viewer: (CILViewer or CILViewer2D)
+        """
+        if viewer not in self._viewers:
+            return
+        self._removeObservers(viewer)
+        self._viewers.remove(viewer)
+        self._pending.pop(viewer, None)
+        self._states.pop(viewer, None)
+        if self._flushTimer is not None and self._flushTimer[0] is viewer.getInteractor():
+            # the timer events of the viewer aren't observed any more, so the flush
+            # is rescheduled on another viewer:
+            interactor, timer = self._flushTimer
+            interactor.DestroyTimer(timer)
+            self._flushTimer = None
+            if self._pending:
+                self._scheduleFlush(self._viewers[0])
+
+    def getViewers(self):
+        return list(self._viewers)
+
+    def enable(self):
+        """
+        Enable the viewer links
+        """
+        # Make sure the observers aren't added twice
+        self.disable()
+        self._enabled = True
+        for viewer in self._viewers:
+            self._addObservers(viewer)
+
+    def disable(self):
+        """
+        Disable the viewer links. Any changes which haven't been applied yet are dropped.
+        """
+        self._enabled = False
+        for viewer in list(self._observers):
+            self._removeObservers(viewer)
+        self._pending.clear()
+        if self._flushTimer is not None:
+            interactor, timer = self._flushTimer
+            interactor.DestroyTimer(timer)
+            self._flushTimer = None
+
+    def _addObservers(self, viewer):
+        self._states[viewer] = self._getState(viewer)
+        renderer = viewer.getRenderer()
+        interactor = viewer.getInteractor()
+        render_observer = renderer.AddObserver("EndEvent", lambda caller, event: self._onRender(viewer))
+        timer_observer = interactor.AddObserver("TimerEvent", self._onTimer)
+        self._observers[viewer] = [(renderer, render_observer), (interactor, timer_observer)]
+
+    def _removeObservers(self, viewer):
+        for caller, observer in self._observers.pop(viewer, []):
+            caller.RemoveObserver(observer)
+
+    def setFrameInterval(self, frameInterval):
+        """
+        Minimum time between updates of the linked viewers
+        :param frameInterval: (float) seconds
+        """
+        self.frameInterval = frameInterval
+
+    def getFrameInterval(self):
+        return self.frameInterval
+
+    def setLinkZoom(self, linkZoom):
+        """
+        Boolean flag to set zoom linkage
+        :param linkZoom: (boolean)
+        """
+        self.linkZoom = linkZoom
+
+    def setLinkPan(self, linkPan):
+        """
+        Boolean flag to set pan linkage
+        :param linkPan: (boolean)
+        """
+        self.linkPan = linkPan
+
+    def setLinkPick(self, linkPick):
+        """
+        Boolean flag to set pick linkage
+        :param linkPick: (boolean)
+        """
+        self.linkPick = linkPick
+
+    def setLinkWindowLevel(self, linkWindowLevel):
+        """
+        Boolean flag to set window level linkage
+        :param linkWindowLevel: (boolean)
+        """
+        self.linkWindowLevel = linkWindowLevel
+
+    def setLinkSlice(self, linkSlice):
+        """
+        Boolean flag to set slice linkage
+        :param linkSlice: (boolean)
+        """
+        self.linkSlice = linkSlice
+
+    def setLinkOrientation(self, linkOrientation):
+        """
+        Boolean flag to set slice orientation linkage
+        :param linkOrientation: (boolean)
+        """
+        self.linkOrientation = linkOrientation
+
+    def setLinkInterpolation(self, linkInterpolation):
+        """
+        Boolean flag to set linkage of interpolation of slice actor
+        :param linkInterpolation: (boolean)
+        """
+        self.linkInterpolation = linkInterpolation
+
+    def getLinkStats(self):
+        """
+        Returns a list with a dict for each link which has been updated: the indices
+        of its 'source' and 'target' viewers, the number of updates ('count'), the
+        'last', 'mean' and 'max' latency in seconds, from the first change to the
+        source viewer in an update to the target viewer being rendered, and the number
+        of changes which were coalesced into an update rather than applied on their own
+        ('dropped').
+        """
+        stats = []
+        for (source, target), link in self._stats.items():
+            if source not in self._viewers or target not in self._viewers:
+                continue
+            count = link['count']
+            stats.append({
+                'source': self._viewers.index(source),
+                'target': self._viewers.index(target),
+                'count': count,
+                'last': link['last'],
+                'mean': link['total'] / count if count else None,
+                'max': link['max'],
+                'dropped': link['dropped']
+            })
+        return stats
+
+    def resetLinkStats(self):
+        self._stats.clear()
+
+    def _getLinkStats(self, source, target):
+        return self._stats.setdefault((source, target), {
+            'count': 0,
+            'last': None,
+            'total': 0.,
+            'max': None,
+            'dropped': 0
+        })
+
+    def _getState(self, viewer):
+        camera = viewer.getRenderer().GetActiveCamera()
+        slice_property = viewer.imageSlice.GetProperty()
+        pick = getattr(viewer.style, 'last_picked_voxel', None)
+        pan = list(camera.GetFocalPoint())
+        if isinstance(viewer.style, CIL2DInteractorStyle):
+            # the camera of a 2D viewer also moves with the slice, which isn't a pan:
+            pan[viewer.getSliceOrientation()] = 0
+        return {
+            'orientation': viewer.getSliceOrientation(),
+            'slice': viewer.getActiveSlice(),
+            'window_level': (slice_property.GetColorWindow(), slice_property.GetColorLevel()),
+            'interpolation': slice_property.GetInterpolationType(),
+            'zoom': camera.GetParallelScale(),
+            'pan': tuple(pan),
+            'pick': None if pick is None else tuple(pick[0:3])
+        }
+
+    def _onRender(self, viewer):
+        if self._applying or not self._enabled:
+            return
+        state = self._getState(viewer)
+        if state == self._states[viewer]:
+            return
+        now = time.perf_counter()
+        if viewer in self._pending:
+            # coalesced with the update which is already waiting:
+            for target in self._viewers:
+                if target is not viewer:
+                    self._getLinkStats(viewer, target)['dropped'] += 1
+        else:
+            # the state the update is applied from, and the time of the first change:
+            self._pending[viewer] = (self._states[viewer], now)
+        self._states[viewer] = state
+
+        self._scheduleFlush(viewer)
+
+    def _scheduleFlush(self, viewer):
+        '''Flushes now if the frame interval is up, otherwise when it is up, with a timer of the viewer'''
+        wait = self.frameInterval - (time.perf_counter() - self._lastFlush)
+        if wait <= 0:
+            self.flush()
+        elif self._flushTimer is None:
+            interactor = viewer.getInteractor()
+            self._flushTimer = (interactor, interactor.CreateOneShotTimer(max(1, int(math.ceil(wait * 1000)))))
+
+    def _onTimer(self, interactor, event):
+        if self._flushTimer is None:
+            return
+        timer_interactor, timer = self._flushTimer
+        if interactor is timer_interactor and interactor.GetTimerEventId() == timer:
+            self._flushTimer = None
+            self.flush()
+
+    def flush(self):
+        """
+        Applies the changes to the viewers which are waiting for the frame interval
+        to be up, and renders the viewers they are applied to.
+        """
+        self._lastFlush = time.perf_counter()
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        self._applying = True
+        try:
+            for source, (baseline, changed) in pending.items():
+                for target in self._viewers:
+                    if target is source:
+                        continue
+                    self._applyChanges(baseline, self._states[source], target)
+                    target.getRenderWindow().Render()
+                    latency = time.perf_counter() - changed
+                    link = self._getLinkStats(source, target)
+                    link['count'] += 1
+                    link['last'] = latency
+                    link['total'] += latency
+                    link['max'] = latency if link['max'] is None else max(link['max'], latency)
+            # the changes applied to the viewers mustn't be passed on again:
+            for viewer in self._viewers:
+                self._states[viewer] = self._getState(viewer)
+        finally:
+            self._applying = False
+
+    def _applyChanges(self, baseline, state, target):
+        """
+        Applies the changes from the baseline to the state of a source viewer to
+        the target viewer.
+        """
+        style = target.style
+        update_pipeline = False
+
+        if self.linkOrientation and state['orientation'] != baseline['orientation'] and \
+                target.getSliceOrientation() != state['orientation']:
+            if isinstance(style, CIL2DInteractorStyle):
+                style.ChangeOrientation(state['orientation'])
+            else:
+                style.SetSliceOrientation(state['orientation'])
+                update_pipeline = True
+
+        if self.linkSlice and (state['slice'], state['orientation']) != (baseline['slice'], baseline['orientation']) \
+                and target.getSliceOrientation() == state['orientation']:
+            style.SetActiveSlice(state['slice'])
+            update_pipeline = True
+
+        if self.linkPick and state['pick'] is not None and state['pick'] != baseline['pick']:
+            # Set current slice to the picked voxel
+            style.SetActiveSlice(state['pick'][target.getSliceOrientation()])
+            if hasattr(style, 'last_picked_voxel'):
+                style.last_picked_voxel = list(state['pick'])
+            update_pipeline = True
+
+        if update_pipeline:
+            style.UpdatePipeline()
+
+        slice_property = target.imageSlice.GetProperty()
+        if self.linkWindowLevel and state['window_level'] != baseline['window_level']:
+            slice_property.SetColorWindow(state['window_level'][0])
+            slice_property.SetColorLevel(state['window_level'][1])
+
+        if self.linkInterpolation and state['interpolation'] != baseline['interpolation']:
+            slice_property.SetInterpolationType(state['interpolation'])
+
+        camera = target.getRenderer().GetActiveCamera()
+        if self.linkZoom and state['zoom'] != baseline['zoom'] and baseline['zoom'] > 0:
+            camera.SetParallelScale(camera.GetParallelScale() * state['zoom'] / baseline['zoom'])
+
+        if self.linkPan and state['pan'] != baseline['pan'] and state['orientation'] == baseline['orientation']:
+            shift = [new - old for new, old in zip(state['pan'], baseline['pan'])]
+            camera.SetFocalPoint([p + d for p, d in zip(camera.GetFocalPoint(), shift)])
+            camera.SetPosition([p + d for p, d in zip(camera.GetPosition(), shift)])
+
+
 #################################
 # ViewerLinkObserver
 #################################
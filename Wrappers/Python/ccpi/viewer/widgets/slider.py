@@ -124,7 +124,7 @@ class SliderCallback:
         value = caller.GetActiveSlice()
         self.slider_widget.GetRepresentation().SetValue(value)
         self.update_label(value)
-        caller.GetRenderWindow().Render()
+        self.viewer.requestRender()
 
     def update_orientation(self, caller, ev):
         '''Update the slider widget when the orientation is changed
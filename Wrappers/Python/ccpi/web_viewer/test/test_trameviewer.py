@@ -15,6 +15,7 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 #
+import asyncio
 import os
 import sys
 import unittest
@@ -23,6 +24,7 @@ from unittest import mock
 from vtkmodules.util import colors
 
 from ccpi.viewer.CILViewer2D import SLICE_ORIENTATION_XY, SLICE_ORIENTATION_XZ, SLICE_ORIENTATION_YZ
+from ccpi.viewer.utils.io import ImageReadCancelledError
 from ccpi.web_viewer.trame_viewer import TrameViewer, server, state
 
 
@@ -91,6 +93,61 @@ class TrameViewerTest(unittest.TestCase):
         self.trame_viewer.load_nexus_file.assert_not_called()
         self.trame_viewer.load_image.assert_called_once_with("file_path/file.mha")
 
+    def test_load_file_uses_the_image_read_by_load_file_async(self):
+        self.trame_viewer.load_nexus_file = mock.MagicMock()
+        self.trame_viewer.load_image = mock.MagicMock()
+        image = mock.MagicMock()
+        handle = mock.MagicMock()
+        handle.Done.return_value = True
+        handle.Result.return_value = image
+        self.trame_viewer.create_image_reader = mock.MagicMock()
+        self.trame_viewer.create_image_reader.return_value.ReadAsync.return_value = handle
+
+        asyncio.run(self.trame_viewer.load_file_async("file_path/file.mha"))
+
+        self.trame_viewer.create_image_reader.assert_called_once_with("file_path/file.mha")
+        self.trame_viewer.load_image.assert_not_called()
+        self.trame_viewer.cil_viewer.setInput3DData.assert_called_with(image)
+        self.assertIsNone(self.trame_viewer.read_handle)
+        self.assertIsNone(self.trame_viewer.read_image)
+        self.assertFalse(state["reading"])
+
+    def test_load_file_async_keeps_the_current_image_if_the_read_is_cancelled(self):
+        self.trame_viewer.load_image = mock.MagicMock()
+        self.trame_viewer.cil_viewer.setInput3DData.reset_mock()
+        handle = mock.MagicMock()
+        handle.Done.return_value = True
+        handle.Result.side_effect = ImageReadCancelledError()
+        self.trame_viewer.create_image_reader = mock.MagicMock()
+        self.trame_viewer.create_image_reader.return_value.ReadAsync.return_value = handle
+
+        asyncio.run(self.trame_viewer.load_file_async("file_path/file.mha"))
+
+        self.trame_viewer.load_image.assert_not_called()
+        self.trame_viewer.cil_viewer.setInput3DData.assert_not_called()
+        self.assertIsNone(self.trame_viewer.read_handle)
+        self.assertFalse(state["reading"])
+
+    def test_cancel_read_cancels_the_read_in_progress(self):
+        self.trame_viewer.cancel_read()
+        handle = mock.MagicMock()
+        self.trame_viewer.read_handle = handle
+
+        self.trame_viewer.cancel_read()
+
+        handle.Cancel.assert_called_once()
+
+    @mock.patch("ccpi.web_viewer.trame_viewer.ImageReader")
+    def test_create_image_reader_resamples_nexus_files_only(self, image_reader):
+        self.assertIs(self.trame_viewer.create_image_reader("file_path/file.nxs"), image_reader.return_value)
+        image_reader.assert_called_once_with(file_name="file_path/file.nxs",
+                                             hdf5_dataset_name='entry1/tomo_entry/data/data',
+                                             target_size=256 * 256 * 256,
+                                             resample_z=True)
+        image_reader.reset_mock()
+        self.trame_viewer.create_image_reader("file_path/file.mha")
+        image_reader.assert_called_once_with(file_name="file_path/file.mha", resample=False)
+
     def test_model_selector_list_is_generated_from_list_of_files_with_base_names_as_text_and_path_as_value(self):
         model_list = self.trame_viewer._create_model_selector_list()
         self.assertEqual(len(model_list), 2)
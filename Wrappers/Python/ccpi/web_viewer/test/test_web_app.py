@@ -18,21 +18,25 @@
 import unittest
 from unittest import mock
 
-from ccpi.web_viewer.web_app import arg_parser, reset_viewer2d, data_finder, set_viewer2d, main, change_orientation, change_opacity_mapping
+from ccpi.web_viewer.web_app import arg_parser, reset_viewer2d, data_finder, set_viewer2d, main, change_orientation, change_opacity_mapping, \
+    set_profile_file
 
 
 class WebAppTest(unittest.TestCase):
 
     def setUp(self):
         reset_viewer2d()
+        set_profile_file(None)
 
     @mock.patch("ccpi.web_viewer.web_app.print")
     @mock.patch("ccpi.web_viewer.web_app.sys")
     def test_arg_parser_handles_h(self, sys, print_output):
-        help_string = "web_app.py [optional args: -h, -d] <data_files>\n" \
+        help_string = "web_app.py [optional args: -h, -d, -p <trace_file>] <data_files>\n" \
                       "Args:\n" \
                       "-h: Show this help and exit the program\n" \
-                      "-d, --2D: Use the 2D viewer instead of the 3D viewer, the default is to just use the 3D viewer."
+                      "-d, --2D: Use the 2D viewer instead of the 3D viewer, the default is to just use the 3D viewer.\n" \
+                      "-p, --profile <trace_file>: Time the reading, pipeline and renders of the viewer. A summary is " \
+                      "printed and the timings are written to trace_file as a Chrome trace when the server stops."
         sys.argv = ["python_file.py", "-h"]
         arg_parser()
 
@@ -62,6 +66,18 @@ class WebAppTest(unittest.TestCase):
         self.assertEqual(VIEWER_2D, True)
         print_output.assert_not_called()
 
+    @mock.patch("ccpi.web_viewer.web_app.print")
+    @mock.patch("ccpi.web_viewer.web_app.sys")
+    def test_arg_parser_handles_profile(self, sys, print_output):
+        sys.argv = ["python_file.py", "--profile", "trace.json"]
+        return_value = arg_parser()
+
+        from ccpi.web_viewer.web_app import PROFILE_FILE
+        self.assertEqual(PROFILE_FILE, "trace.json")
+        # the trace file is not a data file:
+        self.assertEqual(return_value, [])
+        print_output.assert_not_called()
+
     @mock.patch("ccpi.web_viewer.web_app.print")
     @mock.patch("ccpi.web_viewer.web_app.sys")
     def test_arg_parser_does_not_do_anything_with_unused_args(self, sys, print_output):
@@ -143,6 +159,26 @@ class WebAppTest(unittest.TestCase):
         viewer3d.return_value.start.assert_called_once()
         viewer2d.assert_not_called()
 
+    @mock.patch("ccpi.web_viewer.web_app.print")
+    @mock.patch("ccpi.web_viewer.web_app.set_pipeline_profiler")
+    @mock.patch("ccpi.web_viewer.web_app.PipelineProfiler")
+    @mock.patch("ccpi.web_viewer.web_app.arg_parser")
+    @mock.patch("ccpi.web_viewer.web_app.TrameViewer2D")
+    @mock.patch("ccpi.web_viewer.web_app.TrameViewer3D")
+    def test_main_profiles_the_viewer_when_PROFILE_FILE_is_set(self, viewer3d, viewer2d, arg_parser, profiler_class,
+                                                               set_pipeline_profiler, print_output):
+        set_profile_file("trace.json")
+        arg_parser.return_value = mock.MagicMock()
+        profiler = profiler_class.return_value
+
+        main()
+
+        viewer3d.return_value.cil_viewer.setProfiler.assert_called_once_with(profiler)
+        viewer3d.return_value.start.assert_called_once()
+        set_pipeline_profiler.assert_has_calls([mock.call(profiler), mock.call(None)])
+        profiler.WriteChromeTrace.assert_called_once_with("trace.json")
+        print_output.assert_called_once_with(profiler.FormatSummary.return_value)
+
     @mock.patch("ccpi.web_viewer.web_app.TRAME_VIEWER")
     def test_change_orientation_orientation_not_kwargs_calls_nothing(self, trame_viewer):
         change_orientation()
@@ -15,6 +15,7 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 #
+import asyncio
 import inspect
 import os
 
@@ -26,10 +27,15 @@ from vtkmodules.vtkIOImage import vtkMetaImageReader
 
 from ccpi.viewer.CILViewer2D import SLICE_ORIENTATION_XY, SLICE_ORIENTATION_XZ, SLICE_ORIENTATION_YZ
 from ccpi.viewer.utils.conversion import cilHDF5ResampleReader
+from ccpi.viewer.utils.io import ImageReadCancelledError, ImageReader, format_read_progress
+from ccpi.viewer.utils.profiler import profile_algorithm
 
 server = get_server()
 state, ctrl = server.state, server.controller
 
+# Interval in seconds between updates of the read progress bar:
+READ_PROGRESS_INTERVAL = 0.25
+
 
 class TrameViewer:
     """
@@ -55,6 +61,9 @@ class TrameViewer:
             self.cil_viewer = viewer()
         else:
             self.cil_viewer = viewer
+        # The handle of the file being read in the background by load_file_async, and the image it read:
+        self.read_handle = None
+        self.read_image = None
         self.load_file(self.default_file)
 
         # Set the defaults of the base class state
@@ -88,31 +97,105 @@ class TrameViewer:
         self.layout = SinglePageWithDrawerLayout(server, on_ready=self.html_view.update, width=300)
         self.layout.title.set_text(page_title)
 
+        state["reading"] = False
+        state["read_progress"] = 0
+        state["read_status"] = ""
+        with self.layout.toolbar:
+            vuetify.VSpacer()
+            self.read_status_text = self.create_read_status_text()
+            self.read_progress_bar = self.create_read_progress_bar()
+            self.cancel_read_button = self.create_cancel_read_button()
+
     def start(self):
         # Could be static but we don't want it to start from just the class, so must be called on a constructed object where __init__
         # has ran.
         server.start()
 
     def load_file(self, file_name: str, windowing_method: str = "scalar"):
-        if ".nxs" in file_name:
+        if self.read_image is not None and self.read_image[0] == file_name:
+            # The file has already been read in the background by load_file_async:
+            image = self.read_image[1]
+            self.read_image = None
+            self.cil_viewer.setInput3DData(image)
+        elif ".nxs" in file_name:
             self.load_nexus_file(file_name)
         else:
             self.load_image(file_name)
 
     def load_image(self, image_file: str):
-        reader = vtkMetaImageReader()
+        reader = profile_algorithm(vtkMetaImageReader())
         reader.SetFileName(image_file)
         reader.Update()
         self.cil_viewer.setInput3DData(reader.GetOutput())
 
     def load_nexus_file(self, file_name: str):
-        reader = cilHDF5ResampleReader()
+        reader = profile_algorithm(cilHDF5ResampleReader())
         reader.SetFileName(file_name)
         reader.SetDatasetName('entry1/tomo_entry/data/data')
         reader.SetTargetSize(256 * 256 * 256)
         reader.Update()
         self.cil_viewer.setInput3DData(reader.GetOutput())
 
+    def create_image_reader(self, file_name: str):
+        '''
+        Returns an ImageReader which reads the file in the same way as load_file does.
+        '''
+        if ".nxs" in file_name:
+            return ImageReader(file_name=file_name,
+                               hdf5_dataset_name='entry1/tomo_entry/data/data',
+                               target_size=256 * 256 * 256,
+                               resample_z=True)
+        return ImageReader(file_name=file_name, resample=False)
+
+    async def load_file_async(self, file_name: str, windowing_method: str = "scalar"):
+        '''
+        Reads the file in a background thread, reporting the progress, throughput and estimated time
+        left in the toolbar, from where the read can be cancelled. Once read, the image is loaded into
+        the viewer with load_file. If the read is cancelled, or superseded by reading another file,
+        the image currently in the viewer is kept.
+        '''
+        self.cancel_read()
+        handle = self.create_image_reader(file_name).ReadAsync()
+        self.read_handle = handle
+        with state:
+            state["reading"] = True
+            state["read_progress"] = 0
+            state["read_status"] = ""
+        try:
+            while not handle.Done():
+                progress = handle.GetProgress()
+                with state:
+                    state["read_progress"] = 100 * progress['fraction']
+                    state["read_status"] = format_read_progress(progress)
+                await asyncio.sleep(READ_PROGRESS_INTERVAL)
+            image = handle.Result()
+        except ImageReadCancelledError:
+            return
+        finally:
+            if self.read_handle is handle:
+                self.read_handle = None
+                with state:
+                    state["reading"] = False
+        self.read_image = (file_name, image)
+        self.load_file(file_name, windowing_method)
+        ctrl.view_update()
+
+    def cancel_read(self):
+        if self.read_handle is not None:
+            self.read_handle.Cancel()
+
+    def create_read_status_text(self):
+        return vuetify.VCardText("{{ read_status }}", v_show=("reading", False))
+
+    def create_read_progress_bar(self):
+        return vuetify.VProgressLinear(v_model=("read_progress", 0),
+                                       v_show=("reading", False),
+                                       height=20,
+                                       style="max-width: 300px;")
+
+    def create_cancel_read_button(self):
+        return vuetify.VBtn("Cancel", v_show=("reading", False), small=True, click=self.cancel_read)
+
     def _create_model_selector_list(self):
         useful_file_list = []
         for file_path in self.list_of_files:
@@ -397,6 +480,7 @@ class TrameViewer:
         self.change_slice_level(level)
 
     def auto_window_level(self):
+        self.cil_viewer.ia.Update()
         cmin, cmax = self.cil_viewer.ia.GetAutoRange()
         window, level = self.cil_viewer.getSliceWindowLevelFromRange(cmin, cmax)
         if self.window_level_sliders_are_percentages:
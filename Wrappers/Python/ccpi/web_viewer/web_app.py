@@ -19,8 +19,9 @@ import getopt
 import os
 import sys
 
-from trame.app import get_server
+from trame.app import asynchronous, get_server
 
+from ccpi.viewer.utils.profiler import PipelineProfiler, set_pipeline_profiler
 from ccpi.web_viewer.trame_viewer2D import TrameViewer2D
 from ccpi.web_viewer.trame_viewer3D import TrameViewer3D
 
@@ -29,6 +30,8 @@ state, ctrl = server.state, server.controller
 
 TRAME_VIEWER = None
 VIEWER_2D = False
+# file to write the Chrome trace of the pipeline profiler to, when the server stops:
+PROFILE_FILE = None
 
 
 def reset_viewer2d():
@@ -40,17 +43,24 @@ def set_viewer2d(new_value):
     VIEWER_2D = new_value
 
 
+def set_profile_file(new_value):
+    global PROFILE_FILE
+    PROFILE_FILE = new_value
+
+
 def arg_parser():
     """
     Parse the passed arguments to the current
     :return:
     """
-    help_string = "web_app.py [optional args: -h, -d] <data_files>\n" \
+    help_string = "web_app.py [optional args: -h, -d, -p <trace_file>] <data_files>\n" \
                   "Args:\n" \
                   "-h: Show this help and exit the program\n" \
-                  "-d, --2D: Use the 2D viewer instead of the 3D viewer, the default is to just use the 3D viewer."
+                  "-d, --2D: Use the 2D viewer instead of the 3D viewer, the default is to just use the 3D viewer.\n" \
+                  "-p, --profile <trace_file>: Time the reading, pipeline and renders of the viewer. A summary is " \
+                  "printed and the timings are written to trace_file as a Chrome trace when the server stops."
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hd", ["2D"])
+        opts, args = getopt.getopt(sys.argv[1:], "hdp:", ["2D", "profile="])
     except getopt.GetoptError:
         print(help_string)
         sys.exit(2)
@@ -60,6 +70,8 @@ def arg_parser():
         elif opt in ("-d", "--2D"):
             global VIEWER_2D
             VIEWER_2D = True
+        elif opt in ("-p", "--profile"):
+            set_profile_file(arg)
     return data_finder()
 
 
@@ -73,6 +85,9 @@ def data_finder():
         if index == 0 or arg[0] == '-':
             # this is the python script in index 0 and not a passed arg
             continue
+        if sys.argv[index - 1] in ("-p", "--profile"):
+            # this is the trace file of the profiler
+            continue
         if os.path.isfile(arg):
             data_files.append(arg)
         elif os.path.isdir(arg):
@@ -90,13 +105,25 @@ def main() -> int:
     :return: int, exit code for the program
     """
     data_files = arg_parser()
+    profiler = None
+    if PROFILE_FILE is not None:
+        profiler = PipelineProfiler()
+        set_pipeline_profiler(profiler)
     global TRAME_VIEWER
     if not VIEWER_2D:
         TRAME_VIEWER = TrameViewer3D(data_files)
-        TRAME_VIEWER.start()
     else:
         TRAME_VIEWER = TrameViewer2D(data_files)
+    if profiler is None:
+        TRAME_VIEWER.start()
+        return 0
+    TRAME_VIEWER.cil_viewer.setProfiler(profiler)
+    try:
         TRAME_VIEWER.start()
+    finally:
+        set_pipeline_profiler(None)
+        profiler.WriteChromeTrace(PROFILE_FILE)
+        print(profiler.FormatSummary())
     return 0
 
 
@@ -122,7 +149,7 @@ def change_opacity_mapping(**kwargs):
 
 @state.change("file_name")
 def change_model(**kwargs):
-    TRAME_VIEWER.load_file(kwargs['file_name'], kwargs.get('opacity', "scalar"))
+    asynchronous.create_task(TRAME_VIEWER.load_file_async(kwargs['file_name'], kwargs.get('opacity', "scalar")))
 
 
 @state.change("color_map")
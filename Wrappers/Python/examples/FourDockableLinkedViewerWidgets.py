@@ -35,14 +35,6 @@ class FourLinkedViewersDockableWidget(QtWidgets.QMainWindow):
                                       title="3D",
                                       interactorStyle=vlink.Linked3DInteractorStyle)
 
-        # Create the viewer linkers
-        viewerLinkers = self.linkedViewersSetup(self.v00, self.v01, self.v10, self.v11)
-
-        for linker in viewerLinkers:
-            linker.enable()
-
-        self.viewerLinkers = viewerLinkers
-
         head = example_data.HEAD.get()
 
         for el in [self.v00, self.v01, self.v10, self.v11]:
@@ -56,6 +48,10 @@ class FourLinkedViewersDockableWidget(QtWidgets.QMainWindow):
         self.v01.viewer.style.reslicing_enabled = False
         self.v10.viewer.style.reslicing_enabled = False
 
+        # Link the viewers, once they show their slices
+        self.viewerLinkHub = self.linkedViewersSetup(self.v00, self.v01, self.v10, self.v11)
+        self.viewerLinkHub.enable()
+
         # add to the GUI
 
         self.addDockWidget(QtCore.Qt.LeftDockWidgetArea, self.v00, QtCore.Qt.Vertical)
@@ -67,26 +63,15 @@ class FourLinkedViewersDockableWidget(QtWidgets.QMainWindow):
         self.show()
 
     def linkedViewersSetup(self, *args):
-        linked = [viewer for viewer in args]
-        # link all combination of viewers
-        #pairs = [(linked[0],linked[i]) for i in range(1, len(linked))]
-        pairs = []
-        for i in range(len(linked)):
-            for j in range(len(linked)):
-                if not i == j:
-                    pairs.append((linked[i], linked[j]))
-
-        linkers = []
-        for pair in pairs:
-            v2d = pair[0].viewer
-            v3d = pair[1].viewer
-            link2D3D = vlink.ViewerLinker(v2d, v3d)
-            link2D3D.setLinkPan(False)
-            link2D3D.setLinkZoom(False)
-            link2D3D.setLinkWindowLevel(True)
-            link2D3D.setLinkSlice(False)
-            linkers.append(link2D3D)
-        return linkers
+        # one hub links all the viewers, and updates each of them once per frame
+        viewerLinkHub = vlink.ViewerLinkHub(*[widget.viewer for widget in args])
+        viewerLinkHub.setLinkPan(False)
+        viewerLinkHub.setLinkZoom(False)
+        viewerLinkHub.setLinkWindowLevel(True)
+        viewerLinkHub.setLinkSlice(False)
+        # each viewer shows its own orientation
+        viewerLinkHub.setLinkOrientation(False)
+        return viewerLinkHub
 
 
 if __name__ == "__main__":
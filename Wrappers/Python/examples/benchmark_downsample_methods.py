@@ -0,0 +1,83 @@
+'''
+Compares the throughput and accuracy of the downsampling methods of the
+resample readers: vtkImageReslice ('reslice') and the block reductions
+('mean', 'max', 'min', 'median').
+
+The test image is a smooth function of position plus a voxel-sized
+checkerboard pattern, which stands in for noise. The accuracy is given
+as the root mean square difference between the downsampled image and the
+smooth function, evaluated at the centre of each downsampled voxel.
+Sampling methods pick up the checkerboard (aliasing), whilst averaging
+the blocks removes it.
+
+Usage:
+    python benchmark_downsample_methods.py --size 256 --target_size 4 --workers 1
+'''
+import os
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+from ccpi.viewer.utils.conversion import DOWNSAMPLE_METHODS, Converter, cilNumpyResampleReader
+
+
+def smooth_function(z, y, x, size):
+    return 100 + 50 * np.sin(2 * np.pi * x / size) * np.cos(2 * np.pi * y / size) + 20 * z / size
+
+
+def make_test_image(size, noise_amplitude):
+    z, y, x = np.meshgrid(*[np.arange(size, dtype=np.float32)] * 3, indexing='ij')
+    checkerboard = noise_amplitude * (2 * ((x + y + z) % 2) - 1)
+    return (smooth_function(z, y, x, size) + checkerboard).astype(np.float32)
+
+
+def downsampling_error(image, size):
+    '''root mean square difference between the downsampled image and the smooth function'''
+    array = Converter.vtk2numpy(image)
+    origin = image.GetOrigin()
+    spacing = image.GetSpacing()
+    # world coordinates of the downsampled voxels, in numpy order:
+    coords = [origin[i] + spacing[i] * np.arange(n) for i, n in enumerate(array.shape[::-1])]
+    z, y, x = np.meshgrid(coords[2], coords[1], coords[0], indexing='ij')
+    return np.sqrt(np.mean((array - smooth_function(z, y, x, size))**2))
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the downsampling methods of the resample readers.')
+    parser.add_argument('--size', help='Length of each side of the test image.', type=int, default=256)
+    parser.add_argument('--target_size', help='Target size to downsample to, in MB.', type=float, default=4)
+    parser.add_argument('--workers', help='Number of worker processes to resample with.', type=int, default=1)
+    parser.add_argument('--repeats', help='Number of times to time each method.', type=int, default=3)
+    parser.add_argument('--noise', help='Amplitude of the checkerboard pattern.', type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, 'benchmark.npy')
+        image = make_test_image(args.size, args.noise)
+        np.save(fname, image)
+        image_mb = image.nbytes / 1e6
+        del image
+
+        print('Image: {0}^3 float32 ({1:.1f} MB), target size {2} MB, {3} worker(s)'.format(
+            args.size, image_mb, args.target_size, args.workers))
+        print('{:>8} {:>12} {:>12} {:>12}'.format('method', 'time (s)', 'MB/s', 'RMS error'))
+
+        for method in DOWNSAMPLE_METHODS:
+            times = []
+            for _ in range(args.repeats):
+                reader = cilNumpyResampleReader()
+                reader.SetFileName(fname)
+                reader.SetTargetSize(int(args.target_size * 1e6))
+                reader.SetNumberOfWorkers(args.workers)
+                reader.SetDownsampleMethod(method)
+                start = time.perf_counter()
+                reader.Update()
+                times.append(time.perf_counter() - start)
+            best = min(times)
+            error = downsampling_error(reader.GetOutput(), args.size)
+            print('{:>8} {:>12.3f} {:>12.1f} {:>12.3f}'.format(method, best, image_mb / best, error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+'''
+Compares the time taken by cilHDF5ResampleReader to resample contiguous and
+chunked, gzip compressed HDF5 datasets, with and without chunk aligned reads
+(see cilHDF5ResampleReader.SetUseChunkAlignedReads).
+
+The HDF5 chunks of the compressed dataset are chunk_depth slices deep along z,
+which in general doesn't line up with the number of slices which the resample
+reader resamples together. Without chunk aligned reads, the chunks which
+straddle two of these slabs are decompressed more than once.
+
+Usage:
+    python benchmark_hdf5_resample.py --size 256 --target_size 4 --chunk_depth 16
+'''
+import os
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import h5py
+import numpy as np
+from ccpi.viewer.utils.conversion import cilHDF5ResampleReader
+from ccpi.viewer.utils.hdf5_io import get_hdf5_file_pool
+
+
+def make_test_file(fname, size, chunk_depth):
+    np.random.seed(1)
+    image = np.random.randint(0, 1000, size=(size, size, size)).astype(np.uint16)
+    with h5py.File(fname, 'w') as f:
+        f.create_dataset('contiguous', data=image)
+        f.create_dataset('chunked_gzip',
+                         data=image,
+                         chunks=(chunk_depth, max(1, size // 4), max(1, size // 4)),
+                         compression='gzip')
+    return image.nbytes
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark resampling contiguous and chunked HDF5 datasets.')
+    parser.add_argument('--size', help='Length of each side of the test image.', type=int, default=256)
+    parser.add_argument('--target_size', help='Target size to downsample to, in MB.', type=float, default=4)
+    parser.add_argument('--chunk_depth', help='Number of z slices in each HDF5 chunk.', type=int, default=16)
+    parser.add_argument('--repeats', help='Number of times to time each read.', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, 'benchmark.h5')
+        image_mb = make_test_file(fname, args.size, args.chunk_depth) / 1e6
+
+        print('Image: {0}^3 uint16 ({1:.1f} MB), target size {2} MB, HDF5 chunk depth {3}'.format(
+            args.size, image_mb, args.target_size, args.chunk_depth))
+        print('{:>14} {:>8} {:>12} {:>12} {:>14}'.format('dataset', 'aligned', 'time (s)', 'MB/s', 'slices read'))
+
+        for dataset_name in ['contiguous', 'chunked_gzip']:
+            for aligned in [False, True]:
+                times = []
+                for _ in range(args.repeats):
+                    # start each read with a cold chunk cache:
+                    get_hdf5_file_pool().CloseAll()
+                    reader = cilHDF5ResampleReader()
+                    reader.SetFileName(fname)
+                    reader.SetDatasetName(dataset_name)
+                    reader.SetTargetSize(int(args.target_size * 1e6))
+                    reader.SetUseChunkAlignedReads(aligned)
+                    start = time.perf_counter()
+                    reader.Update()
+                    times.append(time.perf_counter() - start)
+                best = min(times)
+                row = (dataset_name, str(aligned), best, image_mb / best, reader.GetNumberOfSlicesRead())
+                print('{:>14} {:>8} {:>12.3f} {:>12.1f} {:>14}'.format(*row))
+        get_hdf5_file_pool().CloseAll()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+#   Copyright 2023 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import os
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+from ccpi.viewer import SLICE_ORIENTATION_XY, SLICE_ORIENTATION_XZ, SLICE_ORIENTATION_YZ
+from ccpi.viewer.CILViewer2D import CILViewer2D
+from ccpi.viewer.utils.conversion import Converter, cilNumpyCroppedReader, cilNumpyResampleReader
+from ccpi.viewer.utils.visualisation_pipeline import cilCachedExtractVOI
+
+# skip the tests on GitHub actions
+if os.environ.get('CONDA_BUILD', '0') == '1':
+    skip_test = True
+else:
+    skip_test = False
+
+print("skip_test is set to ", skip_test)
+
+
+@unittest.skipIf(skip_test, "Skipping tests on GitHub Actions")
+class CILViewer2DLODTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.input_3D_array = np.random.randint(100, size=(20, 16, 12), dtype=np.uint16)
+        self.numpy_filename_3D = 'test_lod_data.npy'
+        np.save(self.numpy_filename_3D, self.input_3D_array)
+
+        resample_reader = cilNumpyResampleReader()
+        resample_reader.SetFileName(self.numpy_filename_3D)
+        resample_reader.SetTargetSize(self.input_3D_array.nbytes // 8)
+        resample_reader.Update()
+        self.downsampled_image = resample_reader.GetOutput()
+
+        self.cil_viewer = CILViewer2D()
+        self.cil_viewer.setInputData(self.downsampled_image)
+
+        self.lod_reader = cilNumpyCroppedReader()
+        self.lod_reader.SetFileName(self.numpy_filename_3D)
+
+    def test_setLODEnabled_requires_a_reader(self):
+        with self.assertRaises(ValueError):
+            self.cil_viewer.setLODEnabled(True)
+
+    def test_full_resolution_slice_replaces_downsampled_slice(self):
+        self.cil_viewer.setLODReader(self.lod_reader)
+        self.cil_viewer.setLODEnabled(True)
+        downsampled_dims = self.cil_viewer.imageSliceMapper.GetInput().GetDimensions()
+
+        self.cil_viewer.requestFullResolutionSlice()
+        self.assertTrue(self.cil_viewer.applyFullResolutionSlice(timeout=10))
+
+        image = self.cil_viewer.getFullResolutionSlice()
+        self.assertEqual(image.GetDimensions(), (12, 16, 1))
+        self.assertEqual(self.cil_viewer.imageSliceMapper.GetInput().GetDimensions(), (12, 16, 1))
+        # the nearest slice of the full resolution image to the active slice:
+        slice_world = self.downsampled_image.GetOrigin()[2] + \
+            self.cil_viewer.getActiveSlice() * self.downsampled_image.GetSpacing()[2]
+        index = int(round(slice_world))
+        np.testing.assert_array_equal(Converter.vtk2numpy(image)[0], self.input_3D_array[index])
+        # it is placed in the plane of the downsampled slice:
+        self.assertAlmostEqual(image.GetBounds()[4], slice_world)
+
+        # scrolling shows the downsampled slice again:
+        self.cil_viewer.setActiveSlice(self.cil_viewer.getActiveSlice() - 1)
+        self.cil_viewer.updatePipeline()
+        self.assertIsNone(self.cil_viewer.getFullResolutionSlice())
+        self.assertEqual(self.cil_viewer.imageSliceMapper.GetInput().GetDimensions(), downsampled_dims)
+
+    def test_full_resolution_slice_is_discarded_if_slice_changes(self):
+        self.cil_viewer.setLODReader(self.lod_reader)
+        self.cil_viewer.setLODEnabled(True)
+        self.cil_viewer.requestFullResolutionSlice()
+        self.cil_viewer.setActiveSlice(self.cil_viewer.getActiveSlice() - 1)
+        self.cil_viewer.updatePipeline()
+        self.assertFalse(self.cil_viewer.applyFullResolutionSlice(timeout=10))
+        self.assertIsNone(self.cil_viewer.getFullResolutionSlice())
+
+    def test_slices_of_every_orientation_are_refined_by_cropped_readers(self):
+        self.cil_viewer.setLODReader(self.lod_reader)
+        self.cil_viewer.setLODEnabled(True)
+        self.assertIsNotNone(self.cil_viewer._getFullResolutionRequest())
+        self.cil_viewer.sliceOrientation = SLICE_ORIENTATION_YZ
+        request = self.cil_viewer._getFullResolutionRequest()
+        self.assertIsNotNone(request)
+        orientation, _, index, region = request
+        self.assertEqual(orientation, SLICE_ORIENTATION_YZ)
+        # only the region in view, in the plane of the slice, is read:
+        self.assertEqual(region[0:2], (index, index))
+        image = self.cil_viewer._readFullResolutionSlice(request)
+        expected = self.input_3D_array[region[4]:region[5] + 1, region[2]:region[3] + 1, index]
+        np.testing.assert_array_equal(Converter.vtk2numpy(image)[:, :, 0], expected)
+        self.cil_viewer.sliceOrientation = SLICE_ORIENTATION_XY
+
+    def tearDown(self):
+        os.remove(self.numpy_filename_3D)
+
+
+@unittest.skipIf(skip_test, "Skipping tests on GitHub Actions")
+class CILViewer2DScrollTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.input_3D_array = np.random.randint(100, size=(20, 16, 12), dtype=np.uint16)
+        self.cil_viewer = CILViewer2D()
+        self.cil_viewer.setInputData(Converter.numpy2vtkImage(self.input_3D_array, deep=1))
+
+    def scroll(self, forward=True):
+        interactor = mock.MagicMock()
+        interactor.GetShiftKey.return_value = False
+        if forward:
+            self.cil_viewer.style.OnMouseWheelForward(interactor, None)
+        else:
+            self.cil_viewer.style.OnMouseWheelBackward(interactor, None)
+
+    def test_scroll_latency_is_recorded(self):
+        stats = self.cil_viewer.getScrollLatencyStats()
+        self.assertEqual(stats['count'], 0)
+        self.assertIsNone(stats['mean'])
+        for _ in range(3):
+            self.scroll()
+        stats = self.cil_viewer.getScrollLatencyStats()
+        self.assertEqual(stats['count'], 3)
+        self.assertGreater(stats['max'], 0)
+        self.assertLessEqual(stats['mean'], stats['max'])
+        self.cil_viewer.resetScrollLatencyStats()
+        self.assertEqual(self.cil_viewer.getScrollLatencyStats()['count'], 0)
+
+    def test_renders_whilst_handling_an_event_are_coalesced(self):
+        self.cil_viewer.resetRenderStats()
+        sliceno = self.cil_viewer.getActiveSlice()
+        self.cil_viewer.style.InvokeEvent('MouseWheelBackwardEvent')
+        self.assertEqual(self.cil_viewer.getActiveSlice(), sliceno - 1)
+        stats = self.cil_viewer.getRenderStats()
+        self.assertEqual(stats['rendered'], 1)
+        self.assertGreater(stats['requested'], 1)
+        # the latency is measured up to the render:
+        self.assertEqual(self.cil_viewer.getScrollLatencyStats()['count'], 1)
+
+    def test_scrolling_displays_prefetched_slices(self):
+        self.scroll(forward=False)
+        self.scroll(forward=False)
+        self.cil_viewer.voi.WaitForPrefetch()
+        misses = self.cil_viewer.getScrollLatencyStats()['misses']
+        self.scroll(forward=False)
+        self.assertEqual(self.cil_viewer.getScrollLatencyStats()['misses'], misses)
+        sliceno = self.cil_viewer.getActiveSlice()
+        np.testing.assert_array_equal(
+            Converter.vtk2numpy(self.cil_viewer.imageSliceMapper.GetInput())[0], self.input_3D_array[sliceno])
+
+    def test_slices_of_every_orientation_are_extracted_by_the_slice_cache(self):
+        self.assertIsInstance(self.cil_viewer.voi, cilCachedExtractVOI)
+        orientations = {'x': SLICE_ORIENTATION_YZ, 'y': SLICE_ORIENTATION_XZ, 'z': SLICE_ORIENTATION_XY}
+        for axis, orientation in orientations.items():
+            with self.subTest(axis=axis):
+                self.cil_viewer.setSliceOrientation(axis)
+                self.cil_viewer.setActiveSlice(3)
+                self.cil_viewer.updatePipeline()
+                self.assertTrue(self.cil_viewer.voi.IsSliceCached(orientation, 3))
+                expected = np.take(self.input_3D_array, 3, axis=2 - orientation)
+                np.testing.assert_array_equal(
+                    Converter.vtk2numpy(self.cil_viewer.voi.GetOutput()).reshape(expected.shape), expected)
+
+
+@unittest.skipIf(skip_test, "Skipping tests on GitHub Actions")
+class CILViewer2DROITest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.input_3D_array = np.random.randint(100, size=(20, 16, 12), dtype=np.uint16)
+        self.cil_viewer = CILViewer2D()
+        self.cil_viewer.setInputData(Converter.numpy2vtkImage(self.input_3D_array, deep=1))
+        # corners of the ROI, in image coordinates (x, y, z):
+        self.cil_viewer.ROI = ((2, 3, 4), (9, 14, 17))
+
+    def test_roi_statistics_match_numpy(self):
+        sliceno = 5
+        expected = {
+            SLICE_ORIENTATION_XY: self.input_3D_array[sliceno, 3:15, 2:10],
+            SLICE_ORIENTATION_YZ: self.input_3D_array[4:18, 3:15, sliceno],
+        }
+        for orientation, region in expected.items():
+            with self.subTest(orientation=orientation):
+                self.cil_viewer.sliceOrientation = orientation
+                self.cil_viewer.setActiveSlice(sliceno)
+                statistics = self.cil_viewer.getROIStatistics()
+                self.assertEqual(statistics['count'], region.size)
+                self.assertAlmostEqual(statistics['mean'], region.mean())
+                self.assertAlmostEqual(statistics['std'], region.std())
+                self.assertEqual(statistics['histogram'].sum(), region.size)
+                self.cil_viewer.updateROIHistogram()
+        self.cil_viewer.sliceOrientation = SLICE_ORIENTATION_XY
+
+    def test_slice_statistics_are_cached_per_orientation(self):
+        statistics = self.cil_viewer.getSliceIntegralStatistics()
+        self.assertIs(self.cil_viewer.getSliceIntegralStatistics(), statistics)
+        self.cil_viewer.sliceOrientation = SLICE_ORIENTATION_YZ
+        yz_statistics = self.cil_viewer.getSliceIntegralStatistics()
+        self.assertEqual(yz_statistics.GetShape(), (20, 16))
+        self.cil_viewer.sliceOrientation = SLICE_ORIENTATION_XY
+        self.assertIs(self.cil_viewer.getSliceIntegralStatistics(), statistics)
+
+        self.cil_viewer.setActiveSlice(self.cil_viewer.getActiveSlice() - 1)
+        self.assertIsNot(self.cil_viewer.getSliceIntegralStatistics(), statistics)
+        statistics = self.cil_viewer.getSliceIntegralStatistics()
+        self.cil_viewer.img3D.Modified()
+        self.assertIsNot(self.cil_viewer.getSliceIntegralStatistics(), statistics)
+
+
+@unittest.skipIf(skip_test, "Skipping tests on GitHub Actions")
+class CILViewer2DLineProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.input_3D_array = np.random.randint(100, size=(20, 16, 12), dtype=np.uint16)
+        self.cil_viewer = CILViewer2D()
+        self.cil_viewer.setInputData(Converter.numpy2vtkImage(self.input_3D_array, deep=1))
+        self.cil_viewer.setActiveSlice(5)
+
+    def test_line_profiles_are_views_of_the_image(self):
+        profile_x, profile_y = self.cil_viewer.getLineProfiles((3, 7, 0))
+        np.testing.assert_array_equal(profile_x, self.input_3D_array[5, 7, :])
+        np.testing.assert_array_equal(profile_y, self.input_3D_array[5, :, 3])
+        image_array = Converter.vtk2numpy(self.cil_viewer.img3D)
+        self.assertTrue(np.shares_memory(profile_x, image_array))
+        self.assertTrue(np.shares_memory(profile_y, image_array))
+
+        self.cil_viewer.sliceOrientation = SLICE_ORIENTATION_YZ
+        x = self.cil_viewer.getActiveSlice()
+        profile_y, profile_z = self.cil_viewer.getLineProfiles((0, 7, 11))
+        np.testing.assert_array_equal(profile_y, self.input_3D_array[11, :, x])
+        np.testing.assert_array_equal(profile_z, self.input_3D_array[:, 7, x])
+        self.cil_viewer.sliceOrientation = SLICE_ORIENTATION_XY
+
+    def test_line_plot_data_is_laid_out_like_the_image(self):
+        self.cil_viewer.updateLinePlot((3, 7, 5), True)
+        image_x = self.cil_viewer.lineProfileX.GetOutputDataObject(0)
+        image_y = self.cil_viewer.lineProfileY.GetOutputDataObject(0)
+        self.assertEqual(image_x.GetExtent(), (0, 11, 7, 7, 5, 5))
+        self.assertEqual(image_y.GetExtent(), (3, 3, 0, 15, 5, 5))
+        np.testing.assert_array_equal(Converter.vtk2numpy(image_y).ravel(), self.input_3D_array[5, :, 3])
+        # moving along the horizontal profile reuses its image:
+        self.cil_viewer.updateLinePlot((4, 7, 5), True)
+        self.assertIs(self.cil_viewer.lineProfileX.GetOutputDataObject(0), image_x)
+        image_y = self.cil_viewer.lineProfileY.GetOutputDataObject(0)
+        np.testing.assert_array_equal(Converter.vtk2numpy(image_y).ravel(), self.input_3D_array[5, :, 4])
+
+    def test_segment_profile_is_bilinearly_interpolated(self):
+        # along a row, through the pixel centres:
+        distances, values = self.cil_viewer.getSegmentProfile((2, 3, 0), (9, 3, 0))
+        np.testing.assert_allclose(distances, np.arange(8))
+        np.testing.assert_allclose(values, self.input_3D_array[5, 3, 2:10])
+
+        # half way between four pixels:
+        _, values = self.cil_viewer.getSegmentProfile((2.5, 3.5, 0), (2.5, 3.5, 0), num_samples=1)
+        np.testing.assert_allclose(values, [self.input_3D_array[5, 3:5, 2:4].mean()])
+
+        # along a diagonal:
+        distances, values = self.cil_viewer.getSegmentProfile((0, 0, 0), (4, 3, 0), num_samples=3)
+        np.testing.assert_allclose(distances, [0, 2.5, 5])
+        slice_array = self.input_3D_array[5].astype(np.float64)
+        # (x, y) = (2, 1.5):
+        self.assertAlmostEqual(values[1], 0.5 * (slice_array[1, 2] + slice_array[2, 2]))
+        self.assertAlmostEqual(values[2], slice_array[3, 4])
+
+        with self.assertRaises(ValueError):
+            self.cil_viewer.getSegmentProfile((0, 0, 0), (4, 3, 0), num_samples=0)
+
+    def test_segment_profile_plot(self):
+        self.cil_viewer.updateSegmentProfilePlot((2, 3, 0), (9, 3, 0), True)
+        self.assertTrue(self.cil_viewer.segmentProfilePlotActor.GetVisibility())
+        image = self.cil_viewer.segmentProfile.GetOutputDataObject(0)
+        np.testing.assert_allclose(Converter.vtk2numpy(image).ravel(), self.input_3D_array[5, 3, 2:10])
+        self.cil_viewer.updateSegmentProfilePlot(None, None, False)
+        self.assertFalse(self.cil_viewer.segmentProfilePlotActor.GetVisibility())
+        self.assertFalse(self.cil_viewer.segmentProfileLineActor.GetVisibility())
+
+
+@unittest.skipIf(skip_test, "Skipping tests on GitHub Actions")
+class CILViewer2DWindowLevelUnderCursorTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.input_3D_array = np.random.randint(1000, size=(200, 64, 80), dtype=np.uint16)
+        self.cil_viewer = CILViewer2D()
+        self.cil_viewer.setInputData(Converter.numpy2vtkImage(self.input_3D_array, deep=1))
+        self.cil_viewer.setActiveSlice(5)
+
+    def test_slice_statistics_are_built_in_the_background(self):
+        self.assertIsNone(self.cil_viewer._getCachedSliceIntegralStatistics())
+        # before they are built, the range is computed from the pixels around the cursor:
+        low, high = self.cil_viewer.getRangeAroundPosition((40, 24, 0))
+        # the square around the cursor has sides of 2 * (63 // 10) + 1 pixels:
+        region = self.input_3D_array[5, 18:31, 34:47]
+        np.testing.assert_allclose((low, high), np.percentile(region, (1., 99.)))
+
+        self.assertTrue(self.cil_viewer.waitForSliceIntegralStatistics(timeout=10))
+        statistics = self.cil_viewer._getCachedSliceIntegralStatistics()
+        self.assertIsNotNone(statistics)
+        self.assertIs(self.cil_viewer.getSliceIntegralStatistics(), statistics)
+
+        # afterwards it is looked up in the tile histograms:
+        low, high = self.cil_viewer.getRangeAroundPosition((40, 24, 0))
+        self.assertEqual(statistics.GetTileSize(), 16)
+        # the square is moved to the nearest tile boundaries:
+        expected = statistics.GetPercentiles((16, 31), (32, 47), (1., 99.))
+        self.assertEqual((low, high), tuple(expected))
+
+    def test_statistics_of_a_modified_image_are_discarded(self):
+        self.cil_viewer.buildSliceIntegralStatistics()
+        self.cil_viewer.img3D.Modified()
+        self.cil_viewer.waitForSliceIntegralStatistics(timeout=10)
+        self.assertIsNone(self.cil_viewer._getCachedSliceIntegralStatistics())
+
+    def test_only_the_background_build_of_the_active_slice_is_waited_for(self):
+        release = threading.Event()
+        build = self.cil_viewer._buildSliceIntegralStatisticsInThread
+
+        def build_when_released(*args):
+            release.wait(10)
+            build(*args)
+
+        with mock.patch.object(self.cil_viewer, '_buildSliceIntegralStatisticsInThread', build_when_released):
+            self.cil_viewer.buildSliceIntegralStatistics()
+        thread = self.cil_viewer._sliceIntegralStatisticsThread
+        # the statistics of another slice are built straight away:
+        self.cil_viewer.setActiveSlice(6)
+        statistics = self.cil_viewer.getSliceIntegralStatistics()
+        self.assertTrue(thread.is_alive())
+        self.assertIs(self.cil_viewer._getCachedSliceIntegralStatistics(), statistics)
+        # the statistics of the slice being built are waited for:
+        self.cil_viewer.setActiveSlice(5)
+        release.set()
+        statistics = self.cil_viewer.getSliceIntegralStatistics()
+        self.assertFalse(thread.is_alive())
+        self.assertIs(self.cil_viewer._getCachedSliceIntegralStatistics(), statistics)
+
+
+if __name__ == '__main__':
+    unittest.main()
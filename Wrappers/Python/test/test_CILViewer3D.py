@@ -18,7 +18,10 @@ import os
 import unittest
 from unittest import mock
 
+import numpy as np
+import vtk
 from ccpi.viewer.CILViewer import CILViewer
+from ccpi.viewer.utils.conversion import Converter
 
 # skip the tests on GitHub actions
 if os.environ.get('CONDA_BUILD', '0') == '1':
@@ -77,6 +80,86 @@ class CILViewer3DTest(unittest.TestCase):
         actual_percentages = self.cil_viewer.getVolumeColorPercentiles()
         self.assertEqual(expected_percentages, actual_percentages)
 
+    def test_volume_render_with_gradient_opacity(self):
+        input_3D_array = np.random.randint(100, size=(8, 10, 12), dtype=np.uint16)
+        image = Converter.numpy2vtkImage(input_3D_array, deep=1)
+        self.cil_viewer.setInput3DData(image)
+        self.cil_viewer.setVolumeRenderOpacityMethod('gradient')
+        self.cil_viewer.installVolumeRenderActorPipeline()
+        self.cil_viewer.volume.VisibilityOn()
+        self.cil_viewer.renWin.Render()
+
+        self.assertIs(self.cil_viewer.volume_mapper.GetInput(), self.cil_viewer.img3D)
+        # the gradient magnitude is computed by cilGradientMagnitude:
+        expected_filter = vtk.vtkImageGradientMagnitude()
+        expected_filter.SetDimensionality(3)
+        expected_filter.HandleBoundariesOn()
+        expected_filter.SetInputData(image)
+        expected_filter.Update()
+        np.testing.assert_allclose(Converter.vtk2numpy(self.cil_viewer.getImageGradientMagnitude()),
+                                   Converter.vtk2numpy(expected_filter.GetOutput()))
+
+
+@unittest.skipIf(skip_test, "Skipping tests on GitHub Actions")
+class CILViewer3DLODTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.input_3D_array = np.random.randint(100, size=(16, 16, 16), dtype=np.uint16)
+        self.cil_viewer = CILViewer()
+        self.cil_viewer.setInput3DData(Converter.numpy2vtkImage(self.input_3D_array, deep=1))
+        self.cil_viewer.installVolumeRenderActorPipeline()
+        self.cil_viewer.setVolumeLODMinimumSize(8)
+
+    def test_levels_are_built_in_the_background(self):
+        self.cil_viewer.setVolumeLODEnabled(True)
+        self.assertTrue(self.cil_viewer.applyVolumeLODLevels(timeout=10))
+        levels = self.cil_viewer.getVolumeLODLevels()
+        # 8**3, 4**3 and 2**3 voxels, no smaller than the minimum size:
+        self.assertEqual([level.GetDimensions() for level in levels], [(8, 8, 8), (4, 4, 4), (2, 2, 2)])
+        # the voxels are the averages of the blocks, at their centres:
+        expected = self.input_3D_array.reshape(8, 2, 8, 2, 8, 2).mean(axis=(1, 3, 5))
+        np.testing.assert_array_equal(Converter.vtk2numpy(levels[0]), expected.astype(np.uint16))
+        np.testing.assert_allclose(levels[0].GetSpacing(), (2, 2, 2))
+        np.testing.assert_allclose(levels[0].GetOrigin(), (0.5, 0.5, 0.5))
+
+    def test_coarser_level_is_rendered_whilst_interacting(self):
+        self.cil_viewer.setVolumeLODEnabled(True)
+        self.cil_viewer.applyVolumeLODLevels(timeout=10)
+        # the full resolution render is too slow for the frame time, so level 1 is chosen:
+        self.cil_viewer.setVolumeLODFrameTime(0.2)
+        self.cil_viewer._volumeLODRenderTimes = {0: 1.0}
+        full_mapper = self.cil_viewer.getVolumeMapper()
+        self.cil_viewer.style.InvokeEvent('StartInteractionEvent')
+        self.assertEqual(self.cil_viewer.getVolumeLODLevel(), 1)
+        self.assertIsNot(self.cil_viewer.volume.GetMapper(), full_mapper)
+        self.cil_viewer.style.InvokeEvent('EndInteractionEvent')
+        self.assertEqual(self.cil_viewer.getVolumeLODLevel(), 0)
+        self.assertIs(self.cil_viewer.volume.GetMapper(), full_mapper)
+
+    def test_level_is_chosen_to_fit_the_frame_time(self):
+        self.cil_viewer.setVolumeLODEnabled(True)
+        self.cil_viewer.applyVolumeLODLevels(timeout=10)
+        self.cil_viewer.setVolumeLODFrameTime(0.2)
+        # only the full resolution render time is known, the others are estimated from it:
+        self.cil_viewer._volumeLODRenderTimes = {0: 1.0}
+        self.assertEqual(self.cil_viewer._chooseVolumeLODLevel(), 1)
+        self.cil_viewer._volumeLODRenderTimes = {0: 0.1}
+        self.assertEqual(self.cil_viewer._chooseVolumeLODLevel(), 0)
+        # when no level is fast enough, the coarsest is used:
+        self.cil_viewer._volumeLODRenderTimes = {0: 1000.}
+        self.assertEqual(self.cil_viewer._chooseVolumeLODLevel(), 3)
+        with self.assertRaises(ValueError):
+            self.cil_viewer.setVolumeLODFrameTime(0)
+
+    def test_levels_are_discarded_when_the_image_changes(self):
+        self.cil_viewer.setVolumeLODEnabled(True)
+        self.cil_viewer.applyVolumeLODLevels(timeout=10)
+        self.cil_viewer.setInput3DData(Converter.numpy2vtkImage(self.input_3D_array[:8], deep=1))
+        self.assertEqual(self.cil_viewer.getVolumeLODLevels(), [])
+        self.assertTrue(self.cil_viewer.applyVolumeLODLevels(timeout=10))
+        self.assertEqual(self.cil_viewer.getVolumeLODLevels()[0].GetDimensions(), (8, 8, 4))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -18,7 +18,11 @@ import unittest
 from unittest import mock
 import os
 
+import numpy as np
+import vtk
 from ccpi.viewer.CILViewer import CILViewerBase
+from ccpi.viewer.CILViewerBase import SliceIntegralStatistics
+from ccpi.viewer.utils import Converter
 
 # skip the tests on GitHub actions
 if os.environ.get('CONDA_BUILD', '0') == '1':
@@ -52,6 +56,50 @@ class CILViewerBaseTest(unittest.TestCase):
         self.assertEqual(self.CILViewerBase_instance.axisLabelsText, labels)
 
 
+@unittest.skipIf(skip_test, "Skipping tests on GitHub Actions")
+class CILViewerBaseRenderSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cil_viewer = CILViewerBase()
+        self.renders = []
+        self.cil_viewer.getRenderer().AddObserver('EndEvent', lambda caller, event: self.renders.append(event))
+
+    def test_requests_outside_a_batch_render_straight_away(self):
+        self.cil_viewer.requestRender()
+        self.cil_viewer.requestRender()
+        self.assertEqual(len(self.renders), 2)
+        self.assertEqual(self.cil_viewer.getRenderStats(), {'requested': 2, 'rendered': 2, 'coalesced': 0})
+
+    def test_requests_in_a_batch_are_coalesced(self):
+        with self.cil_viewer.renderBatch():
+            self.cil_viewer.requestRender()
+            with self.cil_viewer.renderBatch():
+                self.cil_viewer.requestRender()
+            self.assertEqual(len(self.renders), 0)
+            self.cil_viewer.requestRender()
+        self.assertEqual(len(self.renders), 1)
+        self.assertEqual(self.cil_viewer.getRenderStats(), {'requested': 3, 'rendered': 1, 'coalesced': 2})
+        self.cil_viewer.resetRenderStats()
+        self.assertEqual(self.cil_viewer.getRenderStats(), {'requested': 0, 'rendered': 0, 'coalesced': 0})
+
+    def test_max_frame_rate_defers_renders(self):
+        self.cil_viewer.setMaxFrameRate(0.001)
+        self.cil_viewer.requestRender()
+        self.cil_viewer.requestRender()
+        self.cil_viewer.requestRender()
+        self.assertEqual(len(self.renders), 1)
+        self.assertEqual(self.cil_viewer.getRenderStats(), {'requested': 3, 'rendered': 1, 'coalesced': 1})
+        self.cil_viewer.flushRender()
+        self.assertEqual(len(self.renders), 2)
+        self.cil_viewer.flushRender()
+        self.assertEqual(len(self.renders), 2)
+        with self.assertRaises(ValueError):
+            self.cil_viewer.setMaxFrameRate(0)
+        self.cil_viewer.setMaxFrameRate(None)
+        self.cil_viewer.requestRender()
+        self.assertEqual(len(self.renders), 3)
+
+
 @unittest.skipIf(skip_test, "Skipping tests on GitHub Actions")
 class CILViewer3DTest(unittest.TestCase):
 
@@ -81,5 +129,138 @@ class CILViewer3DTest(unittest.TestCase):
             self.cil_viewer.addWidgetReference(widget2, widget_name)
 
 
+@unittest.skipIf(skip_test, "Skipping tests on GitHub Actions")
+class CILViewerBaseImageStatisticsTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.cil_viewer = CILViewerBase()
+        array = np.random.normal(100, 20, size=(20, 16, 12)).clip(0, 255).astype(np.uint8)
+        self.cil_viewer.img3D = Converter.numpy2vtkImage(array, deep=1)
+
+    def test_image_statistics_are_cached_until_the_image_is_modified(self):
+        statistics = self.cil_viewer.getImageStatistics('scalar')
+        self.assertIs(self.cil_viewer.getImageStatistics('scalar'), statistics)
+        self.assertIs(self.cil_viewer.getImageHistogramStatistics('scalar'), statistics.histogram_statistics)
+        gradient_statistics = self.cil_viewer.getImageStatistics('gradient')
+        self.assertIsNot(gradient_statistics, statistics)
+
+        self.cil_viewer.img3D.Modified()
+        self.assertIsNot(self.cil_viewer.getImageStatistics('scalar'), statistics)
+        self.assertIsNot(self.cil_viewer.getImageStatistics('gradient'), gradient_statistics)
+
+    def test_gradient_magnitude_is_computed_once_per_image(self):
+        gradient = self.cil_viewer.getImageGradientMagnitude()
+        self.cil_viewer.getImageMapRange((80., 99.), 'gradient')
+        self.cil_viewer.getImageMapWholeRange('gradient')
+        self.assertIs(self.cil_viewer.getImageGradientMagnitude(), gradient)
+        self.assertEqual(gradient.GetScalarType(), self.cil_viewer.img3D.GetScalarType())
+
+        self.cil_viewer.setGradientMagnitudeScalarType(vtk.VTK_FLOAT)
+        self.assertEqual(self.cil_viewer.getGradientMagnitudeScalarType(), vtk.VTK_FLOAT)
+        float_gradient = self.cil_viewer.getImageGradientMagnitude()
+        self.assertEqual(float_gradient.GetScalarType(), vtk.VTK_FLOAT)
+        # the image is unchanged, so its statistics are still cached:
+        self.assertIs(self.cil_viewer.getImageGradientMagnitude(), float_gradient)
+
+        self.cil_viewer.img3D.Modified()
+        self.assertIsNot(self.cil_viewer.getImageGradientMagnitude(), float_gradient)
+
+    def test_getImageMapRange_matches_vtkImageHistogramStatistics(self):
+        for method in ['scalar', 'gradient']:
+            if method == 'scalar':
+                input_data = self.cil_viewer.img3D
+            else:
+                grad = vtk.vtkImageGradientMagnitude()
+                grad.SetInputData(self.cil_viewer.img3D)
+                grad.SetDimensionality(3)
+                grad.Update()
+                input_data = grad.GetOutput()
+            ia = vtk.vtkImageHistogramStatistics()
+            ia.SetInputData(input_data)
+            ia.Update()
+            self.assertEqual(self.cil_viewer.getImageMapWholeRange(method), (ia.GetMinimum(), ia.GetMaximum()))
+
+            for percentiles in [(0., 100.), (5., 95.), (80., 99.)]:
+                ia.SetAutoRangePercentiles(*percentiles)
+                ia.Update()
+                np.testing.assert_allclose(self.cil_viewer.getImageMapRange(percentiles, method),
+                                           ia.GetAutoRange(),
+                                           atol=2 * ia.GetBinSpacing())
+
+    def test_getImageMapRange_is_never_inverted(self):
+        array = np.random.randint(65536, size=(20, 16, 12)).astype(np.uint16)
+        self.cil_viewer.img3D = Converter.numpy2vtkImage(array, deep=1)
+        for lower in np.arange(0., 100., 0.5):
+            for percentiles in [(lower, lower), (lower, lower + 0.5)]:
+                with self.subTest(percentiles=percentiles):
+                    low, high = self.cil_viewer.getImageMapRange(percentiles, 'scalar')
+                    self.assertLessEqual(low, high)
+
+
+class SliceIntegralStatisticsTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.array = np.random.normal(1000, 50, size=(37, 45))
+        self.statistics = SliceIntegralStatistics(self.array, num_bins=64, tile_size=4)
+
+    def expected_histogram(self, rows, columns):
+        spacing = (self.array.max() - self.array.min()) / 63
+        bins = np.clip(np.floor((self.array - self.array.min()) / spacing), 0, 63).astype(int)
+        return np.bincount(bins[rows[0]:rows[1] + 1, columns[0]:columns[1] + 1].ravel(), minlength=64)
+
+    def test_rectangles_match_numpy(self):
+        rectangles = [
+            ((0, 36), (0, 44)),
+            ((3, 3), (5, 5)),
+            ((1, 2), (10, 30)),
+            ((4, 11), (8, 15)),
+            ((2, 33), (1, 42)),
+            ((35, 5), (40, 0)),
+        ]
+        for _ in range(20):
+            rectangles.append((tuple(np.random.randint(37, size=2)), tuple(np.random.randint(45, size=2))))
+        for rows, columns in rectangles:
+            with self.subTest(rows=rows, columns=columns):
+                r0, r1 = min(rows), max(rows)
+                c0, c1 = min(columns), max(columns)
+                region = self.array[r0:r1 + 1, c0:c1 + 1]
+                statistics = self.statistics.GetStatistics(rows, columns)
+                self.assertEqual(statistics['count'], region.size)
+                self.assertAlmostEqual(statistics['mean'], region.mean(), places=8)
+                self.assertAlmostEqual(statistics['sum'], region.sum(), places=6)
+                self.assertAlmostEqual(statistics['std'], region.std(), places=6)
+                np.testing.assert_array_equal(self.statistics.GetHistogram(rows, columns),
+                                              self.expected_histogram((r0, r1), (c0, c1)))
+
+    def test_bins_span_the_values_of_the_slice(self):
+        self.assertEqual(self.statistics.GetNumberOfBins(), 64)
+        self.assertEqual(self.statistics.GetBinOrigin(), self.array.min())
+        self.assertAlmostEqual(self.statistics.GetBinOrigin() + 63 * self.statistics.GetBinSpacing(), self.array.max())
+
+    def test_percentiles_are_within_a_bin_of_numpy(self):
+        spacing = self.statistics.GetBinSpacing()
+        for rows, columns in [((0, 36), (0, 44)), ((4, 11), (8, 15)), ((3, 3), (5, 5))]:
+            with self.subTest(rows=rows, columns=columns):
+                region = self.array[rows[0]:rows[1] + 1, columns[0]:columns[1] + 1]
+                low, high = self.statistics.GetPercentiles(rows, columns, (1., 99.))
+                expected_low, expected_high = np.percentile(region, (1., 99.))
+                self.assertLessEqual(abs(low - expected_low), spacing)
+                self.assertLessEqual(abs(high - expected_high), spacing)
+        # the lowest value is in the first bin which isn't empty:
+        low, = self.statistics.GetPercentiles((4, 11), (8, 15), (0., ))
+        self.assertLessEqual(low, self.array[4:12, 8:16].min())
+        self.assertGreater(low + spacing, self.array[4:12, 8:16].min())
+
+    def test_rectangles_must_be_inside_the_slice(self):
+        with self.assertRaises(ValueError):
+            self.statistics.GetStatistics((0, 37), (0, 5))
+        with self.assertRaises(ValueError):
+            self.statistics.GetHistogram((0, 5), (-1, 5))
+        with self.assertRaises(ValueError):
+            SliceIntegralStatistics(np.zeros((2, 2, 2)))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,3 +1,4 @@
+import json
 import os
 import unittest
 
@@ -175,6 +176,95 @@ class TestCLIResample(unittest.TestCase):
         target_size = int(target_size * 1e6)
         self._test_resampling_acq_data(reader, target_size)
 
+    def test_resample_with_yaml_downsample_method(self):
+        # 'max' and 'min' must not be evaluated as python builtins when read from the yaml file:
+        for method in ['max', 'mean']:
+            with self.subTest(method=method):
+                self.raw_dict['resample']['downsample_method'] = method
+                with open(self.raw_yaml_filename, 'w') as file:
+                    yaml.dump(self.raw_dict, file)
+
+                if system('resample -f {}'.format(self.raw_yaml_filename)) != 0:
+                    raise Exception("Error running test_resample_with_yaml_downsample_method")
+
+                reader = cilviewerHDF5Reader()
+                reader.SetFileName(self.raw_dict['output']['file_name'])
+                target_size = int(self.raw_dict['resample']['target_size'] * 1e6)
+                self._test_resampling_acq_data(reader, target_size)
+
+                with h5py.File(self.raw_dict['output']['file_name'], 'r') as f:
+                    self.assertEqual(f['entry2/tomo_entry/data/data'].attrs['downsample_method'], method)
+
+    def test_resample_command_line_downsample_method(self):
+        dict = self.raw_dict
+        shape = list(eval(dict['input']['shape']))
+        shape = f"{shape[0]},{shape[1]},{shape[2]}"
+        out = dict['output']['file_name']
+
+        command = f"resample -i {dict['input']['file_name']} --shape {shape} --is_fortran {dict['input']['is_fortran']} --is_big_endian {dict['input']['is_big_endian']} --typecode {dict['input']['typecode']} -o {out} -target_size {dict['resample']['target_size']} --resample_z {dict['resample']['resample_z']} --out_format {dict['output']['format']} --downsample_method median"
+
+        if system(command) != 0:
+            raise Exception("Error running test_resample_command_line_downsample_method")
+
+        reader = cilviewerHDF5Reader()
+        reader.SetFileName(out)
+        target_size = int(dict['resample']['target_size'] * 1e6)
+        self._test_resampling_acq_data(reader, target_size)
+
+        with h5py.File(out, 'r') as f:
+            self.assertEqual(f['entry2/tomo_entry/data/data'].attrs['downsample_method'], 'median')
+
+    def test_resample_command_line_stream(self):
+        dict = self.raw_dict
+        shape = list(eval(dict['input']['shape']))
+        shape = f"{shape[0]},{shape[1]},{shape[2]}"
+        out = dict['output']['file_name']
+        streamed_out = 'test_raw_out_streamed.hdf5'
+
+        command = f"resample -i {dict['input']['file_name']} --shape {shape} --is_fortran {dict['input']['is_fortran']} --is_big_endian {dict['input']['is_big_endian']} --typecode {dict['input']['typecode']} -target_size {dict['resample']['target_size']} --resample_z {dict['resample']['resample_z']} --out_format {dict['output']['format']}"
+
+        if system(command + f" -o {out}") != 0:
+            raise Exception("Error running test_resample_command_line_stream")
+        if system(command + f" -o {streamed_out} --stream --compression gzip --compression_opts 4") != 0:
+            raise Exception("Error running test_resample_command_line_stream")
+
+        reader = cilviewerHDF5Reader()
+        reader.SetFileName(streamed_out)
+        target_size = int(dict['resample']['target_size'] * 1e6)
+        self._test_resampling_acq_data(reader, target_size)
+
+        # the streamed file has the same contents as the file written in one go:
+        with h5py.File(out, 'r') as f, h5py.File(streamed_out, 'r') as f_streamed:
+            for entry in ['entry1', 'entry2']:
+                dset = f[entry + '/tomo_entry/data/data']
+                dset_streamed = f_streamed[entry + '/tomo_entry/data/data']
+                self.assertEqual(dset.shape, dset_streamed.shape)
+                for key, value in dset.attrs.items():
+                    np.testing.assert_array_equal(dset_streamed.attrs[key], value)
+            dset_streamed = f_streamed['entry2/tomo_entry/data/data']
+            np.testing.assert_array_equal(dset_streamed[()], f['entry2/tomo_entry/data/data'][()])
+            self.assertEqual(dset_streamed.chunks, (1, ) + dset_streamed.shape[1:])
+            self.assertEqual(dset_streamed.compression, 'gzip')
+        os.remove(streamed_out)
+
+    def test_resample_command_line_profile(self):
+        dict = self.raw_dict
+        shape = list(eval(dict['input']['shape']))
+        shape = f"{shape[0]},{shape[1]},{shape[2]}"
+        trace_file = 'test_resample_trace.json'
+
+        command = f"resample -i {dict['input']['file_name']} --shape {shape} --is_fortran {dict['input']['is_fortran']} --is_big_endian {dict['input']['is_big_endian']} --typecode {dict['input']['typecode']} -o {dict['output']['file_name']} -target_size {dict['resample']['target_size']} --resample_z {dict['resample']['resample_z']} --out_format {dict['output']['format']} --profile {trace_file}"
+
+        if system(command) != 0:
+            raise Exception("Error running test_resample_command_line_profile")
+
+        with open(trace_file) as f:
+            trace = json.load(f)
+        names = set(event['name'] for event in trace['traceEvents'] if event['ph'] == 'X')
+        for name in ['resample file', 'ImageReader.Read', 'cilRawResampleReader', 'chunk read', 'resample', 'write']:
+            self.assertIn(name, names)
+        os.remove(trace_file)
+
     def tearDown(self):
         files = [self.hdf5_filename_3D, self.hdf5_yaml_filename, self.raw_filename_3D, self.raw_yaml_filename]
         for f in files:
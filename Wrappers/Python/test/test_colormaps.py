@@ -0,0 +1,76 @@
+#   Copyright 2023 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import unittest
+
+import numpy as np
+from ccpi.viewer.utils import colormaps
+from ccpi.viewer.utils.colormaps import CILColorMaps
+
+
+class TestOpacityFunctions(unittest.TestCase):
+
+    def setUp(self):
+        self.x = np.linspace(0, 10, num=11)
+
+    def test_relu(self):
+        expected = [0, 0, 0, 0, 0, 0, 0.125, 0.25, 0.375, 0.5, 0]
+        np.testing.assert_allclose(colormaps.relu(self.x, 5, 9, 0.5), expected)
+
+    def test_ramp(self):
+        expected = [0, 0, 0, 0, 0, 0, 0.25, 0.5, 0.75, 1, 1]
+        np.testing.assert_allclose(colormaps.ramp(self.x, 5, 9), expected)
+
+    def test_step(self):
+        expected = [0, 0, 0, 0, 0, 2, 2, 2, 2, 2, 2]
+        np.testing.assert_allclose(colormaps.step(self.x, 5, 2), expected)
+
+    def test_ramp_with_equal_limits_is_a_step(self):
+        np.testing.assert_allclose(colormaps.ramp(self.x, 5, 5), colormaps.step(self.x, 5))
+
+
+class TestCILColorMaps(unittest.TestCase):
+
+    def test_get_color_transfer_function(self):
+        tf = CILColorMaps.get_color_transfer_function('viridis', (10, 20))
+        colors = CILColorMaps.get_color_map('viridis')
+        self.assertEqual(tf.GetSize(), len(colors))
+        self.assertEqual(tf.GetRange(), (10, 20))
+        np.testing.assert_allclose(tf.GetColor(10), colors[0], atol=1e-6)
+        np.testing.assert_allclose(tf.GetColor(20), colors[-1], atol=1e-6)
+        # unchanged arguments return a copy of the same function, which may be modified:
+        tf.AddRGBPoint(15, 1, 0, 0)
+        cached_tf = CILColorMaps.get_color_transfer_function('viridis', (10, 20))
+        self.assertIsNot(cached_tf, tf)
+        self.assertEqual(cached_tf.GetSize(), len(colors))
+        np.testing.assert_allclose(cached_tf.GetColor(20), colors[-1], atol=1e-6)
+        self.assertEqual(CILColorMaps.get_color_transfer_function('viridis', (10, 21)).GetRange(), (10, 21))
+
+    def test_get_opacity_transfer_function(self):
+        x = np.linspace(0, 10, num=11)
+        opacity = CILColorMaps.get_opacity_transfer_function(x, colormaps.relu, 5, 9, 0.5)
+        self.assertEqual(opacity.GetSize(), len(x))
+        for _x, _y in zip(x, colormaps.relu(x, 5, 9, 0.5)):
+            self.assertAlmostEqual(opacity.GetValue(_x), _y)
+        opacity.AddPoint(2, 1)
+        cached_opacity = CILColorMaps.get_opacity_transfer_function(x, colormaps.relu, 5, 9, 0.5)
+        self.assertIsNot(cached_opacity, opacity)
+        self.assertEqual(cached_opacity.GetSize(), len(x))
+        self.assertAlmostEqual(cached_opacity.GetValue(2), 0)
+        self.assertAlmostEqual(
+            CILColorMaps.get_opacity_transfer_function(x, colormaps.relu, 5, 8, 0.5).GetValue(8), 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,8 @@ import unittest
 import numpy as np
 import vtk
 from ccpi.viewer.utils.conversion import (Converter, cilRawResampleReader, cilMetaImageResampleReader,
-                                          cilNumpyResampleReader, cilNumpyMETAImageWriter)
+                                          cilNumpyResampleReader, cilNumpyMETAImageWriter, block_reduce,
+                                          calculate_block_edges)
 
 import numpy as np
 '''
@@ -72,6 +73,35 @@ class TestConversion(unittest.TestCase):
         np.testing.assert_array_equal(read_mhd_raw, raw_array)
         np.testing.assert_array_equal(read_mhd_raw, self.input_3D_array)
 
+    def test_calculate_block_edges(self):
+        np.testing.assert_array_equal(calculate_block_edges(10, 5), [0, 2, 4, 6, 8, 10])
+        np.testing.assert_array_equal(calculate_block_edges(10, 3), [0, 3, 6, 10])
+        with self.assertRaises(ValueError):
+            calculate_block_edges(10, 11)
+        with self.assertRaises(ValueError):
+            calculate_block_edges(10, 0)
+
+    def test_block_reduce(self):
+        # compares block_reduce with reducing each block in turn,
+        # including blocks of unequal size:
+        array = self.input_3D_array
+        block_edges = [[0, 2, 5], calculate_block_edges(10, 3), calculate_block_edges(6, 4)]
+        reductions = {'mean': np.mean, 'max': np.max, 'min': np.min, 'median': np.median}
+        for method, reduction in reductions.items():
+            with self.subTest(method=method):
+                reduced = block_reduce(array, block_edges, method)
+                self.assertEqual(reduced.shape, (2, 3, 4))
+                for i in range(2):
+                    for j in range(3):
+                        for k in range(4):
+                            block = array[block_edges[0][i]:block_edges[0][i + 1],
+                                          block_edges[1][j]:block_edges[1][j + 1],
+                                          block_edges[2][k]:block_edges[2][k + 1]]
+                            self.assertAlmostEqual(reduced[i, j, k], reduction(block))
+
+        with self.assertRaises(ValueError):
+            block_reduce(array, block_edges, 'sum')
+
     def tearDown(self):
         files = [self.raw_filename_3D]
         for f in files:
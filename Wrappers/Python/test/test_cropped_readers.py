@@ -97,6 +97,28 @@ class TestCroppedReaders(unittest.TestCase):
                 self.check_extent(reader, target_z_extent)
                 self.check_values(target_z_extent, reader.GetOutput())
 
+    def test_meta_cropped_reader_compressed_mha(self):
+        fname = 'test_3D_data_compressed.mha'
+        writer = vtk.vtkMetaImageWriter()
+        writer.SetFileName(fname)
+        writer.SetInputData(Converter.numpy2vtkImage(self.input_3D_array))
+        writer.SetCompression(True)
+        writer.Write()
+        self.addCleanup(os.remove, fname)
+        for target_extent in [(0, -1, 0, -1, 1, 3), (1, 4, 2, 3, 2, 4)]:
+            with self.subTest(target_extent=target_extent):
+                reader = cilMetaImageCroppedReader()
+                reader.SetFileName(fname)
+                reader.SetTargetExtent(target_extent)
+                reader.Update()
+                self.assertTrue(reader.GetIsCompressedData())
+                x_max = target_extent[1] if target_extent[1] >= 0 else self.input_3D_array.shape[2] - 1
+                y_max = target_extent[3] if target_extent[3] >= 0 else self.input_3D_array.shape[1] - 1
+                np.testing.assert_array_equal(
+                    Converter.vtk2numpy(reader.GetOutput()),
+                    self.input_3D_array[target_extent[4]:target_extent[5] + 1, target_extent[2]:y_max + 1,
+                                        target_extent[0]:x_max + 1])
+
     def _setup_tiff_cropped_reader(self, target_z_extent):
         reader = cilTIFFCroppedReader()
         reader.SetFileName(self.tiff_fnames)
@@ -121,6 +143,76 @@ class TestCroppedReaders(unittest.TestCase):
         self.assertEqual(self.raw_type_code, reader.GetTypeCodeName())
         self.check_values(target_z_extent, reader.GetOutput(), expected_array)
 
+    def _setup_cropped_readers(self):
+        raw_reader = cilRawCroppedReader()
+        raw_reader.SetFileName(self.raw_filename_3D)
+        raw_reader.SetBigEndian(False)
+        raw_reader.SetIsFortran(False)
+        raw_reader.SetTypeCodeName(self.raw_type_code)
+        raw_reader.SetStoredArrayShape(np.shape(self.input_3D_array))
+        numpy_reader = cilNumpyCroppedReader()
+        numpy_reader.SetFileName(self.numpy_filename_3D)
+        meta_reader = cilMetaImageCroppedReader()
+        meta_reader.SetFileName(self.meta_filename_3D)
+        tiff_reader = cilTIFFCroppedReader()
+        tiff_reader.SetFileName(self.tiff_fnames)
+        return {'raw': raw_reader, 'numpy': numpy_reader, 'meta': meta_reader, 'tiff': tiff_reader}
+
+    def test_cropped_readers_with_target_extent(self):
+        # (target extent, the extent it is clipped to):
+        extents = [
+            # whole rows, one read per slice:
+            ((0, 5, 1, 2, 1, 3), (0, 5, 1, 2, 1, 3)),
+            # whole slices, a single read:
+            ((0, -1, 0, -1, 2, 4), (0, 5, 0, 3, 2, 4)),
+            # cropped on every axis, read from a memory map:
+            ((2, 4, 1, 3, 0, 1), (2, 4, 1, 3, 0, 1)),
+            # beyond the image:
+            ((-1, 10, 3, 3, 4, 20), (0, 5, 3, 3, 4, 4)),
+        ]
+        for label, reader in self._setup_cropped_readers().items():
+            for target_extent, extent in extents:
+                with self.subTest(reader=label, target_extent=target_extent):
+                    reader.SetTargetExtent(target_extent)
+                    reader.Update()
+                    image = reader.GetOutput()
+                    self.assertEqual(image.GetExtent(), extent)
+                    np.testing.assert_array_equal(
+                        Converter.vtk2numpy(image),
+                        self.input_3D_array[extent[4]:extent[5] + 1, extent[2]:extent[3] + 1, extent[0]:extent[1] + 1])
+            with self.subTest(reader=label):
+                # setting the z extent replaces the target extent:
+                reader.SetTargetZExtent((1, 2))
+                self.assertIsNone(reader.GetTargetExtent())
+                self.check_extent(reader, [1, 2])
+                self.check_values([1, 2], reader.GetOutput())
+
+    def test_set_target_extent_validates_input(self):
+        reader = cilNumpyCroppedReader()
+        with self.assertRaises(ValueError):
+            reader.SetTargetExtent((0, 1, 0, 1))
+        # an extent which doesn't overlap the image of shape (6, 4, 5):
+        reader.SetTargetExtent((10, 12, 0, 1, 0, 1))
+        with self.assertRaises(ValueError):
+            reader._GetExtentToRead([6, 4, 5])
+
+    def test_raw_cropped_reader_big_endian(self):
+        array = (self.input_3D_array * 300).astype('>u2')
+        with open(self.raw_filename_3D, 'wb') as f:
+            f.write(array.tobytes())
+        for target_extent in [(0, 5, 0, 3, 1, 3), (1, 4, 0, 3, 1, 3)]:
+            with self.subTest(target_extent=target_extent):
+                reader = cilRawCroppedReader()
+                reader.SetFileName(self.raw_filename_3D)
+                reader.SetBigEndian(True)
+                reader.SetIsFortran(False)
+                reader.SetTypeCodeName('uint16')
+                reader.SetStoredArrayShape(np.shape(array))
+                reader.SetTargetExtent(target_extent)
+                reader.Update()
+                np.testing.assert_array_equal(Converter.vtk2numpy(reader.GetOutput()),
+                                              array[1:4, :, target_extent[0]:target_extent[1] + 1])
+
     def tearDown(self):
         files = [self.raw_filename_3D, self.numpy_filename_3D, self.meta_filename_3D] + self.tiff_fnames
         for f in files:
@@ -1,11 +1,13 @@
 import os
+import time
 import unittest
 
 import h5py
 import numpy as np
 import vtk
 from ccpi.viewer.utils.conversion import Converter, calculate_target_downsample_shape, cilHDF5CroppedReader, cilHDF5ResampleReader
-from ccpi.viewer.utils.hdf5_io import (HDF5Reader, HDF5SubsetReader, write_image_data_to_hdf5)
+from ccpi.viewer.utils.hdf5_io import (HDF5ChunkAlignedReader, HDF5FilePool, HDF5Reader, HDF5SubsetReader,
+                                       get_hdf5_file_pool, write_image_data_to_hdf5)
 
 
 class TestHDF5IO(unittest.TestCase):
@@ -186,5 +188,164 @@ class TestHDF5IO(unittest.TestCase):
             os.remove(f)
 
 
+class TestHDF5FilePool(unittest.TestCase):
+
+    def setUp(self):
+        self.hdf5_filename = 'test_pool_data.h5'
+        self.input_array = np.arange(60, dtype=np.float32).reshape(3, 4, 5)
+        with h5py.File(self.hdf5_filename, 'w') as f:
+            f.create_dataset('ImageData', data=self.input_array)
+        self.pool = HDF5FilePool(idle_timeout=None)
+
+    def test_file_is_reused(self):
+        for _ in range(3):
+            with self.pool.Open(self.hdf5_filename) as f:
+                np.testing.assert_array_equal(f['ImageData'][()], self.input_array)
+        metrics = self.pool.GetMetrics()
+        self.assertEqual(metrics['opens'], 1)
+        self.assertEqual(metrics['hits'], 2)
+        self.assertEqual(metrics['open_files'], 1)
+
+    def test_file_is_reopened_when_it_changes(self):
+        with self.pool.Open(self.hdf5_filename) as f:
+            f['ImageData'][()]
+        self.pool.Invalidate(self.hdf5_filename)
+        self.assertEqual(self.pool.GetNumberOfOpenFiles(), 0)
+        with h5py.File(self.hdf5_filename, 'w') as f:
+            f.create_dataset('ImageData', data=2 * self.input_array)
+        with self.pool.Open(self.hdf5_filename) as f:
+            np.testing.assert_array_equal(f['ImageData'][()], 2 * self.input_array)
+        self.assertEqual(self.pool.GetMetrics()['opens'], 2)
+
+        # replacing the file without invalidating it:
+        with h5py.File(self.hdf5_filename + '.tmp', 'w') as f:
+            f.create_dataset('ImageData', data=3 * self.input_array)
+        os.replace(self.hdf5_filename + '.tmp', self.hdf5_filename)
+        with self.pool.Open(self.hdf5_filename) as f:
+            np.testing.assert_array_equal(f['ImageData'][()], 3 * self.input_array)
+        metrics = self.pool.GetMetrics()
+        self.assertEqual(metrics['opens'], 3)
+        self.assertEqual(metrics['invalidations'], 1)
+
+    def test_file_is_closed_after_reads_when_invalidated(self):
+        with self.pool.Open(self.hdf5_filename) as f:
+            self.pool.Invalidate(self.hdf5_filename)
+            np.testing.assert_array_equal(f['ImageData'][()], self.input_array)
+        self.assertFalse(f)
+        self.assertEqual(self.pool.GetNumberOfOpenFiles(), 0)
+
+    def test_idle_files_are_evicted(self):
+        self.pool.SetIdleTimeout(0.1)
+        with self.pool.Open(self.hdf5_filename) as f:
+            f['ImageData'][()]
+        self.assertEqual(self.pool.GetNumberOfOpenFiles(), 1)
+        time.sleep(0.2)
+        self.pool.EvictIdle()
+        self.assertEqual(self.pool.GetNumberOfOpenFiles(), 0)
+        self.assertEqual(self.pool.GetMetrics()['evictions'], 1)
+
+    def test_set_chunk_cache(self):
+        self.pool.SetChunkCache(1024 * 1024, 521)
+        self.assertEqual(self.pool.GetChunkCache(), (1024 * 1024, 521))
+        with self.pool.Open(self.hdf5_filename) as f:
+            self.assertEqual(f.id.get_access_plist().get_cache()[1:3], (521, 1024 * 1024))
+        with self.assertRaises(ValueError):
+            self.pool.SetChunkCache(-1)
+
+    def test_file_is_closed_after_reads_by_default(self):
+        pool = HDF5FilePool()
+        self.assertEqual(pool.GetIdleTimeout(), 0)
+        with pool.Open(self.hdf5_filename) as f:
+            with pool.Open(self.hdf5_filename) as g:
+                self.assertIs(f, g)
+            self.assertEqual(pool.GetNumberOfOpenFiles(), 1)
+        self.assertEqual(pool.GetNumberOfOpenFiles(), 0)
+        self.assertFalse(f)
+        # the file can be written to once it is closed:
+        with h5py.File(self.hdf5_filename, 'w') as f:
+            f.create_dataset('ImageData', data=2 * self.input_array)
+
+    def test_resample_reader_opens_file_once_per_read(self):
+        pool = get_hdf5_file_pool()
+        pool.CloseAll()
+        reader = cilHDF5ResampleReader()
+        reader.SetFileName(self.hdf5_filename)
+        reader.SetDatasetName('ImageData')
+        reader.SetTargetSize(100)
+        pool.ResetMetrics()
+        reader.Update()
+        metrics = pool.GetMetrics()
+        # once for the dataset info, and once for all of the chunks:
+        self.assertEqual(metrics['opens'], 2)
+        self.assertGreater(metrics['hits'], 0)
+        # the file is closed once it has been read:
+        self.assertEqual(metrics['open_files'], 0)
+
+    def tearDown(self):
+        self.pool.CloseAll()
+        get_hdf5_file_pool().CloseAll()
+        os.remove(self.hdf5_filename)
+
+
+class TestHDF5ChunkAlignedReads(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.input_3D_array = np.random.randint(1000, size=(20, 12, 10)).astype(np.uint16)
+        self.hdf5_filename = 'test_chunked_data.h5'
+        with h5py.File(self.hdf5_filename, 'w') as f:
+            f.create_dataset('Chunked', data=self.input_3D_array, chunks=(4, 6, 5), compression='gzip')
+            f.create_dataset('Contiguous', data=self.input_3D_array)
+
+    def _read_slabs(self, reader, z_extents):
+        subset_reader = HDF5SubsetReader()
+        subset_reader.SetInputConnection(reader.GetOutputPort())
+        for z_extent in z_extents:
+            subset_reader.SetUpdateExtent((0, 9, 0, 11) + z_extent)
+            subset_reader.Update()
+            np.testing.assert_array_equal(Converter.vtk2numpy(subset_reader.GetOutput()),
+                                          self.input_3D_array[z_extent[0]:z_extent[1] + 1])
+
+    def test_chunk_aligned_reader_reads_each_slice_once(self):
+        z_extents = [(i, min(i + 2, 19)) for i in range(0, 20, 3)]
+        for dataset_name in ['Chunked', 'Contiguous']:
+            with self.subTest(dataset_name=dataset_name):
+                reader = HDF5ChunkAlignedReader()
+                reader.SetFileName(self.hdf5_filename)
+                reader.SetDatasetName(dataset_name)
+                self._read_slabs(reader, z_extents)
+                self.assertEqual(reader.GetNumberOfSlicesRead(), 20)
+
+    def test_chunk_aligned_reader_reads_only_the_update_extent_if_buffer_is_too_small(self):
+        reader = HDF5ChunkAlignedReader()
+        reader.SetFileName(self.hdf5_filename)
+        reader.SetDatasetName('Chunked')
+        reader.SetMaxBufferSize(self.input_3D_array[0].nbytes)
+        self._read_slabs(reader, [(0, 0), (1, 1), (5, 7)])
+        self.assertEqual(reader.GetNumberOfSlicesRead(), 5)
+
+    def test_resample_reader_with_chunk_aligned_reads(self):
+        for dataset_name in ['Chunked', 'Contiguous']:
+            for method in ['reslice', 'mean']:
+                with self.subTest(dataset_name=dataset_name, method=method):
+                    images = []
+                    for aligned in [True, False]:
+                        reader = cilHDF5ResampleReader()
+                        reader.SetFileName(self.hdf5_filename)
+                        reader.SetDatasetName(dataset_name)
+                        reader.SetTargetSize(self.input_3D_array.nbytes // 20)
+                        reader.SetDownsampleMethod(method)
+                        reader.SetUseChunkAlignedReads(aligned)
+                        reader.Update()
+                        images.append(Converter.vtk2numpy(reader.GetOutput()))
+                        if aligned:
+                            self.assertEqual(reader.GetNumberOfSlicesRead(), 20)
+                    np.testing.assert_array_equal(images[0], images[1])
+
+    def tearDown(self):
+        get_hdf5_file_pool().CloseAll()
+        os.remove(self.hdf5_filename)
+
+
 if __name__ == '__main__':
     unittest.main()
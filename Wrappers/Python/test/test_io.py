@@ -1,11 +1,16 @@
 import os
+import shutil
+import tempfile
 import unittest
+from unittest import mock
 
 import h5py
 import numpy as np
 import vtk
-from ccpi.viewer.utils.conversion import Converter, calculate_target_downsample_shape
-from ccpi.viewer.utils.io import ImageReader, cilviewerHDF5Writer, cilviewerHDF5Reader
+from ccpi.viewer.utils.conversion import Converter, calculate_target_downsample_shape, block_reduce, \
+    calculate_block_edges
+from ccpi.viewer.utils.io import ImageReader, ImageReadCancelledError, cilviewerHDF5Writer, cilviewerHDF5Reader, \
+    ImagePyramidCache, format_read_progress
 
 
 class TestImageReaderAndWriter(unittest.TestCase):
@@ -240,6 +245,101 @@ class TestImageReaderAndWriter(unittest.TestCase):
         read_cropped_array = Converter.vtk2numpy(array_image_data)
         np.testing.assert_array_equal(cropped_array, read_cropped_array)
 
+    def _get_cropped_and_resampled_readers(self, target_size, target_z_extent):
+        kwargs = {'crop': True, 'target_z_extent': target_z_extent, 'target_size': target_size, 'resample_z': True}
+        return {
+            'hdf5': ImageReader(file_name=self.hdf5_filename_3D, hdf5_dataset_name="ImageData", **kwargs),
+            'numpy': ImageReader(file_name=self.numpy_filename_3D, **kwargs),
+            'mha': ImageReader(file_name=self.mha_filename_3D, **kwargs),
+            'raw': ImageReader(file_name=self.raw_filename_3D, raw_image_attrs=self.raw_image_attrs, **kwargs),
+            'tiff': ImageReader(file_name=self.tiff_fnames, **kwargs)
+        }
+
+    def test_read_cropped_and_resampled(self):
+        # only slices 1 to 3 are resampled, so we expect the same image as
+        # resampling a file containing only these slices, moved along z:
+        target_size = 100
+        cropped_filename = 'test_3D_data_cropped.npy'
+        np.save(cropped_filename, self.input_3D_array[1:4])
+        try:
+            expected_image = ImageReader(file_name=cropped_filename, target_size=target_size, resample_z=True).Read()
+        finally:
+            os.remove(cropped_filename)
+        expected_array = Converter.vtk2numpy(expected_image)
+        expected_origin = np.array(expected_image.GetOrigin()) + [0, 0, 1]
+
+        for key, reader in self._get_cropped_and_resampled_readers(target_size, [1, 3]).items():
+            with self.subTest(format=key):
+                image = reader.Read()
+                np.testing.assert_array_equal(Converter.vtk2numpy(image), expected_array)
+                np.testing.assert_allclose(image.GetSpacing(), expected_image.GetSpacing())
+                np.testing.assert_allclose(image.GetOrigin(), expected_origin)
+                attrs = reader.GetLoadedImageAttrs()
+                self.assertTrue(attrs['cropped'])
+                self.assertTrue(attrs['resampled'])
+                np.testing.assert_allclose(attrs['origin'], expected_origin)
+                np.testing.assert_allclose(attrs['spacing'], expected_image.GetSpacing())
+
+    def test_read_cropped_and_resampled_to_size_bigger_than_cropped_image(self):
+        for key, reader in self._get_cropped_and_resampled_readers(1e12, [1, 3]).items():
+            with self.subTest(format=key):
+                image = reader.Read()
+                np.testing.assert_array_equal(Converter.vtk2numpy(image), self.input_3D_array[1:4])
+                self.assertEqual(image.GetExtent()[4:], (0, 2))
+                np.testing.assert_allclose(image.GetOrigin(), (0, 0, 1))
+                attrs = reader.GetLoadedImageAttrs()
+                self.assertTrue(attrs['cropped'])
+                self.assertFalse(attrs['resampled'])
+
+    def test_read_async(self):
+        target_size = 100
+        expected_image = ImageReader(file_name=self.numpy_filename_3D, target_size=target_size, resample_z=True).Read()
+        reader = ImageReader(file_name=self.numpy_filename_3D, target_size=target_size, resample_z=True)
+        handle = reader.ReadAsync()
+        image = handle.Result(timeout=60)
+        self.assertTrue(handle.Done())
+        self.assertFalse(handle.Cancelled())
+        self.assertIsNone(handle.Exception())
+        self.assertIs(handle.GetImageReader(), reader)
+        np.testing.assert_array_equal(Converter.vtk2numpy(image), Converter.vtk2numpy(expected_image))
+        self.assertTrue(reader.GetLoadedImageAttrs()['resampled'])
+
+        progress = handle.GetProgress()
+        self.assertEqual(progress['fraction'], 1)
+        self.assertEqual(progress['chunks_done'], progress['num_chunks'])
+        self.assertGreater(progress['bytes_read'], 0)
+        self.assertEqual(progress['eta'], 0)
+        # once done, the read can't be cancelled:
+        self.assertFalse(handle.Cancel())
+
+    def test_cancel_read(self):
+        reader = ImageReader(file_name=self.numpy_filename_3D, target_size=100, resample_z=True)
+        reader.Cancel()
+        with self.assertRaises(ImageReadCancelledError):
+            reader.Read()
+        # the next read isn't cancelled:
+        self.assertIsNotNone(reader.Read())
+
+        reader.Cancel()
+        handle = reader.ReadAsync()
+        with self.assertRaises(ImageReadCancelledError):
+            handle.Result(timeout=60)
+        self.assertTrue(handle.Cancelled())
+
+    def test_format_read_progress(self):
+        progress = {
+            'fraction': 0.45,
+            'chunks_done': 3,
+            'num_chunks': 7,
+            'bytes_read': 10,
+            'bytes_per_second': 210.5e6,
+            'elapsed': 10,
+            'eta': 12
+        }
+        self.assertEqual(format_read_progress(progress), '45% - 3 of 7 chunks - 210.5 MB/s - about 12 s left')
+        progress = dict(progress, chunks_done=None, num_chunks=None, bytes_per_second=None, eta=None)
+        self.assertEqual(format_read_progress(progress), '45%')
+
     def test_write_read_hdf5(self):
         ''''
         This:
@@ -293,6 +393,108 @@ class TestImageReaderAndWriter(unittest.TestCase):
             else:
                 self.assertEqual(value, read_original_image_attrs[key])
 
+    def test_read_with_pyramid_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = ImagePyramidCache(cache_dir=cache_dir, max_level_size=200, min_level_size=10)
+            reader = ImageReader(file_name=self.raw_filename_3D,
+                                 target_size=50,
+                                 resample_z=True,
+                                 raw_image_attrs=self.raw_image_attrs,
+                                 downsample_method='mean',
+                                 pyramid_cache=cache)
+            image = reader.Read()
+            key = reader._GetPyramidCacheKey()
+            self.assertTrue(cache.IsUpToDate(self.raw_filename_3D, key))
+            self.assertTrue(os.path.isfile(cache.GetCacheFileName(self.raw_filename_3D, key)))
+            self.assertEqual(reader.GetLoadedImageAttrs()['pyramid_level'], 1)
+            self.assertLessEqual(image.GetPointData().GetScalars().GetDataTypeSize() * image.GetNumberOfPoints(), 50)
+            np.testing.assert_array_equal(reader.GetOriginalImageAttrs()['shape'], np.shape(self.input_3D_array))
+            # the progress of building the pyramid is reported:
+            progress = reader.GetReadProgress()
+            self.assertEqual(progress['chunks_done'], progress['num_chunks'])
+            self.assertEqual(progress['fraction'], 1)
+
+            # each level is downsampled 2 times more than the last,
+            # and the first level is the block mean of the image:
+            levels = cache.GetLevels(self.raw_filename_3D, key)
+            self.assertEqual([level[1] for level in levels], [1, 2])
+            level_reader = cilviewerHDF5Reader()
+            level_reader.SetFileName(cache.GetCacheFileName(self.raw_filename_3D, key))
+            level_reader.Update()
+            block_edges = [[0, 2, 4, 5], calculate_block_edges(10, 5), calculate_block_edges(6, 3)]
+            expected_level = np.rint(block_reduce(self.input_3D_array, block_edges, 'mean'))
+            np.testing.assert_array_equal(Converter.vtk2numpy(level_reader.GetOutputDataObject(0)),
+                                          expected_level.astype(self.input_3D_array.dtype))
+
+            # reading again is served from the cache:
+            reader = ImageReader(file_name=self.raw_filename_3D,
+                                 target_size=50,
+                                 resample_z=True,
+                                 raw_image_attrs=self.raw_image_attrs,
+                                 downsample_method='mean',
+                                 pyramid_cache=cache)
+            np.testing.assert_array_equal(Converter.vtk2numpy(reader.Read()), Converter.vtk2numpy(image))
+            self.assertEqual(reader.GetLoadedImageAttrs()['pyramid_level'], 1)
+
+            # the pyramid of another downsample method is built with that method:
+            max_reader = ImageReader(file_name=self.raw_filename_3D,
+                                     target_size=50,
+                                     resample_z=True,
+                                     raw_image_attrs=self.raw_image_attrs,
+                                     downsample_method='max',
+                                     pyramid_cache=cache)
+            max_reader.Read()
+            max_key = max_reader._GetPyramidCacheKey()
+            self.assertNotEqual(max_key, key)
+            level_reader.SetFileName(cache.GetCacheFileName(self.raw_filename_3D, max_key))
+            level_reader.Update()
+            expected_level = block_reduce(self.input_3D_array, block_edges, 'max')
+            np.testing.assert_array_equal(Converter.vtk2numpy(level_reader.GetOutputDataObject(0)), expected_level)
+
+            # target sizes larger than the first level are read from the file:
+            reader.SetTargetSize(500)
+            reader.Read()
+            self.assertNotIn('pyramid_level', reader.GetLoadedImageAttrs())
+
+            # the pyramid is out of date if the file is modified:
+            stat = os.stat(self.raw_filename_3D)
+            os.utime(self.raw_filename_3D, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            self.assertFalse(cache.IsUpToDate(self.raw_filename_3D, key))
+
+            # the least recently used pyramid is evicted when the cache is full:
+            cache.SetMaxCacheSize(1)
+            reader = ImageReader(file_name=self.numpy_filename_3D, target_size=50, resample_z=True, pyramid_cache=cache)
+            reader.Read()
+            self.assertFalse(os.path.isfile(cache.GetCacheFileName(self.raw_filename_3D, key)))
+            numpy_cache_file = cache.GetCacheFileName(self.numpy_filename_3D, reader._GetPyramidCacheKey())
+            self.assertTrue(os.path.isfile(numpy_cache_file))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_cancel_pyramid_cache_build(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = ImagePyramidCache(cache_dir=cache_dir, max_level_size=200, min_level_size=10)
+            reader = ImageReader(file_name=self.numpy_filename_3D, target_size=50, resample_z=True, pyramid_cache=cache)
+            set_current_reader = reader._SetCurrentReader
+
+            def cancel_once_reading(current_reader):
+                set_current_reader(current_reader)
+                reader.Cancel()
+
+            # the pyramid is built by the current reader, so it is cancelled as it starts:
+            with mock.patch.object(reader, '_SetCurrentReader', cancel_once_reading):
+                with self.assertRaises(ImageReadCancelledError):
+                    reader.Read()
+            self.assertFalse(cache.IsUpToDate(self.numpy_filename_3D, reader._GetPyramidCacheKey()))
+            self.assertTrue(reader._CurrentReader.GetReadAborted())
+            # the next read builds the pyramid:
+            reader.Read()
+            self.assertTrue(cache.IsUpToDate(self.numpy_filename_3D, reader._GetPyramidCacheKey()))
+        finally:
+            shutil.rmtree(cache_dir)
+
     def tearDown(self):
         files = [self.hdf5_filename_3D, self.numpy_filename_3D, self.mha_filename_3D, self.raw_filename_3D
                  ] + self.tiff_fnames
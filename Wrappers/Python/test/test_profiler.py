@@ -0,0 +1,180 @@
+#   Copyright 2023 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import vtk
+from ccpi.viewer.CILViewer2D import CILViewer2D
+from ccpi.viewer.utils.conversion import Converter, cilNumpyResampleReader
+from ccpi.viewer.utils.profiler import PipelineProfiler, get_pipeline_profiler, profile_phase, set_pipeline_profiler
+
+# skip the tests on GitHub actions
+if os.environ.get('CONDA_BUILD', '0') == '1':
+    skip_test = True
+else:
+    skip_test = False
+
+print("skip_test is set to ", skip_test)
+
+
+class PipelineProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        image = Converter.numpy2vtkImage(np.arange(4 * 5 * 6, dtype=np.float32).reshape(4, 5, 6), deep=1)
+        self.smooth = vtk.vtkImageGaussianSmooth()
+        self.smooth.SetInputData(image)
+        self.shift = vtk.vtkImageShiftScale()
+        self.shift.SetInputConnection(self.smooth.GetOutputPort())
+        self.profiler = PipelineProfiler()
+
+    def tearDown(self):
+        set_pipeline_profiler(None)
+
+    def _names(self):
+        return [s['name'] for s in self.profiler.GetSummary()]
+
+    def test_observe_times_each_execution(self):
+        self.profiler.Observe(self.smooth)
+        self.profiler.Observe(self.smooth, 'observed twice')
+        for _ in range(3):
+            self.smooth.Modified()
+            self.smooth.Update()
+
+        summary = self.profiler.GetSummary()
+        self.assertEqual(len(summary), 1)
+        self.assertEqual(summary[0]['name'], 'vtkImageGaussianSmooth')
+        self.assertEqual(summary[0]['category'], 'vtk')
+        self.assertEqual(summary[0]['count'], 3)
+        self.assertAlmostEqual(summary[0]['mean'], summary[0]['total'] / 3)
+        self.assertGreater(len(self.profiler.GetProgressUpdates()), 0)
+
+    def test_observe_pipeline_observes_upstream_algorithms(self):
+        self.profiler.ObservePipeline(self.shift)
+        self.shift.Update()
+        # the vtkTrivialProducer of the input data is not observed:
+        self.assertEqual(sorted(self._names()), ['vtkImageGaussianSmooth', 'vtkImageShiftScale'])
+        self.assertFalse(self.profiler.IsObserving(self.smooth.GetInputAlgorithm()))
+
+    def test_stop_observing(self):
+        self.profiler.Observe(self.smooth)
+        self.profiler.StopObserving(self.smooth)
+        self.assertFalse(self.profiler.IsObserving(self.smooth))
+        self.smooth.Update()
+        self.assertEqual(self.profiler.GetTimings(), [])
+
+    def test_disabled_profiler_records_nothing(self):
+        self.profiler.Observe(self.smooth)
+        self.profiler.SetEnabled(False)
+        self.smooth.Update()
+        with self.profiler.Phase('phase'):
+            pass
+        self.assertEqual(self.profiler.GetTimings(), [])
+
+    def test_phase(self):
+        with self.profiler.Phase('phase', chunk=2):
+            self.smooth.Update()
+        timing = self.profiler.GetTimings()[0]
+        self.assertEqual(timing['name'], 'phase')
+        self.assertEqual(timing['category'], 'python')
+        self.assertEqual(timing['args'], {'chunk': 2})
+        self.assertGreaterEqual(timing['duration'], 0)
+
+    def test_chrome_trace(self):
+        self.profiler.Observe(self.smooth)
+        with self.profiler.Phase('phase', extent=(0, 1)):
+            self.smooth.Update()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'trace.json')
+            self.profiler.WriteChromeTrace(fname)
+            with open(fname) as f:
+                trace = json.load(f)
+
+        complete = {e['name']: e for e in trace['traceEvents'] if e['ph'] == 'X'}
+        self.assertEqual(sorted(complete.keys()), ['phase', 'vtkImageGaussianSmooth'])
+        self.assertEqual(complete['phase']['args'], {'extent': [0, 1]})
+        # the algorithm runs within the phase:
+        self.assertGreaterEqual(complete['vtkImageGaussianSmooth']['ts'], complete['phase']['ts'])
+        self.assertTrue(any(e['ph'] == 'C' for e in trace['traceEvents']))
+        self.assertTrue(any(e['ph'] == 'M' for e in trace['traceEvents']))
+
+    def test_format_summary(self):
+        with self.profiler.Phase('phase'):
+            pass
+        lines = self.profiler.FormatSummary().split('\n')
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('phase'))
+
+    def test_profile_phase_uses_the_pipeline_profiler(self):
+        with profile_phase('not recorded'):
+            pass
+        set_pipeline_profiler(self.profiler)
+        self.assertIs(get_pipeline_profiler(), self.profiler)
+        with profile_phase('recorded'):
+            pass
+        self.assertEqual(self._names(), ['recorded'])
+
+    def test_resample_reader_phases(self):
+        set_pipeline_profiler(self.profiler)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'image.npy')
+            np.save(fname, np.random.randint(100, size=(16, 12, 10), dtype=np.uint16))
+            reader = cilNumpyResampleReader()
+            reader.SetFileName(fname)
+            reader.SetTargetSize(100)
+            reader.Update()
+        names = self._names()
+        for name in ['chunk read', 'resample', 'copy', 'vtkImageReslice']:
+            self.assertIn(name, names)
+        num_chunks = reader.GetReadProgress()['num_chunks']
+        chunk_reads = [s for s in self.profiler.GetSummary() if s['name'] == 'chunk read'][0]
+        self.assertEqual(chunk_reads['count'], num_chunks)
+
+
+@unittest.skipIf(skip_test, "Skipping tests on GitHub Actions")
+class CILViewerProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        image = Converter.numpy2vtkImage(np.random.randint(100, size=(10, 12, 8), dtype=np.uint16), deep=1)
+        self.viewer = CILViewer2D()
+        self.viewer.setInputData(image)
+        self.profiler = PipelineProfiler()
+
+    def test_set_profiler(self):
+        self.assertEqual(self.viewer.getProfileSummary(), [])
+        self.viewer.setProfiler(self.profiler)
+        self.assertIs(self.viewer.getProfiler(), self.profiler)
+        self.assertTrue(self.profiler.IsObserving(self.viewer.voi))
+
+        self.viewer.setActiveSlice(3)
+        self.viewer.updatePipeline()
+
+        names = [s['name'] for s in self.viewer.getProfileSummary()]
+        for name in ['CILViewer2D.updatePipeline', 'CILViewer2D.voi', 'CILViewer2D.render']:
+            self.assertIn(name, names)
+
+    def test_unset_profiler(self):
+        self.viewer.setProfiler(self.profiler)
+        self.viewer.setProfiler(None)
+        self.assertFalse(self.profiler.IsObserving(self.viewer.voi))
+        self.viewer.updatePipeline()
+        self.assertEqual(self.profiler.GetTimings(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
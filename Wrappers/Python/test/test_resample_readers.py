@@ -1,12 +1,13 @@
 import os
 import unittest
 import warnings
+import zlib
 
 import numpy as np
 import vtk
 from ccpi.viewer.utils.conversion import Converter, calculate_target_downsample_shape, \
     cilRawResampleReader, cilTIFFResampleReader, cilNumpyMETAImageWriter, cilMetaImageResampleReader,\
-    cilNumpyResampleReader
+    cilNumpyResampleReader, cilTIFFStackDecoder, cilZlibSlabDecoder, block_reduce, calculate_block_edges
 
 
 class TestResampleReaders(unittest.TestCase):
@@ -174,6 +175,35 @@ class TestResampleReaders(unittest.TestCase):
         expected_array = np.flip(np.copy(self.input_3D_array), axis=1)
         self.resample_reader_test1(reader, self.size_greater_than_input_size, expected_array)
 
+    def test_tiff_stack_decoder(self):
+        shape = self.input_3D_array.shape
+        decoder = cilTIFFStackDecoder(self.tiff_fnames, shape[1:], self.input_3D_array.dtype, num_threads=3)
+        try:
+            np.testing.assert_array_equal(decoder.Decode(0, 1), self.input_3D_array[0:2])
+            decoder.Prefetch(2, 4)
+            np.testing.assert_array_equal(decoder.Decode(2, 4), self.input_3D_array[2:5])
+            # a slab which wasn't prefetched:
+            decoder.Prefetch(0, 0)
+            np.testing.assert_array_equal(decoder.Decode(1, 3), self.input_3D_array[1:4])
+            with self.assertRaises(ValueError):
+                decoder.Decode(3, 5)
+        finally:
+            decoder.Close()
+
+    def test_tiff_resample_reader_with_decoding_threads(self):
+        for method in ['reslice', 'mean']:
+            images = []
+            for num_threads in [1, 3]:
+                reader = self._setup_tiff_resample_reader()
+                reader.SetNumberOfDecodingThreads(num_threads)
+                reader.SetDownsampleMethod(method)
+                reader.SetTargetSize(self.size_to_resample_to)
+                reader.Update()
+                images.append(Converter.vtk2numpy(reader.GetOutput()))
+            np.testing.assert_array_equal(images[0], images[1])
+        with self.assertRaises(ValueError):
+            reader.SetNumberOfDecodingThreads(0)
+
     def test_meta_resample_reader_mha(self):
         reader = cilMetaImageResampleReader()
         reader.SetFileName(self.meta_filename_3D)
@@ -194,6 +224,70 @@ class TestResampleReaders(unittest.TestCase):
         reader.SetFileName(self.mhd_filename_3D)
         self.resample_reader_test1(reader, self.size_greater_than_input_size)
 
+    def _write_compressed_mha(self):
+        fname = 'test_3D_data_compressed.mha'
+        writer = vtk.vtkMetaImageWriter()
+        writer.SetFileName(fname)
+        writer.SetInputData(Converter.numpy2vtkImage(self.input_3D_array))
+        writer.SetCompression(True)
+        writer.Write()
+        self.addCleanup(os.remove, fname)
+        return fname
+
+    def test_meta_resample_reader_compressed_mha(self):
+        reader = cilMetaImageResampleReader()
+        reader.SetFileName(self._write_compressed_mha())
+        self.resample_reader_test1(reader, self.size_to_resample_to)
+        self.assertTrue(reader.GetIsCompressedData())
+        self.resample_reader_test1(reader, self.size_greater_than_input_size)
+
+    def test_meta_resample_reader_compressed_mha_matches_uncompressed(self):
+        compressed_fname = self._write_compressed_mha()
+        for target_z_extent in [None, (1, 3)]:
+            for method in ['reslice', 'mean']:
+                for num_workers in [1, 2]:
+                    with self.subTest(target_z_extent=target_z_extent, method=method, num_workers=num_workers):
+                        images = []
+                        for fname in [self.meta_filename_3D, compressed_fname]:
+                            reader = cilMetaImageResampleReader()
+                            reader.SetFileName(fname)
+                            reader.SetTargetSize(self.size_to_resample_to)
+                            reader.SetTargetZExtent(target_z_extent)
+                            reader.SetDownsampleMethod(method)
+                            reader.SetNumberOfWorkers(num_workers)
+                            reader.Update()
+                            images.append(reader.GetOutput())
+                        np.testing.assert_array_equal(Converter.vtk2numpy(images[0]), Converter.vtk2numpy(images[1]))
+                        np.testing.assert_allclose(images[0].GetOrigin(), images[1].GetOrigin())
+                        np.testing.assert_allclose(images[0].GetSpacing(), images[1].GetSpacing())
+
+    def test_zlib_slab_decoder(self):
+        # a checkpoint is saved every 2 slices, so that reading slices out of order
+        # restarts from the nearest checkpoint:
+        slice_length = self.input_3D_array[0].nbytes
+        fname = 'test_3D_data.zlib'
+        header = b'header'
+        with open(fname, 'wb') as f:
+            f.write(header + zlib.compress(self.input_3D_array.tobytes()) + b'trailing data')
+        self.addCleanup(os.remove, fname)
+        decoder = cilZlibSlabDecoder(fname,
+                                     len(header),
+                                     slice_length,
+                                     checkpoint_interval=2 * slice_length,
+                                     read_size=16)
+        try:
+            for start_slice, end_slice in [(0, 1), (3, 4), (1, 2), (4, 4), (0, 4)]:
+                slab = np.empty_like(self.input_3D_array[start_slice:end_slice + 1])
+                decoder.ReadInto(start_slice, slab)
+                np.testing.assert_array_equal(slab, self.input_3D_array[start_slice:end_slice + 1])
+            self.assertEqual(decoder.GetNumberOfCheckpoints(), 2)
+            with self.assertRaises(ValueError):
+                decoder.ReadInto(4, np.empty_like(self.input_3D_array[:2]))
+            with self.assertRaises(ValueError):
+                decoder.ReadInto(0, np.empty(slice_length + 1, dtype=np.uint8))
+        finally:
+            decoder.Close()
+
     def test_npy_resample_reader(self):
         reader = cilNumpyResampleReader()
         reader.SetFileName(self.numpy_filename_3D)
@@ -206,6 +300,392 @@ class TestResampleReaders(unittest.TestCase):
         self.resample_reader_test1(reader, self.size_to_resample_to)
         self.resample_reader_test1(reader, self.size_greater_than_input_size)
 
+    def _setup_raw_resample_reader(self):
+        reader = cilRawResampleReader()
+        reader.SetFileName(self.raw_filename_3D)
+        reader.SetBigEndian(False)
+        reader.SetIsFortran(False)
+        reader.SetTypeCodeName(str(self.input_3D_array.dtype))
+        reader.SetStoredArrayShape(np.shape(self.input_3D_array))
+        return reader
+
+    def memory_map_test(self, setup_reader):
+        # Tests that reading the chunks from a memory map gives the same result as
+        # reading them through temporary files:
+        for target_size in [self.size_to_resample_to, self.size_greater_than_input_size]:
+            reader = setup_reader()
+            reader.SetTargetSize(target_size)
+            reader.Update()
+            expected_array = Converter.vtk2numpy(reader.GetOutput())
+            expected_bytes_read = reader.GetChunkBytesRead()
+
+            mmap_reader = setup_reader()
+            mmap_reader.SetUseMemoryMap(True)
+            self.assertTrue(mmap_reader.GetUseMemoryMap())
+            mmap_reader.SetTargetSize(target_size)
+            mmap_reader.Update()
+            image = mmap_reader.GetOutput()
+            self.assertIsNone(mmap_reader._GetTempDir())
+            # when reading through temporary files, the last chunk is padded if it
+            # has fewer slices than the others, so we only compare the full chunks:
+            num_full_chunks = self.input_3D_array.shape[0] // mmap_reader._GetNumSlicesPerChunk()
+            resulting_array = Converter.vtk2numpy(image)
+            self.assertEqual(expected_array.shape, resulting_array.shape)
+            np.testing.assert_array_equal(expected_array[:num_full_chunks], resulting_array[:num_full_chunks])
+            self.assertEqual(reader.GetOutput().GetSpacing(), image.GetSpacing())
+            self.assertEqual(reader.GetOutput().GetOrigin(), image.GetOrigin())
+            self.assertEqual(expected_bytes_read, mmap_reader.GetChunkBytesRead())
+            self.assertEqual(sum(mmap_reader.GetChunkBytesRead()), self.input_3D_array.size * self.bytes_per_element)
+
+    def test_raw_resample_reader_memory_map(self):
+        self.memory_map_test(self._setup_raw_resample_reader)
+
+    def test_npy_resample_reader_memory_map(self):
+
+        def setup_reader():
+            reader = cilNumpyResampleReader()
+            reader.SetFileName(self.numpy_filename_3D)
+            return reader
+
+        self.memory_map_test(setup_reader)
+
+    def test_meta_resample_reader_memory_map(self):
+        for fname in [self.meta_filename_3D, self.mhd_filename_3D]:
+
+            def setup_reader():
+                reader = cilMetaImageResampleReader()
+                reader.SetFileName(fname)
+                return reader
+
+            self.memory_map_test(setup_reader)
+
+    def test_raw_resample_reader_memory_map_big_endian(self):
+        big_endian_fname = 'test_3D_data_big_endian.raw'
+        self.input_3D_array.astype('>u2').tofile(big_endian_fname)
+        try:
+            reader = self._setup_raw_resample_reader()
+            reader.SetFileName(big_endian_fname)
+            reader.SetBigEndian(True)
+            reader.SetUseMemoryMap(True)
+            reader.SetTargetSize(self.size_greater_than_input_size)
+            reader.Update()
+            np.testing.assert_array_equal(np.asfortranarray(self.input_3D_array),
+                                          Converter.vtk2numpy(reader.GetOutput()))
+        finally:
+            os.remove(big_endian_fname)
+
+    def parallel_test(self, setup_reader):
+        # Tests that resampling the chunks in worker processes gives the same
+        # result as resampling them serially:
+        reader = setup_reader()
+        reader.SetTargetSize(self.size_to_resample_to)
+        reader.Update()
+        expected_image = reader.GetOutput()
+
+        parallel_reader = setup_reader()
+        parallel_reader.SetNumberOfWorkers(2)
+        self.assertEqual(parallel_reader.GetNumberOfWorkers(), 2)
+        parallel_reader.SetTargetSize(self.size_to_resample_to)
+        progress = []
+        parallel_reader.AddObserver(vtk.vtkCommand.ProgressEvent,
+                                    lambda caller, event: progress.append(caller.GetProgress()))
+        parallel_reader.Update()
+        image = parallel_reader.GetOutput()
+
+        np.testing.assert_array_equal(Converter.vtk2numpy(expected_image), Converter.vtk2numpy(image))
+        self.assertEqual(expected_image.GetSpacing(), image.GetSpacing())
+        self.assertEqual(expected_image.GetOrigin(), image.GetOrigin())
+        self.assertGreater(len(progress), 0)
+        self.assertEqual(progress[-1], 1.0)
+
+    def test_raw_resample_reader_parallel(self):
+        self.parallel_test(self._setup_raw_resample_reader)
+
+    def test_raw_resample_reader_parallel_memory_map(self):
+
+        def setup_reader():
+            reader = self._setup_raw_resample_reader()
+            reader.SetUseMemoryMap(True)
+            return reader
+
+        self.parallel_test(setup_reader)
+
+    def test_npy_resample_reader_parallel(self):
+
+        def setup_reader():
+            reader = cilNumpyResampleReader()
+            reader.SetFileName(self.numpy_filename_3D)
+            return reader
+
+        self.parallel_test(setup_reader)
+
+    def test_meta_resample_reader_parallel(self):
+
+        def setup_reader():
+            reader = cilMetaImageResampleReader()
+            reader.SetFileName(self.meta_filename_3D)
+            return reader
+
+        self.parallel_test(setup_reader)
+
+    def test_tiff_resample_reader_parallel(self):
+        self.parallel_test(self._setup_tiff_resample_reader)
+
+    def test_raw_resample_reader_parallel_when_last_chunk_is_partial(self):
+        # The 5 slices are resampled in chunks of 2, so the last chunk only has 1 slice.
+        # The memory mapped reader reads exactly the slices of each chunk, so it is the reference:
+        reference_reader = self._setup_raw_resample_reader()
+        reference_reader.SetUseMemoryMap(True)
+        reference_reader.SetTargetSize(self.size_to_resample_to)
+        reference_reader.Update()
+        self.assertEqual(reference_reader._GetNumSlicesPerChunk(), 2)
+        expected_array = Converter.vtk2numpy(reference_reader.GetOutput())
+
+        for num_workers in [1, 2]:
+            reader = self._setup_raw_resample_reader()
+            reader.SetNumberOfWorkers(num_workers)
+            reader.SetTargetSize(self.size_to_resample_to)
+            reader.Update()
+            np.testing.assert_array_equal(expected_array, Converter.vtk2numpy(reader.GetOutput()))
+            self.assertEqual(reader.GetChunkBytesRead()[-1], 1 * 10 * 6 * self.bytes_per_element)
+
+    def test_set_number_of_workers_validates_input(self):
+        reader = cilRawResampleReader()
+        with self.assertRaises(ValueError):
+            reader.SetNumberOfWorkers(0)
+        with self.assertRaises(ValueError):
+            reader.SetNumberOfWorkers(2.)
+
+    def block_reduce_test(self, setup_reader, num_workers=1):
+        # Tests that downsampling with block reduction gives an image with the same
+        # geometry as reslicing, where each voxel is the reduction of its block:
+        reslice_reader = setup_reader()
+        reslice_reader.SetTargetSize(self.size_to_resample_to)
+        reslice_reader.Update()
+        expected_image = reslice_reader.GetOutput()
+
+        for method in ['mean', 'max', 'min', 'median']:
+            with self.subTest(method=method):
+                reader = setup_reader()
+                reader.SetDownsampleMethod(method)
+                self.assertEqual(reader.GetDownsampleMethod(), method)
+                reader.SetNumberOfWorkers(num_workers)
+                reader.SetTargetSize(self.size_to_resample_to)
+                reader.Update()
+                image = reader.GetOutput()
+
+                self.assertEqual(expected_image.GetExtent(), image.GetExtent())
+                self.assertEqual(expected_image.GetSpacing(), image.GetSpacing())
+                self.assertEqual(expected_image.GetOrigin(), image.GetOrigin())
+
+                num_slices_per_chunk = reader._GetNumSlicesPerChunk()
+                z_edges = list(range(0, self.input_3D_array.shape[0], num_slices_per_chunk))
+                extent = image.GetExtent()
+                block_edges = [
+                    z_edges + [self.input_3D_array.shape[0]],
+                    calculate_block_edges(self.input_3D_array.shape[1], extent[3] + 1),
+                    calculate_block_edges(self.input_3D_array.shape[2], extent[1] + 1)
+                ]
+                expected_array = np.rint(block_reduce(self.input_3D_array, block_edges, method))
+                np.testing.assert_array_equal(Converter.vtk2numpy(image),
+                                              expected_array.astype(self.input_3D_array.dtype))
+
+    def test_raw_resample_reader_block_reduce(self):
+        self.block_reduce_test(self._setup_raw_resample_reader)
+
+    def test_raw_resample_reader_block_reduce_memory_map(self):
+
+        def setup_reader():
+            reader = self._setup_raw_resample_reader()
+            reader.SetUseMemoryMap(True)
+            return reader
+
+        self.block_reduce_test(setup_reader)
+
+    def test_raw_resample_reader_block_reduce_parallel(self):
+        self.block_reduce_test(self._setup_raw_resample_reader, num_workers=2)
+
+    def test_npy_resample_reader_block_reduce(self):
+
+        def setup_reader():
+            reader = cilNumpyResampleReader()
+            reader.SetFileName(self.numpy_filename_3D)
+            return reader
+
+        self.block_reduce_test(setup_reader)
+
+    def test_meta_resample_reader_block_reduce(self):
+
+        def setup_reader():
+            reader = cilMetaImageResampleReader()
+            reader.SetFileName(self.meta_filename_3D)
+            return reader
+
+        self.block_reduce_test(setup_reader)
+
+    def stream_test(self, setup_reader, target_z_extent=None):
+        # Tests that streaming the resampled slices gives the same image as Update:
+        for target_size in [self.size_to_resample_to, self.size_greater_than_input_size]:
+            for method in ['reslice', 'mean']:
+                with self.subTest(target_size=target_size, method=method):
+                    reader = setup_reader()
+                    reader.SetTargetSize(target_size)
+                    reader.SetDownsampleMethod(method)
+                    reader.SetTargetZExtent(target_z_extent)
+                    reader.Update()
+                    expected_image = reader.GetOutput()
+
+                    stream_reader = setup_reader()
+                    stream_reader.SetTargetSize(target_size)
+                    stream_reader.SetDownsampleMethod(method)
+                    stream_reader.SetTargetZExtent(target_z_extent)
+                    info = stream_reader.GetResampledImageInfo()
+                    self.assertEqual(info['shape'], expected_image.GetDimensions())
+                    np.testing.assert_allclose(info['spacing'], expected_image.GetSpacing())
+                    np.testing.assert_allclose(info['origin'], expected_image.GetOrigin())
+                    self.assertEqual(info['resampled'], target_size == self.size_to_resample_to)
+
+                    slices = list(stream_reader.StreamResampledSlices())
+                    self.assertEqual([index for index, _ in slices], list(range(info['shape'][2])))
+                    np.testing.assert_array_equal(np.stack([array for _, array in slices]),
+                                                  Converter.vtk2numpy(expected_image))
+
+    def test_raw_resample_reader_stream(self):
+        self.stream_test(self._setup_raw_resample_reader)
+
+    def test_npy_resample_reader_stream_memory_map(self):
+
+        def setup_reader():
+            reader = cilNumpyResampleReader()
+            reader.SetFileName(self.numpy_filename_3D)
+            reader.SetUseMemoryMap(True)
+            return reader
+
+        self.stream_test(setup_reader)
+
+    def test_tiff_resample_reader_stream(self):
+        self.stream_test(self._setup_tiff_resample_reader)
+
+    def test_raw_resample_reader_stream_with_target_z_extent(self):
+        self.stream_test(self._setup_raw_resample_reader, target_z_extent=(1, 3))
+
+    def test_tiff_resample_reader_stream_with_target_z_extent(self):
+        self.stream_test(self._setup_tiff_resample_reader, target_z_extent=(1, 3))
+
+    def target_z_extent_test(self, setup_reader):
+        # Tests that only the target z extent is resampled, and that it is
+        # positioned at the first slice read:
+        cropped_array = self.input_3D_array[1:4]
+        cropped_filename = 'test_3D_data_cropped.npy'
+        np.save(cropped_filename, cropped_array)
+        self.addCleanup(os.remove, cropped_filename)
+        for target_size in [self.size_to_resample_to, self.size_greater_than_input_size]:
+            for method in ['reslice', 'mean']:
+                with self.subTest(target_size=target_size, method=method):
+                    expected_reader = cilNumpyResampleReader()
+                    expected_reader.SetFileName(cropped_filename)
+                    expected_reader.SetTargetSize(target_size)
+                    expected_reader.SetDownsampleMethod(method)
+                    expected_reader.Update()
+                    expected_image = expected_reader.GetOutput()
+
+                    reader = setup_reader()
+                    reader.SetTargetSize(target_size)
+                    reader.SetDownsampleMethod(method)
+                    reader.SetTargetZExtent((1, 3))
+                    reader.Update()
+                    image = reader.GetOutput()
+                    np.testing.assert_array_equal(Converter.vtk2numpy(image), Converter.vtk2numpy(expected_image))
+                    self.assertEqual(image.GetExtent(), expected_image.GetExtent())
+                    np.testing.assert_allclose(image.GetSpacing(), expected_image.GetSpacing())
+                    np.testing.assert_allclose(image.GetOrigin(), np.array(expected_image.GetOrigin()) + [0, 0, 1])
+
+    def test_raw_resample_reader_with_target_z_extent(self):
+        self.target_z_extent_test(self._setup_raw_resample_reader)
+
+    def test_raw_resample_reader_memory_map_with_target_z_extent(self):
+
+        def setup_reader():
+            reader = self._setup_raw_resample_reader()
+            reader.SetUseMemoryMap(True)
+            return reader
+
+        self.target_z_extent_test(setup_reader)
+
+    def test_meta_resample_reader_with_target_z_extent(self):
+
+        def setup_reader():
+            reader = cilMetaImageResampleReader()
+            reader.SetFileName(self.meta_filename_3D)
+            return reader
+
+        self.target_z_extent_test(setup_reader)
+
+    def test_tiff_resample_reader_with_target_z_extent(self):
+        self.target_z_extent_test(self._setup_tiff_resample_reader)
+
+    def test_set_target_z_extent_validates_input(self):
+        reader = self._setup_raw_resample_reader()
+        self.assertIsNone(reader.GetTargetZExtent())
+        with self.assertRaises(ValueError):
+            reader.SetTargetZExtent(1)
+        reader.SetTargetZExtent([7, 9])
+        self.assertEqual(reader.GetTargetZExtent(), (7, 9))
+        reader.ReadDataSetInfo()
+        # the extent doesn't overlap the 5 slices of the file:
+        with self.assertRaises(ValueError):
+            reader._GetZExtentToRead()
+        reader.SetTargetZExtent((3, 9))
+        self.assertEqual(reader._GetZExtentToRead(), (3, 4))
+
+    def test_read_progress_is_reported_per_chunk(self):
+        reader = self._setup_raw_resample_reader()
+        reader.SetTargetSize(self.size_to_resample_to)
+        reader.Update()
+        progress = reader.GetReadProgress()
+        self.assertGreater(progress['num_chunks'], 0)
+        self.assertEqual(progress['chunks_done'], progress['num_chunks'])
+        self.assertGreater(progress['bytes_read'], 0)
+        self.assertLessEqual(progress['bytes_read'], self.input_3D_array.nbytes)
+        self.assertFalse(reader.GetReadAborted())
+
+    def test_abort_read_leaves_output_empty(self):
+        for workers in [1, 2]:
+            with self.subTest(workers=workers):
+                reader = self._setup_raw_resample_reader()
+                reader.SetTargetSize(self.size_to_resample_to)
+                reader.SetNumberOfWorkers(workers)
+                reader.SetAbortRead(True)
+                reader.Update()
+                self.assertTrue(reader.GetReadAborted())
+                self.assertEqual(reader.GetReadProgress()['chunks_done'], 0)
+                self.assertEqual(reader.GetOutput().GetNumberOfPoints(), 0)
+
+                # the reader reads the image once the abort is lifted:
+                reader.SetAbortRead(False)
+                reader.Modified()
+                reader.Update()
+                self.assertFalse(reader.GetReadAborted())
+                self.assertGreater(reader.GetOutput().GetNumberOfPoints(), 0)
+
+    def test_abort_read_stops_stream(self):
+        # without resampling, each slice is read as a separate chunk:
+        reader = self._setup_raw_resample_reader()
+        reader.SetTargetSize(self.size_greater_than_input_size)
+        slices = reader.StreamResampledSlices()
+        next(slices)
+        reader.SetAbortRead(True)
+        list(slices)
+        self.assertTrue(reader.GetReadAborted())
+        progress = reader.GetReadProgress()
+        self.assertLess(progress['chunks_done'], progress['num_chunks'])
+
+    def test_set_downsample_method_validates_input(self):
+        reader = cilRawResampleReader()
+        self.assertEqual(reader.GetDownsampleMethod(), 'reslice')
+        with self.assertRaises(ValueError):
+            reader.SetDownsampleMethod('average')
+
     def tearDown(self):
         files = [self.raw_filename_3D, self.numpy_filename_3D, self.meta_filename_3D
                  ] + self.tiff_fnames + [self.mhd_filename_3D]
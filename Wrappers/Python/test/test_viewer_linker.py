@@ -0,0 +1,126 @@
+#   Copyright 2023 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import os
+import unittest
+
+import numpy as np
+from ccpi.viewer import SLICE_ORIENTATION_XY, SLICE_ORIENTATION_YZ
+from ccpi.viewer.CILViewer2D import CILViewer2D
+from ccpi.viewer.utils.conversion import Converter
+from ccpi.viewer.viewerLinker import ViewerLinkHub
+
+# skip the tests on GitHub actions
+if os.environ.get('CONDA_BUILD', '0') == '1':
+    skip_test = True
+else:
+    skip_test = False
+
+print("skip_test is set to ", skip_test)
+
+
+@unittest.skipIf(skip_test, "Skipping tests on GitHub Actions")
+class ViewerLinkHubTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        image = Converter.numpy2vtkImage(np.random.randint(100, size=(20, 16, 12), dtype=np.uint16), deep=1)
+        self.viewers = [CILViewer2D() for _ in range(3)]
+        for viewer in self.viewers:
+            viewer.setInputData(image)
+        self.hub = ViewerLinkHub(*self.viewers, frameInterval=0)
+        self.hub.enable()
+
+    def tearDown(self):
+        self.hub.disable()
+
+    def test_window_level_is_applied_to_all_the_viewers(self):
+        self.viewers[0].setSliceColorWindowLevel(40, 30)
+        for viewer in self.viewers[1:]:
+            self.assertEqual((viewer.getSliceColorWindow(), viewer.getSliceColorLevel()), (40, 30))
+        stats = self.hub.getLinkStats()
+        self.assertEqual(sorted((link['source'], link['target']) for link in stats), [(0, 1), (0, 2)])
+        for link in stats:
+            self.assertEqual(link['count'], 1)
+            self.assertEqual(link['dropped'], 0)
+            self.assertGreaterEqual(link['max'], link['mean'])
+
+    def test_changes_within_the_frame_interval_are_coalesced(self):
+        self.hub.setFrameInterval(60)
+        source = self.viewers[0]
+        # the first change is applied straight away, the rest wait for the frame interval:
+        for sliceno in range(3, 8):
+            source.style.SetActiveSlice(sliceno)
+            source.style.UpdatePipeline()
+        self.assertEqual(self.viewers[1].getActiveSlice(), 3)
+        self.hub.flush()
+        for viewer in self.viewers[1:]:
+            self.assertEqual(viewer.getActiveSlice(), 7)
+        for link in self.hub.getLinkStats():
+            self.assertEqual(link['count'], 2)
+            self.assertEqual(link['dropped'], 3)
+
+    def test_zoom_is_applied_as_a_ratio(self):
+        self.hub.setLinkPan(False)
+        # zoom the target without the link:
+        self.hub.disable()
+        target_camera = self.viewers[1].getRenderer().GetActiveCamera()
+        target_camera.SetParallelScale(2 * target_camera.GetParallelScale())
+        self.viewers[1].getRenderWindow().Render()
+        scale = target_camera.GetParallelScale()
+        self.hub.enable()
+
+        self.viewers[0].getRenderer().GetActiveCamera().Zoom(2)
+        self.viewers[0].getRenderWindow().Render()
+        self.assertAlmostEqual(target_camera.GetParallelScale(), scale / 2)
+
+    def test_slices_are_only_linked_in_the_same_orientation(self):
+        self.hub.setLinkOrientation(False)
+        self.viewers[2].style.ChangeOrientation(SLICE_ORIENTATION_YZ)
+        sliceno = self.viewers[2].getActiveSlice()
+        self.viewers[0].style.SetActiveSlice(2)
+        self.viewers[0].style.UpdatePipeline()
+        self.assertEqual(self.viewers[1].getActiveSlice(), 2)
+        self.assertEqual(self.viewers[2].getSliceOrientation(), SLICE_ORIENTATION_YZ)
+        self.assertEqual(self.viewers[2].getActiveSlice(), sliceno)
+        self.assertEqual(self.viewers[0].getSliceOrientation(), SLICE_ORIENTATION_XY)
+
+    def test_removed_viewers_are_not_updated(self):
+        self.hub.removeViewer(self.viewers[2])
+        window = self.viewers[2].getSliceColorWindow()
+        self.viewers[0].setSliceColorWindowLevel(window + 10, 30)
+        self.assertEqual(self.viewers[1].getSliceColorWindow(), window + 10)
+        self.assertEqual(self.viewers[2].getSliceColorWindow(), window)
+
+    def test_flush_is_rescheduled_when_the_viewer_with_the_timer_is_removed(self):
+        self.hub.setFrameInterval(60)
+        self.viewers[0].style.SetActiveSlice(3)
+        self.viewers[0].style.UpdatePipeline()
+        # the flush timer is created by the first change within the frame interval:
+        self.viewers[0].style.SetActiveSlice(5)
+        self.viewers[0].style.UpdatePipeline()
+        self.viewers[1].setSliceColorWindowLevel(40, 30)
+        self.hub.removeViewer(self.viewers[0])
+        self.assertNotEqual(self.viewers[2].getSliceColorWindow(), 40)
+
+        # the timer of another viewer fires when the frame interval is up:
+        interactor = self.viewers[1].getInteractor()
+        interactor.SetTimerEventId(self.hub._flushTimer[1])
+        interactor.InvokeEvent('TimerEvent')
+        self.assertEqual((self.viewers[2].getSliceColorWindow(), self.viewers[2].getSliceColorLevel()), (40, 30))
+        self.assertIsNone(self.hub._flushTimer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+#   Copyright 2023 STFC, United Kingdom Research and Innovation
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+import time
+import unittest
+
+import numpy as np
+import vtk
+from ccpi.viewer.utils import Converter, cilCachedExtractVOI, cilGradientMagnitude, cilMaskPolyData
+from vtk.util import numpy_support
+
+
+class TestCachedExtractVOI(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.input_3D_array = np.random.randint(100, size=(10, 8, 6), dtype=np.uint16)
+        self.image = Converter.numpy2vtkImage(self.input_3D_array, deep=1)
+        self.voi = cilCachedExtractVOI()
+        self.voi.SetInputData(self.image)
+
+    def extract(self, voi):
+        self.voi.SetVOI(*voi)
+        self.voi.Update()
+        return self.voi.GetOutput()
+
+    def extract_with_vtk(self, voi):
+        extract = vtk.vtkExtractVOI()
+        extract.SetInputData(self.image)
+        extract.SetVOI(*voi)
+        extract.Update()
+        return extract.GetOutput()
+
+    def test_output_matches_vtkExtractVOI(self):
+        for voi in [(0, 5, 0, 7, 3, 3), (2, 2, 0, 7, 0, 9), (0, 5, 4, 4, 0, 9), (1, 3, 2, 5, 4, 8)]:
+            output = self.extract(voi)
+            expected = self.extract_with_vtk(voi)
+            self.assertEqual(output.GetExtent(), expected.GetExtent())
+            np.testing.assert_array_equal(Converter.vtk2numpy(output), Converter.vtk2numpy(expected))
+        self.assertEqual(self.voi.GetVOI(), (1, 3, 2, 5, 4, 8))
+
+    def test_slices_are_cached(self):
+        # the prefetched slices would add to the cache size:
+        self.voi.SetPrefetchDepth(0)
+        self.extract((0, 5, 0, 7, 3, 3))
+        self.extract((0, 5, 0, 7, 4, 4))
+        self.extract((0, 5, 0, 7, 3, 3))
+        self.assertEqual(self.voi.GetCacheMisses(), 2)
+        self.assertEqual(self.voi.GetCacheHits(), 1)
+        self.assertTrue(self.voi.IsSliceCached(2, 3))
+        self.assertEqual(self.voi.GetCacheSize(), 2 * 6 * 8 * 2)
+
+    def test_memory_budget_evicts_least_recently_used_slices(self):
+        self.voi.SetPrefetchDepth(0)
+        self.voi.SetMemoryBudget(2 * 6 * 8 * 2)
+        for sliceno in (0, 1, 0, 2):
+            self.extract((0, 5, 0, 7, sliceno, sliceno))
+        self.assertEqual(self.voi.GetNumberOfCachedSlices(), 2)
+        self.assertTrue(self.voi.IsSliceCached(2, 0))
+        self.assertFalse(self.voi.IsSliceCached(2, 1))
+        self.assertTrue(self.voi.IsSliceCached(2, 2))
+
+    def test_slices_ahead_of_scrolling_are_prefetched(self):
+        self.voi.SetPrefetchDepth(3)
+        self.extract((0, 5, 0, 7, 5, 5))
+        self.extract((0, 5, 0, 7, 4, 4))
+        self.voi.WaitForPrefetch()
+        for sliceno in (3, 2, 1):
+            self.assertTrue(self.voi.IsSliceCached(2, sliceno))
+        self.assertFalse(self.voi.IsSliceCached(2, 6))
+
+        output = self.extract((0, 5, 0, 7, 2, 2))
+        self.assertEqual(self.voi.GetCacheMisses(), 2)
+        np.testing.assert_array_equal(Converter.vtk2numpy(output)[0], self.input_3D_array[2])
+
+    def test_cache_is_cleared_when_input_is_modified(self):
+        self.extract((0, 5, 0, 7, 3, 3))
+        self.input_3D_array[3] = 0
+        self.image.DeepCopy(Converter.numpy2vtkImage(self.input_3D_array, deep=1))
+        output = self.extract((0, 5, 0, 7, 3, 3))
+        self.assertEqual(self.voi.GetCacheMisses(), 2)
+        np.testing.assert_array_equal(Converter.vtk2numpy(output)[0], 0)
+
+
+class TestMaskPolyData(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.mask_array = np.random.randint(3, size=(30, 20, 10), dtype=np.uint8)
+        self.mask = Converter.numpy2vtkImage(self.mask_array, spacing=(1., 2., 3.), deep=1)
+
+    def mask_points(self, points, mask_value=1):
+        polydata = vtk.vtkPolyData()
+        vtk_points = vtk.vtkPoints()
+        vtk_points.SetData(numpy_support.numpy_to_vtk(points, deep=1))
+        polydata.SetPoints(vtk_points)
+
+        mask_filter = cilMaskPolyData()
+        mask_filter.SetMaskValue(mask_value)
+        mask_filter.SetInputDataObject(0, polydata)
+        mask_filter.SetInputDataObject(1, self.mask)
+        mask_filter.Update()
+        return mask_filter.GetOutput()
+
+    def points_in_mask(self, points, mask_value=1):
+        '''the points in the mask, found one at a time'''
+        spacing = np.asarray(self.mask.GetSpacing())
+        out = []
+        for point in points:
+            x, y, z = [int(round(c)) for c in point / spacing]
+            if 0 <= x < 10 and 0 <= y < 20 and 0 <= z < 30 and self.mask_array[z, y, x] == mask_value:
+                out.append(point)
+        return np.asarray(out, dtype=points.dtype).reshape(-1, 3)
+
+    def test_points_in_mask(self):
+        # some points are outside the mask:
+        points = (np.random.uniform(-2, 1.1, size=(1000, 3)) * [10, 40, 90]).astype(np.float32)
+        output = self.mask_points(points, mask_value=2)
+        expected = self.points_in_mask(points, mask_value=2)
+        self.assertEqual(output.GetNumberOfPoints(), len(expected))
+        self.assertEqual(output.GetNumberOfVerts(), len(expected))
+        np.testing.assert_array_equal(numpy_support.vtk_to_numpy(output.GetPoints().GetData()), expected)
+
+    def test_no_points(self):
+        output = self.mask_points(np.zeros((0, 3), dtype=np.float32))
+        self.assertEqual(output.GetNumberOfPoints(), 0)
+        self.assertEqual(output.GetNumberOfVerts(), 0)
+
+    def test_benchmark_1M_points(self):
+        # all the points are inside the mask:
+        points = (np.random.uniform(0, 1, size=(1000000, 3)) * [9.4, 38.8, 88.2]).astype(np.float32)
+        start = time.perf_counter()
+        output = self.mask_points(points)
+        elapsed = time.perf_counter() - start
+        print("cilMaskPolyData masked {} points in {:.3f} s".format(len(points), elapsed))
+
+        spacing = np.asarray(self.mask.GetSpacing())
+        ic = np.rint(points / spacing).astype(int)
+        mask_values = self.mask_array[ic[:, 2], ic[:, 1], ic[:, 0]]
+        self.assertEqual(output.GetNumberOfPoints(), np.count_nonzero(mask_values == 1))
+        self.assertEqual(output.GetNumberOfVerts(), output.GetNumberOfPoints())
+        # looping over the points in Python took tens of seconds:
+        self.assertLess(elapsed, 10)
+
+
+class TestGradientMagnitude(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.input_3D_array = np.random.randint(100, size=(10, 8, 6), dtype=np.uint16)
+
+    def gradient_with_vtk(self, image):
+        grad = vtk.vtkImageGradientMagnitude()
+        grad.SetInputData(image)
+        grad.SetDimensionality(3)
+        grad.Update()
+        return grad.GetOutput()
+
+    def test_output_matches_vtkImageGradientMagnitude(self):
+        for dtype in [np.uint8, np.int16, np.float32, np.float64]:
+            image = Converter.numpy2vtkImage(self.input_3D_array.astype(dtype), spacing=(1., 2., 0.5), deep=1)
+            expected = self.gradient_with_vtk(image)
+            for depth in [1, 3, 16]:
+                for threads in [1, 4]:
+                    with self.subTest(dtype=dtype, depth=depth, threads=threads):
+                        gradient = cilGradientMagnitude()
+                        gradient.SetInputData(image)
+                        gradient.SetSlabDepth(depth)
+                        gradient.SetNumberOfThreads(threads)
+                        gradient.Update()
+                        output = gradient.GetOutput()
+                        self.assertEqual(output.GetScalarType(), expected.GetScalarType())
+                        self.assertEqual(output.GetExtent(), expected.GetExtent())
+                        self.assertEqual(output.GetSpacing(), expected.GetSpacing())
+                        np.testing.assert_array_equal(Converter.vtk2numpy(output), Converter.vtk2numpy(expected))
+
+    def test_output_scalar_type(self):
+        image = Converter.numpy2vtkImage(self.input_3D_array.astype(np.float64), deep=1)
+        expected = Converter.vtk2numpy(self.gradient_with_vtk(image))
+        gradient = cilGradientMagnitude()
+        gradient.SetInputData(image)
+        gradient.SetOutputScalarType(vtk.VTK_FLOAT)
+        gradient.Update()
+        self.assertEqual(gradient.GetOutput().GetScalarType(), vtk.VTK_FLOAT)
+        np.testing.assert_allclose(Converter.vtk2numpy(gradient.GetOutput()), expected, rtol=1e-6)
+
+        gradient.SetOutputScalarType(vtk.VTK_UNSIGNED_SHORT)
+        gradient.Update()
+        self.assertEqual(gradient.GetOutput().GetScalarType(), vtk.VTK_UNSIGNED_SHORT)
+        np.testing.assert_array_equal(Converter.vtk2numpy(gradient.GetOutput()), expected.astype(np.uint16))
+
+    def test_settings_are_validated(self):
+        gradient = cilGradientMagnitude()
+        with self.assertRaises(ValueError):
+            gradient.SetNumberOfThreads(0)
+        with self.assertRaises(ValueError):
+            gradient.SetSlabDepth(0)
+        with self.assertRaises(ValueError):
+            gradient.SetOutputScalarType(-1)
+
+
+if __name__ == '__main__':
+    unittest.main()
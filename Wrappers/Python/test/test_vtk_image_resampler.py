@@ -1,5 +1,6 @@
 from ccpi.viewer.utils.conversion import Converter
-from ccpi.viewer.utils.conversion import vtkImageResampler
+from ccpi.viewer.utils.conversion import (vtkImageResampler, block_reduce, calculate_block_edges,
+                                          calculate_target_downsample_magnification)
 import unittest
 import numpy as np
 
@@ -81,6 +82,41 @@ class TestVTKImageResampler(unittest.TestCase):
         self.assertEqual(resulting_size, expected_size)
         self.assertEqual(resulting_z_shape, og_z_shape)
 
+    def test_vtk_resample_reader_block_reduce(self):
+        # Tests downsampling with block reduction gives an image with the same
+        # geometry as reslicing, where each voxel is the mean of its block:
+        reader = vtkImageResampler()
+        reader.SetInputDataObject(self.input_vtk_image)
+        reader.SetTargetSize(100)
+        reader.Update()
+        expected_image = reader.GetOutput()
+
+        reader = vtkImageResampler()
+        reader.SetInputDataObject(self.input_vtk_image)
+        reader.SetTargetSize(100)
+        reader.SetDownsampleMethod('mean')
+        self.assertEqual(reader.GetDownsampleMethod(), 'mean')
+        reader.Update()
+        image = reader.GetOutput()
+
+        self.assertEqual(expected_image.GetExtent(), image.GetExtent())
+        self.assertEqual(expected_image.GetSpacing(), image.GetSpacing())
+        self.assertEqual(expected_image.GetOrigin(), image.GetOrigin())
+
+        extent = image.GetExtent()
+        og_shape = np.shape(self.input_3D_array)
+        num_slices_per_chunk, _ = calculate_target_downsample_magnification(100, self.input_3D_array.nbytes)
+        block_edges = [
+            list(range(0, og_shape[0], num_slices_per_chunk)) + [og_shape[0]],
+            calculate_block_edges(og_shape[1], extent[3] + 1),
+            calculate_block_edges(og_shape[2], extent[1] + 1)
+        ]
+        expected_array = np.rint(block_reduce(self.input_3D_array, block_edges, 'mean'))
+        np.testing.assert_array_equal(Converter.vtk2numpy(image), expected_array.astype(self.input_3D_array.dtype))
+
+        with self.assertRaises(ValueError):
+            reader.SetDownsampleMethod('average')
+
 
 if __name__ == '__main__':
     unittest.main()